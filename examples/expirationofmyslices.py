@@ -34,6 +34,12 @@ import gcf.oscript as omni
 #     export PYTHONPATH=${PYTHONPATH}:path/to/gcf/src
 #
 ################################################################################
+#
+# This script shows how to call omni from your own code. To report the
+# expiration of all your slices and of the resources in them, with many
+# calls made at once, use 'omni.py expirationreport' instead.
+#
+################################################################################
 
 def main(argv=None):
   ##############################################################################
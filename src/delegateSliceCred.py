@@ -60,6 +60,7 @@ import string
 import sys
 
 import gcf.sfa.trust.credential as cred
+from gcf.sfa.trust.credential_signer import CredentialSigner
 import gcf.sfa.trust.rights as privs
 from gcf.sfa.trust.gid import GID
 from gcf.sfa.trust.certificate import Keypair, Certificate
@@ -297,7 +298,7 @@ omni.py --slicecred mySliceCred.xml -o getslicecred mySliceName\n\
     dcred.set_privileges(slicecred.get_privileges())
     dcred.get_privileges().delegate_all_privileges(opts.delegatable)
 
-    dcred.set_issuer_keys(opts.key, opts.cert)
+    dcred.set_signer(CredentialSigner(opts.key, opts.cert))
     dcred.encode()
     dcred.sign()
 
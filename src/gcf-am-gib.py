@@ -43,7 +43,9 @@ import os
 
 from gcf import geni
 import gcf.geni.am.gibaggregate.am_gib
+import gcf.geni.am.gibaggregate.config
 from gcf.geni.config import read_config
+from gcf.geni.am.am_metrics import make_metrics
 
 
 def parse_args(argv):
@@ -91,6 +93,12 @@ def main(argv=None):
         level = logging.DEBUG
     logging.basicConfig(level=level)
 
+    # GENI-in-a-Box only runs on Ubuntu and Red Hat
+    distroError = gcf.geni.am.gibaggregate.config.distroError
+    if distroError:
+        logging.getLogger('gcf-am').error(distroError)
+        sys.exit(distroError)
+
     # Read in config file options, command line gets priority
     optspath = None
     if not opts.configfile is None:
@@ -128,13 +136,22 @@ def main(argv=None):
     # certs possibly concatenated together
     comboCertsFile = geni.CredentialVerifier.getCAsFileFromDir(getAbsPath(opts.rootcadir))
 
+    multithread = False
+    if hasattr(opts, 'multithread') and opts.multithread is not None and str(opts.multithread).strip() != "":
+        if str(opts.multithread).strip().lower() == "true":
+            multithread = True
+        elif str(opts.multithread).strip().lower() != "false":
+            logging.getLogger('gcf-am').warning("Invalid argument for 'multithread', set default : false")
+
     ams = gcf.geni.am.gibaggregate.am_gib.AggregateManagerServer((opts.host,
                                      int(opts.port)),
                                      keyfile=keyfile,
                                      certfile=certfile,
                                      trust_roots_dir=getAbsPath(opts.rootcadir),
                                      ca_certs=comboCertsFile,
-                                     base_name=config['global']['base_name'])
+                                     base_name=config['global']['base_name'],
+                                     metrics=make_metrics(opts, logging.getLogger('gcf-am')),
+                                     multithread=multithread)
 
     logging.getLogger('gcf-am').info('GENI AM Listening on port %s...' % (opts.port))
     ams.serve_forever()
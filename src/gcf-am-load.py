@@ -0,0 +1,555 @@
+#!/usr/bin/env python
+
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Load generator for a GENI Aggregate Manager, such as a local gcf-am.py
+(AM API v2 or v3) with its gcf-ch.py clearinghouse.
+
+Creates N simulated users, each with its own certificate signed by the
+clearinghouse key (as gen-certs.py does) and its own slice from the
+clearinghouse. The users then concurrently run a weighted mix of AM API
+calls (ListResources, Allocate, Provision, Status, Describe, Renew,
+Delete), at a target total call rate, for a given duration. At the end
+it reports throughput, per method p50/p95/p99 latency and error rates,
+and optionally writes the results as JSON for comparison between runs.
+
+Each user tracks the state of its slice, and only picks calls that make
+sense in that state: Allocate only on an empty slice, Provision only
+after Allocate, and so on. In AM API v2, Allocate is CreateSliver,
+Status is SliverStatus, Describe is ListResources on the slice, Renew is
+RenewSliver and Delete is DeleteSliver. There is no Provision.
+
+Note that the reference AMs have few resources (3 in v2, 20 in v3), so
+large numbers of users will see some Allocate calls refused.
+
+Run with "-h" flag to see usage and command line options.
+Example:
+  gcf-am-load.py -V 3 --users 20 --rate 10 --duration 120 --output load.json
+"""
+
+import sys
+
+# Check python version. Requires 2.6 or greater, but less than 3.
+if sys.version_info < (2, 6):
+    raise Exception('Must use python 2.6 or greater.')
+elif sys.version_info >= (3,):
+    raise Exception('Not python 3 ready')
+
+import datetime
+import json
+import logging
+import optparse
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+import gcf.geni as geni
+import gcf.sfa.trust.gid as gid
+import gcf.sfa.trust.certificate as cert
+import gcf.sfa.trust.credential as cred
+from gcf.geni.config import read_config
+from gcf.geni.util.cert_util import create_cert
+from gcf.omnilib.xmlrpc.client import make_client
+
+METHODS = ('ListResources', 'Allocate', 'Provision', 'Status', 'Describe',
+           'Renew', 'Delete')
+
+DEFAULT_MIX = "ListResources=3,Allocate=2,Provision=2,Status=4,Describe=2,Renew=1,Delete=2"
+
+# Slice states
+EMPTY = 'empty'
+ALLOCATED = 'allocated'
+PROVISIONED = 'provisioned'
+
+# Which calls make sense in each slice state
+VALID_METHODS = {EMPTY: ('ListResources', 'Allocate'),
+                 ALLOCATED: ('ListResources', 'Provision', 'Status',
+                             'Describe', 'Renew', 'Delete'),
+                 PROVISIONED: ('ListResources', 'Status', 'Describe',
+                               'Renew', 'Delete')}
+
+RSPEC_VERSION = dict(type="geni", version="3")
+
+logger = logging.getLogger('gcf-am-load')
+
+def getAbsPath(path):
+    """Return None or a normalized absolute path version of the argument string.
+    Does not check that the path exists."""
+    if path is None:
+        return None
+    if path.strip() == "":
+        return None
+    path = os.path.normcase(os.path.expanduser(path))
+    if os.path.isabs(path):
+        return path
+    else:
+        return os.path.abspath(path)
+
+def parse_mix(mix, api_version):
+    """Parse a mix string like 'Status=4,Delete=1' into a dict of weights."""
+    weights = dict()
+    for item in mix.split(','):
+        item = item.strip()
+        if item == '':
+            continue
+        if '=' in item:
+            (method, weight) = item.split('=', 1)
+        else:
+            (method, weight) = (item, 1)
+        method = method.strip()
+        if method not in METHODS:
+            raise ValueError("Unknown method '%s' in mix (use %s)" % (method, ", ".join(METHODS)))
+        weights[method] = float(weight)
+    if api_version < 3 and weights.has_key('Provision'):
+        # No Provision in APIv2: CreateSliver does it all
+        del weights['Provision']
+    if sum(weights.values()) <= 0:
+        raise ValueError("Mix '%s' has no calls to make" % mix)
+    return weights
+
+def make_request_rspec(num_nodes):
+    """An unbound request RSpec for the given number of nodes."""
+    nodes = "".join(['  <node client_id="load%d" exclusive="false"/>\n' % i
+                     for i in range(num_nodes)])
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<rspec type="request"\n'
+            '       xmlns="http://www.geni.net/resources/rspec/3"\n'
+            '       xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"\n'
+            '       xsi:schemaLocation="http://www.geni.net/resources/rspec/3 '
+            'http://www.geni.net/resources/rspec/3/request.xsd">\n'
+            '%s</rspec>\n' % nodes)
+
+def percentile(sorted_values, pct):
+    """Nearest rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1
+    rank = max(0, min(rank, len(sorted_values) - 1))
+    return sorted_values[rank]
+
+class Pacer(object):
+    """Hands out call start times to all users, to hold the total call
+    rate at the target. A rate of 0 means as fast as possible."""
+
+    def __init__(self, rate):
+        self.interval = 0
+        if rate > 0:
+            self.interval = 1.0 / rate
+        self.next_time = time.time()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.time()
+            if self.next_time < now:
+                self.next_time = now
+            start = self.next_time
+            self.next_time += self.interval
+        delay = start - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+class Results(object):
+    """Latencies and errors per method, from all users."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = dict()
+        self.errors = dict()
+        self.codes = dict()
+        self.start = None
+        self.end = None
+
+    def add(self, method, secs, code):
+        code = str(code)
+        with self.lock:
+            self.latencies.setdefault(method, []).append(secs)
+            codes = self.codes.setdefault(method, dict())
+            codes[code] = codes.get(code, 0) + 1
+            if code != '0':
+                self.errors[method] = self.errors.get(method, 0) + 1
+
+    def summary(self):
+        elapsed = max((self.end or time.time()) - (self.start or 0), 0.001)
+        methods = dict()
+        total_calls = 0
+        total_errors = 0
+        for (method, latencies) in self.latencies.iteritems():
+            latencies = sorted(latencies)
+            count = len(latencies)
+            errors = self.errors.get(method, 0)
+            total_calls += count
+            total_errors += errors
+            methods[method] = dict(count=count,
+                                   errors=errors,
+                                   error_rate=float(errors) / count,
+                                   codes=self.codes.get(method, dict()),
+                                   throughput=count / elapsed,
+                                   mean=sum(latencies) / count,
+                                   p50=percentile(latencies, 50),
+                                   p95=percentile(latencies, 95),
+                                   p99=percentile(latencies, 99),
+                                   max=latencies[-1])
+        error_rate = 0.0
+        if total_calls:
+            error_rate = float(total_errors) / total_calls
+        return dict(elapsed=elapsed, calls=total_calls, errors=total_errors,
+                    error_rate=error_rate, throughput=total_calls / elapsed,
+                    methods=methods)
+
+def result_code(result):
+    """Return the geni_code of an AM API return, or a description of
+    what is wrong with it."""
+    if not isinstance(result, dict) or not result.has_key('code'):
+        return 'bad-return'
+    code = result['code']
+    if isinstance(code, dict):
+        return code.get('geni_code', 'no-geni_code')
+    return code
+
+class SimulatedUser(threading.Thread):
+    """One experimenter: own cert, own slice, own AM connection."""
+
+    def __init__(self, name, keyfile, certfile, opts, weights, rspec,
+                 pacer, results, seed=None):
+        threading.Thread.__init__(self, name=name)
+        self.daemon = True
+        self.keyfile = keyfile
+        self.certfile = certfile
+        self.api_version = opts.api_version
+        self.max_calls = opts.calls_per_user
+        self.weights = weights
+        self.rspec = rspec
+        self.pacer = pacer
+        self.results = results
+        # Set when the run starts
+        self.stop_time = None
+        self.random = random.Random(seed)
+        self.state = EMPTY
+        self.slice_urn = None
+        self.credentials = None
+        self.am = make_client(opts.am, keyfile, certfile, timeout=opts.timeout)
+        self.ch = make_client(opts.ch, keyfile, certfile, timeout=opts.timeout)
+
+    def create_slice(self):
+        slice_cred_string = self.ch.CreateSlice()
+        slice_credential = cred.Credential(string=slice_cred_string)
+        self.slice_urn = slice_credential.get_gid_object().get_urn()
+        if self.api_version > 2:
+            self.credentials = [dict(geni_type=cred.Credential.SFA_CREDENTIAL_TYPE,
+                                     geni_version="3",
+                                     geni_value=slice_cred_string)]
+        else:
+            self.credentials = [slice_cred_string]
+
+    def choose(self):
+        valid = [(m, w) for (m, w) in self.weights.iteritems()
+                 if m in VALID_METHODS[self.state] and w > 0]
+        if not valid:
+            # Mix has nothing to do in this state: reset the slice
+            if self.state == EMPTY:
+                return 'ListResources'
+            return 'Delete'
+        point = self.random.uniform(0, sum([w for (_, w) in valid]))
+        for (method, weight) in valid:
+            point -= weight
+            if point <= 0:
+                return method
+        return valid[-1][0]
+
+    def call(self, method):
+        """Make the given call, returning its result code."""
+        am = self.am
+        creds = self.credentials
+        urn = self.slice_urn
+        if method == 'ListResources':
+            return am.ListResources(creds, dict(geni_available=True,
+                                                geni_compressed=True,
+                                                geni_rspec_version=RSPEC_VERSION))
+        if method == 'Renew':
+            expiration = (datetime.datetime.utcnow() +
+                          datetime.timedelta(minutes=30)).isoformat()
+        if self.api_version > 2:
+            if method == 'Allocate':
+                return am.Allocate(urn, creds, self.rspec, dict())
+            elif method == 'Provision':
+                return am.Provision([urn], creds,
+                                    dict(geni_rspec_version=RSPEC_VERSION))
+            elif method == 'Status':
+                return am.Status([urn], creds, dict())
+            elif method == 'Describe':
+                return am.Describe([urn], creds,
+                                   dict(geni_rspec_version=RSPEC_VERSION))
+            elif method == 'Renew':
+                return am.Renew([urn], creds, expiration, dict())
+            elif method == 'Delete':
+                return am.Delete([urn], creds, dict())
+        else:
+            if method == 'Allocate':
+                return am.CreateSliver(urn, creds, self.rspec, [], dict())
+            elif method == 'Status':
+                return am.SliverStatus(urn, creds, dict())
+            elif method == 'Describe':
+                return am.ListResources(creds,
+                                        dict(geni_slice_urn=urn,
+                                             geni_rspec_version=RSPEC_VERSION))
+            elif method == 'Renew':
+                return am.RenewSliver(urn, creds, expiration, dict())
+            elif method == 'Delete':
+                return am.DeleteSliver(urn, creds, dict())
+        raise ValueError("Unknown method %s" % method)
+
+    def update_state(self, method, code):
+        if code != 0:
+            return
+        if method == 'Allocate':
+            if self.api_version > 2:
+                self.state = ALLOCATED
+            else:
+                self.state = PROVISIONED
+        elif method == 'Provision':
+            self.state = PROVISIONED
+        elif method == 'Delete':
+            self.state = EMPTY
+
+    def run(self):
+        calls = 0
+        while time.time() < self.stop_time:
+            if self.max_calls and calls >= self.max_calls:
+                break
+            method = self.choose()
+            self.pacer.wait()
+            start = time.time()
+            try:
+                code = result_code(self.call(method))
+            except Exception, e:
+                logger.debug("%s: %s raised %s", self.name, method, e)
+                code = e.__class__.__name__
+            self.results.add(method, time.time() - start, code)
+            self.update_state(method, code)
+            calls += 1
+        # Leave nothing behind
+        if self.state != EMPTY:
+            try:
+                self.call('Delete')
+            except Exception, e:
+                logger.warning("%s: Failed to delete slivers in %s: %s",
+                               self.name, self.slice_urn, e)
+
+def make_users(num_users, certdir, ch_keyfile, ch_certfile, authority):
+    """Create certs and keys for the simulated users, signed by the
+    clearinghouse, in certdir. Return a list of (name, keyfile, certfile)."""
+    ch_gid = gid.GID(filename=ch_certfile)
+    ch_keys = cert.Keypair(filename=ch_keyfile)
+    # Unique per run, so slices and users from old runs don't collide
+    run_id = uuid.uuid4().hex[:6]
+    users = []
+    for i in range(num_users):
+        username = "load%s%04d" % (run_id, i)
+        urn = geni.URN(authority, 'user', username).urn_string()
+        (user_gid, user_keys) = create_cert(urn, issuer_key=ch_keys,
+                                            issuer_cert=ch_gid, ca=False,
+                                            lifeDays=1, uuidarg=uuid.uuid4())
+        certfile = os.path.join(certdir, "%s-cert.pem" % username)
+        keyfile = os.path.join(certdir, "%s-key.pem" % username)
+        user_gid.save_to_file(certfile)
+        user_keys.save_to_file(keyfile)
+        users.append((username, keyfile, certfile))
+    return users
+
+def print_summary(summary, out=sys.stdout):
+    out.write("%d calls in %.1f seconds: %.2f calls/sec, %d errors (%.1f%%)\n" %
+              (summary['calls'], summary['elapsed'], summary['throughput'],
+               summary['errors'], 100 * summary['error_rate']))
+    out.write("%-14s %7s %8s %7s %9s %9s %9s %9s\n" %
+              ("Method", "Calls", "Calls/s", "Errors", "p50 (s)", "p95 (s)",
+               "p99 (s)", "Max (s)"))
+    for method in METHODS:
+        stats = summary['methods'].get(method)
+        if stats is None:
+            continue
+        out.write("%-14s %7d %8.2f %6.1f%% %9.3f %9.3f %9.3f %9.3f\n" %
+                  (method, stats['count'], stats['throughput'],
+                   100 * stats['error_rate'], stats['p50'], stats['p95'],
+                   stats['p99'], stats['max']))
+
+def parse_args(argv):
+    parser = optparse.OptionParser(usage="%prog [options]",
+                                   description="Drive an AM with concurrent simulated users and report per method latency and errors.")
+    parser.add_option("-c", "--configfile",  help="config file path", metavar="FILE")
+    parser.add_option("--ch",
+                      help="clearinghouse URL")
+    parser.add_option("--am",
+                      help="aggregate manager URL")
+    parser.add_option("-V", "--api-version", type=int,
+                      help="AM API Version (2 or 3)", default=2)
+    parser.add_option("--ch-keyfile", metavar="FILE",
+                      help="Clearinghouse key, to sign the user certs (default: from the config file)")
+    parser.add_option("--ch-certfile", metavar="FILE",
+                      help="Clearinghouse cert, to sign the user certs (default: from the config file)")
+    parser.add_option("--certdir", metavar="DIR",
+                      help="Directory in which to save the user certs and keys (default: a temporary directory, removed at the end)")
+    parser.add_option("-u", "--users", type=int, default=10,
+                      help="Number of concurrent simulated users. Default: %default")
+    parser.add_option("--rate", type=float, default=0,
+                      help="Target total calls per second across all users (0 for as fast as possible). Default: %default")
+    parser.add_option("--duration", type=float, default=60,
+                      help="Seconds to run. Default: %default")
+    parser.add_option("--calls-per-user", type=int, default=0,
+                      help="Stop each user after this many calls (0 for no limit)")
+    parser.add_option("--mix", default=DEFAULT_MIX,
+                      help="Weighted mix of calls. Default: %default")
+    parser.add_option("--nodes", type=int, default=1,
+                      help="Nodes per Allocate request. Default: %default")
+    parser.add_option("--rspec-file", metavar="FILE",
+                      help="Request RSpec to use instead of a generated one")
+    parser.add_option("--timeout", type=float, default=360,
+                      help="Seconds to wait for each call. Default: %default")
+    parser.add_option("--seed", default=None,
+                      help="Random seed, for repeatable call sequences")
+    parser.add_option("-o", "--output", metavar="FILE",
+                      help="Write the options and results as JSON to this file")
+    parser.add_option("--debug", action="store_true", default=False,
+                       help="enable debugging output")
+    return parser.parse_args(argv[1:])
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+    opts = parse_args(argv)[0]
+    level = logging.INFO
+    if opts.debug:
+        level = logging.DEBUG
+    logging.basicConfig(level=level)
+
+    optspath = None
+    if not opts.configfile is None:
+        optspath = os.path.expanduser(opts.configfile)
+
+    config = read_config(optspath)
+
+    # Determine the AM and CH URLs from the config file
+    if opts.ch is None:
+        host = config['clearinghouse']['host']
+        port = config['clearinghouse']['port']
+        if not host.startswith('http'):
+            host = 'https://%s' % host.strip('/')
+        opts.ch = "%s:%s/" % (host, port)
+    if opts.am is None:
+        host = config['aggregate_manager']['host']
+        port = config['aggregate_manager']['port']
+        if not host.startswith('http'):
+            host = 'https://%s' % host.strip('/')
+        opts.am = "%s:%s/" % (host, port)
+    if opts.ch_keyfile is None:
+        opts.ch_keyfile = config['clearinghouse']['keyfile']
+    if opts.ch_certfile is None:
+        opts.ch_certfile = config['clearinghouse']['certfile']
+    ch_keyfile = getAbsPath(opts.ch_keyfile)
+    ch_certfile = getAbsPath(opts.ch_certfile)
+    for fname in (ch_keyfile, ch_certfile):
+        if not fname or not os.path.exists(fname) or not os.path.getsize(fname) > 0:
+            sys.exit("Clearinghouse key/cert file %s doesn't exist or is empty" % fname)
+
+    if opts.api_version not in (2, 3):
+        sys.exit("Unsupported API version %d: use 2 or 3" % opts.api_version)
+    if opts.users < 1:
+        sys.exit("Need at least 1 user")
+    try:
+        weights = parse_mix(opts.mix, opts.api_version)
+    except ValueError, e:
+        sys.exit(str(e))
+
+    if opts.rspec_file:
+        with open(getAbsPath(opts.rspec_file)) as f:
+            rspec = f.read()
+    else:
+        rspec = make_request_rspec(opts.nodes)
+
+    tmpdir = None
+    certdir = getAbsPath(opts.certdir)
+    if certdir is None:
+        tmpdir = tempfile.mkdtemp(prefix='gcf-am-load-')
+        certdir = tmpdir
+    elif not os.path.exists(certdir):
+        os.makedirs(certdir)
+
+    try:
+        logger.info("Creating %d user certificates in %s", opts.users, certdir)
+        users = make_users(opts.users, certdir, ch_keyfile, ch_certfile,
+                           config['global']['base_name'])
+
+        results = Results()
+        pacer = Pacer(opts.rate)
+        threads = []
+        for (i, (name, keyfile, certfile)) in enumerate(users):
+            seed = None
+            if opts.seed is not None:
+                seed = "%s-%d" % (opts.seed, i)
+            threads.append(SimulatedUser(name, keyfile, certfile, opts,
+                                         weights, rspec, pacer, results,
+                                         seed))
+        logger.info("Creating %d slices at %s", len(threads), opts.ch)
+        for thread in threads:
+            thread.create_slice()
+
+        logger.info("Running %d users against %s (API v%d) for %s seconds",
+                    len(threads), opts.am, opts.api_version, opts.duration)
+        # Slice creation time is not part of the run
+        stop_time = time.time() + opts.duration
+        for thread in threads:
+            thread.stop_time = stop_time
+        results.start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            # Join with a timeout so Ctrl-C works
+            while thread.is_alive():
+                thread.join(1)
+        results.end = time.time()
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    summary = results.summary()
+    print_summary(summary)
+    if opts.output:
+        run = dict(am=opts.am, api_version=opts.api_version,
+                   users=opts.users, rate=opts.rate, duration=opts.duration,
+                   mix=weights, nodes=opts.nodes,
+                   time=datetime.datetime.utcnow().isoformat())
+        with open(getAbsPath(opts.output), 'w') as f:
+            json.dump(dict(run=run, results=summary), f, indent=2,
+                      sort_keys=True)
+        logger.info("Wrote results to %s", opts.output)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -47,6 +47,7 @@ import gcf.geni.am.am2
 import gcf.geni.am.am3
 from gcf.geni.config import read_config
 from gcf.geni.auth.util import getInstanceFromClassname
+from gcf.geni.am.am_metrics import make_metrics
 
 
 def parse_args(argv):
@@ -178,6 +179,9 @@ def main(argv=None):
             multithread = False
             logging.getLogger('gcf-am').warning("Invalid argument for 'multithread', set default : false")
 
+    # Optional per-method call metrics, from the metrics* config options
+    metrics = make_metrics(opts, logging.getLogger('gcf-am'))
+
     # here rootcadir is supposed to be a single file with multiple
     # certs possibly concatenated together
     comboCertsFile = geni.CredentialVerifier.getCAsFileFromDir(getAbsPath(opts.rootcadir))
@@ -200,7 +204,8 @@ def main(argv=None):
                                                      base_name=config['global']['base_name'], 
                                                      authorizer=authorizer,
                                                      resource_manager=resource_manager,
-                                                     delegate=delegate)
+                                                     delegate=delegate,
+                                                     metrics=metrics)
     elif opts.api_version == 3:
         ams = gcf.geni.am.am3.AggregateManagerServer((opts.host, int(opts.port)),
                                                      keyfile=keyfile,
@@ -210,7 +215,8 @@ def main(argv=None):
                                                      base_name=config['global']['base_name'],
                                                      authorizer=authorizer,
                                                      resource_manager=resource_manager,
-                                                     delegate=delegate, multithread=multithread)
+                                                     delegate=delegate, multithread=multithread,
+                                                     metrics=metrics)
     else:
         msg = "Unknown API version: %d. Valid choices are \"1\", \"2\", or \"3\""
         sys.exit(msg % (opts.api_version))
@@ -0,0 +1,1402 @@
+#!/usr/bin/env python
+
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Micro-benchmarks for the Omni, stitcher and gcf hot paths.
+
+Runs offline: certificates, credentials, RSpecs and advertisements are
+generated in a temporary directory, and the stitcher benchmarks use the
+request RSpecs in stitcherTestFiles. Covered:
+
+  cert.*     GID and Certificate parsing
+  cred.*     Credential.verify and CredentialVerifier.verify_from_strings
+             on delegated credential chains, and signing and issuing
+             slice credentials in process and with xmlsec1 (those that
+             use xmlsec1 are skipped without it)
+  vlan.*     VLANRange.fromString and set algebra
+  stitch.*   RSpecParser.parse, WorkflowParser.parse, combineManifestRSpecs,
+             writing the request for each AM from planned edits and (as
+             stitcher used to) from an edited copy of the request DOM,
+             and extracting the available VLAN tags of the stitching
+             ports in a multi-MB advertisement by streaming and (as
+             stitcher used to) with a DOM
+  rspec.*    expires_from_rspec, getPrettyRSpec, writePrettyRSpec and
+             _maybeDecompressRSpec on a multi-MB advertisement, and
+             schema validation of the stitcherTestFiles requests in
+             process (given local copies of the schemas, see
+             --rspec-schema-dir) and with rspeclint
+  xmlrpc.*   XML-RPC marshalling of a Describe result with a multi-MB
+             manifest and many slivers, by xmlrpc_codec and by xmlrpclib
+             (the xmlrpc_codec benchmarks first check that both give
+             the same results)
+  gib.*      GENI-in-a-Box static route planning on ring, mesh and tree
+             topologies (first checked against the exhaustive search it
+             replaced, on small topologies)
+  auth.*     ABAC_Authorizer.authorize with the example AM policies
+
+Each benchmark is calibrated to run for at least --min-time seconds per
+sample (like timeit), then sampled --repeat times. Results are per call
+times (min, median, mean and standard deviation), and may be written as
+JSON with -o.
+
+Regression mode: given --baseline (a JSON file written by an earlier
+run with -o), compare the minimum per call time of each benchmark to
+the baseline, and exit with status 1 if any is slower by more than
+--tolerance percent.
+
+Run with "-h" flag to see usage and command line options.
+Examples:
+  gcf-bench.py --list
+  gcf-bench.py -k vlan -k cert
+  gcf-bench.py -o before.json
+  gcf-bench.py --baseline before.json --tolerance 15
+"""
+
+import sys
+
+# Check python version. Requires 2.6 or greater, but less than 3.
+if sys.version_info < (2, 6):
+    raise Exception('Must use python 2.6 or greater.')
+elif sys.version_info >= (3,):
+    raise Exception('Not python 3 ready')
+
+import base64
+import datetime
+import fnmatch
+import gc
+import glob
+import gzip
+import json
+import logging
+import optparse
+import os
+import platform
+import shutil
+import tempfile
+import time
+import uuid
+import xmlrpclib
+import zlib
+from xml.dom.minidom import parseString
+
+import gcf.geni as geni
+import gcf.sfa.trust.gid as gid
+import gcf.sfa.trust.certificate as cert
+import gcf.sfa.trust.credential as cred
+from gcf.gcf_version import GCF_VERSION
+from gcf.geni.util.cert_util import create_cert
+
+# Where credential.py looks for xmlsec1
+XMLSEC_PATHS = ['/usr/bin', '/usr/local/bin', '/bin', '/opt/bin', '/opt/local/bin']
+
+# Default locations of the test inputs, relative to this script in a
+# source tree
+_TOP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+DEFAULT_STITCHER_FILES = os.path.join(_TOP_DIR, 'stitcherTestFiles')
+DEFAULT_POLICY_FILE = os.path.join(_TOP_DIR, 'examples', 'example_am_policies.json')
+
+AUTHORITY = 'bench.example.net'
+
+# Aggregates used by the synthetic stitching RSpecs
+STITCH_AMS = ['urn:publicid:IDN+am%d.bench.example.net+authority+cm' % i
+              for i in range(4)]
+
+# Size in MB of the advertisement without an expires attribute. The
+# search for ExoGENI sliver info takes time worse than quadratic in the
+# size of the RSpec, so this one is small.
+NO_EXPIRES_AD_SIZE = 0.02
+
+# Stitching ports in the advertisement of the stitch.vlan_availability
+# benchmarks
+AD_STITCHING_PORTS = 200
+
+# Number of credentials issued per call by cred.issue_batch
+CRED_BATCH_SIZE = 10
+
+# Number of slivers in the Describe result of the xmlrpc benchmarks
+XMLRPC_SLIVERS = 500
+
+# Hosts in the GENI-in-a-Box topologies of the gib benchmarks (the mesh
+# is the largest square grid with at most this many), and in the ones
+# checked against the old exhaustive route search
+GIB_HOSTS = 64
+GIB_CHECK_HOSTS = 9
+
+VLAN_STRINGS = ['any', '2-4094', '3747', '100-200,300,400-3000,3500-3510',
+                ','.join(str(v) for v in range(1000, 3000, 7))]
+
+logger = logging.getLogger('gcf-bench')
+
+class SkipBenchmark(Exception):
+    '''Raised by a benchmark setup function that cannot run here.'''
+    pass
+
+class Benchmark(object):
+    '''A named benchmark. The setup function takes the Fixtures and
+    returns the function to time, or a (prepare, function) pair where
+    prepare is called (untimed) before each timed call.'''
+
+    def __init__(self, name, setup):
+        self.name = name
+        self.setup = setup
+        self.description = (setup.__doc__ or '').strip()
+
+BENCHMARKS = []
+
+def benchmark(name):
+    '''Decorator registering a benchmark setup function.'''
+    def decorator(setup):
+        BENCHMARKS.append(Benchmark(name, setup))
+        return setup
+    return decorator
+
+def find_xmlsec1():
+    for path in XMLSEC_PATHS:
+        xmlsec = os.path.join(path, 'xmlsec1')
+        if os.path.isfile(xmlsec):
+            return xmlsec
+    return None
+
+def find_rspeclint():
+    # rspec_util runs rspeclint from the PATH
+    for path in os.environ.get('PATH', '').split(os.pathsep):
+        rspeclint = os.path.join(path, 'rspeclint')
+        if os.path.isfile(rspeclint):
+            return rspeclint
+    return None
+
+class Fixtures(object):
+    '''Inputs shared by the benchmarks, generated on first use.'''
+
+    def __init__(self, opts, tmpdir):
+        self.opts = opts
+        self.tmpdir = tmpdir
+        self.xmlsec1 = find_xmlsec1()
+        self._cache = dict()
+
+    def _get(self, name, maker):
+        if name not in self._cache:
+            self._cache[name] = maker()
+        return self._cache[name]
+
+    def require_xmlsec1(self):
+        if self.xmlsec1 is None:
+            raise SkipBenchmark("xmlsec1 not found (needed to sign and verify credentials)")
+
+    # Certificates
+
+    def _make_certs(self):
+        '''An authority, 3 users and a slice, as gen-certs.py would make.'''
+        certs = dict()
+        trusted_roots = os.path.join(self.tmpdir, 'trusted_roots')
+        os.makedirs(trusted_roots)
+        ca_urn = geni.URN(AUTHORITY, 'authority', 'sa').urn_string()
+        (ca_gid, ca_keys) = create_cert(ca_urn, ca=True, lifeDays=1,
+                                        uuidarg=uuid.uuid4())
+        self._save('ca', ca_gid, ca_keys, certs)
+        ca_gid.save_to_file(os.path.join(trusted_roots, 'ca-cert.pem'))
+        for name in ('alice', 'bob', 'carol'):
+            urn = geni.URN(AUTHORITY, 'user', name).urn_string()
+            (user_gid, user_keys) = create_cert(urn, issuer_key=ca_keys,
+                                                issuer_cert=ca_gid, ca=False,
+                                                lifeDays=1, uuidarg=uuid.uuid4())
+            self._save(name, user_gid, user_keys, certs)
+        slice_urn = geni.URN(AUTHORITY, 'slice', 'benchslice').urn_string()
+        (slice_gid, slice_keys) = create_cert(slice_urn, issuer_key=ca_keys,
+                                              issuer_cert=ca_gid, ca=False,
+                                              lifeDays=1, uuidarg=uuid.uuid4())
+        self._save('slice', slice_gid, slice_keys, certs)
+        am_urn = geni.URN(AUTHORITY, 'authority', 'am').urn_string()
+        (am_gid, am_keys) = create_cert(am_urn, issuer_key=ca_keys,
+                                        issuer_cert=ca_gid, ca=False,
+                                        lifeDays=1, uuidarg=uuid.uuid4())
+        self._save('am', am_gid, am_keys, certs)
+        certs['trusted_roots'] = trusted_roots
+        certs['slice_urn'] = slice_urn
+        return certs
+
+    def _save(self, name, the_gid, keys, certs):
+        certfile = os.path.join(self.tmpdir, '%s-cert.pem' % name)
+        keyfile = os.path.join(self.tmpdir, '%s-key.pem' % name)
+        the_gid.save_to_file(certfile, save_parents=True)
+        keys.save_to_file(keyfile)
+        certs[name] = dict(certfile=certfile, keyfile=keyfile,
+                           pem=open(certfile).read(), gid=the_gid)
+
+    @property
+    def certs(self):
+        return self._get('certs', self._make_certs)
+
+    # Credentials
+
+    def _make_delegated_creds(self):
+        '''A slice credential for alice, delegated to bob, then to carol.
+        Returns the credential XML strings, outermost last.'''
+        self.require_xmlsec1()
+        from gcf.geni.util.cred_util import create_credential
+        certs = self.certs
+        expiration = datetime.datetime.utcnow() + datetime.timedelta(days=1)
+        slice_cred = create_credential(certs['alice']['gid'],
+                                       certs['slice']['gid'], expiration,
+                                       'slice', certs['ca']['keyfile'],
+                                       certs['ca']['certfile'],
+                                       [certs['ca']['certfile']],
+                                       delegatable=True)
+        creds = [slice_cred.save_to_string()]
+        current = slice_cred
+        for (caller, delegee) in (('alice', 'bob'), ('bob', 'carol')):
+            current = current.delegate(certs[delegee]['certfile'],
+                                       certs[caller]['keyfile'],
+                                       certs[caller]['certfile'])
+            creds.append(current.save_to_string())
+        return creds
+
+    @property
+    def delegated_creds(self):
+        return self._get('delegated_creds', self._make_delegated_creds)
+
+    # RSpecs
+
+    def _read_stitcher_requests(self):
+        files = sorted(glob.glob(os.path.join(self.opts.stitcher_files, 'request-*.xml')))
+        if not files:
+            raise SkipBenchmark("No request RSpecs in %s" % self.opts.stitcher_files)
+        return [open(f).read() for f in files]
+
+    @property
+    def stitcher_requests(self):
+        return self._get('stitcher_requests', self._read_stitcher_requests)
+
+    @property
+    def expanded_request(self):
+        '''A request as the SCS would expand it, with a stitching path
+        per link.'''
+        return self._get('expanded_request',
+                         lambda: make_stitching_rspec(self.opts.links, 'request'))
+
+    @property
+    def advertisement(self):
+        return self._get('advertisement',
+                         lambda: make_advertisement(self.opts.ad_size, expires=True))
+
+    @property
+    def stitching_advertisement(self):
+        '''An advertisement with a stitching extension.'''
+        return self._get('stitching_advertisement',
+                         lambda: make_advertisement(self.opts.ad_size, expires=True,
+                                                    ports=AD_STITCHING_PORTS))
+
+    def _make_describe_result(self):
+        '''A V3 Describe result, as an AM returns it: the manifest is
+        the advertisement.'''
+        slice_urn = geni.URN(AUTHORITY, 'slice', 'benchslice').urn_string()
+        expires = (datetime.datetime.utcnow() + datetime.timedelta(days=1)).isoformat()
+        slivers = [dict(geni_sliver_urn=geni.URN(AUTHORITY, 'sliver', str(i)).urn_string(),
+                        geni_expires=expires,
+                        geni_allocation_status='geni_provisioned',
+                        geni_operational_status='geni_ready',
+                        geni_error='')
+                   for i in range(XMLRPC_SLIVERS)]
+        slivers[0]['geni_error'] = u'Na\xefve error message'
+        value = dict(geni_rspec=self.advertisement, geni_urn=slice_urn,
+                     geni_slivers=slivers)
+        return dict(code=dict(geni_code=0, am_type='gcf', am_code=0),
+                    value=value, output='')
+
+    @property
+    def describe_result(self):
+        return self._get('describe_result', self._make_describe_result)
+
+    @property
+    def advertisement_no_expires(self):
+        '''An advertisement without an expires attribute, as from
+        ExoGENI, which makes expires_from_rspec search the whole thing.'''
+        return self._get('advertisement_no_expires',
+                         lambda: make_advertisement(NO_EXPIRES_AD_SIZE, expires=False))
+
+def make_stitching_rspec(nlinks, rspec_type, manifest_for=None):
+    '''An RSpec with a stitched link between nodes at 2 of the STITCH_AMS
+    for each of nlinks links, and its stitching extension. If manifest_for
+    is an AM URN, make the manifest from that AM (with sliver IDs and VLAN
+    tags for its parts).'''
+    out = ['<rspec xmlns="http://www.geni.net/resources/rspec/3" '
+           'xmlns:stitch="http://hpn.east.isi.edu/rspec/ext/stitch/0.1/" '
+           'type="%s">' % rspec_type]
+    for i in range(nlinks):
+        for (side, am) in _link_ams(i):
+            sliver = ''
+            if manifest_for == am:
+                sliver = ' sliver_id="%s+sliver+n%d%s"' % (am, i, side)
+            out.append('<node client_id="n%d%s" component_manager_id="%s"%s>'
+                       '<interface client_id="n%d%s:if0"/></node>' %
+                       (i, side, am, sliver, i, side))
+    for i in range(nlinks):
+        ams = _link_ams(i)
+        link_attrs = ''
+        if manifest_for in [am for (side, am) in ams]:
+            link_attrs = ' sliver_id="%s+sliver+l%d" vlantag="%d"' % (manifest_for, i, 100 + i)
+        managers = ''.join('<component_manager name="%s"/>' % am for (side, am) in ams)
+        irefs = ''
+        for (side, am) in ams:
+            sliver = ''
+            if manifest_for == am:
+                sliver = ' sliver_id="%s+sliver+if%d%s"' % (am, i, side)
+            irefs += '<interface_ref client_id="n%d%s:if0"%s/>' % (i, side, sliver)
+        out.append('<link client_id="link%d"%s>%s%s'
+                   '<property source_id="n%da:if0" dest_id="n%db:if0"/></link>' %
+                   (i, link_attrs, managers, irefs, i, i))
+    out.append('<stitch:stitching lastUpdateTime="20160101:00:00:00">')
+    for i in range(nlinks):
+        out.append('<stitch:path id="link%d">' % i)
+        for (hop, (side, am)) in enumerate(_link_ams(i)):
+            vlans = 'any'
+            if manifest_for == am:
+                vlans = str(100 + i)
+            out.append('<stitch:hop id="%d"><stitch:link id="%s+interface+l%d">'
+                       '<stitch:trafficEngineeringMetric>10</stitch:trafficEngineeringMetric>'
+                       '<stitch:capacity>100000</stitch:capacity>'
+                       '<stitch:switchingCapabilityDescriptor>'
+                       '<stitch:switchingcapType>l2sc</stitch:switchingcapType>'
+                       '<stitch:encodingType>ethernet</stitch:encodingType>'
+                       '<stitch:switchingCapabilitySpecificInfo>'
+                       '<stitch:switchingCapabilitySpecificInfo_L2sc>'
+                       '<stitch:interfaceMTU>9000</stitch:interfaceMTU>'
+                       '<stitch:vlanRangeAvailability>2-4094</stitch:vlanRangeAvailability>'
+                       '<stitch:suggestedVLANRange>%s</stitch:suggestedVLANRange>'
+                       '<stitch:vlanTranslation>false</stitch:vlanTranslation>'
+                       '</stitch:switchingCapabilitySpecificInfo_L2sc>'
+                       '</stitch:switchingCapabilitySpecificInfo>'
+                       '</stitch:switchingCapabilityDescriptor>'
+                       '</stitch:link><stitch:nextHop>%s</stitch:nextHop></stitch:hop>' %
+                       (hop + 1, am, i, vlans, ('null', hop + 2)[hop == 0]))
+        out.append('</stitch:path>')
+    out.append('</stitch:stitching></rspec>')
+    return ''.join(out)
+
+def _link_ams(i):
+    return (('a', STITCH_AMS[i % len(STITCH_AMS)]),
+            ('b', STITCH_AMS[(i + 1) % len(STITCH_AMS)]))
+
+def make_workflow(rspec):
+    '''A workflow like the SCS returns for the given parsed expanded
+    request: on each path, the hop at the AM with the greater URN
+    imports its VLAN from the other hop.'''
+    workflow = dict()
+    for path in rspec.stitching.paths:
+        deps = []
+        for hop in path.hops:
+            am_urn = [am for am in STITCH_AMS if hop.urn.startswith(am[:-len('authority+cm')])][0]
+            deps.append(dict(hop_urn=hop.urn, aggregate_urn=am_urn,
+                             aggregate_url='https://%s:12346' % am_urn.split('+')[1],
+                             import_vlans=False, dependencies=[]))
+        (importer, producer) = sorted(deps, key=lambda d: d['aggregate_urn'], reverse=True)
+        importer['import_vlans'] = True
+        importer['dependencies'] = [dict(producer)]
+        workflow[path.id] = dict(dependencies=deps)
+    return workflow
+
+def make_advertisement(size_mb, expires=True, ports=0):
+    '''A PG style advertisement of at least size_mb megabytes. If ports,
+    with a stitching extension with that many ports.'''
+    now = datetime.datetime.utcnow()
+    stamps = 'generated="%sZ"' % now.strftime('%Y-%m-%dT%H:%M:%S')
+    if expires:
+        stamps += ' expires="%sZ"' % (now + datetime.timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M:%S')
+    cm = 'urn:publicid:IDN+%s+authority+cm' % AUTHORITY
+    out = ['<?xml version="1.0" encoding="UTF-8"?>\n',
+           '<rspec xmlns="http://www.geni.net/resources/rspec/3" '
+           'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+           'xsi:schemaLocation="http://www.geni.net/resources/rspec/3 '
+           'http://www.geni.net/resources/rspec/3/ad.xsd" '
+           'type="advertisement" %s>\n' % stamps]
+    size = sum(len(s) for s in out)
+    target = int(size_mb * 1024 * 1024)
+    i = 0
+    while size < target:
+        node = ['  <node component_id="urn:publicid:IDN+%s+node+pc%d" '
+                'component_manager_id="%s" component_name="pc%d" exclusive="true">\n' %
+                (AUTHORITY, i, cm, i)]
+        for hw in ('pc3000', 'pcvm', 'd710'):
+            node.append('    <hardware_type name="%s"><emulab:node_type '
+                        'xmlns:emulab="http://www.protogeni.net/resources/rspec/ext/emulab/1" '
+                        'type_slots="1"/></hardware_type>\n' % hw)
+        for st in ('raw-pc', 'emulab-xen', 'emulab-openvz'):
+            node.append('    <sliver_type name="%s"><disk_image '
+                        'name="urn:publicid:IDN+%s+image+emulab-ops:UBUNTU14-64-STD" '
+                        'os="Linux" version="14.04"/></sliver_type>\n' % (st, AUTHORITY))
+        for j in range(4):
+            node.append('    <interface component_id="urn:publicid:IDN+%s+interface+pc%d:eth%d" '
+                        'role="experimental"/>\n' % (AUTHORITY, i, j))
+        node.append('    <available now="true"/>\n')
+        node.append('    <location country="US" latitude="42.39" longitude="-71.15"/>\n')
+        node.append('  </node>\n')
+        chunk = ''.join(node)
+        out.append(chunk)
+        size += len(chunk)
+        i += 1
+    if ports:
+        out.append('  <stitching xmlns="http://hpn.east.isi.edu/rspec/ext/stitch/0.1/" '
+                   'lastUpdateTime="20160101:00:00:00">\n'
+                   '    <aggregate id="%s" url="https://%s:12369/protogeni/xmlrpc/am">\n'
+                   '      <node id="urn:publicid:IDN+%s+node+procurve2">\n' %
+                   (cm, AUTHORITY, AUTHORITY))
+        for i in range(ports):
+            port = 'urn:publicid:IDN+%s+stitchport+procurve2:%d' % (AUTHORITY, i)
+            out.append('        <port id="%s">\n'
+                       '          <capacity>1000000</capacity>\n'
+                       '          <link id="%s:link">\n'
+                       '            <remoteLinkId>urn:publicid:IDN+ion.internet2.edu+interface+rtr.newy:et-%d:bench</remoteLinkId>\n'
+                       '            <trafficEngineeringMetric>10</trafficEngineeringMetric>\n'
+                       '            <capacity>1000000</capacity>\n'
+                       '            <switchingCapabilityDescriptor>\n'
+                       '              <switchingcapType>l2sc</switchingcapType>\n'
+                       '              <encodingType>ethernet</encodingType>\n'
+                       '              <switchingCapabilitySpecificInfo>\n'
+                       '                <switchingCapabilitySpecificInfo_L2sc>\n'
+                       '                  <interfaceMTU>9000</interfaceMTU>\n'
+                       '                  <vlanRangeAvailability>%d-%d,%d</vlanRangeAvailability>\n'
+                       '                  <vlanTranslation>false</vlanTranslation>\n'
+                       '                </switchingCapabilitySpecificInfo_L2sc>\n'
+                       '              </switchingCapabilitySpecificInfo>\n'
+                       '            </switchingCapabilityDescriptor>\n'
+                       '          </link>\n'
+                       '        </port>\n' %
+                       (port, port, i, 3000 + i, 3100 + i, 3500 + i))
+        out.append('      </node>\n    </aggregate>\n  </stitching>\n')
+    out.append('</rspec>\n')
+    return ''.join(out)
+
+# Certificates
+
+@benchmark('cert.gid_parse')
+def bench_gid_parse(fixtures):
+    '''Parse a user GID (with its issuer chain) from PEM, and get its URN'''
+    pem = fixtures.certs['alice']['pem']
+    def run():
+        gid.GID(string=pem).get_urn()
+    return run
+
+@benchmark('cert.certificate_parse')
+def bench_certificate_parse(fixtures):
+    '''Parse a Certificate (with its issuer chain) from PEM'''
+    pem = fixtures.certs['alice']['pem']
+    def run():
+        cert.Certificate(string=pem)
+    return run
+
+@benchmark('cert.verify_chain')
+def bench_verify_chain(fixtures):
+    '''Parse a user GID and verify its chain to the trusted root'''
+    certs = fixtures.certs
+    pem = certs['carol']['pem']
+    root = gid.GID(filename=certs['ca']['certfile'])
+    def run():
+        gid.GID(string=pem).verify_chain([root])
+    return run
+
+# Credentials
+
+@benchmark('cred.verify')
+def bench_cred_verify(fixtures):
+    '''Parse and verify a twice delegated slice credential'''
+    xml = fixtures.delegated_creds[-1]
+    trusted = [fixtures.certs['ca']['certfile']]
+    def run():
+        cred.Credential(string=xml).verify(trusted)
+    return run
+
+@benchmark('cred.verify_from_strings')
+def bench_verify_from_strings(fixtures):
+    '''CredentialVerifier.verify_from_strings on a twice delegated slice credential'''
+    from gcf.geni.util.cred_util import CredentialVerifier
+    creds = [fixtures.delegated_creds[-1]]
+    certs = fixtures.certs
+    verifier = CredentialVerifier(certs['trusted_roots'])
+    caller = certs['carol']['pem']
+    def run():
+        verifier.verify_from_strings(caller, creds, certs['slice_urn'], ['info'])
+    return run
+
+def _slice_cred_maker(fixtures):
+    '''Returns a function making an encoded (unsigned) slice credential
+    for alice, issued by the CA, as create_credential makes them.'''
+    from gcf.sfa.trust import rights
+    certs = fixtures.certs
+    expiration = datetime.datetime.utcnow() + datetime.timedelta(days=1)
+    def make():
+        ucred = cred.Credential()
+        ucred.set_gid_caller(certs['alice']['gid'])
+        ucred.set_gid_object(certs['slice']['gid'])
+        ucred.set_expiration(expiration)
+        privileges = rights.determine_rights('slice', None)
+        privileges.delegate_all_privileges(True)
+        ucred.set_privileges(privileges)
+        ucred.encode()
+        ucred.set_issuer_keys(certs['ca']['keyfile'], certs['ca']['certfile'])
+        return ucred
+    return make
+
+@benchmark('cred.sign_in_process')
+def bench_cred_sign_in_process(fixtures):
+    '''Sign a slice credential in process, with a preloaded CredentialSigner'''
+    from gcf.sfa.trust.credential_signer import CredentialSigner
+    certs = fixtures.certs
+    signer = CredentialSigner(certs['ca']['keyfile'], certs['ca']['certfile'])
+    make = _slice_cred_maker(fixtures)
+    def run():
+        ucred = make()
+        ucred.set_signer(signer)
+        ucred.sign()
+    return run
+
+@benchmark('cred.sign_xmlsec1')
+def bench_cred_sign_xmlsec1(fixtures):
+    '''Sign a slice credential with xmlsec1'''
+    fixtures.require_xmlsec1()
+    make = _slice_cred_maker(fixtures)
+    def run():
+        make().sign()
+    return run
+
+@benchmark('cred.issue_batch')
+def bench_cred_issue_batch(fixtures):
+    '''Issue CRED_BATCH_SIZE slice credentials with create_credentials'''
+    from gcf.geni.util.cred_util import create_credentials
+    from gcf.sfa.trust.credential_signer import CredentialSigner
+    certs = fixtures.certs
+    signer = CredentialSigner(certs['ca']['keyfile'], certs['ca']['certfile'])
+    expiration = datetime.datetime.utcnow() + datetime.timedelta(days=1)
+    specs = [(certs['alice']['gid'], certs['slice']['gid'], expiration,
+              'slice', True)] * CRED_BATCH_SIZE
+    def run():
+        create_credentials(specs, certs['ca']['keyfile'],
+                           certs['ca']['certfile'],
+                           [certs['ca']['certfile']], signer=signer)
+    return run
+
+# VLANs
+
+@benchmark('vlan.from_string')
+def bench_vlan_from_string(fixtures):
+    '''VLANRange.fromString on some typical VLAN range strings'''
+    from gcf.omnilib.stitch.VLANRange import VLANRange
+    def run():
+        for s in VLAN_STRINGS:
+            VLANRange.fromString(s)
+    return run
+
+@benchmark('vlan.set_algebra')
+def bench_vlan_set_algebra(fixtures):
+    '''Intersect, union and subtract large VLANRanges, and format the result'''
+    from gcf.omnilib.stitch.VLANRange import VLANRange
+    whole = VLANRange.fromString('2-4094')
+    odd = VLANRange.fromString(','.join(str(v) for v in range(3, 4094, 2)))
+    block = VLANRange.fromString('1000-3000')
+    def run():
+        avail = (whole & block) | odd
+        avail = avail - VLANRange.fromString('1500-1600')
+        str(avail)
+    return run
+
+# Stitching
+
+@benchmark('stitch.rspec_parse')
+def bench_rspec_parse(fixtures):
+    '''RSpecParser.parse on each stitcherTestFiles request'''
+    from gcf.omnilib.stitch.RSpecParser import RSpecParser
+    requests = fixtures.stitcher_requests
+    parser = RSpecParser(logger)
+    def run():
+        for request in requests:
+            parser.parse(request)
+    return run
+
+@benchmark('stitch.rspec_parse_expanded')
+def bench_rspec_parse_expanded(fixtures):
+    '''RSpecParser.parse on an expanded request with --links stitching paths'''
+    from gcf.omnilib.stitch.RSpecParser import RSpecParser
+    request = fixtures.expanded_request
+    parser = RSpecParser(logger)
+    def run():
+        parser.parse(request)
+    return run
+
+@benchmark('stitch.workflow_parse')
+def bench_workflow_parse(fixtures):
+    '''WorkflowParser.parse on an SCS style workflow for the expanded request'''
+    from gcf.omnilib.stitch.RSpecParser import RSpecParser
+    from gcf.omnilib.stitch.workflow import WorkflowParser
+    from gcf.omnilib.stitch.objects import Aggregate
+    request = fixtures.expanded_request
+    workflow = make_workflow(RSpecParser(logger).parse(request))
+    state = dict()
+    def prepare():
+        # Parsing the workflow changes the RSpec objects and adds
+        # to the global Aggregate cache, so start over each time
+        Aggregate.clearCache()
+        state['rspec'] = RSpecParser(logger).parse(request)
+    def run():
+        WorkflowParser(logger).parse(workflow, state['rspec'])
+    return (prepare, run)
+
+class _BenchPath(object):
+    def __init__(self, i):
+        self.id = 'link%d' % i
+
+class _BenchHopLink(object):
+    def __init__(self, urn):
+        self.urn = urn
+        self.vlan_suggested_request = 'any'
+        self.vlan_range_request = '2-4094'
+        self.vlan_suggested_manifest = None
+        self.ofAMUrl = None
+        self.controllerUrl = None
+
+class _BenchHop(object):
+    def __init__(self, agg, i, hop_id):
+        self._id = str(hop_id)
+        self.path = _BenchPath(i)
+        self.aggregate = agg
+        self._hop_link = _BenchHopLink('%s+interface+l%d' % (agg.urn, i))
+        self.globalId = None
+        self.import_vlans_from = None
+        self.vlans_unavailable = []
+
+class _BenchAggregate(object):
+    '''Just the parts of a stitching Aggregate that
+    combineManifestRSpecs uses.'''
+
+    def __init__(self, urn, nlinks):
+        self.urn = urn
+        self.urn_syns = [urn]
+        self.url = 'https://%s:12346' % urn.split('+')[1]
+        self.api_version = 2
+        self.userRequested = True
+        self.dcn = False
+        self.isEG = False
+        self.dependsOn = []
+        self.pgLogUrl = None
+        self.lastError = None
+        self.nick = None
+        self.requestDom = None
+        self.manifestDom = parseString(make_stitching_rspec(nlinks, 'manifest', urn))
+        self.hops = []
+        for i in range(nlinks):
+            for (hop, (side, am)) in enumerate(_link_ams(i)):
+                if am == urn:
+                    self.hops.append(_BenchHop(self, i, hop + 1))
+        self._hops = self.hops
+
+    def __str__(self):
+        return '<Aggregate %s>' % self.urn
+
+@benchmark('stitch.combine_manifests')
+def bench_combine_manifests(fixtures):
+    '''combineManifestRSpecs on manifests from 4 AMs with --links stitched links'''
+    from gcf.omnilib.stitch.ManifestRSpecCombiner import combineManifestRSpecs
+    nlinks = fixtures.opts.links
+    aggs = [_BenchAggregate(urn, nlinks) for urn in STITCH_AMS]
+    template = make_stitching_rspec(nlinks, 'manifest')
+    state = dict()
+    def prepare():
+        # The combiner edits the template
+        state['template'] = parseString(template)
+    def run():
+        combineManifestRSpecs(aggs, state['template'])
+    return (prepare, run)
+
+def _request_aggregates(fixtures):
+    # The expanded request, with the stitching extension in the default
+    # namespace as the SCS returns it, and its Aggregates from the
+    # workflow, with new VLAN tags to request and some loose hops
+    from gcf.omnilib.stitch import defs
+    from gcf.omnilib.stitch.RSpecParser import RSpecParser
+    from gcf.omnilib.stitch.workflow import WorkflowParser
+    from gcf.omnilib.stitch.objects import Aggregate
+    from gcf.omnilib.stitch.VLANRange import VLANRange
+    request = fixtures.expanded_request.replace('<stitch:', '<').replace('</stitch:', '</')
+    request = request.replace('<stitching ', '<stitching xmlns="%s" ' % defs.STITCH_V1_NS)
+    Aggregate.clearCache()
+    rspec = RSpecParser(logger).parse(request)
+    WorkflowParser(logger).parse(make_workflow(rspec), rspec)
+    aggs = Aggregate.all_aggregates()
+    for agg in aggs:
+        for (i, hop) in enumerate(agg.hops):
+            hop.loose = (i % 10 == 0)
+            hop._hop_link.vlan_range_request = VLANRange.fromString('%d-%d' % (100 + i, 3000 + i))
+            hop._hop_link.vlan_suggested_request = VLANRange.fromString(str(100 + i))
+    return (rspec.dom, aggs)
+
+@benchmark('stitch.request_edit_plan')
+def bench_request_edit_plan(fixtures):
+    '''The request XML for each of 4 AMs on --links stitched links, from edits planned with a shared RequestIndex'''
+    from gcf.omnilib.stitch.requestplan import RequestIndex
+    (dom, aggs) = _request_aggregates(fixtures)
+    expires = datetime.datetime.utcnow() + datetime.timedelta(days=1)
+    index = RequestIndex(dom)
+    for agg in aggs:
+        if agg.getRequestEditPlan(dom, expires, index).toxml(encoding="utf-8") != \
+                agg.getEditedRSpecDom(dom, expires).toxml(encoding="utf-8"):
+            raise Exception("Planned request for %s differs from the edited DOM" % agg)
+    def run():
+        index = RequestIndex(dom)
+        for agg in aggs:
+            agg.getRequestEditPlan(dom, expires, index).toxml(encoding="utf-8")
+    return run
+
+@benchmark('stitch.request_edit_dom')
+def bench_request_edit_dom(fixtures):
+    '''The request XML for each of 4 AMs on --links stitched links, from an edited copy of the request DOM'''
+    (dom, aggs) = _request_aggregates(fixtures)
+    expires = datetime.datetime.utcnow() + datetime.timedelta(days=1)
+    def run():
+        for agg in aggs:
+            agg.getEditedRSpecDom(dom, expires).toxml(encoding="utf-8")
+    return run
+
+def _vlan_availability_dom(rspec):
+    # How Aggregate.updateWithAvail used to get the available tags
+    from gcf.omnilib.stitch import defs
+    from gcf.omnilib.stitch.objects import HopLink
+    avail = dict()
+    for port in parseString(rspec).getElementsByTagName(defs.PORT_TAG):
+        for child in port.childNodes:
+            if child.localName == defs.LINK_TAG:
+                hopLink = HopLink.fromDOM(child)
+                avail[hopLink.urn] = hopLink.vlan_range_request
+    return avail
+
+def _extract_vlan_availability(fixtures):
+    '''Return extract_vlan_availability, after checking that it finds
+    the same tags as the DOM.'''
+    from gcf.omnilib.stitch.availability import extract_vlan_availability
+    def check():
+        ad = fixtures.stitching_advertisement
+        avail = extract_vlan_availability(ad)
+        if len(avail) != AD_STITCHING_PORTS or avail != _vlan_availability_dom(ad):
+            raise Exception("extract_vlan_availability differs from the DOM")
+        return True
+    fixtures._get('vlan_availability_conformance', check)
+    return extract_vlan_availability
+
+@benchmark('stitch.vlan_availability')
+def bench_vlan_availability(fixtures):
+    '''extract_vlan_availability on a --ad-size MB advertisement with stitching ports'''
+    extract = _extract_vlan_availability(fixtures)
+    ad = fixtures.stitching_advertisement
+    def run():
+        extract(ad)
+    return run
+
+@benchmark('stitch.vlan_availability_dom')
+def bench_vlan_availability_dom(fixtures):
+    '''The available tags of the stitching ports from a DOM of a --ad-size MB advertisement'''
+    ad = fixtures.stitching_advertisement
+    def run():
+        _vlan_availability_dom(ad)
+    return run
+
+# RSpecs
+
+@benchmark('rspec.expires_from_rspec')
+def bench_expires_from_rspec(fixtures):
+    '''expires_from_rspec on a --ad-size MB advertisement with an expires attribute'''
+    from gcf.omnilib.util.handler_utils import expires_from_rspec
+    ad = fixtures.advertisement
+    def run():
+        expires_from_rspec(ad, logger)
+    return run
+
+@benchmark('rspec.expires_from_rspec_no_expires')
+def bench_expires_from_rspec_no_expires(fixtures):
+    '''expires_from_rspec on a small advertisement with no expires attribute'''
+    from gcf.omnilib.util.handler_utils import expires_from_rspec
+    ad = fixtures.advertisement_no_expires
+    def run():
+        expires_from_rspec(ad, logger)
+    return run
+
+@benchmark('rspec.pretty')
+def bench_pretty(fixtures):
+    '''getPrettyRSpec on a --ad-size MB advertisement'''
+    from gcf.geni.util.rspec_util import getPrettyRSpec
+    ad = fixtures.advertisement
+    def run():
+        getPrettyRSpec(ad)
+    return run
+
+@benchmark('rspec.write_pretty_gzip')
+def bench_write_pretty_gzip(fixtures):
+    '''writePrettyRSpec of a --ad-size MB advertisement to a gzip compressed file'''
+    from gcf.geni.util.rspec_util import writePrettyRSpec
+    ad = fixtures.advertisement
+    filename = os.path.join(fixtures.tmpdir, 'advertisement.xml.gz')
+    def run():
+        with gzip.open(filename, 'wb') as f:
+            writePrettyRSpec(ad, f)
+    return run
+
+def _make_am_handler():
+    from gcf.oscript import parse_args
+    from gcf.omnilib.amhandler import AMCallHandler
+    opts = parse_args(['listresources'])[0]
+    return AMCallHandler(None, dict(logger=logger, omni=dict()), opts)
+
+@benchmark('rspec.decompress')
+def bench_decompress(fixtures):
+    '''_maybeDecompressRSpec on a compressed --ad-size MB advertisement'''
+    handler = _make_am_handler()
+    compressed = base64.b64encode(zlib.compress(fixtures.advertisement))
+    options = dict(geni_compressed=True)
+    def run():
+        handler._maybeDecompressRSpec(options, compressed)
+    return run
+
+@benchmark('rspec.decompress_uncompressed')
+def bench_decompress_uncompressed(fixtures):
+    '''_maybeDecompressRSpec on an uncompressed --ad-size MB advertisement'''
+    handler = _make_am_handler()
+    ad = fixtures.advertisement
+    options = dict()
+    def run():
+        handler._maybeDecompressRSpec(options, ad)
+    return run
+
+def _rspec_validator(fixtures):
+    from gcf.geni.util import rspec_util
+    schema_dirs = rspec_util.RSPEC_SCHEMA_DIRS
+    if fixtures.opts.rspec_schema_dir:
+        schema_dirs = [fixtures.opts.rspec_schema_dir] + schema_dirs
+    validator = rspec_util.RSpecValidator(schema_dirs, logger=logger)
+    if not validator.can_validate():
+        raise SkipBenchmark("No lxml or no local copy of %s (see --rspec-schema-dir)"
+                            % rspec_util.GENI_3_REQ_SCHEMA)
+    # Compile the schemas and check the requests are valid
+    for request in fixtures.stitcher_requests:
+        (valid, message) = validator.validate(request)
+        if not valid:
+            raise SkipBenchmark("A stitcherTestFiles request does not validate: %s" % message)
+    return validator
+
+@benchmark('rspec.validate_xsd')
+def bench_validate_xsd(fixtures):
+    '''RSpecValidator.validate (in process, uncached) on each stitcherTestFiles request'''
+    validator = _rspec_validator(fixtures)
+    requests = fixtures.stitcher_requests
+    def run():
+        for request in requests:
+            validator.validate(request)
+    return (validator.clear, run)
+
+@benchmark('rspec.validate_xsd_cached')
+def bench_validate_xsd_cached(fixtures):
+    '''RSpecValidator.validate of already validated stitcherTestFiles requests'''
+    validator = _rspec_validator(fixtures)
+    requests = fixtures.stitcher_requests
+    def run():
+        for request in requests:
+            validator.validate(request)
+    return run
+
+@benchmark('rspec.validate_rspeclint')
+def bench_validate_rspeclint(fixtures):
+    '''rspeclint on each stitcherTestFiles request (what validate_rspec did)'''
+    from gcf.geni.util import rspec_util
+    if find_rspeclint() is None:
+        raise SkipBenchmark("rspeclint not found")
+    requests = fixtures.stitcher_requests
+    def run():
+        for request in requests:
+            rspec_util._run_rspeclint(request, rspec_util.GENI_3_NAMESPACE,
+                                      rspec_util.GENI_3_REQ_SCHEMA)
+    return run
+
+# XML-RPC
+
+def _xmlrpc_codec(fixtures):
+    '''Return the xmlrpc_codec module, after checking that it marshals
+    and unmarshals the Describe result as xmlrpclib does.'''
+    from gcf.geni.util import xmlrpc_codec
+    def check():
+        params = (fixtures.describe_result,)
+        data = xmlrpclib.dumps(params, methodresponse=1)
+        if xmlrpc_codec.dumps(params, methodresponse=1) != data:
+            raise Exception("xmlrpc_codec.dumps differs from xmlrpclib.dumps")
+        if xmlrpc_codec.loads(data) != xmlrpclib.loads(data):
+            raise Exception("xmlrpc_codec.loads differs from xmlrpclib.loads")
+        return True
+    fixtures._get('xmlrpc_conformance', check)
+    return xmlrpc_codec
+
+def _describe_response(fixtures):
+    return fixtures._get('describe_response',
+                         lambda: xmlrpclib.dumps((fixtures.describe_result,),
+                                                 methodresponse=1))
+
+@benchmark('xmlrpc.dumps')
+def bench_xmlrpc_dumps(fixtures):
+    '''xmlrpc_codec.dumps of a Describe result with a --ad-size MB manifest'''
+    codec = _xmlrpc_codec(fixtures)
+    params = (fixtures.describe_result,)
+    def run():
+        codec.dumps(params, methodresponse=1)
+    return run
+
+@benchmark('xmlrpc.dumps_xmlrpclib')
+def bench_xmlrpc_dumps_xmlrpclib(fixtures):
+    '''xmlrpclib.dumps of a Describe result with a --ad-size MB manifest'''
+    params = (fixtures.describe_result,)
+    def run():
+        xmlrpclib.dumps(params, methodresponse=1)
+    return run
+
+@benchmark('xmlrpc.loads')
+def bench_xmlrpc_loads(fixtures):
+    '''xmlrpc_codec.loads of a Describe result with a --ad-size MB manifest'''
+    codec = _xmlrpc_codec(fixtures)
+    data = _describe_response(fixtures)
+    def run():
+        codec.loads(data)
+    return run
+
+@benchmark('xmlrpc.loads_xmlrpclib')
+def bench_xmlrpc_loads_xmlrpclib(fixtures):
+    '''xmlrpclib.loads of a Describe result with a --ad-size MB manifest'''
+    data = _describe_response(fixtures)
+    def run():
+        xmlrpclib.loads(data)
+    return run
+
+@benchmark('xmlrpc.loads_gzip')
+def bench_xmlrpc_loads_gzip(fixtures):
+    '''gzip decoding and xmlrpc_codec.loads of a compressed Describe result, as Omni receives it'''
+    codec = _xmlrpc_codec(fixtures)
+    data = xmlrpclib.gzip_encode(_describe_response(fixtures))
+    def run():
+        codec.loads(xmlrpclib.gzip_decode(data, max_decode=-1))
+    return run
+
+# GENI-in-a-Box
+
+def _gib_graph():
+    # Route planning only needs graphUtils, not the rest of the GIB
+    # aggregate
+    from gcf.geni.am.gibaggregate import graphUtils
+    return graphUtils
+
+class _BenchVMNode(object):
+    '''The parts of a GIB VMNode (and NIC and Link below) that route
+    planning uses.'''
+    def __init__(self, i):
+        self.containerName = 101 + i
+        self.nodeName = 'host%d' % i
+        self.NICs = []
+    def getNeighbors(self):
+        return self.NICs
+
+class _BenchNIC(object):
+    def __init__(self, host, link):
+        self.myHost = host
+        self.link = link
+        host.NICs.append(self)
+        link.endPoints.append(self)
+        self.deviceNumber = len(host.NICs)
+        self.ipAddress = '10.0.%d.%d' % (link.subnetNumber, host.containerName)
+    def getNeighbors(self):
+        return [self.link, self.myHost]
+
+class _BenchLink(object):
+    def __init__(self, subnetNumber):
+        self.subnetNumber = subnetNumber
+        self.endPoints = []
+    def getNeighbors(self):
+        return self.endPoints
+
+def make_gib_topology(kind, nhosts):
+    '''A GIB topology: a ring, a square grid mesh, or a binary tree of
+    LANs (each parent on a link with its children). Returns the hosts
+    and links.'''
+    if kind == 'mesh':
+        side = int(nhosts ** 0.5)
+        nhosts = side * side
+    hosts = [_BenchVMNode(i) for i in range(nhosts)]
+    links = []
+    def connect(*ends):
+        link = _BenchLink(len(links) + 3)
+        links.append(link)
+        for host in ends:
+            _BenchNIC(host, link)
+    if kind == 'ring':
+        for i in range(nhosts):
+            connect(hosts[i], hosts[(i + 1) % nhosts])
+    elif kind == 'mesh':
+        for i in range(nhosts):
+            if i % side < side - 1:
+                connect(hosts[i], hosts[i + 1])
+            if i + side < nhosts:
+                connect(hosts[i], hosts[i + side])
+    else:
+        for i in range(nhosts):
+            children = [hosts[c] for c in (2 * i + 1, 2 * i + 2) if c < nhosts]
+            if children:
+                connect(hosts[i], *children)
+    return (hosts, links)
+
+def _gib_route_lines(hosts, hostRoutes):
+    # As gibaggregate.resources._generateBashScript writes them
+    lines = []
+    for (host, routes) in zip(hosts, hostRoutes):
+        for (link, nic, gateway) in routes:
+            if gateway is None:
+                lines.append('vzctl exec %d "/sbin/ip route add 10.0.%d.0/24 dev eth%d"' %
+                             (host.containerName, link.subnetNumber, nic.deviceNumber))
+            else:
+                lines.append('vzctl exec %d "/sbin/ip route add 10.0.%d.0/24 via %s"' %
+                             (host.containerName, link.subnetNumber, gateway.ipAddress))
+    return lines
+
+def _exhaustive_shortest_path(startNode, endNode, pathSoFar=[]):
+    # The graphUtils.findShortestPath GIB used before: try every path
+    pathSoFar = pathSoFar + [startNode]
+    if startNode == endNode:
+        return pathSoFar
+    pathFromHere = None
+    for neighbor in startNode.getNeighbors():
+        if neighbor not in pathSoFar:
+            path = _exhaustive_shortest_path(neighbor, endNode, pathSoFar)
+            if path is not None and (pathFromHere is None or
+                                     len(path) < len(pathFromHere)):
+                pathFromHere = path
+    return pathFromHere
+
+def _exhaustive_routes(hosts, links):
+    hostRoutes = []
+    for host in hosts:
+        direct = []
+        gateways = []
+        for link in links:
+            nics = [nic for nic in link.endPoints if nic.myHost == host]
+            if nics:
+                direct.append((link, nics[0], None))
+            else:
+                path = _exhaustive_shortest_path(host, link)
+                if path is not None:
+                    gateways.append((link, None, path[3]))
+        hostRoutes.append(direct + gateways)
+    return hostRoutes
+
+def _gib_routes(kind):
+    '''Setup of the gib.routes_* benchmarks.'''
+    graphUtils = _gib_graph()
+    (hosts, links) = make_gib_topology(kind, GIB_CHECK_HOSTS)
+    if _gib_route_lines(hosts, graphUtils.planRoutes(hosts, links)) != \
+            _gib_route_lines(hosts, _exhaustive_routes(hosts, links)):
+        raise Exception("planRoutes differs from the exhaustive search on a %s" % kind)
+    (hosts, links) = make_gib_topology(kind, GIB_HOSTS)
+    def run():
+        _gib_route_lines(hosts, graphUtils.planRoutes(hosts, links))
+    return run
+
+@benchmark('gib.routes_ring')
+def bench_gib_routes_ring(fixtures):
+    '''GIB route planning for a ring of GIB_HOSTS hosts'''
+    return _gib_routes('ring')
+
+@benchmark('gib.routes_mesh')
+def bench_gib_routes_mesh(fixtures):
+    '''GIB route planning for a square grid of up to GIB_HOSTS hosts'''
+    return _gib_routes('mesh')
+
+@benchmark('gib.routes_tree')
+def bench_gib_routes_tree(fixtures):
+    '''GIB route planning for a binary tree of LANs of GIB_HOSTS hosts'''
+    return _gib_routes('tree')
+
+# Authorization
+
+@benchmark('auth.abac_authorize')
+def bench_abac_authorize(fixtures):
+    '''ABAC_Authorizer.authorize of Allocate with the example AM policies'''
+    from gcf.geni.auth.abac_authorizer import ABAC_Authorizer
+    from gcf.geni.auth.base_authorizer import AM_Methods
+    policy_file = fixtures.opts.policy_file
+    if not os.path.exists(policy_file):
+        raise SkipBenchmark("No policy file %s" % policy_file)
+    certs = fixtures.certs
+    # Point the example identities at our certs
+    with open(policy_file) as f:
+        policies = json.load(f)
+    for name in policies.get('identities', dict()):
+        if name == 'AM':
+            policies['identities'][name] = certs['am']['certfile']
+        else:
+            policies['identities'][name] = certs['ca']['certfile']
+    policies_file = os.path.join(fixtures.tmpdir, 'am_policies.json')
+    with open(policies_file, 'w') as f:
+        json.dump(policies, f)
+    map_file = os.path.join(fixtures.tmpdir, 'am_policy_map.json')
+    with open(map_file, 'w') as f:
+        json.dump(dict(default=[policies_file]), f)
+    opts = optparse.Values(dict(authorizer_policy_map_file=map_file))
+    authorizer = ABAC_Authorizer(certs['trusted_roots'], opts)
+    # The ABAC authorizer logs every condition it evaluates
+    logging.getLogger('gcf.abac_auth').setLevel(logging.WARNING)
+
+    caller = certs['carol']['pem']
+    if fixtures.xmlsec1:
+        creds = [fixtures.delegated_creds[-1]]
+    else:
+        # Without a credential the SFA binder does not authorize the
+        # caller, so authorize fails once all the policies are evaluated
+        creds = []
+        logging.getLogger('cred-verifier').setLevel(logging.CRITICAL)
+    slice_urn = certs['slice_urn']
+    request = fixtures.stitcher_requests[0]
+    args = dict(slice_urn=slice_urn, rspec=request)
+    options = dict(geni_am_urn=geni.URN(AUTHORITY, 'authority', 'am').urn_string())
+    # The slice already has some slivers
+    start = datetime.datetime.utcnow()
+    end = start + datetime.timedelta(hours=2)
+    user_urn = certs['carol']['gid'].get_urn()
+    allocations = [dict(sliver_urn=geni.URN(AUTHORITY, 'sliver', str(i)).urn_string(),
+                        slice_urn=slice_urn, user_urn=user_urn,
+                        start_time=str(start), end_time=str(end),
+                        measurements=dict(NODE=1))
+                   for i in range(3)]
+    def run():
+        try:
+            authorizer.authorize(AM_Methods.ALLOCATE_V3, caller, creds,
+                                 args, options, allocations)
+        except Exception:
+            if fixtures.xmlsec1:
+                raise
+    return run
+
+# Running
+
+def select_benchmarks(patterns):
+    '''Benchmarks whose names contain or match any of the given patterns.'''
+    if not patterns:
+        return list(BENCHMARKS)
+    return [b for b in BENCHMARKS
+            if any(p in b.name or fnmatch.fnmatch(b.name, p) for p in patterns)]
+
+def _time_loops(prepare, run, number):
+    total = 0.0
+    timer = time.time
+    if prepare is None:
+        start = timer()
+        for i in xrange(number):
+            run()
+        return timer() - start
+    for i in xrange(number):
+        prepare()
+        start = timer()
+        run()
+        total += timer() - start
+    return total
+
+def measure(prepare, run, repeat, min_time):
+    '''Time run() like timeit: find a loop count giving samples of at
+    least min_time seconds, then take repeat samples. Return the stats
+    of the per call times.'''
+    gcenabled = gc.isenabled()
+    gc.disable()
+    try:
+        # Warm up (and calibrate)
+        number = 1
+        while True:
+            elapsed = _time_loops(prepare, run, number)
+            if elapsed >= min_time or number >= 1000000:
+                break
+            if elapsed <= 0:
+                number *= 10
+            else:
+                number = min(max(int(number * min_time * 1.2 / elapsed), number + 1),
+                             number * 10)
+        samples = [_time_loops(prepare, run, number) / number
+                   for i in range(repeat)]
+    finally:
+        if gcenabled:
+            gc.enable()
+    samples.sort()
+    n = len(samples)
+    mean = sum(samples) / n
+    if n % 2:
+        median = samples[n // 2]
+    else:
+        median = (samples[n // 2 - 1] + samples[n // 2]) / 2
+    stdev = 0.0
+    if n > 1:
+        stdev = (sum((s - mean) ** 2 for s in samples) / (n - 1)) ** 0.5
+    return dict(loops=number, repeat=repeat, min=samples[0], max=samples[-1],
+                median=median, mean=mean, stdev=stdev)
+
+def run_benchmarks(benchmarks, fixtures, opts, out=sys.stdout):
+    results = dict()
+    skipped = dict()
+    for bench in benchmarks:
+        try:
+            setup = bench.setup(fixtures)
+        except SkipBenchmark, e:
+            skipped[bench.name] = str(e)
+            out.write("%-36s skipped: %s\n" % (bench.name, e))
+            continue
+        if isinstance(setup, tuple):
+            (prepare, run) = setup
+        else:
+            (prepare, run) = (None, setup)
+        stats = measure(prepare, run, opts.repeat, opts.min_time)
+        results[bench.name] = stats
+        out.write("%-36s %s +- %s (%d loops x %d)\n" %
+                  (bench.name, format_secs(stats['min']), format_secs(stats['stdev']),
+                   stats['loops'], stats['repeat']))
+        out.flush()
+    return (results, skipped)
+
+def format_secs(secs):
+    for (unit, scale) in (('s', 1.0), ('ms', 1e3), ('us', 1e6)):
+        if secs >= 1.0 / scale:
+            return "%7.3f %-2s" % (secs * scale, unit)
+    return "%7.3f %-2s" % (secs * 1e9, 'ns')
+
+def environment(fixtures):
+    return dict(gcf_version=GCF_VERSION,
+                python=platform.python_version(),
+                platform=platform.platform(),
+                machine=platform.machine(),
+                xmlsec1=fixtures.xmlsec1)
+
+def compare(results, baseline, tolerance, out=sys.stdout):
+    '''Compare our min per call times to those in the baseline.
+    Return the names of the benchmarks slower by more than tolerance percent.'''
+    regressions = []
+    base_results = baseline.get('benchmarks', dict())
+    out.write("\n%-36s %12s %12s %8s\n" % ("Benchmark", "Baseline", "Current", "Change"))
+    for name in sorted(set(results) | set(base_results)):
+        if name not in results:
+            out.write("%-36s %12s %12s\n" % (name, format_secs(base_results[name]['min']), "-"))
+            continue
+        if name not in base_results:
+            out.write("%-36s %12s %12s\n" % (name, "-", format_secs(results[name]['min'])))
+            continue
+        old = base_results[name]['min']
+        new = results[name]['min']
+        change = 0.0
+        if old > 0:
+            change = 100.0 * (new - old) / old
+        flag = ''
+        if change > tolerance:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        out.write("%-36s %12s %12s %+7.1f%%%s\n" %
+                  (name, format_secs(old), format_secs(new), change, flag))
+    return regressions
+
+def parse_args(argv):
+    parser = optparse.OptionParser(usage="%prog [options]",
+                                   description="Run micro-benchmarks of the Omni, stitcher and gcf hot paths.")
+    parser.add_option("-l", "--list", action="store_true", default=False,
+                      help="List the benchmarks and exit")
+    parser.add_option("-k", "--select", action="append", default=[], metavar="PATTERN",
+                      help="Run only the benchmarks whose names contain or match PATTERN (may be repeated)")
+    parser.add_option("-r", "--repeat", type=int, default=5,
+                      help="Number of samples per benchmark. Default: %default")
+    parser.add_option("--min-time", type=float, default=0.2,
+                      help="Minimum seconds per sample. Default: %default")
+    parser.add_option("--links", type=int, default=100,
+                      help="Stitched links in the synthetic stitching RSpecs. Default: %default")
+    parser.add_option("--ad-size", type=float, default=4,
+                      help="Size in MB of the synthetic advertisement. Default: %default")
+    parser.add_option("--stitcher-files", metavar="DIR", default=DEFAULT_STITCHER_FILES,
+                      help="Directory of request RSpecs for the stitcher benchmarks. Default: %default")
+    parser.add_option("--rspec-schema-dir", metavar="DIR",
+                      help="Directory of local copies of the RSpec schemas, laid out as their URLs (e.g. DIR/www.geni.net/resources/rspec/3/request.xsd)")
+    parser.add_option("--policy-file", metavar="FILE", default=DEFAULT_POLICY_FILE,
+                      help="ABAC AM policy file. Default: %default")
+    parser.add_option("-o", "--output", metavar="FILE",
+                      help="Write the environment and results as JSON to this file")
+    parser.add_option("--baseline", metavar="FILE",
+                      help="Compare to the results in this JSON file, and exit 1 on any regression")
+    parser.add_option("--tolerance", type=float, default=10,
+                      help="Percent slower than the baseline that counts as a regression. Default: %default")
+    parser.add_option("--debug", action="store_true", default=False,
+                       help="enable debugging output")
+    return parser.parse_args(argv[1:])
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+    opts = parse_args(argv)[0]
+    level = logging.WARNING
+    if opts.debug:
+        level = logging.DEBUG
+    logging.basicConfig(level=level)
+
+    benchmarks = select_benchmarks(opts.select)
+    if opts.list:
+        for bench in benchmarks:
+            print "%-36s %s" % (bench.name, bench.description)
+        return 0
+    if not benchmarks:
+        sys.exit("No benchmarks match %s" % ", ".join(opts.select))
+    if opts.repeat < 1:
+        sys.exit("Need at least 1 sample per benchmark")
+
+    baseline = None
+    if opts.baseline:
+        with open(os.path.expanduser(opts.baseline)) as f:
+            baseline = json.load(f)
+
+    tmpdir = tempfile.mkdtemp(prefix='gcf-bench-')
+    try:
+        fixtures = Fixtures(opts, tmpdir)
+        if fixtures.xmlsec1 is None:
+            logger.warning("xmlsec1 not found: skipping the credential benchmarks that need it")
+        (results, skipped) = run_benchmarks(benchmarks, fixtures, opts)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    if opts.output:
+        report = dict(time=datetime.datetime.utcnow().isoformat(),
+                      environment=environment(fixtures),
+                      options=dict(repeat=opts.repeat, min_time=opts.min_time,
+                                   links=opts.links, ad_size=opts.ad_size),
+                      benchmarks=results,
+                      skipped=skipped)
+        with open(os.path.expanduser(opts.output), 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print "Wrote results to %s" % opts.output
+
+    if baseline is not None:
+        regressions = compare(results, baseline, opts.tolerance)
+        if regressions:
+            print "\n%d benchmark(s) more than %g%% slower than the baseline: %s" % \
+                (len(regressions), opts.tolerance, ", ".join(regressions))
+            return 1
+        print "\nNo benchmark more than %g%% slower than the baseline" % opts.tolerance
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
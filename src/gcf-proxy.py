@@ -50,7 +50,9 @@ from gcf import geni
 import gcf.geni.am
 import gcf.geni.am.am2
 import gcf.geni.am.proxyam
+import gcf.geni.am.proxy_clients
 from gcf.geni.config import read_config
+from gcf.geni.am.am_metrics import make_metrics
 
 def parse_args(argv):
     parser = optparse.OptionParser()
@@ -151,7 +153,11 @@ def main(argv=None):
                                              certfile=certfile,
                                              trust_roots_dir=getAbsPath(opts.rootcadir),
                                              ca_certs=comboCertsFile,
-                                             base_name=config['global']['base_name'])
+                                             base_name=config['global']['base_name'],
+                                             metrics=make_metrics(opts, logger),
+                                             inside_key_ttl=int(getattr(opts, 'inside_key_ttl', None) or gcf.geni.am.proxy_clients.DEFAULT_TTL),
+                                             inside_key_dir=getAbsPath(getattr(opts, 'inside_key_dir', None)),
+                                             pool_size=int(getattr(opts, 'upstream_pool_size', None) or gcf.geni.am.proxy_clients.DEFAULT_POOL_SIZE))
 
     logger.info('GENI AM Listening on port %s...' % (opts.port))
     pams.serve_forever()
@@ -34,10 +34,15 @@ import ssl
 import base64
 import textwrap
 import os
+import sys
+import time
+import xmlrpclib
 
 from SimpleXMLRPCServer import SimpleXMLRPCServer
 from SimpleXMLRPCServer import SimpleXMLRPCRequestHandler
 
+from .util import xmlrpc_codec
+
 class SecureXMLRPCRequestHandler(SimpleXMLRPCRequestHandler):
     """A request handler that grabs the socket peer's certificate and
     makes it available while the request is handled.
@@ -66,6 +71,15 @@ class SecureXMLRPCRequestHandler(SimpleXMLRPCRequestHandler):
         self.server.der_cert = None
         self.server.pem_cert = None
         SimpleXMLRPCRequestHandler.finish(self)
+
+    def end_headers(self):
+        # SimpleXMLRPCRequestHandler decodes gzip compressed requests
+        # (and compresses large responses if the client accepts
+        # gzip). Say so (RFC 7694), so that Omni compresses its large
+        # requests.
+        if hasattr(self, 'decode_request_content'):
+            self.send_header("Accept-Encoding", "gzip")
+        SimpleXMLRPCRequestHandler.end_headers(self)
         
     def der_to_pem(self, der_cert_bytes):
         "base64 encode the der cert and wrap with proper begin/end lines."
@@ -86,6 +100,8 @@ class SecureXMLRPCServer(SimpleXMLRPCServer):
                  ca_certs=None):
         SimpleXMLRPCServer.__init__(self, addr, requestHandler, logRequests,
                                     allow_none, encoding, False)
+        # An optional gcf.geni.am.am_metrics.AMMetrics to record calls in
+        self.metrics = None
         if certfile and ((not os.path.exists(certfile)) or os.path.getsize(certfile) < 1):
             raise Exception("certfile %s doesn't exist or is empty" % certfile)
 
@@ -113,3 +129,66 @@ class SecureXMLRPCServer(SimpleXMLRPCServer):
     # This method for the threaded case
     def get_pem_cert(self):
         return self.pem_cert
+
+    # As SimpleXMLRPCServer._marshaled_dispatch, but decoding the
+    # request and marshalling the result with the faster xmlrpc_codec
+    def _codec_marshaled_dispatch(self, data, dispatch_method=None, path=None):
+        try:
+            params, method = xmlrpc_codec.loads(data)
+
+            # generate response
+            if dispatch_method is not None:
+                response = dispatch_method(method, params)
+            else:
+                response = self._dispatch(method, params)
+            # wrap response in a singleton tuple
+            response = (response,)
+            response = xmlrpc_codec.dumps(response, methodresponse=1,
+                                          allow_none=self.allow_none,
+                                          encoding=self.encoding)
+        except xmlrpclib.Fault, fault:
+            response = xmlrpc_codec.dumps(fault, allow_none=self.allow_none,
+                                          encoding=self.encoding)
+        except:
+            # report exception back to server
+            exc_type, exc_value, exc_tb = sys.exc_info()
+            response = xmlrpc_codec.dumps(
+                xmlrpclib.Fault(1, "%s:%s" % (exc_type, exc_value)),
+                encoding=self.encoding, allow_none=self.allow_none,
+                )
+        return response
+
+    # When collecting metrics, time each request (including decoding the
+    # request and marshalling the result) and the dispatch within it.
+    def _marshaled_dispatch(self, data, dispatch_method=None, path=None):
+        metrics = self.metrics
+        if metrics is None:
+            return self._codec_marshaled_dispatch(data, dispatch_method, path)
+        record = metrics.begin_call(None)
+        try:
+            return self._codec_marshaled_dispatch(data, dispatch_method, path)
+        finally:
+            if record.method is None:
+                # Request could not be decoded
+                metrics.discard_call(record)
+            else:
+                metrics.end_call(record)
+
+    def _dispatch(self, method, params):
+        metrics = self.metrics
+        record = None
+        if metrics is not None:
+            record = metrics.current_call()
+        if record is None:
+            return SimpleXMLRPCServer._dispatch(self, method, params)
+        record.method = method
+        start = time.time()
+        try:
+            result = SimpleXMLRPCServer._dispatch(self, method, params)
+        except:
+            record.dispatch_secs = time.time() - start
+            metrics.note_result(record, fault=True)
+            raise
+        record.dispatch_secs = time.time() - start
+        metrics.note_result(record, result)
+        return result
@@ -55,6 +55,7 @@ from ..util.tz_util import tzd
 from ..SecureXMLRPCServer import SecureXMLRPCServer
 from ..auth.base_authorizer import *
 from .am_method_context import AMMethodContext
+from .am_metrics import get_metrics_result
 from ...gcf_version import GCF_VERSION
 
 # See sfa/trust/rights.py
@@ -300,7 +301,7 @@ class ReferenceAggregateManager(object):
             raise xmlrpclib.Fault('Insufficient privileges', str(e))
 
         # Grab the user_urn
-        user_urn = gid.GID(string=options['geni_true_caller_cert']).get_urn()
+        user_urn = gid.gid_from_string(options['geni_true_caller_cert']).get_urn()
 
         # If we get here, the credentials give the caller
         # all needed privileges to act on the given target.
@@ -397,7 +398,7 @@ class ReferenceAggregateManager(object):
             raise xmlrpclib.Fault('Insufficient privileges', str(e))
 
         # Grab the user_urn
-        user_urn = gid.GID(string=options['geni_true_caller_cert']).get_urn()
+        user_urn = gid.gid_from_string(options['geni_true_caller_cert']).get_urn()
 
 
         # If we get here, the credentials give the caller
@@ -710,12 +711,14 @@ class AggregateManager(object):
     """
 
     def __init__(self, trust_roots_dir, delegate, authorizer=None,
-                 resource_manager=None):
+                 resource_manager=None, metrics=None):
         self._trust_roots_dir = trust_roots_dir
         self._delegate = delegate
         self.logger = logging.getLogger('gcf.am2')
         self.authorizer = authorizer
         self.resource_manager = resource_manager
+        # Optional AMMetrics, used by AMMethodContext and GetMetrics
+        self.metrics = metrics
 
     def _exception_result(self, exception):
         output = str(exception)
@@ -737,6 +740,12 @@ class AggregateManager(object):
             self.logger.exception("Error in GetVersion:")
             return self._exception_result(e)
 
+    def GetMetrics(self, options=dict()):
+        '''Return per-method call counts, result codes, latency
+        histograms by phase and recent slow calls at this AM,
+        if metrics are enabled. See am_metrics.py.'''
+        return get_metrics_result(self.metrics, "gcf2")
+
     def ListResources(self, credentials, options):
         '''Return an RSpec of resources managed at this AM.
         If a geni_slice_urn
@@ -854,7 +863,7 @@ class AggregateManagerServer(object):
                  trust_roots_dir=None,
                  ca_certs=None, base_name=None,
                  authorizer=None, resource_manager=None,
-                 delegate=None):
+                 delegate=None, metrics=None):
         # ca_certs arg here must be a file of concatenated certs
         if ca_certs is None:
             raise Exception('Missing CA Certs')
@@ -870,7 +879,9 @@ class AggregateManagerServer(object):
         self._server = SecureXMLRPCServer(addr, keyfile=keyfile,
                                           certfile=certfile, ca_certs=ca_certs)
         aggregate_manager = AggregateManager(trust_roots_dir, delegate, 
-                                             authorizer, resource_manager)
+                                             authorizer, resource_manager,
+                                             metrics)
+        self._server.metrics = metrics
         self._server.register_instance(aggregate_manager)
         # Set the server on the delegate so it can access the
         # client certificate.
@@ -64,6 +64,7 @@ from ...omnilib.util import credparsing as credutils
 
 from ..auth.base_authorizer import *
 from .am_method_context import AMMethodContext
+from .am_metrics import get_metrics_result
 from .api_error_exception import ApiErrorException
 
 # See sfa/trust/rights.py
@@ -439,7 +440,7 @@ class ReferenceAggregateManager(object):
         # all needed privileges to act on the given target.
 
         # Grab the user_urn
-        user_urn = gid.GID(string=options['geni_true_caller_cert']).get_urn()
+        user_urn = gid.gid_from_string(options['geni_true_caller_cert']).get_urn()
 
 
         rspec_dom = None
@@ -639,7 +640,7 @@ class ReferenceAggregateManager(object):
         self.getVerifiedCredentials(the_slice.urn, credentials, options, privileges)
 
         # Grab the user_urn
-        user_urn = gid.GID(string=options['geni_true_caller_cert']).get_urn()
+        user_urn = gid.gid_from_string(options['geni_true_caller_cert']).get_urn()
 
         # If we get here, the credentials give the caller
         # all needed privileges to act on the given target.
@@ -1185,12 +1186,14 @@ class AggregateManager(object):
     """
 
     def __init__(self, trust_roots_dir, delegate, authorizer=None,
-                 resource_manager=None):
+                 resource_manager=None, metrics=None):
         self._trust_roots_dir = trust_roots_dir
         self._delegate = delegate
         self.logger = logging.getLogger('gcf.am3')
         self.authorizer = authorizer
         self.resource_manager = resource_manager
+        # Optional AMMetrics, used by AMMethodContext and GetMetrics
+        self.metrics = metrics
 
     def _exception_result(self, exception):
         output = str(exception)
@@ -1221,6 +1224,12 @@ class AggregateManager(object):
             traceback.print_exc()
             return self._exception_result(e)
 
+    def GetMetrics(self, options=dict()):
+        '''Return per-method call counts, result codes, latency
+        histograms by phase and recent slow calls at this AM,
+        if metrics are enabled. See am_metrics.py.'''
+        return get_metrics_result(self.metrics, "gcf")
+
     def ListResources(self, credentials, options):
         '''Return an RSpec of resources managed at this AM.
         If geni_available is specified in the options,
@@ -1387,7 +1396,7 @@ class AggregateManagerServer(object):
                  trust_roots_dir=None,
                  ca_certs=None, base_name=None,
                  authorizer=None, resource_manager=None,
-                 delegate=None, multithread=False):
+                 delegate=None, multithread=False, metrics=None):
         # ca_certs arg here must be a file of concatenated certs
         if ca_certs is None:
             raise Exception('Missing CA Certs')
@@ -1411,7 +1420,9 @@ class AggregateManagerServer(object):
                                           certfile=certfile, ca_certs=ca_certs, 
                                           logRequests=logRequest)
         aggregate_manager = AggregateManager(trust_roots_dir, delegate, 
-                                             authorizer, resource_manager)
+                                             authorizer, resource_manager,
+                                             metrics)
+        self._server.metrics = metrics
         self._server.register_instance(aggregate_manager)
         # Set the server on the delegate so it can access the
         # client certificate.
@@ -24,9 +24,10 @@
 from __future__ import absolute_import
 
 import os
+import time
 import traceback
 
-from ...sfa.trust.gid import GID
+from ...sfa.trust.gid import GID, gid_from_string
 from ...sfa.trust.credential import Credential
 from ...sfa.trust.certificate import Certificate
 from ...sfa.trust.abac_credential import ABACCredential
@@ -59,14 +60,19 @@ class AMMethodContext:
         self._options = options
 #        self._caller_cert = self._aggregate_manager._delegate._server.pem_cert
         self._caller_cert = aggregate_manager._delegate._server.get_pem_cert()
-        self._caller_urn = GID(string=self._caller_cert).get_urn()
+        self._caller_urn = gid_from_string(self._caller_cert).get_urn()
         self._is_v3 = is_v3
         self._resource_bindings = resource_bindings
         self._result = None
         self._error = False
+        # Optional per-method metrics (see am_metrics.py)
+        self._metrics = getattr(aggregate_manager, 'metrics', None)
+        self._metrics_record = None
+        self._own_metrics_record = False
 
     # This method is called prior to the 'with AMMethodContext' block
     def __enter__(self):
+        self._begin_metrics()
         try:
             self._logger.info("AM Invocation: %s %s %s %s" % \
                                   (self._method_name, self._caller_urn, 
@@ -82,6 +88,7 @@ class AMMethodContext:
                                                         self._options)
 #                self._logger.info("New Args %s New Options %s" % \
 #                                      (self._args, self._options))
+            self._mark('validate_args')
 
             # Change client cert if valid speaks-for invocation
             caller_gid = GID(string=self._caller_cert)
@@ -97,6 +104,7 @@ class AMMethodContext:
                                   (self._caller_urn, new_caller_urn))
                 self._caller_cert = new_caller_gid.save_to_string()
                 self._caller_urn = new_caller_urn
+            self._mark('speaksfor')
 
             self._options['geni_true_caller_cert'] = self._caller_cert
             self._options['geni_am_urn'] = \
@@ -112,6 +120,7 @@ class AMMethodContext:
                                                                       options=self._options)
                     if the_slice and 'slice_urn' not in self._args:
                         self._args['slice_urn'] = the_slice.getURN()
+                self._mark('credentials')
 
             if self._authorizer is not None:
                 requested_allocation_state = []
@@ -129,6 +138,7 @@ class AMMethodContext:
                                            credentials, self._args, 
                                            self._options,
                                            requested_allocation_state)
+                self._mark('authorize')
         except ApiErrorException, e:
             self._result = self._api_error(e);
         except Exception, e:
@@ -153,6 +163,9 @@ class AMMethodContext:
     # type, value is the exception and traceback_object is the stack trace
     # Otherwise, these arguments are all none
     def __exit__(self, type, value, traceback_object):
+        # Charge the 'with' block to the delegate, unless __enter__ failed
+        if not self._error:
+            self._mark('delegate')
         if type is ApiErrorException:
             self._logger.exception("AM API Error in %s" % self._method_name)
             self._result=self._api_error(value);
@@ -162,6 +175,33 @@ class AMMethodContext:
 
         self._logger.info("Result from %s: %s", self._method_name, 
                           self._result)
+        self._end_metrics()
+
+    # Start (or join the XML-RPC server's) metrics record for this call
+    def _begin_metrics(self):
+        if self._metrics is None:
+            return
+        record = self._metrics.current_call()
+        if record is None:
+            record = self._metrics.begin_call(self._method_name)
+            self._own_metrics_record = True
+        record.method = self._method_name
+        record.last_mark = time.time()
+        self._metrics_record = record
+
+    # Charge the time since the last mark to the given phase
+    def _mark(self, phase):
+        if self._metrics_record is not None:
+            self._metrics_record.mark(phase)
+
+    def _end_metrics(self):
+        record = self._metrics_record
+        if record is None:
+            return
+        record.caller_urn = self._caller_urn
+        self._metrics.note_result(record, self._result)
+        if self._own_metrics_record:
+            self._metrics.end_call(record)
 
     # Return a GENI_style error return for given exception/traceback
     def _errorReturn(self, e):
@@ -0,0 +1,319 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Per-method call metrics for aggregate managers.
+
+An AMMetrics instance counts calls and result codes per method, keeps
+latency histograms per method and phase, and keeps a log of calls slower
+than a threshold. The XML-RPC server starts and finishes a record for
+each request (timing the request decoding and result marshalling), and
+AMMethodContext marks the phases within the call:
+
+  validate_args  Authorizer argument validation
+  speaksfor      Speaks-for resolution
+  credentials    Normalizing credentials and decoding URNs (APIv3)
+  authorize      Credential verification and authorization
+  delegate       The delegate (the real work of the call)
+  marshal        XML-RPC request decoding and result marshalling
+  total          The whole request
+
+Metrics are off unless an AMMetrics is given to the AggregateManagerServer
+(see make_metrics, and the metrics* options in gcf_config). When off,
+the servers and AMMethodContext skip all of this.
+
+Metrics are available from the GetMetrics XML-RPC method, and may be
+periodically written to a JSON file.
+"""
+
+from __future__ import absolute_import
+
+import collections
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+
+# Upper bounds (in seconds) of the latency histogram buckets.
+# A final 'le_inf' bucket catches the rest.
+BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+PHASES = ('validate_args', 'speaksfor', 'credentials', 'authorize',
+          'delegate', 'marshal', 'total')
+
+# Code recorded for calls that raised an exception (XML-RPC Fault)
+FAULT_CODE = 'fault'
+
+def _bucket_name(bound):
+    return 'le_%s' % bound
+
+_BUCKET_NAMES = [_bucket_name(b) for b in BUCKETS] + ['le_inf']
+
+class Histogram(object):
+    """A fixed bucket latency histogram, plus count, sum and max."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, secs):
+        i = 0
+        for bound in BUCKETS:
+            if secs <= bound:
+                break
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.total += secs
+        if secs > self.max:
+            self.max = secs
+
+    def as_dict(self):
+        avg = 0.0
+        if self.count:
+            avg = self.total / self.count
+        return dict(count=self.count, total_secs=self.total,
+                    avg_secs=avg, max_secs=self.max,
+                    buckets=dict(zip(_BUCKET_NAMES, self.counts)))
+
+class MethodStats(object):
+    """Counts, result codes and phase histograms for one method."""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.codes = collections.defaultdict(int)
+        self.phases = collections.defaultdict(Histogram)
+
+    def as_dict(self):
+        return dict(count=self.count, errors=self.errors,
+                    codes=dict(self.codes),
+                    phases=dict((name, hist.as_dict()) for (name, hist)
+                                in self.phases.iteritems()))
+
+class CallRecord(object):
+    """Timing for one call in progress."""
+
+    def __init__(self, method):
+        self.method = method
+        self.caller_urn = None
+        self.start = time.time()
+        self.last_mark = self.start
+        self.phases = {}
+        self.dispatch_secs = None
+        self.code = None
+
+    def mark(self, phase):
+        """Charge the time since the last mark to the given phase."""
+        now = time.time()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self.last_mark
+        self.last_mark = now
+
+def result_code(result):
+    """Return the geni_code of a GENI style return struct, or 0."""
+    if isinstance(result, dict) and 'code' in result:
+        code = result['code']
+        if isinstance(code, dict):
+            code = code.get('geni_code', 0)
+        return code
+    return 0
+
+class AMMetrics(object):
+    """Thread safe per-method metrics and slow call log for an AM."""
+
+    def __init__(self, slow_threshold=None, slow_log_size=100, logger=None):
+        # slow_threshold is in seconds. None or 0 means no slow call log.
+        self.slow_threshold = slow_threshold
+        self.logger = logger or logging.getLogger('gcf.am.metrics')
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._methods = collections.defaultdict(MethodStats)
+        self._slow_calls = collections.deque(maxlen=slow_log_size)
+        self._local = threading.local()
+        self._dump_thread = None
+        self._sections = []
+
+    # Call records: the XML-RPC server begins and ends a record around
+    # each request. AMMethodContext fills in the phases of the current
+    # record, or begins and ends its own if there is none (as when the
+    # AM is called without our servers).
+
+    def begin_call(self, method):
+        record = CallRecord(method)
+        self._local.record = record
+        return record
+
+    def current_call(self):
+        return getattr(self._local, 'record', None)
+
+    def discard_call(self, record):
+        if getattr(self._local, 'record', None) is record:
+            self._local.record = None
+
+    def note_result(self, record, result=None, fault=False):
+        """Note the result code of the call, unless already noted."""
+        if record.code is not None:
+            return
+        if fault:
+            record.code = FAULT_CODE
+        else:
+            record.code = result_code(result)
+
+    def end_call(self, record):
+        """Finish the given record and add it to the metrics."""
+        if record is None:
+            return
+        self.discard_call(record)
+        now = time.time()
+        total = now - record.start
+        phases = record.phases
+        if record.dispatch_secs is not None:
+            if not phases:
+                # Not an AMMethodContext call: all the dispatch time
+                # was in the delegate
+                phases['delegate'] = record.dispatch_secs
+            phases['marshal'] = max(total - record.dispatch_secs, 0.0)
+        phases['total'] = total
+        code = record.code
+        if code is None:
+            code = 0
+        code = str(code)
+        with self._lock:
+            stats = self._methods[record.method]
+            stats.count += 1
+            if code != '0':
+                stats.errors += 1
+            stats.codes[code] += 1
+            for (phase, secs) in phases.iteritems():
+                stats.phases[phase].add(secs)
+            slow = self.slow_threshold and total > self.slow_threshold
+            if slow:
+                self._slow_calls.append(dict(method=record.method,
+                                             start=_iso(record.start),
+                                             total_secs=total,
+                                             code=code,
+                                             phases=dict(phases)))
+        if slow:
+            self.logger.warning("Slow call: %s by %s took %.3f seconds (code %s): %s",
+                                record.method, record.caller_urn, total,
+                                code, _format_phases(phases))
+
+    def add_section(self, name, get_section):
+        """Add the result of calling get_section() (a dict that XML-RPC
+        can marshal) to the metrics, as name. For metrics kept by an AM
+        delegate, e.g. the proxy AM."""
+        self._sections.append((name, get_section))
+
+    def get_metrics(self):
+        """Return the current metrics as a dict that XML-RPC can marshal."""
+        with self._lock:
+            methods = dict((name, stats.as_dict()) for (name, stats)
+                           in self._methods.iteritems())
+            slow_calls = list(self._slow_calls)
+        now = time.time()
+        result = dict(started=_iso(self.started),
+                      now=_iso(now),
+                      uptime_secs=now - self.started,
+                      slow_threshold_secs=float(self.slow_threshold or 0),
+                      methods=methods,
+                      slow_calls=slow_calls)
+        for (name, get_section) in self._sections:
+            result[name] = get_section()
+        return result
+
+    def dump(self, filename):
+        """Write the current metrics as JSON to the given file."""
+        tmpname = filename + '.tmp'
+        with open(tmpname, 'w') as f:
+            json.dump(self.get_metrics(), f, indent=2, sort_keys=True)
+        os.rename(tmpname, filename)
+
+    def start_dump_thread(self, filename, interval=60):
+        """Write the metrics to filename every interval seconds,
+        from a daemon thread."""
+        def dumper():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.dump(filename)
+                except Exception, e:
+                    self.logger.warning("Failed to write metrics to %s: %s",
+                                        filename, e)
+        self._dump_thread = threading.Thread(target=dumper,
+                                             name='am-metrics-dump')
+        self._dump_thread.daemon = True
+        self._dump_thread.start()
+
+def _iso(secs):
+    return datetime.datetime.utcfromtimestamp(secs).isoformat() + 'Z'
+
+def _format_phases(phases):
+    return ", ".join("%s=%.3f" % (phase, phases[phase])
+                     for phase in PHASES if phase in phases)
+
+def get_metrics_result(metrics, am_type):
+    """GENI style return struct for the GetMetrics XML-RPC method."""
+    if metrics is None:
+        # 13 = UNSUPPORTED
+        return dict(code=dict(geni_code=13, am_type=am_type, am_code=13),
+                    value="",
+                    output="Metrics are not enabled at this aggregate")
+    return dict(code=dict(geni_code=0, am_type=am_type, am_code=0),
+                value=metrics.get_metrics(),
+                output="")
+
+def _is_true(value):
+    return value is not None and str(value).strip().lower() in ('true', 'yes', '1', 'on')
+
+def make_metrics(opts, logger=None):
+    """Create an AMMetrics from the metrics options of an AM config
+    section, or return None if metrics are not enabled:
+      metrics=true                  Enable metrics and GetMetrics
+      metrics_slow_threshold=SECS   Log calls slower than this
+      metrics_slow_log_size=N       Keep the last N slow calls (default 100)
+      metrics_dump_file=FILE        Periodically write metrics to FILE
+      metrics_dump_interval=SECS    How often to write them (default 60)
+    """
+    if logger is None:
+        logger = logging.getLogger('gcf.am.metrics')
+    if not _is_true(getattr(opts, 'metrics', None)):
+        return None
+    slow_threshold = getattr(opts, 'metrics_slow_threshold', None)
+    if slow_threshold is not None and str(slow_threshold).strip() != "":
+        slow_threshold = float(slow_threshold)
+    else:
+        slow_threshold = None
+    slow_log_size = int(getattr(opts, 'metrics_slow_log_size', None) or 100)
+    metrics = AMMetrics(slow_threshold, slow_log_size, logger)
+    dump_file = getattr(opts, 'metrics_dump_file', None)
+    if dump_file is not None and str(dump_file).strip() != "":
+        dump_file = os.path.abspath(os.path.expanduser(str(dump_file).strip()))
+        interval = float(getattr(opts, 'metrics_dump_interval', None) or 60)
+        metrics.start_dump_thread(dump_file, interval)
+        logger.info("Writing AM metrics to %s every %s seconds",
+                    dump_file, interval)
+    logger.info("AM metrics enabled (slow call threshold: %s)", slow_threshold)
+    return metrics
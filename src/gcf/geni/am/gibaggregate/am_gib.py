@@ -44,9 +44,11 @@ from .... import geni
 from ...util.tz_util import tzd
 from ...util.urn_util import publicid_to_urn
 from ...SecureXMLRPCServer import SecureXMLRPCServer
+from ...SecureThreadedXMLRPCServer import SecureThreadedXMLRPCServer
 from ..resource import Resource
 from ..aggregate import Aggregate
 from ..fakevm import FakeVM
+from ..am_metrics import get_metrics_result
 
 
 # See sfa/trust/rights.py
@@ -180,7 +182,7 @@ class ReferenceAggregateManager(object):
         # from the https connection by the SecureXMLRPCServer
         # to identify the caller.
         try:
-            self._cred_verifier.verify_from_strings(self._server.pem_cert,
+            self._cred_verifier.verify_from_strings(self._server.get_pem_cert(),
                                                     credentials,
                                                     slice_urn,
                                                     privileges,
@@ -220,7 +222,7 @@ class ReferenceAggregateManager(object):
             slice_urn = options['geni_slice_urn']
             if slice_urn in self._slices:
                 ### result = self.manifest_rspec(slice_urn)
-                result = gib_manager.get_manifest()
+                result = gib_manager.get_manifest(slice_urn)
             else:
                 # return an empty rspec
                 return self._no_such_slice(slice_urn)
@@ -275,7 +277,7 @@ class ReferenceAggregateManager(object):
         # from the https connection by the SecureXMLRPCServer
         # to identify the caller.
         try:
-            creds = self._cred_verifier.verify_from_strings(self._server.pem_cert,
+            creds = self._cred_verifier.verify_from_strings(self._server.get_pem_cert(),
                                                             credentials,
                                                             slice_urn,
                                                             privileges,
@@ -346,7 +348,7 @@ class ReferenceAggregateManager(object):
 
         self.logger.info("Created new slice %s" % slice_urn)
         ### result = self.manifest_rspec(slice_urn)
-        result = gib_manager.get_manifest()
+        result = gib_manager.get_manifest(slice_urn)
 
         self.logger.debug('Result = %s', result)
         return dict(code=dict(geni_code=0,
@@ -374,7 +376,7 @@ class ReferenceAggregateManager(object):
         # from the https connection by the SecureXMLRPCServer
         # to identify the caller.
         try:
-            self._cred_verifier.verify_from_strings(self._server.pem_cert,
+            self._cred_verifier.verify_from_strings(self._server.get_pem_cert(),
                                                     credentials,
                                                     slice_urn,
                                                     privileges,
@@ -395,7 +397,7 @@ class ReferenceAggregateManager(object):
             ### for r in resources:
             ###     r.status = Resource.STATUS_UNKNOWN
 
-            gib_manager.deleteSliver()
+            gib_manager.deleteSliver(slice_urn)
 
             del self._slices[slice_urn]
             self.logger.info("Sliver %r deleted" % slice_urn)
@@ -419,7 +421,7 @@ class ReferenceAggregateManager(object):
         # listslices, listnodes, policy
         privileges = (SLIVERSTATUSPRIV,)
         try:
-            self._cred_verifier.verify_from_strings(self._server.pem_cert,
+            self._cred_verifier.verify_from_strings(self._server.get_pem_cert(),
                                                     credentials,
                                                     slice_urn,
                                                     privileges,
@@ -464,7 +466,7 @@ class ReferenceAggregateManager(object):
         self.logger.info('RenewSliver(%r, %r)' % (slice_urn, expiration_time))
         privileges = (RENEWSLIVERPRIV,)
         try:
-            creds = self._cred_verifier.verify_from_strings(self._server.pem_cert,
+            creds = self._cred_verifier.verify_from_strings(self._server.get_pem_cert(),
                                                             credentials,
                                                             slice_urn,
                                                             privileges,
@@ -516,7 +518,7 @@ class ReferenceAggregateManager(object):
         self.logger.info('Shutdown(%r)' % (slice_urn))
         privileges = (SHUTDOWNSLIVERPRIV,)
         try:
-            self._cred_verifier.verify_from_strings(self._server.pem_cert,
+            self._cred_verifier.verify_from_strings(self._server.get_pem_cert(),
                                                     credentials,
                                                     slice_urn,
                                                     privileges,
@@ -628,9 +630,11 @@ class AggregateManager(object):
     XMLRPC interface and invokes a delegate for all the operations.
     """
 
-    def __init__(self, delegate):
+    def __init__(self, delegate, metrics=None):
         self._delegate = delegate
         self.logger = logging.getLogger('gcf.am2')
+        # Optional AMMetrics, for GetMetrics
+        self.metrics = metrics
 
     def _exception_result(self, exception):
         output = str(exception)
@@ -652,6 +656,12 @@ class AggregateManager(object):
             self.logger.exception("Error in GetVersion:")
             return self._exception_result(e)
 
+    def GetMetrics(self, options=dict()):
+        '''Return per-method call counts, result codes, latency
+        histograms by phase and recent slow calls at this AM,
+        if metrics are enabled. See am_metrics.py.'''
+        return get_metrics_result(self.metrics, "gcf2")
+
     def ListResources(self, credentials, options):
         '''Return an RSpec of resources managed at this AM.
         If a geni_slice_urn
@@ -722,7 +732,8 @@ class AggregateManagerServer(object):
 
     def __init__(self, addr, keyfile=None, certfile=None,
                  trust_roots_dir=None,
-                 ca_certs=None, base_name=None):
+                 ca_certs=None, base_name=None, metrics=None,
+                 multithread=False):
         # ca_certs arg here must be a file of concatenated certs
         if ca_certs is None:
             raise Exception('Missing CA Certs')
@@ -734,9 +745,18 @@ class AggregateManagerServer(object):
         delegate = ReferenceAggregateManager(trust_roots_dir, base_name, 
                                              server_url)
         # FIXME: set logRequests=true if --debug
-        self._server = SecureXMLRPCServer(addr, keyfile=keyfile,
-                                          certfile=certfile, ca_certs=ca_certs)
-        self._server.register_instance(AggregateManager(delegate))
+        # Slivers of different slices can be created, deleted and checked
+        # at the same time, so requests may be served in threads
+        if multithread:
+            self._server = SecureThreadedXMLRPCServer(addr, keyfile=keyfile,
+                                                      certfile=certfile,
+                                                      ca_certs=ca_certs)
+        else:
+            self._server = SecureXMLRPCServer(addr, keyfile=keyfile,
+                                              certfile=certfile,
+                                              ca_certs=ca_certs)
+        self._server.metrics = metrics
+        self._server.register_instance(AggregateManager(delegate, metrics))
         # Set the server on the delegate so it can access the
         # client certificate.
         delegate._server = self._server
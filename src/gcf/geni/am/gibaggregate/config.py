@@ -50,17 +50,31 @@ manifestFile = 'gib-manifest.rspec'   # Slice manifest is written to this file
 shellScriptFile = 'createSliver.sh'   # Shell script generated to create and
                                       #     configure the sliver
 
-# Figure out the Linux distribution: Red Hat Fedora or Ubuntu
-_version = open('/proc/version').read()
+# Figure out the Linux distribution: Red Hat Fedora or Ubuntu.  On any
+#    other system distro is None and distroError says why: the aggregate
+#    does not run there (gcf-am-gib.py exits), but this package can still
+#    be loaded, e.g. for dry runs of provisioning and for tests.
+try :
+    _version = open('/proc/version').read()
+except IOError :
+    _version = ''
+distroError = None
 if _version.find('Ubuntu') != -1 :
     distro = 'UBUNTU10-STD'
 elif _version.find('Red Hat') != -1 :
     distro = 'FEDORA15-STD'
 else :
-    _exitMsg = 'Running on an unsupported Linux distribution: %s' % _version 
-    logger.error(_exitMsg)
-    sys.exit(_exitMsg)
+    distro = None
+    distroError = 'Running on an unsupported Linux distribution: %s' % \
+        (_version.strip() or sys.platform)
 
 
 
 rootPwd = 'geniinabox'     # No comment  :-)
+
+# Number of OpenVZ containers (101, 102, ...) shared by all the slices on
+#    this aggregate.  hostSetup.sh adds host names for pc101 to pc106.
+maxContainers = 6
+
+# Number of provisioning steps (e.g. setting up one container) run at once
+provisioningThreads = 4
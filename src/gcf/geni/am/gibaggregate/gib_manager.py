@@ -23,67 +23,154 @@
 
 from __future__ import absolute_import
 
+import functools
 import logging
 import os
+import shutil
 import subprocess
+import threading
 
 from . import resources
 from . import rspec_handler
 from . import config
+from . import provisioning
+
+_runner = None      # CommandRunner that runs the provisioning steps
+_slices = {}        # Map of slice URNs to the resources.SliceTopology of
+                    #    their slivers on this aggregate
+_slicesLock = threading.Lock()
+
+def setCommandRunner(runner) :
+    """
+        Run provisioning steps with the specified provisioning.CommandRunner
+        (e.g. a RecordingRunner, for a dry run) instead of running them
+        as root.
+    """
+    global _runner
+    _runner = runner
+
+
+def _getRunner() :
+    if _runner is None :
+        return provisioning.SudoShellRunner(config.rootPwd)
+    return _runner
+
+
+def _getTopology(slice_urn) :
+    with _slicesLock :
+        return _slices.get(slice_urn)
+
 
 # GENI-in-a-box specific createSliver
 def createSliver(slice_urn, requestRspec, users) :
     """
-        Create a sliver on this aggregate.
+        Create a sliver on this aggregate.  Slivers of other slices may
+        be created at the same time.
+
+        Returns None if everything goes well.  In case of an error it
+        returns a string describing the error.
     """
     config.logger.info("createSliver called")
 
+    topology = resources.SliceTopology(slice_urn)
+    with _slicesLock :
+        if slice_urn in _slices :
+            return 'Slice %s already has a sliver at this aggregate' % \
+                slice_urn
+        _slices[slice_urn] = topology
+
+    errString = _planSliver(topology, requestRspec, users)
+    if errString is not None :
+        # Give back whatever was allocated to the sliver
+        with _slicesLock :
+            del _slices[slice_urn]
+        topology.free()
+        shutil.rmtree(topology.scriptsDir, ignore_errors = True)
+        return errString
+
+    ## Run the steps that create the new sliver, in the background.  The
+    #    status of each host is updated as its steps finish.
+    for hostObject in topology.hosts.values() :
+        resources.setResourceStatus(topology, hostObject.containerName,
+                                    'unknown')
+    topology.executor = provisioning.StepExecutor(
+        topology.provisioningSteps, _getRunner(),
+        config.provisioningThreads,
+        functools.partial(resources.setResourceStatus, topology),
+        config.logger)
+    topology.executor.start()
+    return None
+
+
+def _planSliver(topology, requestRspec, users) :
     # Parse the request rspec
-    rspec_handler.parseRequestRspec(slice_urn, requestRspec)
+    errString = rspec_handler.parseRequestRspec(topology, requestRspec)
+    if errString is not None :
+        return errString
 
     # Provision the sliver i.e. assign resource as specifed in the request rspec
-    #    The sliver isn't created yet.  The shell commands used to create
-    #    the sliver are written into the file named in config.py
-    resources.provisionSliver(users)
+    #    The sliver isn't created yet.  The steps that create the sliver
+    #    are planned.
+    errString = resources.provisionSliver(topology, users)
+    if errString is not None :
+        return errString
+
+    # The files of the sliver go in a directory of its own
+    try :
+        if not os.path.isdir(topology.scriptsDir) :
+            os.makedirs(topology.scriptsDir)
+    except OSError, e :
+        config.logger.error("Failed to create directory %s: %s" %
+                            (topology.scriptsDir, e))
+        return 'Failed to create the files of the sliver'
 
     # Generate the manifest rspec.  The manifest is written to the file named
     #    in config.py
-    (rspec_handler.GeniManifest(users, requestRspec)).create()
+    if (rspec_handler.GeniManifest(topology, users, requestRspec)).create() \
+            is None :
+        return 'Failed to write the manifest of the sliver'
 
-    # Add commands to the bash script that create special files/directories
-    #    in the containers.  They contain slice configuration information
-    #    such as manifest rspec, slice name, etc.
-    resources.specialFiles()
+    # Add steps that create special files/directories in the containers.
+    #    They contain slice configuration information such as manifest
+    #    rspec, slice name, etc.
+    resources.specialFiles(topology)
 
-    ## Execute the shell script that create a new sliver
-    pathToFile = config.sliceSpecificScriptsDir + '/' + config.shellScriptFile
-    command = 'echo \"%s\" | sudo -S %s' % (config.rootPwd, pathToFile)
-    print command
-    os.system(command)
+    # Write the steps into the bash script named in config.py, as a record
+    #    of what is run
+    resources.writeScript(topology)
+    return None
 
 
-def deleteSliver() :
+def deleteSliver(slice_urn) :
     """
-       Delete the sliver created on this aggregate.
+       Delete the sliver of the specified slice created on this aggregate.
     """
-    config.logger.info("createSliver called")
+    config.logger.info("deleteSliver called")
 
-    # Invoke the deleteSliver script in the standardScipts directory
-    pathToFile = config.standardScriptsDir + '/' + config.deleteSliver
-    command = 'echo \"%s\" | sudo -S %s %s %s' % (config.rootPwd,
-                                                  pathToFile,
-                                                  config.homeDirectory,
-                                                  config.sliceSpecificScriptsDir
-                                               )
-    print command
-    os.system(command)
-
-    # Delete the file containing the manifest rspec
-    pathToFile = config.sliceSpecificScriptsDir + '/' + config.manifestFile
-    os.remove(pathToFile)
+    with _slicesLock :
+        topology = _slices.pop(slice_urn, None)
+    if topology is None :
+        config.logger.error("No sliver of slice %s to delete" % slice_urn)
+        return
+
+    # Stop provisioning the sliver, if that is still going on
+    if topology.executor is not None :
+        topology.executor.cancel()
+        topology.executor.wait()
+
+    # Stop and destroy the containers and delete the bridges of the sliver
+    (exitStatus, output) = \
+        _getRunner().run(provisioning.Step('delete sliver',
+                                           resources.teardownCommands(topology)))
+    if exitStatus != 0 :
+        config.logger.error("Failed to delete sliver (exit status %s): %s" %
+                            (exitStatus, output))
+
+    # Delete the manifest rspec and status files of the sliver
+    shutil.rmtree(topology.scriptsDir, ignore_errors = True)
     
-    # Free up internal data structures representing these resources
-    resources.freeResources()
+    # Give the containers, subnets and MAC addresses back for other slivers
+    topology.free()
 
 
 def sliverStatus(slice_urn) :
@@ -92,8 +179,13 @@ def sliverStatus(slice_urn) :
     """
     config.logger.info("sliverStatus called")
 
+    topology = _getTopology(slice_urn)
+    if topology is None :
+        return dict(geni_urn = slice_urn, geni_status = 'unknown',
+                    geni_resources = [])
+
     # Get a list of statuses for each of the VM resources
-    resourceStatusList = resources.getResourceStatus()
+    resourceStatusList = resources.getResourceStatus(topology)
 
     # Determine the overall status of the slice at this aggregate
     #     If any resource is 'shutdown', the sliver is 'shutdown'
@@ -125,18 +217,22 @@ def sliverStatus(slice_urn) :
         if readyCount == len(resourceStatusList) :
             sliceStatus = 'ready'
 
-    return dict(geni_urn = resources.sliceURN, \
+    return dict(geni_urn = topology.sliceURN, \
                     geni_status = sliceStatus, \
                     geni_resources = resourceStatusList)
     
 
 
-def get_manifest() :
+def get_manifest(slice_urn) :
     """
-        Return the manifest rspec for the current slice.  The manifest
+        Return the manifest rspec for the specified slice.  The manifest
         is in a file created by rspec_handler.GeniManifest.
     """
-    pathToFile = config.sliceSpecificScriptsDir + '/' + config.manifestFile
+    topology = _getTopology(slice_urn)
+    if topology is None :
+        config.logger.error("No sliver of slice %s" % slice_urn)
+        return None
+    pathToFile = topology.scriptsDir + '/' + config.manifestFile
     config.logger.info('Reading manifest from %s' % pathToFile)
     try:
         f = open(pathToFile, 'r')
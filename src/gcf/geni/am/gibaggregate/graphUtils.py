@@ -21,6 +21,8 @@
 # IN THE WORK.
 #----------------------------------------------------------------------
 
+import collections
+
 
 class GraphNode(object) :
     """ This is the base class for all the objects that correspond to 
@@ -38,30 +40,121 @@ class GraphNode(object) :
         pass
 
 
-def findShortestPath(startNode, endNode, pathSoFar =[]) :
+def buildAdjacency(startNodes) :
+    """ Return a dictionary mapping the id of every GraphNode reachable
+        from the specified GraphNodes to the list of its neighbors.
+        Searches that share this (e.g. one per host) then do not ask
+        nodes for their neighbors again.
+    """
+    adjacency = {}
+    toVisit = list(startNodes)
+    while toVisit :
+        node = toVisit.pop()
+        if node is None or id(node) in adjacency :
+            continue
+        neighbors = [neighbor for neighbor in node.getNeighbors() \
+                         if neighbor is not None]
+        adjacency[id(node)] = neighbors
+        toVisit.extend(neighbors)
+    return adjacency
+
+
+def _breadthFirstSearch(startNode, adjacency = None) :
+    """ Breadth first search of the graph from startNode.  Returns the
+        GraphNodes reachable from startNode in the order visited
+        (nearest first), and a dictionary mapping the id of each to its
+        (predecessor, distance) on a shortest path from startNode.
+        Neighbors are visited in the order getNeighbors lists them, so
+        of the shortest paths to a node, the one found is the first in
+        that order (the one the exhaustive search this replaced chose).
+    """
+    found = {id(startNode) : (None, 0)}
+    order = [startNode]
+    queue = collections.deque(order)
+    while queue :
+        node = queue.popleft()
+        distance = found[id(node)][1] + 1
+        if adjacency is not None :
+            neighbors = adjacency.get(id(node), [])
+        else :
+            neighbors = node.getNeighbors()
+        for neighbor in neighbors :
+            if neighbor is not None and id(neighbor) not in found :
+                found[id(neighbor)] = (node, distance)
+                order.append(neighbor)
+                queue.append(neighbor)
+    return (order, found)
+
+
+def findShortestPath(startNode, endNode, adjacency = None) :
     """ Find the shortest path between the specified GraphNode objects 
-        that form the nodes of a graph.
+        that form the nodes of a graph.  Returns the list of GraphNodes
+        on the path (starting with startNode and ending with endNode),
+        or None if there is no path.
+    """
+    found = _breadthFirstSearch(startNode, adjacency)[1]
+    if id(endNode) not in found :
+        return None
+    path = [endNode]
+    predecessor = found[id(endNode)][0]
+    while predecessor is not None :
+        path.append(predecessor)
+        predecessor = found[id(predecessor)][0]
+    path.reverse()
+    return path
+
+
+def findFirstHops(startNode, hops, adjacency = None) :
+    """ Find the shortest paths from the specified GraphNode to every
+        node it can reach, in one breadth first search.  Returns a
+        dictionary mapping the id of each node at least 'hops' steps
+        from startNode to the node 'hops' steps along the path to it
+        (the node that findShortestPath(startNode, node)[hops] gives).
+    """
+    (order, found) = _breadthFirstSearch(startNode, adjacency)
+    firstHops = {}
+    for node in order :
+        (predecessor, distance) = found[id(node)]
+        if distance == hops :
+            firstHops[id(node)] = node
+        elif distance > hops :
+            # Predecessors are visited first
+            firstHops[id(node)] = firstHops[id(predecessor)]
+    return firstHops
+
+
+def planRoutes(hosts, links) :
+    """ Plan the static IP routes of each host (VMNode) to every link
+        (subnet) it can reach, with one breadth first search per host
+        over the host - NIC - link graph.
+
+        Returns a list with a list of routes per host (in the order
+        given).  A route is a tuple (link, NIC, gateway NIC):
+          - For links the host is directly connected to, the NIC is
+            the first endpoint of the link on this host, and the
+            gateway is None.  These routes come first.
+          - For other links, the NIC is None and the gateway is the NIC
+            (on another host) that is the first hop on the shortest path
+            to the link: path is NIC -> Link -> NIC -> Host (gateway)
+            -> ..., so the 3rd node along it.
+        Links the host cannot reach get no route.
     """
-    # Add this node to the path explored so far
-    pathSoFar = pathSoFar + [startNode]
-
-    if startNode == endNode :
-        # Found path to the endNode!
-        return pathSoFar
-
-    # Path from here to the endNode.  We currently don't have such a path
-    pathFromHere =  None
-
-    # See if we can get to the endNode through one of our neighbors
-    neighbors = startNode.getNeighbors() 
-    for i in range(len(neighbors)) :
-        if neighbors[i] not in pathSoFar :
-            pathThruNeighbor = findShortestPath(neighbors[i], endNode, \
-                                                    pathSoFar)
-            if pathThruNeighbor != None :
-                if (pathFromHere == None) or (len(pathThruNeighbor) < \
-                                                  len(pathFromHere)) :
-                    # Found a new or shorter path to the endNode 
-                    pathFromHere = pathThruNeighbor
-
-    return pathFromHere
+    adjacency = buildAdjacency(list(hosts) + list(links))
+    hostRoutes = []
+    for hostObject in hosts :
+        directRoutes = []
+        gatewayRoutes = []
+        firstHops = None
+        for linkObject in links :
+            for nicObject in linkObject.endPoints :
+                if nicObject.myHost == hostObject :
+                    directRoutes.append((linkObject, nicObject, None))
+                    break
+            else :
+                if firstHops is None :
+                    firstHops = findFirstHops(hostObject, 3, adjacency)
+                gateway = firstHops.get(id(linkObject))
+                if gateway is not None :
+                    gatewayRoutes.append((linkObject, None, gateway))
+        hostRoutes.append(directRoutes + gatewayRoutes)
+    return hostRoutes
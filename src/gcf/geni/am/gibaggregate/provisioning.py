@@ -0,0 +1,415 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+""" Provisioning of a GENI-in-a-Box sliver as a graph of steps.
+
+    Each step is a short list of shell commands (e.g. set up the
+    interfaces of one container, or the bridge of one link) and the
+    steps it depends on.  A StepExecutor runs a step once all the steps
+    it depends on are done, running up to a given number of steps at
+    once, so that the steps of different containers run in parallel.
+
+    The commands are run by a pluggable CommandRunner: SudoShellRunner
+    runs them as root with sudo; RecordingRunner just records them, for
+    trying out provisioning on machines without OpenVZ.
+
+    IdPool hands out the IDs (containers, link subnets, MAC addresses)
+    that the slivers being provisioned share.
+"""
+
+from __future__ import absolute_import
+
+import abc
+import collections
+import os
+import stat
+import subprocess
+import threading
+import time
+
+# Bash function used by steps that wait for a container to come up
+PING_NODE_FUNCTION = [
+    'pingNode () {  # pings specified PC to check if it is alive ',
+    '    pingAttempts=0 ',
+    '    echo \"Pinging VM 10.0.1.$1...\" ',
+    '    ping -c2 10.0.1.$1 ',
+    '    while [ $? -ne 0 ] && [ $pingAttempts -le 50 ] ',
+    '    do ',
+    '        sleep 10  # sleep for 10 more seconds ',
+    '        let \"pingAttempts += 1\" ',
+    '        echo \"Pinging VM 10.0.1.$1...\" ',
+    '        ping -c2 10.0.1.$1 ',
+    '    done ',
+    '    if [ $pingAttempts -gt 20 ] ',
+    '    then ',
+    '        return 1  # failed to ping PC ',
+    '    else ',
+    '        return 0  # success ',
+    '    fi ',
+    '} ',
+    ]
+
+
+class IdPool(object) :
+    """ Thread safe pool of the integer IDs first to last (e.g. OpenVZ
+        container names).  Freed IDs go on a free list and are handed out
+        again oldest first; until the free list has enough, IDs come from
+        a counter of never used ones.  So allocating and freeing an ID
+        take constant time, however big the pool.
+    """
+    def __init__(self, first, last) :
+        self.first = first
+        self.last = last
+        self._lock = threading.Lock()
+        self._nextUnused = first          # Lowest ID never handed out
+        self._freeList = collections.deque()
+
+    def allocate(self, count = 1) :
+        """ Returns a list of count IDs, or None (allocating none of them)
+            if fewer than count are available.
+        """
+        with self._lock :
+            if count > self._available() :
+                return None
+            ids = []
+            while len(ids) < count and self._freeList :
+                ids.append(self._freeList.popleft())
+            while len(ids) < count :
+                ids.append(self._nextUnused)
+                self._nextUnused += 1
+            return ids
+
+    def free(self, ids) :
+        with self._lock :
+            self._freeList.extend(ids)
+
+    def available(self) :
+        with self._lock :
+            return self._available()
+
+    def _available(self) :
+        return len(self._freeList) + self.last - self._nextUnused + 1
+
+
+class Step(object) :
+    """ One step of provisioning a sliver: shell commands to run once
+        the steps this one depends on are done.
+
+        A step may belong to a container (e.g. 101).  If a step that
+        must succeed fails, the status of its container becomes
+        'failed', and the steps that depend on it are skipped (and
+        their containers fail too).  Other steps only log failures, as
+        the single bash script that provisioning used to be did.  When
+        a step with a statusOnSuccess is done, its container gets that
+        status, unless the container has failed.  A step with no
+        commands just marks a point in the graph (e.g. a container
+        being ready).
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    SKIPPED = 'skipped'
+
+    def __init__(self, name, commands, dependsOn = [], container = None,
+                 mustSucceed = False, statusOnSuccess = None,
+                 functions = []) :
+        self.name = name
+        self.commands = list(commands)     # Shell commands to run
+        self.dependsOn = list(dependsOn)   # Steps to finish first
+        self.container = container         # Container (e.g. 101) or None
+        self.mustSucceed = mustSucceed
+        self.statusOnSuccess = statusOnSuccess
+        self.functions = list(functions)   # Bash function definitions
+        self.state = Step.PENDING
+        self.exitStatus = None
+        self.output = ''
+        self.elapsed = None                # Seconds the commands took
+
+    def script(self) :
+        """ The bash script that runs this step """
+        return '\n'.join(self.functions + self.commands) + '\n'
+
+    def __repr__(self) :
+        return 'Step(%r)' % self.name
+
+
+class CommandRunner(object) :
+    """ Abstract base of the runners of the commands of a step.
+        Subclasses must implement run(step).  StepExecutor calls run from
+        several threads at once, one step per call.
+    """
+    __metaclass__ = abc.ABCMeta
+
+    @abc.abstractmethod
+    def run(self, step) :
+        """ Run the commands of the specified Step (step.script()).
+            Returns a tuple of their exit status (0 for success) and
+            their output.
+        """
+
+
+class SudoShellRunner(CommandRunner) :
+    """ Runs the commands of each step as a bash script, as root,
+        giving sudo the specified password.
+    """
+    def __init__(self, password) :
+        self.password = password
+
+    def run(self, step) :
+        process = subprocess.Popen(['sudo', '-S', '-p', '', '/bin/bash', '-c',
+                                    step.script()],
+                                   stdin = subprocess.PIPE,
+                                   stdout = subprocess.PIPE,
+                                   stderr = subprocess.STDOUT)
+        output = process.communicate(self.password + '\n')[0]
+        return (process.returncode, output)
+
+
+class RecordingRunner(CommandRunner) :
+    """ Dry run: records the steps it is asked to run, in order, instead
+        of running them.  Steps named in failSteps are reported as
+        failed.
+    """
+    def __init__(self, failSteps = ()) :
+        self.failSteps = set(failSteps)
+        self.steps = []    # (step name, script) in the order run
+        self._lock = threading.Lock()
+
+    def run(self, step) :
+        with self._lock :
+            self.steps.append((step.name, step.script()))
+        if step.name in self.failSteps :
+            return (1, 'Failed (as asked)')
+        return (0, '')
+
+
+class StepExecutor(object) :
+    """ Runs a graph of Steps with the specified CommandRunner, at most
+        maxParallel at once, each once all the steps it depends on are
+        done.
+
+        run() runs the steps and returns when they are all done;
+        start() runs them in a background thread.  statusCallback (if
+        any) is called with a container name and its new status when a
+        step changes the status of its container.
+    """
+    def __init__(self, steps, runner, maxParallel = 4, statusCallback = None,
+                 logger = None) :
+        self.steps = list(steps)
+        self.runner = runner
+        self.maxParallel = max(1, maxParallel)
+        self.statusCallback = statusCallback
+        self.logger = logger
+        self.elapsed = None       # Seconds to run all the steps
+        self._cond = threading.Condition()
+        self._cancelled = False
+        self._finished = threading.Event()
+        self._thread = None
+        self._running = 0
+        self._ready = []
+        self._waitingOn = {}      # Step -> number of steps still to finish
+        self._dependents = {}     # Step -> steps that depend on it
+        self._failedContainers = set()
+        for step in self.steps :
+            self._waitingOn[step] = len(step.dependsOn)
+            self._dependents.setdefault(step, [])
+            for dependency in step.dependsOn :
+                self._dependents.setdefault(dependency, []).append(step)
+            if not step.dependsOn :
+                self._ready.append(step)
+
+    def start(self) :
+        """ Run the steps in a background thread """
+        self._thread = threading.Thread(target = self.run,
+                                        name = 'gib-provisioning')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def cancel(self) :
+        """ Start no more steps.  Steps that are running finish. """
+        with self._cond :
+            self._cancelled = True
+            self._cond.notifyAll()
+
+    def wait(self, timeout = None) :
+        """ Wait for the steps to be done (or skipped, if cancelled).
+            Returns whether they are.
+        """
+        self._finished.wait(timeout)
+        return self._finished.isSet()
+
+    def isDone(self) :
+        return self._finished.isSet()
+
+    def failedSteps(self) :
+        return [step for step in self.steps if step.state == Step.FAILED]
+
+    def run(self) :
+        """ Run the steps.  Returns whether all of them succeeded. """
+        start = time.time()
+        try :
+            with self._cond :
+                while True :
+                    while self._ready and not self._cancelled and \
+                            self._running < self.maxParallel :
+                        step = self._ready.pop(0)
+                        step.state = Step.RUNNING
+                        self._running += 1
+                        worker = threading.Thread(target = self._runStep,
+                                                  args = (step,),
+                                                  name = 'gib-step')
+                        worker.daemon = True
+                        worker.start()
+                    if self._running == 0 and \
+                            (self._cancelled or not self._ready) :
+                        break
+                    self._cond.wait()
+                for step in self.steps :
+                    if step.state == Step.PENDING :
+                        # Cancelled, or waiting on a step that failed
+                        step.state = Step.SKIPPED
+        finally :
+            self.elapsed = time.time() - start
+            self._finished.set()
+        self._logTimings()
+        return not self.failedSteps()
+
+    def _runStep(self, step) :
+        start = time.time()
+        if step.commands :
+            try :
+                (exitStatus, output) = self.runner.run(step)
+            except Exception, e :
+                (exitStatus, output) = (-1, str(e))
+        else :
+            (exitStatus, output) = (0, '')
+        elapsed = time.time() - start
+        with self._cond :
+            step.exitStatus = exitStatus
+            step.output = output
+            step.elapsed = elapsed
+            self._running -= 1
+            if exitStatus != 0 and step.mustSucceed :
+                step.state = Step.FAILED
+                self._log('error', 'Step %s failed (exit status %s) after %.1f seconds: %s',
+                          step.name, exitStatus, elapsed, output)
+                self._fail(step)
+            else :
+                if exitStatus != 0 :
+                    self._log('warning', 'Step %s exited with status %s: %s',
+                              step.name, exitStatus, output)
+                step.state = Step.DONE
+                self._log('info', 'Step %s done in %.1f seconds',
+                          step.name, elapsed)
+                # A failed container stays failed, even if one of its
+                #    steps that was already running finishes later
+                if step.statusOnSuccess is not None and \
+                        step.container is not None and \
+                        step.container not in self._failedContainers :
+                    self._setStatus(step.container, step.statusOnSuccess)
+                for dependent in self._dependents[step] :
+                    self._waitingOn[dependent] -= 1
+                    if self._waitingOn[dependent] == 0 and \
+                            dependent.state == Step.PENDING :
+                        self._ready.append(dependent)
+            self._cond.notifyAll()
+
+    def _fail(self, failedStep) :
+        # Skip all the steps that (indirectly) depend on the failed step,
+        #    and fail their containers.  Called with the lock held.
+        failedContainers = set()
+        if failedStep.container is not None :
+            failedContainers.add(failedStep.container)
+        toSkip = list(self._dependents[failedStep])
+        while toSkip :
+            step = toSkip.pop()
+            if step.state != Step.PENDING :
+                continue
+            step.state = Step.SKIPPED
+            if step in self._ready :
+                self._ready.remove(step)
+            if step.container is not None :
+                failedContainers.add(step.container)
+            toSkip.extend(self._dependents[step])
+        for container in sorted(failedContainers -
+                                self._failedContainers) :
+            self._setStatus(container, 'failed')
+        self._failedContainers.update(failedContainers)
+
+    def _setStatus(self, container, status) :
+        if self.statusCallback is not None :
+            try :
+                self.statusCallback(container, status)
+            except Exception, e :
+                self._log('error', 'Failed to set status of %s to %s: %s',
+                          container, status, e)
+
+    def _log(self, level, msg, *args) :
+        if self.logger is not None :
+            getattr(self.logger, level)(msg, *args)
+
+    def _logTimings(self) :
+        ran = [step for step in self.steps if step.elapsed is not None]
+        self._log('info', 'Ran %d of %d provisioning steps in %.1f seconds (%.1f seconds of steps)',
+                  len(ran), len(self.steps), self.elapsed,
+                  sum(step.elapsed for step in ran))
+        for step in sorted(ran, key = lambda step : -step.elapsed)[:5] :
+            self._log('info', '    %6.1f seconds: %s', step.elapsed,
+                      step.name)
+
+
+def writeScript(steps, pathToFile) :
+    """ Write the steps as a single bash script, that runs them one at a
+        time in the order given (which must have every step after the
+        steps it depends on).  Returns whether it could write the file.
+    """
+    try :
+        scriptFile = open(pathToFile, 'w')
+    except IOError :
+        return False
+
+    # Make this file executable
+    os.chmod(pathToFile, stat.S_IRWXU | stat.S_IRWXG | stat.S_IRWXO)
+
+    scriptFile.write('#!/bin/bash \n\n')
+    scriptFile.write('# This script is auto-generated by the aggregate\n')
+    scriptFile.write('#    manager in response to a createSliver call.\n')
+    scriptFile.write('#    The aggregate runs these steps itself, in parallel\n')
+    scriptFile.write('#    where it can; this script runs them one at a time.\n\n')
+
+    scriptFile.write('## Function definitions\n')
+    written = []
+    for step in steps :
+        if step.functions and step.functions not in written :
+            scriptFile.write('\n'.join(step.functions) + '\n')
+            written.append(step.functions)
+
+    for step in steps :
+        if not step.commands :
+            continue
+        scriptFile.write('\n## Step: %s\n' % step.name)
+        for command in step.commands :
+            scriptFile.write(command + '\n')
+    scriptFile.close()
+    return True
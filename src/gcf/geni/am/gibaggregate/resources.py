@@ -23,17 +23,17 @@
 
 from __future__ import absolute_import
 
+import hashlib
+import re
 import sys
-import stat
 import os.path
 import uuid
 
 from . import config
 from . import graphUtils 
+from . import provisioning
 from .graphUtils import GraphNode
-
-sliceURN = ""
-sliceName = ""
+from .provisioning import IdPool
 
 class VMNode(GraphNode) :
     """ This class holds information about a VM (compute node) requested
@@ -44,10 +44,8 @@ class VMNode(GraphNode) :
         information held by this class is provide by this script.
         E.g. the OpenVZ container name that corresponds to this node.
     """
-    numVMs = 6  # max number of Virtual Machines available from this aggregate
-
-    def __init__(self, nodeNumber) :
-        self.containerName = 100 + nodeNumber # OpenVZ container name (e.g. 101)
+    def __init__(self, containerName) :
+        self.containerName = containerName # OpenVZ container name (e.g. 101)
         self.controlNetAddr = ''        # IP address of node on control network
         self.nodeName = ''    # Experimenter supplied name (client_id)
         self.NICs = []        # List of NICs for this node
@@ -136,54 +134,84 @@ class executeItem :
         self.shell = 'sh'      # Shell used to execute command
 
 
-experimentHosts = {}    # Map of container names (e.g. 101) to corresponding
-                        #    VMNode objects
-experimentLinks = []    # List of links specified by the experimenter 
-experimentNICs = {}     # Map of client supplied network interface names to
-                        #    corresponding NIC objects
+# Resources shared by all the slices on this aggregate
+containerIDs = IdPool(101, 100 + config.maxContainers)  # OpenVZ containers
+subnetNumbers = IdPool(3, 254)  # Link x is 10.0.x.0/24 with bridge brx.
+                                #    Starts with 3 since subnet 1 is for
+                                #    control network and subnet 2 is used
+                                #    by VirtualBox
+macNumbers = IdPool(1, 0xFFFFFF)   # Low 3 bytes of NIC MAC addresses
+
 
-def _annotateGraph() :
+class SliceTopology(object) :
+    """ The topology (VMNode, NIC and Link objects) of the sliver of one
+        slice, the resources allocated to it and the steps that provision
+        it.  Each slice has its own, so slivers of different slices can
+        be created, deleted and checked at the same time.  Its files
+        (manifest, status files, createSliver.sh) are in scriptsDir.
+    """
+    def __init__(self, sliceURN) :
+        self.sliceURN = sliceURN
+        # The slice name is the last part of the URN.  For example, the
+        #    slice name in the URN urn:publicid:IDN+geni:gpo:gcf+slice+myslice
+        #    is myslice.
+        self.sliceName = re.split(r'[:\+]+', sliceURN)[-1]
+        self.scriptsDir = '%s/%s-%s' % (config.sliceSpecificScriptsDir,
+                                        self.sliceName,
+                                        hashlib.sha1(sliceURN).hexdigest()[:8])
+        self.hosts = {}     # Map of container names (e.g. 101) to
+                            #    corresponding VMNode objects
+        self.links = []     # List of links specified by the experimenter
+        self.NICs = {}      # Map of client supplied network interface names
+                            #    to corresponding NIC objects
+        self.provisioningSteps = []  # Steps (provisioning.Step) that create
+                            #    and set up the sliver, each after the steps
+                            #    it depends on
+        self.executor = None         # StepExecutor running those steps
+        self.containerNames = []     # IDs allocated from the pools above
+        self.subnetNumbers = []
+        self.macNumbers = []
+
+    def free(self) :
+        """ Return the resources of this slice to the pools """
+        containerIDs.free(self.containerNames)
+        subnetNumbers.free(self.subnetNumbers)
+        macNumbers.free(self.macNumbers)
+        self.containerNames = []
+        self.subnetNumbers = []
+        self.macNumbers = []
+
+
+def _annotateGraph(topology) :
     """ This function walks through the VMNode, NIC and LINK objects 
         created by parsing the request Rspec and fills in the missing
         information (e.g. MAC and IP addresses for interfaces, bridge names
         for links, etc).
+
+        This function returns None if everything goes well.  If there
+        are not enough MAC addresses or subnets left it returns a string
+        describing the error.
     """
-    # Walk though all NICs and assign them MAC addresses
-    MACAddresses = [    # Table of MAC addresses for assignment to NICs
-    "00:0C:29:B4:DF:A7",
-    "00:0C:29:69:1D:AB",
-    "00:0C:29:C8:76:FD",
-    "00:0C:29:71:BA:ED",
-    "00:0C:29:B8:81:05",
-    "00:0C:29:9B:6E:5A",
-    "00:0C:29:87:F0:5E",
-    "00:0C:29:E8:77:47",
-    "00:0C:29:7D:99:5C",
-    "00:0C:29:3B:CF:F8",
-    "00:0C:29:3E:76:6B",
-    "00:0C:29:D5:B2:C3",
-    "00:0C:29:D8:CB:38",
-    "00:0C:29:D5:B2:13",
-    "00:0C:29:DA:3E:91",
-    "00:0C:29:15:97:46",
-    "00:0C:29:AF:FC:08",
-    "00:0C:29:05:DF:8C"
-    ]
-    macAddressesIndex = 0;
-    nicNames = experimentNICs.keys()
+    # Walk though all NICs and assign them MAC addresses from the pool
+    nicNames = topology.NICs.keys()
+    macs = macNumbers.allocate(len(nicNames))
+    if macs is None :
+        config.logger.error('Ran out of MAC addresses')
+        return 'Number of interfaces requested exceeds availability.'
+    topology.macNumbers = macs
     for i in range(len(nicNames)) :
-        nicObject = experimentNICs[nicNames[i]]
-        nicObject.macAddress = MACAddresses[macAddressesIndex];
-        macAddressesIndex += 1
+        nicObject = topology.NICs[nicNames[i]]
+        nicObject.macAddress = '00:0C:29:%02X:%02X:%02X' % \
+            ((macs[i] >> 16) & 0xFF, (macs[i] >> 8) & 0xFF, macs[i] & 0xFF)
 
     # For every host, give its NICs numbers: 1 (= eth1), 2 or 3
     #    Also give the NICs the names of the corresponding veth device in the
     #    host.  OpenVZ convention: veth101.1 is virtual ethernet on host that
     #    corresponds to eth1 on container 101; veth103.2 is virtual ethernet
     #    on host that corresponds to eth2 on container 103.
-    hostNames = experimentHosts.keys()
+    hostNames = topology.hosts.keys()
     for i in range(len(hostNames)) :
-        hostObject = experimentHosts[hostNames[i]]
+        hostObject = topology.hosts[hostNames[i]]
         interfaceCount = 1
         for nicObject in hostObject.NICs :
             nicObject.deviceNumber = interfaceCount
@@ -191,12 +219,15 @@ def _annotateGraph() :
                 (nicObject.myHost.containerName, interfaceCount)
             interfaceCount += 1
 
-    # Give each link a subnet address and bridge name
-    networkNumber = 3;   # Subnet number to assign to link. Starts with 3
-                         #    since subnet 1 is for control network and 
-                         #    subnet 2 is used by VirtualBox
-    for i in range(len(experimentLinks)) :
-        linkObject = experimentLinks[i]
+    # Give each link a subnet address and bridge name from the pool
+    networkNumbers = subnetNumbers.allocate(len(topology.links))
+    if networkNumbers is None :
+        config.logger.error('Ran out of subnets')
+        return 'Number of links requested exceeds availability.  Number of links available: %s' % subnetNumbers.available()
+    topology.subnetNumbers = networkNumbers
+    for i in range(len(topology.links)) :
+        linkObject = topology.links[i]
+        networkNumber = networkNumbers[i]
         linkObject.subnetNumber = networkNumber
         linkObject.bridgeID = 'br%d' % networkNumber
 
@@ -208,11 +239,9 @@ def _annotateGraph() :
             nicObject.ipAddress = "10.0.%d.%d" % (networkNumber, \
                 nicObject.myHost.containerName)
 
-        networkNumber += 1
-
     # Assign URNs to the VM resources
     for i in range(len(hostNames)) :
-        hostObject = experimentHosts[hostNames[i]]
+        hostObject = topology.hosts[hostNames[i]]
         hostObject.componentID = ('urn:publicid:IDN+geni-in-a-box.net+node+pc%s'
                                  % hostObject.containerName)
         hostObject.sliverURN = ('urn:publicid:IDN+geni-in-a-box.net+sliver+%s'
@@ -220,7 +249,7 @@ def _annotateGraph() :
         
     # Assign URNs to the NICs 
     for i in range(len(nicNames)) :
-        nicObject = experimentNICs[nicNames[i]]
+        nicObject = topology.NICs[nicNames[i]]
         nicObject.componentID =  \
             ('urn:publicid:IDN+geni-in-a-box.net+interface+pc%s:eth%s' % 
              (nicObject.myHost.containerName, nicObject.deviceNumber))
@@ -229,287 +258,213 @@ def _annotateGraph() :
                                   nicObject.deviceNumber))
 
     # Assign URNs to the links 
-    for i in range(len(experimentLinks)) :
-        linkObject = experimentLinks[i]
+    for i in range(len(topology.links)) :
+        linkObject = topology.links[i]
         linkObject.sliverURN =  \
             'urn:publicid:IDN+geni-in-a-box.net+sliver+%s' % linkObject.bridgeID
+    return None
 
 
+def teardownCommands(topology) :
+    """ Shell commands that stop and destroy the containers and delete the
+        bridges of the specified slice (and only those: other slices may
+        be using other containers and bridges on this host).
+    """
+    commands = []
+    for containerName in sorted(topology.hosts.keys()) :
+        commands.append('vzctl stop %s' % containerName)
+        commands.append('vzctl destroy %s' % containerName)
+        commands.append('ssh-keygen -f %s/.ssh/known_hosts -R 10.0.1.%s > /dev/null 2>&1' %
+                        (config.homeDirectory, containerName))
+    for linkObject in topology.links :
+        commands.append('if [ -d /sys/class/net/%s ]' % linkObject.bridgeID)
+        commands.append('then')
+        commands.append('    /sbin/ifconfig %s down' % linkObject.bridgeID)
+        commands.append('    /usr/sbin/brctl delbr %s' % linkObject.bridgeID)
+        commands.append('fi')
+    return commands
+
+
+def _hostSteps(topology, hostObject) :
+    """ The provisioning steps that belong to the specified host, in the
+        order planned.
+    """
+    return [step for step in topology.provisioningSteps \
+                if step.container == hostObject.containerName]
 
-def _generateBashScript(users) :
-    ''' Generate the Bash script that is run to actually create and set up the
-            Virtual Machines and networks used in the experiment.
-    '''
-    # Create the file into which the script will be written
-    pathToFile = config.sliceSpecificScriptsDir + '/' + config.shellScriptFile
-    try:
-        scriptFile = open(pathToFile, 'w')
-    except IOError:
-        config.logger.error("Failed to open file that creates sliver: %s" %
-                            pathToFile)
-        return None
-
-    # Make this file executable
-    os.chmod(pathToFile, stat.S_IRWXU | stat.S_IRWXG | stat.S_IRWXO)
-    
-    # Start creating the script
-    scriptFile.write('#!/bin/bash \n\n')
-
-    scriptFile.write('# This script is auto-generated by the aggregate\n')
-    scriptFile.write('#    manager in response to a createSliver call \n\n')
-
-    scriptFile.write('## Function definitions\n')
-    scriptFile.write('pingNode () {  # pings specified PC to check if it is alive \n')
-    scriptFile.write('    pingAttempts=0 \n')
-    scriptFile.write('    echo \"Pinging VM 10.0.1.$1...\" \n')
-    scriptFile.write('    ping -c2 10.0.1.$1 \n')
-    scriptFile.write('    while [ $? -ne 0 ] && [ $pingAttempts -le 50 ] \n')
-    scriptFile.write('    do \n')
-    scriptFile.write('        sleep 10  # sleep for 10 more seconds \n')
-    scriptFile.write('        let \"pingAttempts += 1\" \n')
-    scriptFile.write('        echo \"Pinging VM 10.0.1.$1...\" \n')
-    scriptFile.write('        ping -c2 10.0.1.$1 \n')
-    scriptFile.write('    done \n')
-    scriptFile.write('    if [ $pingAttempts -gt 20 ] \n')
-    scriptFile.write('    then \n')
-    scriptFile.write('        return 1  # failed to ping PC \n')
-    scriptFile.write('    else \n')
-    scriptFile.write('        return 0  # success \n')
-    scriptFile.write('    fi \n')
-    scriptFile.write('} \n')
-
-    scriptFile.write('\n## Delete any existing sliver. \n')
-    scriptFile.write('%s/%s %s %s\n' % (config.standardScriptsDir,
-                                        config.deleteSliver,
-                                        config.homeDirectory,
-                                        config.sliceSpecificScriptsDir))
-
-    hostNames = experimentHosts.keys()
-
-    # Set the sliver status for each host to "unknown"
-    scriptFile.write('\n# Setting sliver status of hosts to unknown \n')
-    for i in range(len(hostNames)) :
-        hostObject = experimentHosts[hostNames[i]]
-        statusFileName = '%s/pc%s.status' % (config.sliceSpecificScriptsDir, 
-                                             hostObject.containerName)
-        scriptFile.write('echo \"unknown\" > %s \n' % statusFileName)
-    
-
-    # Create container templates
-    scriptFile.write('\n## Define containers for each of the hosts in the experiment.\n')
-    for i in range(len(hostNames)) :
-        hostObject = experimentHosts[hostNames[i]]
 
+def _planSteps(topology, users) :
+    ''' Plan the steps that actually create and set up the Virtual
+            Machines and networks used in the experiment.  The steps are
+            put in topology.provisioningSteps, each after the steps it
+            depends on.
+    '''
+    provisioningSteps = topology.provisioningSteps
+    del provisioningSteps[:]
+
+    def addStep(name, commands, dependsOn = [], hostObject = None, **kwargs) :
+        container = None
+        if hostObject is not None :
+            container = hostObject.containerName
+        step = provisioning.Step(name, commands, dependsOn, container,
+                                 **kwargs)
+        provisioningSteps.append(step)
+        return step
+
+    hostNames = topology.hosts.keys()
+    hostObjects = [topology.hosts[hostName] for hostName in hostNames]
+
+    ## Clear away anything left in the containers and bridges allocated to
+    #    this sliver (e.g. by an aggregate that stopped without deleting
+    #    its slivers).
+    deleteStep = addStep('delete leftover containers and bridges',
+                         teardownCommands(topology))
+
+    # Turn off firewall on host
+    firewallStep = addStep('stop firewall', ['/etc/init.d/iptables stop'],
+                           [deleteStep])
+
+    # Define a container for each of the hosts in the experiment, with its
+    #    host name, control network IP address and interfaces (connected to
+    #    the appropriate bridges), and start it up
+    startSteps = {}
+    for hostObject in hostObjects :
+        commands = []
         if config.distro == 'UBUNTU10-STD' : 
-            scriptFile.write('vzctl create %s --ostemplate ubuntu-10.04-x86\n' % hostObject.containerName)
+            commands.append('vzctl create %s --ostemplate ubuntu-10.04-x86' % hostObject.containerName)
         else :
-            scriptFile.write('vzctl create %s --ostemplate fedora-15-x86 --config basic\n' % hostObject.containerName)
-            
-    scriptFile.write('\n## Set up host names and control network IP addresses for the containers. \n')
-    for i in range(len(hostNames)) :
-        hostObject = experimentHosts[hostNames[i]]
-        scriptFile.write('vzctl set %s --hostname %s --save \n' % 
-                         (hostObject.containerName, hostObject.nodeName))
-        scriptFile.write('vzctl set %s --ipadd 10.0.1.%s --save\n' %
-                         (hostObject.containerName, hostObject.containerName))
-
-
-    scriptFile.write('\n# Turn off firewall on host \n')
-    scriptFile.write('/etc/init.d/iptables stop \n')
-
-    scriptFile.write('\n## Set up interfaces on the hosts and connect them to the appropriate bridges \n')
-    for i in range(len(hostNames)) :
-        hostObject = experimentHosts[hostNames[i]]
-        scriptFile.write('# Set up interfaces for host %s \n' % 
-                         hostObject.nodeName)
-        
-        # for each NIC on host set up the interface
-        for j in range(0, len(hostObject.NICs)) :
-            nicObject = hostObject.NICs[j]
-            scriptFile.write('vzctl set %d --netif_add eth%d,%s,%s,FE:FF:FF:FF:FF:FF,%s --save \n' % (hostObject.containerName, nicObject.deviceNumber, nicObject.macAddress, nicObject.virtualEthName, nicObject.link.bridgeID))
-        scriptFile.write('\n')
+            commands.append('vzctl create %s --ostemplate fedora-15-x86 --config basic' % hostObject.containerName)
+        commands.append('vzctl set %s --hostname %s --save' % 
+                        (hostObject.containerName, hostObject.nodeName))
+        commands.append('vzctl set %s --ipadd 10.0.1.%s --save' %
+                        (hostObject.containerName, hostObject.containerName))
+        for nicObject in hostObject.NICs :
+            commands.append('vzctl set %d --netif_add eth%d,%s,%s,FE:FF:FF:FF:FF:FF,%s --save' % (hostObject.containerName, nicObject.deviceNumber, nicObject.macAddress, nicObject.virtualEthName, nicObject.link.bridgeID))
+        createStep = addStep('create container %s' % hostObject.containerName,
+                             commands, [deleteStep], hostObject)
+        startSteps[hostObject.containerName] = \
+            addStep('start container %s' % hostObject.containerName,
+                    ['vzctl start %s' % hostObject.containerName],
+                    [createStep], hostObject)
+
+    # Configure bridges on host, once the containers with the virtual eth
+    #    devices corresponding to the end-points of the link are up
+    networkSteps = []
+    for linkObject in topology.links :
+        commands = ['brctl addbr %s' % linkObject.bridgeID]
+        dependsOn = []
+        for nicObject in linkObject.endPoints :
+            commands.append('brctl addif %s %s' % (linkObject.bridgeID, \
+                                                   nicObject.virtualEthName))
+            startStep = startSteps[nicObject.myHost.containerName]
+            if startStep not in dependsOn :
+                dependsOn.append(startStep)
+        commands.append('ifconfig %s 0' % linkObject.bridgeID)
+        networkSteps.append(addStep('bridge %s' % linkObject.bridgeID,
+                                    commands, dependsOn))
 
-    scriptFile.write('\n## Start up the hosts (containers) \n')
-    for i in range(len(hostNames)) :
-        hostObject = experimentHosts[hostNames[i]]
-        scriptFile.write('vzctl start %s \n' % hostObject.containerName)
-        
-    scriptFile.write('\n## Configure bridges on host \n')
-    for i in range(len(experimentLinks)) :
-        linkObject = experimentLinks[i]
-        scriptFile.write('brctl addbr %s \n' % linkObject.bridgeID)
-        
-        # Add the virtual eth devices corresponding to the end-points of the
-        #    link to the bridge
-        for j in range(len(linkObject.endPoints)) :
-            scriptFile.write('brctl addif %s %s \n' % (linkObject.bridgeID, \
-                                       linkObject.endPoints[j].virtualEthName))
-        
-        scriptFile.write('ifconfig %s 0 \n\n' % linkObject.bridgeID)
-                             
-    scriptFile.write('\n## Give the hosts 30 seconds to start up \n')
-    scriptFile.write('sleep 30 \n\n')
-    scriptFile.write('# Ping hosts to make sure they are up.  Give them more time if necessary.\n')
-    for i in range(len(hostNames)) :
-        hostObject = experimentHosts[hostNames[i]]
-        scriptFile.write('pingNode %d \n' % hostObject.containerName)
-        scriptFile.write('if [ $? -ne 0 ] \n')
-        scriptFile.write('then \n')
-        scriptFile.write('    echo \"Container %d failed to start up.\" \n' % hostObject.containerName)
-        statusFileName = '%s/pc%s.status' % (config.sliceSpecificScriptsDir, 
-                                             hostObject.containerName)
-        scriptFile.write('    echo \"failed\" > %s \n' % statusFileName)
-        scriptFile.write('else \n')
-        statusFileName = '%s/pc%s.status' % (config.sliceSpecificScriptsDir, 
-                                             hostObject.containerName)
-        scriptFile.write('    echo \"configuring\" > %s \n' % statusFileName)
-        scriptFile.write('fi \n')
-        
-    scriptFile.write('\n## Set up interfaces on each host (container) \n')
-    for i in range(len(hostNames)) :
-        hostObject = experimentHosts[hostNames[i]]
-        scriptFile.write('# Set up interfaces on PC %s\n' % hostObject.nodeName)
-        
-        # Set up ethernet devices on the container
-        for j in range(len(hostObject.NICs)) :
-            scriptFile.write('vzctl exec %d \"/sbin/ifconfig eth%d 0\" \n' % \
-                                 (hostObject.containerName, \
-                                 hostObject.NICs[j].deviceNumber))
-            scriptFile.write('vzctl exec %d \"/sbin/ip addr add %s dev eth%d\"\n'  % \
-                                 (hostObject.containerName, \
-                                 hostObject.NICs[j].ipAddress, \
-                                 hostObject.NICs[j].deviceNumber))
-            scriptFile.write('vzctl exec %d \"echo 0 > /proc/sys/net/ipv4/conf/eth%d/rp_filter\" \n' \
-                             % (hostObject.containerName, \
-                                hostObject.NICs[j].deviceNumber))
-            scriptFile.write('vzctl exec %d \"/sbin/ifconfig eth%d up\" \n' % \
-                                 (hostObject.containerName, \
-                                 hostObject.NICs[j].deviceNumber))
-            scriptFile.write('\n')
-
-
-    # Now we are ready to set up the IP routing tables on each container
-    scriptFile.write('\n## Set up IP routing tables on each host \n');
-    for i in range(len(hostNames)) :
-        hostObject = experimentHosts[hostNames[i]]
-    
-        scriptFile.write('# Set up IP routing table for %s\n' % \
-                             hostObject.nodeName)
+    # Turn on forwarding and arp proxing on the virtual eth devices created
+    #    in the host OS (container 0)
+    for hostObject in hostObjects :
+        commands = []
+        for nicObject in hostObject.NICs :
+            commands.append('ifconfig %s 0' % nicObject.virtualEthName)
+            commands.append('echo 1 > /proc/sys/net/ipv4/conf/%s/forwarding' \
+                                % nicObject.virtualEthName)
+            commands.append('echo 1 > /proc/sys/net/ipv4/conf/%s/proxy_arp' \
+                                % nicObject.virtualEthName)
+        if commands :
+            networkSteps.append(addStep('virtual eth devices of container %s'
+                                        % hostObject.containerName, commands,
+                                        [startSteps[hostObject.containerName]],
+                                        hostObject))
+
+    # Give each host 30 seconds to start up, then ping it to make sure it
+    #    is up (giving it more time if necessary).  Once it is up, its
+    #    status is 'configuring'.
+    pingSteps = {}
+    for hostObject in hostObjects :
+        pingSteps[hostObject.containerName] = \
+            addStep('ping container %s' % hostObject.containerName,
+                    ['sleep 30',
+                     'pingNode %d' % hostObject.containerName],
+                    [startSteps[hostObject.containerName], firewallStep],
+                    hostObject, mustSucceed = True,
+                    statusOnSuccess = 'configuring',
+                    functions = provisioning.PING_NODE_FUNCTION)
+
+    # Set up interfaces and then IP routing tables on each host (container).
+    #    Directly connected links are routed to the NIC on the host that is
+    #    connected to the link; other links are routed via the first host
+    #    in the direction of the shortest path to the link (that host acts
+    #    as a gateway)
+    hostRoutes = graphUtils.planRoutes(hostObjects, topology.links)
+    for i in range(len(hostObjects)) :
+        hostObject = hostObjects[i]
+        commands = []
+        for nicObject in hostObject.NICs :
+            commands.append('vzctl exec %d \"/sbin/ifconfig eth%d 0\"' % \
+                                (hostObject.containerName, \
+                                 nicObject.deviceNumber))
+            commands.append('vzctl exec %d \"/sbin/ip addr add %s dev eth%d\"'  % \
+                                (hostObject.containerName, \
+                                 nicObject.ipAddress, \
+                                 nicObject.deviceNumber))
+            commands.append('vzctl exec %d \"echo 0 > /proc/sys/net/ipv4/conf/eth%d/rp_filter\"' \
+                                % (hostObject.containerName, \
+                                   nicObject.deviceNumber))
+            commands.append('vzctl exec %d \"/sbin/ifconfig eth%d up\"' % \
+                                (hostObject.containerName, \
+                                 nicObject.deviceNumber))
+        interfacesStep = addStep('interfaces of container %s' %
+                                 hostObject.containerName, commands,
+                                 [pingSteps[hostObject.containerName]],
+                                 hostObject)
 
         # Turn on IP forwarding so host (container) can forward IP packets
-        scriptFile.write('vzctl exec %d \"/sbin/sysctl -w net.ipv4.ip_forward=1\" \n' \
-                         % hostObject.containerName)
-
-        ## Now set up routing tables.  Create routing table entries so we
-        #    can get to any reachable link (subnet) from this host.
-        #  We first set up routes to links that are directly connected to
-        #    to this host.  Then we set up routes to links that can be
-        #    reached through a gateway.
-	
-        #  Make two lists: One of directly connected links and the other
-        #    that are not directly connected
-        #
-        directlyConnectedLinks = []
-        notDirectlyConnectedLinks = []
-        for j in range(len(experimentLinks)) :
-            directlyConnected = False
-            linkObject = experimentLinks[j]
-            for k in range(len(linkObject.endPoints)) :
-                if linkObject.endPoints[k].myHost == hostObject :
-                    # This host is directly connected to the link (subnet)
-                    #    because one of the endPoints (NICs) on this link
-                    #    belong to this host.
-                    directlyConnected = True
-
-            if directlyConnected :
-                directlyConnectedLinks.append(linkObject)
+        commands = ['vzctl exec %d \"/sbin/sysctl -w net.ipv4.ip_forward=1\"' \
+                        % hostObject.containerName]
+        for (linkObject, endPointToLink, gateway) in hostRoutes[i] :
+            if gateway is None :
+                commands.append('vzctl exec %d \"/sbin/ip route add 10.0.%d.0/24 dev eth%d\"' \
+                                    % (hostObject.containerName, \
+                                       linkObject.subnetNumber, \
+                                       endPointToLink.deviceNumber))
             else :
-                notDirectlyConnectedLinks.append(linkObject) 
-        
-        # Now set up routing table entries for directly connected links.
-        #   For these links we simply route packets to the NIC on this
-        #   host that is conneted to this link (subnet) 
-	for j in range(len(directlyConnectedLinks)) :
-            linkObject = directlyConnectedLinks[j]
-
-            # Find the endpoint on this link that is connected to this host
-            for k in range(len(linkObject.endPoints)) :
-                if linkObject.endPoints[k].myHost == hostObject :
-                    # Found the endPoint (NIC) connects this host to the link
-                    endPointToLink = linkObject.endPoints[k]
-                    scriptFile.write('vzctl exec %d \"/sbin/ip route add 10.0.%d.0/24 dev eth%d\" \n' \
-                                     % (hostObject.containerName, \
-                                        linkObject.subnetNumber, \
-                                         endPointToLink.deviceNumber))
-                    break    # Break out of the 'for k in...' loop
-            
-        # Now set up routing table entries for links that are not directly
-        #    connected.  For these links find the shortes path to the link
-        #    (subnet) and route packes in that direction (first host in that
-        #    direction acts as a gateway)
-        for j in range(len(notDirectlyConnectedLinks)) :
-            linkObject = notDirectlyConnectedLinks[j]
-
-            # Find the shortest path from this host to this subnet (linkObject)
-            path = graphUtils.findShortestPath(hostObject, linkObject)
-            if path != None :
-                # We found a path from this host to the subnet (link)
-                #    Path is a NIC -> Link -> NIC -> Host (gateway) -> ...
-                #    We care about the NIC on the gateway i.e. the 3rd
-                #    item on this path
-                scriptFile.write('vzctl exec %d \"/sbin/ip route add 10.0.%d.0/24 via %s\" \n' \
-                                 % (hostObject.containerName, \
-                                    linkObject.subnetNumber, \
-                                     path[3].ipAddress))
-
-        scriptFile.write('\n')
-
-    # Turn on forwarding and arp proxing on the virtual eth devices created
-    #    in the host OS (container 0)
-    scriptFile.write('\n# Turn on forwarding and arp proxing on the virtual eth devices created on the host OS \n')
-    nicNames = experimentNICs.keys()
-    for i in range(len(nicNames)) :
-        nicObject = experimentNICs[nicNames[i]]
-        scriptFile.write('ifconfig %s 0 \n' % nicObject.virtualEthName)
-        scriptFile.write('echo 1 > /proc/sys/net/ipv4/conf/%s/forwarding \n' \
-                             % nicObject.virtualEthName)
-        scriptFile.write('echo 1 > /proc/sys/net/ipv4/conf/%s/proxy_arp \n' \
-                             % nicObject.virtualEthName)
-        scriptFile.write('\n')
+                commands.append('vzctl exec %d \"/sbin/ip route add 10.0.%d.0/24 via %s\"' \
+                                    % (hostObject.containerName, \
+                                       linkObject.subnetNumber, \
+                                       gateway.ipAddress))
+        networkSteps.append(addStep('routes of container %s' %
+                                    hostObject.containerName, commands,
+                                    [interfacesStep], hostObject))
 
     # Set up DNS entries on the containers so they can reference one another
-    #    by name and can also reference hosts on the external network by name
-    scriptFile.write('\n# Set up DNS on the hosts.  Use Google DNS.\n')
-    scriptFile.write('PRIMARYDNS=\"nameserver 8.8.8.8\" \n')
-    scriptFile.write('SECONDARYDNS=\"nameserver 8.8.4.4\" \n')
-    for i in range(len(hostNames)) :
-        hostObject = experimentHosts[hostNames[i]]
-        scriptFile.write('vzctl exec %s \"echo order host,bind >> /etc/host.conf\" \n' % hostObject.containerName)
-        scriptFile.write('vzctl exec %s \"echo $PRIMARYDNS >> /etc/resolv.conf\" \n' % hostObject.containerName)
-        scriptFile.write('vzctl exec %s \"echo $SECONDARYDNS >> /etc/resolv.conf\" \n' % hostObject.containerName)
-    scriptFile.write('\n')
-
-    # Add hostname and IP addresses to /etc/hosts.  For each host we pick
+    #    by name and can also reference hosts on the external network by
+    #    name.  Use Google DNS.
+    #  Add hostname and IP addresses to /etc/hosts.  For each host we pick
     #    IP address to add to this file.  We arbitrarily pick the IP address
     #    associated with the first eth device in the list of NICs associated
     #    with the host.  Examples of how hosts can be addressed: client_id,
     #    pc101, client_id.sliceName.geni-in-a-box.net or 
     #    pc101.geni-in-a-box.net.
-    scriptFile.write('# Add host names and IP addresses to /etc/hosts \n')
-    for i in range(len(hostNames)) :
-        hostObject = experimentHosts[hostNames[i]]
+    for hostObject in hostObjects :
+        commands = ['PRIMARYDNS=\"nameserver 8.8.8.8\"',
+                    'SECONDARYDNS=\"nameserver 8.8.4.4\"',
+                    'vzctl exec %s \"echo order host,bind >> /etc/host.conf\"' % hostObject.containerName,
+                    'vzctl exec %s \"echo $PRIMARYDNS >> /etc/resolv.conf\"' % hostObject.containerName,
+                    'vzctl exec %s \"echo $SECONDARYDNS >> /etc/resolv.conf\"' % hostObject.containerName]
         # In the /etc/hosts for this host add an entry for every host
-        for j in range(len(hostNames)) :
-            hostObject2 = experimentHosts[hostNames[j]]
+        for hostObject2 in hostObjects :
             if len(hostObject2.NICs) != 0 :
-                scriptFile.write('vzctl exec %s \"echo %s %s pc%s %s.%s.geni-in-a-box.net pc%s.geni-in-a-box.net >> /etc/hosts\" \n' \
-                                     % (hostObject.containerName, 
-                                        hostObject2.NICs[0].ipAddress, 
-                                        hostObject2.nodeName,
-                                        hostObject2.containerName,
-                                        hostObject2.nodeName,
-                                        sliceName,
-                                        hostObject2.containerName))
+                commands.append('vzctl exec %s \"echo %s %s pc%s %s.%s.geni-in-a-box.net pc%s.geni-in-a-box.net >> /etc/hosts\"' \
+                                    % (hostObject.containerName, 
+                                       hostObject2.NICs[0].ipAddress, 
+                                       hostObject2.nodeName,
+                                       hostObject2.containerName,
+                                       hostObject2.nodeName,
+                                       topology.sliceName,
+                                       hostObject2.containerName))
 
         # /etc/hosts has an entry for this host that is automatically 
         #    put in there by OpenVZ.  The entry looks like:
@@ -518,31 +473,35 @@ def _generateBashScript(users) :
         #    delete this entry we copy /etc/hosts to /tmp/etc.hosts, delete
         #    the offending line, and write to /etc/hosts.  The offending
         #    line will always start with 10.0.1. (control network)
-        scriptFile.write('# Deleting entry for %s that was inserted by OpenVz\n' % hostObject.nodeName)
-        scriptFile.write('vzctl exec %s \"cp /etc/hosts /tmp/etc.hosts\"\n' 
-                         % hostObject.containerName)
-        scriptFile.write('vzctl exec %s \"cat /tmp/etc.hosts | sed \'/^10.0.1./d\' > /etc/hosts\" \n' % hostObject.containerName)
-        scriptFile.write('vzctl exec %s \"rm /tmp/etc.hosts\" \n' %
-                             hostObject.containerName)
-        scriptFile.write('\n')
-    
-    
-    # Download and install experimenter specified  files into the VMs
-    # Go through each host and find out what needs to be installed
-    for i in range(len(hostNames)) :
-        hostObject = experimentHosts[hostNames[i]]
-        installList = hostObject.installList
-        if len(installList) != 0 :
-            scriptFile.write('# Install experimenter specified software on host %s \n' % hostObject.nodeName)
-        for item in installList :
+        commands.append('vzctl exec %s \"cp /etc/hosts /tmp/etc.hosts\"' 
+                        % hostObject.containerName)
+        commands.append('vzctl exec %s \"cat /tmp/etc.hosts | sed \'/^10.0.1./d\' > /etc/hosts\"' % hostObject.containerName)
+        commands.append('vzctl exec %s \"rm /tmp/etc.hosts\"' %
+                        hostObject.containerName)
+        networkSteps.append(addStep('host names of container %s' %
+                                    hostObject.containerName, commands,
+                                    [pingSteps[hostObject.containerName]],
+                                    hostObject))
+
+    for hostObject in hostObjects :
+        pingStep = pingSteps[hostObject.containerName]
+
+        # Download and install experimenter specified files into the VM.
+        #    Each container downloads to its own directory, as containers
+        #    are set up in parallel.
+        downloadDir = '/tmp/pc%s' % hostObject.containerName
+        commands = []
+        for item in hostObject.installList :
             # Download the file from the specified URL
-            scriptFile.write('# Download file %s\n' % item.sourceURL)
-            scriptFile.write('wget -P /tmp %s \n' % item.sourceURL)
-            scriptFile.write('if [ $? -eq 0 ] \n')
-            scriptFile.write('then \n')
-            scriptFile.write('    # Download successful \n')
+            commands.append('# Download file %s' % item.sourceURL)
+            commands.append('mkdir -p %s' % downloadDir)
+            commands.append('wget -P %s %s' % (downloadDir, item.sourceURL))
+            commands.append('if [ $? -eq 0 ]')
+            commands.append('then')
+            commands.append('    # Download successful')
 
-            downloadedFile = '/tmp/%s' % os.path.basename(item.sourceURL)
+            downloadedFile = '%s/%s' % (downloadDir,
+                                        os.path.basename(item.sourceURL))
 
             # Now generate commands to move the file to its proper location.
             #     If the file is of type .tgz or .tar.gz, we untar it to 
@@ -581,55 +540,40 @@ def _generateBashScript(users) :
             # Create destination directory (and any necessary parent/ancestor
             #    directories in path) if it does not exist
             if not os.path.isdir(dest) :
-                scriptFile.write('    mkdir -p %s \n' % dest)
+                commands.append('    mkdir -p %s' % dest)
 
             if item.fileType == 'tar.gz':
                 # File to be installed is of type tar.gz: Uncompress and 
                 #    untar to destination
-                scriptFile.write('    tar -C %s -zxvf %s \n' % 
-                                 (dest, downloadedFile))
+                commands.append('    tar -C %s -zxvf %s' % 
+                                (dest, downloadedFile))
             elif item.fileType == 'gz' :
                 # File to be installed is of type gz: Copy to destination 
                 #    and then gunzip in place
-                scriptFile.write('    cp %s %s \n' % (downloadedFile, dest))
+                commands.append('    cp %s %s' % (downloadedFile, dest))
                 # Get the name of the zipped file
                 zipFile = dest + '/' + os.path.basename(downloadedFile)
-                scriptFile.write('    gunzip %s \n' % zipFile)
+                commands.append('    gunzip %s' % zipFile)
             else :
                 # Some other file type.  Simply copy file to destination
-                scriptFile.write('    cp %s %s \n' % (downloadedFile, dest))
+                commands.append('    cp %s %s' % (downloadedFile, dest))
 
             # Make file accessible to experimenter
-            scriptFile.write('    chmod -R 777 %s \n' % dest)
+            commands.append('    chmod -R 777 %s' % dest)
 
             # Delete the downloaded file
-            scriptFile.write('    rm %s \n' % downloadedFile)
-
-            scriptFile.write('fi \n')
+            commands.append('    rm %s' % downloadedFile)
 
+            commands.append('fi')
+        installSteps = []
+        if commands :
+            installSteps.append(addStep('install software on container %s' %
+                                        hostObject.containerName, commands,
+                                        [pingStep], hostObject))
 
-        # Now handle scripts to be executed on host (container) startup
-        execList = hostObject.executeList
-        if len(execList) != 0 :
-            scriptFile.write('\n# Set up experimenter specified startup scripts on host %s \n' % hostObject.nodeName)
-        for item in execList :
-            if item.shell == 'sh' or 'bash' :
-                pathToScript = '/vz/root/%s/%s' % (hostObject.containerName,
-                                                   item.command)
-                scriptFile.write('vzctl runscript %s %s \n' % \
-                                     (hostObject.containerName, pathToScript))
-            else :
-                # Not a script type we recognize.  Log error
-                config.logger.error("Execute script %s is of unsuported type" \
-                                        % item.command)
-
-        scriptFile.write('\n')
-        
         # set up an account for root
-        scriptFile.write('# Create root account in container %i \n' %
-                         hostObject.containerName)
-        scriptFile.write('vzctl set %i --userpasswd root:%s \n' %
-                         (hostObject.containerName, config.rootPwd))
+        commands = ['vzctl set %i --userpasswd root:%s' %
+                    (hostObject.containerName, config.rootPwd)]
 
         # set up the user accounts and ssh public keys 
         for user in users :
@@ -650,19 +594,18 @@ def _generateBashScript(users) :
             
             # only install the user account if there is a user to install
             if userName != "":
-                scriptFile.write("# Create user %s for container %i and install public keys\n" % (userName, hostObject.containerName))
-                scriptFile.write("echo \"Creating user %s for container %s and installing public keys...\"\n" % (userName, hostObject.nodeName))
-                scriptFile.write("vzctl set %i --userpasswd %s:%s \n" % 
-                                 (hostObject.containerName,
-                                  userName, config.rootPwd))
+                commands.append("echo \"Creating user %s for container %s and installing public keys...\"" % (userName, hostObject.nodeName))
+                commands.append("vzctl set %i --userpasswd %s:%s" % 
+                                (hostObject.containerName,
+                                 userName, config.rootPwd))
             
                 # install all of the public keys for this user
                 for publicKey in publicKeys :
-                    scriptFile.write("mkdir -p /vz/root/%i/home/%s/.ssh\n" % (hostObject.containerName, userName))
-                    scriptFile.write("chmod 755 /vz/root/%i/home/%s/.ssh\n" % (hostObject.containerName, userName))
-                    scriptFile.write("touch /vz/root/%i/home/%s/.ssh/authorized_keys\n" % (hostObject.containerName, userName))
-                    scriptFile.write("chmod 744 /vz/root/%i/home/%s/.ssh/authorized_keys\n" % (hostObject.containerName, userName))
-                    scriptFile.write("echo \"%s\">>/vz/root/%i/home/%s/.ssh/authorized_keys\n" % (publicKey[:-1], hostObject.containerName, userName))
+                    commands.append("mkdir -p /vz/root/%i/home/%s/.ssh" % (hostObject.containerName, userName))
+                    commands.append("chmod 755 /vz/root/%i/home/%s/.ssh" % (hostObject.containerName, userName))
+                    commands.append("touch /vz/root/%i/home/%s/.ssh/authorized_keys" % (hostObject.containerName, userName))
+                    commands.append("chmod 744 /vz/root/%i/home/%s/.ssh/authorized_keys" % (hostObject.containerName, userName))
+                    commands.append("echo \"%s\">>/vz/root/%i/home/%s/.ssh/authorized_keys" % (publicKey[:-1], hostObject.containerName, userName))
 
                 # add this user to group wheel or root depending on OS
                 groupName = ""
@@ -671,77 +614,101 @@ def _generateBashScript(users) :
                 else :
                     groupName = "wheel"
                     
-                scriptFile.write('vzctl exec %s \"usermod -a -G %s %s" \n' %
+                commands.append('vzctl exec %s \"usermod -a -G %s %s"' %
                                 (hostObject.containerName, groupName, userName))
-            
-            scriptFile.write('\n')
-            
-        scriptFile.write('\n')
-
-    scriptFile.close()
-
+        accountsStep = addStep('accounts on container %s' %
+                               hostObject.containerName, commands,
+                               [pingStep], hostObject)
+
+        # Now handle scripts to be executed on host (container) startup.
+        #    These run once the experimenter's software is installed and
+        #    the whole network is set up.
+        commands = []
+        for item in hostObject.executeList :
+            if item.shell == 'sh' or 'bash' :
+                pathToScript = '/vz/root/%s/%s' % (hostObject.containerName,
+                                                   item.command)
+                commands.append('vzctl runscript %s %s' % \
+                                    (hostObject.containerName, pathToScript))
+            else :
+                # Not a script type we recognize.  Log error
+                config.logger.error("Execute script %s is of unsuported type" \
+                                        % item.command)
+        if commands :
+            addStep('startup scripts on container %s' %
+                    hostObject.containerName, commands,
+                    installSteps + [accountsStep] + networkSteps, hostObject)
 
-def specialFiles() :
-    # Re-open the file containing the bash script in append mode
-    pathToFile = config.sliceSpecificScriptsDir + '/' + config.shellScriptFile
-    try:
-        scriptFile = open(pathToFile, 'a')
-    except IOError:
-        config.logger.error("Failed to re-open file that creates sliver: %s" %
-                            pathToFile)
-        return None
 
-    scriptFile.write('\n# Set up special files that contain slice info. \n')
-    hostNames = experimentHosts.keys()
+def specialFiles(topology) :
+    """ Add the steps that set up special files that contain slice info
+        in the containers, and then mark each host ready.
+    """
+    provisioningSteps = topology.provisioningSteps
+    hostNames = topology.hosts.keys()
     for i in range(len(hostNames)) :
-        hostObject = experimentHosts[hostNames[i]]
+        hostObject = topology.hosts[hostNames[i]]
+        hostSteps = _hostSteps(topology, hostObject)
+        commands = []
         
         # Put the slice manifest in the VMs 
         # Figure out name of destination directory for manifest.  Create that
         #    directory (and any necessary parent/ancestor directories in path) 
         #    if it does not exist
-        scriptFile.write('# Put slice manifest in /proj/<siteName>/exp/<sliceName>/tbdata/geni_manifest \n')
-        dest = '/vz/root/%s/proj/geni-in-a-box.net/exp/%s/tbdata/geni_manifest' % (hostObject.containerName, sliceName)
-        scriptFile.write('mkdir -p %s \n' % dest)
+        commands.append('# Put slice manifest in /proj/<siteName>/exp/<sliceName>/tbdata/geni_manifest')
+        dest = '/vz/root/%s/proj/geni-in-a-box.net/exp/%s/tbdata/geni_manifest' % (hostObject.containerName, topology.sliceName)
+        commands.append('mkdir -p %s' % dest)
 
         # Copy the manifest to this directory
-        src = config.sliceSpecificScriptsDir + '/' +  config.manifestFile
-        scriptFile.write('cp %s %s \n' % (src, dest))
+        src = topology.scriptsDir + '/' +  config.manifestFile
+        commands.append('cp %s %s' % (src, dest))
 
 
         # Put slice information in /var/emulab/boot/nickname
         #    This file has the fully qualified name of the host in the form
         #    <experimenterSpecifiedHostName>.<sliceName>.geni-in-a-box.net
-        scriptFile.write('# Create nickname file \n')
+        commands.append('# Create nickname file')
         dest = '/vz/root/%s/var/emulab/boot' %  \
             hostObject.containerName
-        scriptFile.write('mkdir -p %s \n' % dest)
+        commands.append('mkdir -p %s' % dest)
 
         fileContents = '%s.%s.geni-in-a-box.net' % (hostObject.nodeName,
-                                                    sliceName)
-        scriptFile.write('echo \"%s\" > %s/nickname \n' % (fileContents, dest))
-
-        # Set status of the node to ready
-        scriptFile.write('# Set node status to ready \n')
-        statusFileName = '%s/pc%s.status' % (config.sliceSpecificScriptsDir, 
-                                             hostObject.containerName)
-        scriptFile.write('echo \"ready\" > %s \n' % statusFileName)
-
-        scriptFile.write('\n')
-        
-    scriptFile.close()
-
-
-def freeResources() :
-    """
-        Free up resources.
+                                                    topology.sliceName)
+        commands.append('echo \"%s\" > %s/nickname' % (fileContents, dest))
+
+        pingStep = [step for step in hostSteps if step.mustSucceed]
+        specialStep = provisioning.Step('slice files on container %s' %
+                                        hostObject.containerName, commands,
+                                        pingStep, hostObject.containerName)
+        provisioningSteps.append(specialStep)
+
+        # The node is ready when all its steps are done, and so are the
+        #    bridges of its links
+        dependsOn = hostSteps + [specialStep]
+        for nicObject in hostObject.NICs :
+            bridgeStep = [step for step in provisioningSteps \
+                              if step.name == 'bridge %s' % \
+                              nicObject.link.bridgeID]
+            dependsOn.extend(bridgeStep)
+        provisioningSteps.append(provisioning.Step('container %s ready' %
+                                                   hostObject.containerName,
+                                                   [], dependsOn,
+                                                   hostObject.containerName,
+                                                   statusOnSuccess = 'ready'))
+
+
+def writeScript(topology) :
+    """ Write the provisioning steps of the slice to the bash script named
+        in config.py, which runs them one at a time.  The aggregate runs
+        the steps itself; the script is a record of what it does.
     """
-    experimentHosts.clear()
-    del experimentLinks[:]
-    experimentNICs.clear()
+    pathToFile = topology.scriptsDir + '/' + config.shellScriptFile
+    if not provisioning.writeScript(topology.provisioningSteps, pathToFile) :
+        config.logger.error("Failed to open file that creates sliver: %s" %
+                            pathToFile)
 
 
-def getResourceStatus() :
+def getResourceStatus(topology) :
     """
         Return a list with the status of all VM resources.  Each item in the
         list is a dictionary with resource URN, resource status and error code.
@@ -755,10 +722,10 @@ def getResourceStatus() :
             ]
     """
     resStatus = list()
-    hostNames = experimentHosts.keys()
+    hostNames = topology.hosts.keys()
     for i in range(len(hostNames)) :
-        hostObject = experimentHosts[hostNames[i]]
-        resStatusFile = '%s/pc%s.status' % (config.sliceSpecificScriptsDir, 
+        hostObject = topology.hosts[hostNames[i]]
+        resStatusFile = '%s/pc%s.status' % (topology.scriptsDir,
                                              hostObject.containerName)
         try :
             f = open(resStatusFile, 'r')
@@ -774,17 +741,37 @@ def getResourceStatus() :
     return resStatus
 
 
+def setResourceStatus(topology, containerName, status) :
+    """
+        Set the status (configuring, ready, failed or unknown) of the VM
+        resource in the specified container of the slice, as
+        getResourceStatus reports it.
+    """
+    resStatusFile = '%s/pc%s.status' % (topology.scriptsDir, containerName)
+    try :
+        f = open(resStatusFile, 'w')
+        f.write('%s\n' % status)
+        f.close()
+    except IOError :
+        config.logger.error("Failed to write status file %s" % resStatusFile)
+
 
-def provisionSliver(users) :
+
+def provisionSliver(topology, users) :
     """
-        Provision the sliver.  First fill in missing information in the
-        VMNode, NIC and Link objects created when parsing the request rspec.
-        Then generate the bash script that, when run, will create and configure
-        the OpenVZ containers.
+        Provision the sliver of the slice.  First fill in missing
+        information in the VMNode, NIC and Link objects created when
+        parsing the request rspec.  Then plan the steps that, when run,
+        will create and configure the OpenVZ containers.
+
+        Returns None if everything goes well, or a string describing
+        the error.
     """
     # Fill in missing information in VMNode, NIC and Link objects
-    _annotateGraph()
+    errString = _annotateGraph(topology)
+    if errString is not None :
+        return errString
 
-    # Generate the bash script
-    _generateBashScript(users)
-    
+    # Plan the provisioning steps
+    _planSteps(topology, users)
+    return None
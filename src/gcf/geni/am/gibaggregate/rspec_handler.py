@@ -25,27 +25,24 @@ from __future__ import absolute_import
 
 import sys
 import datetime
-import re
 from xml.dom.minidom import *
 
 from . import config
 from .  import resources
-from .resources import VMNode, NIC, Link, installItem, executeItem, \
-    experimentHosts, experimentLinks, experimentNICs 
+from .resources import VMNode, NIC, Link, installItem, executeItem
 
-def parseRequestRspec(slice_urn, rspec) :
+def parseRequestRspec(topology, rspec) :
     """ This function parses a request Rspec and creates an in-memory 
         representation of the experimenter specified topology using 
-        VMNode, NIC and Link objects.
+        VMNode, NIC and Link objects, in the specified
+        resources.SliceTopology.  It allocates a container to each node.
 
         This function returns None if everything goes well.  In case of
         of an error it returns a string describing the error.
     """
-    # Get the slice name.  This is the last part of the URN.  For example,
-    #    the slice name in the URN urn:publicid:IDN+geni:gpo:gcf+slice+myslice
-    #    is myslice.
-    resources.sliceURN = slice_urn
-    resources.sliceName = re.split(r'[:\+]+', slice_urn)[-1]
+    experimentHosts = topology.hosts
+    experimentLinks = topology.links
+    experimentNICs = topology.NICs
 
     # Parse the xml rspec
     rspec_dom = parseString(rspec)
@@ -54,17 +51,22 @@ def parseRequestRspec(slice_urn, rspec) :
     #    experimenter
     hostList = rspec_dom.getElementsByTagName('node')
 
+    # Allocate a container for each host, from the containers not used by
+    #    other slices
+    containerNames = resources.containerIDs.allocate(len(hostList))
+    if containerNames is None :
+        config.logger.error('Experimenter requested more nodes than available')
+        return 'Number of nodes requested exceeds availability.  Number of nodes available: %s' % resources.containerIDs.available()
+    topology.containerNames = containerNames
+
     # For each host, extract experimenter specified information from DOM node
     hostCount = 0;      # Keep track of the number of hosts allocated
     for host in hostList : 
         hostCount += 1
-        if hostCount >  VMNode.numVMs :
-            config.logger.error('Experimenter requested more nodes than available')
-            return 'Number of nodes requested exceeds availability.  Number of nodes available: %s' % VMNode.numVMs 
 
         # Create a VMNode object for this host and add it to our collection
         #    of hosts allocated to the experiment
-        hostObject = VMNode(hostCount)
+        hostObject = VMNode(containerNames[hostCount - 1])
         experimentHosts[hostObject.containerName] = hostObject
 
         # Get information about the host from the rspec
@@ -221,14 +223,15 @@ class GeniManifest :
     Initializes a new instance of GeniManifest.
     
     This constructor expects the request rspec has already
-    been parsed and the structure is already set up.
+    been parsed into the given slice topology.
     """
-    def __init__(self, users, rspec) :
+    def __init__(self, topology, users, rspec) :
         self.users = users
         self.rspec = rspec
-        self.hosts = experimentHosts
-        self.links = experimentLinks
-        self.NICs = experimentNICs
+        self.hosts = topology.hosts
+        self.links = topology.links
+        self.NICs = topology.NICs
+        self.scriptsDir = topology.scriptsDir
         self.validUntil = datetime.datetime.today() +  \
             datetime.timedelta(days = 365)
     
@@ -449,7 +452,7 @@ class GeniManifest :
         print finalManifest
         
         # Create the file into which the manifest will be written
-        pathToFile = config.sliceSpecificScriptsDir + '/' + config.manifestFile
+        pathToFile = self.scriptsDir + '/' + config.manifestFile
         try:
             manFile = open(pathToFile, 'w')
         except IOError:
@@ -0,0 +1,375 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Inside key cache and upstream client pool for the proxy AM (gcf-proxy.py).
+
+The proxy AM calls the real AM as the calling member, with the member's
+'inside' key and certificate from the Member Authority (MA). Rather than
+asking the MA and writing the key and certificate to new files on every
+call:
+
+ - InsideKeyCache keeps the files of each member, in a private directory
+   (on a tmpfs such as /dev/shm where there is one, so the keys never
+   reach a disk), until a TTL passes or the certificate is about to
+   expire.
+ - ClientPool keeps idle XML-RPC clients to the real AM per member, so
+   that calls reuse their TLS connection.
+ - Every SWEEP_INTERVAL seconds, a call retires the expired keys of all
+   members and closes the idle clients made with them, so that the
+   files of members who stop calling are removed too.
+ - ProxyStats counts cache and pool hits and misses, and times MA
+   lookups and upstream calls. The proxy AM adds these to its GetMetrics
+   result, when metrics are enabled.
+"""
+
+from __future__ import absolute_import
+
+import calendar
+import collections
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from ...sfa.trust.certificate import Certificate
+from ..util.ch_interface import lookup_inside_key_and_cert
+from ...omnilib.xmlrpc.client import make_client
+from .am_metrics import Histogram
+
+# Seconds to keep a member's inside key and certificate
+DEFAULT_TTL = 3600
+
+# Refetch a key this many seconds before its certificate expires
+EXPIRY_MARGIN = 300
+
+# Idle clients kept per member
+DEFAULT_POOL_SIZE = 2
+
+# Seconds between sweeps for expired keys and their idle clients
+SWEEP_INTERVAL = 60
+
+# Directories to keep keys in, if they exist: tmpfs
+_TMPFS_DIRS = ('/dev/shm', '/run/shm')
+
+def _default_key_dir():
+    for dirname in _TMPFS_DIRS:
+        if os.path.isdir(dirname) and os.access(dirname, os.W_OK | os.X_OK):
+            return dirname
+    return None # The default temporary directory
+
+def _cert_expiration(certificate):
+    """Seconds since the epoch when the given PEM certificate expires."""
+    not_after = Certificate(string=certificate).cert.get_notAfter()
+    return calendar.timegm(time.strptime(not_after, "%Y%m%d%H%M%SZ"))
+
+class ProxyStats(object):
+    """Thread safe counts and latencies of the inside key cache, the
+    client pool and the upstream calls."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = collections.defaultdict(int)
+        self.key_lookups = Histogram()
+        self.calls = collections.defaultdict(Histogram)
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def add_key_lookup(self, secs):
+        with self._lock:
+            self.key_lookups.add(secs)
+
+    def add_call(self, method, secs):
+        with self._lock:
+            self.calls[method].add(secs)
+
+    def as_dict(self):
+        with self._lock:
+            return dict(counts=dict(self.counts),
+                        key_lookups=self.key_lookups.as_dict(),
+                        calls=dict((method, hist.as_dict()) for (method, hist)
+                                   in self.calls.iteritems()))
+
+class InsideKey(object):
+    """The files holding the inside key and certificate of a member.
+
+    The files are removed once the key is retired (replaced or expired)
+    and no client made with them is left."""
+
+    def __init__(self, member_id, key_fname, cert_fname, expires):
+        self.member_id = member_id
+        self.key_fname = key_fname
+        self.cert_fname = cert_fname
+        self.expires = expires
+        self._lock = threading.Lock()
+        self._clients = 0
+        self._retired = False
+
+    def is_current(self, now=None):
+        if now is None:
+            now = time.time()
+        return not self._retired and now < self.expires
+
+    def add_client(self):
+        with self._lock:
+            self._clients += 1
+
+    def remove_client(self):
+        with self._lock:
+            self._clients -= 1
+            remove = self._retired and self._clients == 0
+        if remove:
+            self._remove_files()
+
+    def retire(self):
+        with self._lock:
+            if self._retired:
+                return
+            self._retired = True
+            remove = self._clients == 0
+        if remove:
+            self._remove_files()
+
+    def _remove_files(self):
+        for fname in (self.key_fname, self.cert_fname):
+            try:
+                os.unlink(fname)
+            except OSError:
+                pass
+
+class InsideKeyCache(object):
+    """Thread safe cache of the InsideKey of each member, looked up from
+    the MA at ma_url."""
+
+    def __init__(self, ma_url, logger=None, ttl=DEFAULT_TTL, key_dir=None,
+                 stats=None, lookup=lookup_inside_key_and_cert,
+                 sweep_interval=SWEEP_INTERVAL):
+        self.ma_url = ma_url
+        self.logger = logger or logging.getLogger('gcf.pxam')
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._next_sweep = 0
+        self.stats = stats or ProxyStats()
+        self._lookup = lookup
+        if key_dir is None:
+            key_dir = _default_key_dir()
+        # Readable only by us (mkdtemp makes it mode 0700)
+        self.key_dir = tempfile.mkdtemp(prefix='gcf-pxam-', dir=key_dir)
+        self._lock = threading.Lock()
+        self._keys = {}
+        self._member_locks = {}
+
+    def get(self, member_id):
+        """Return the current InsideKey of the given member, looking it
+        up if need be, or None if the MA has none."""
+        self._maybe_sweep()
+        with self._lock:
+            key = self._keys.get(member_id)
+            if key is not None and key.is_current():
+                self.stats.count('key_hits')
+                return key
+            member_lock = self._member_locks.setdefault(member_id,
+                                                        threading.Lock())
+        # One lookup per member at a time
+        with member_lock:
+            with self._lock:
+                key = self._keys.get(member_id)
+            if key is not None and key.is_current():
+                self.stats.count('key_hits')
+                return key
+            self.stats.count('key_misses')
+            start = time.time()
+            try:
+                key_cert = self._lookup(member_id, self.ma_url, self.logger)
+            finally:
+                self.stats.add_key_lookup(time.time() - start)
+            if key_cert is None:
+                self.stats.count('key_lookup_failures')
+                return None
+            new_key = self._write(member_id, key_cert[0], key_cert[1])
+            with self._lock:
+                old_key = self._keys.get(member_id)
+                self._keys[member_id] = new_key
+        if old_key is not None:
+            old_key.retire()
+        return new_key
+
+    def sweep(self, now=None):
+        """Retire the keys of all members that are no longer current,
+        so that their files are removed once no client uses them."""
+        if now is None:
+            now = time.time()
+        with self._lock:
+            expired = [key for key in self._keys.itervalues()
+                       if not key.is_current(now)]
+            for key in expired:
+                del self._keys[key.member_id]
+        for key in expired:
+            key.retire()
+
+    def _maybe_sweep(self):
+        now = time.time()
+        if now >= self._next_sweep:
+            self._next_sweep = now + self.sweep_interval
+            self.sweep(now)
+
+    def invalidate(self, member_id):
+        """Forget the key of the given member, so the next get looks it
+        up again."""
+        with self._lock:
+            key = self._keys.pop(member_id, None)
+        if key is not None:
+            key.retire()
+
+    def close(self):
+        """Forget all keys and remove the key directory."""
+        with self._lock:
+            keys = self._keys.values()
+            self._keys.clear()
+        for key in keys:
+            key.retire()
+        shutil.rmtree(self.key_dir, ignore_errors=True)
+
+    def _write(self, member_id, private_key, certificate):
+        now = time.time()
+        expires = now + self.ttl
+        try:
+            cert_expires = _cert_expiration(certificate) - EXPIRY_MARGIN
+        except Exception, e:
+            self.logger.warning("Failed to read expiration of inside certificate of member %s: %s",
+                                member_id, e)
+        else:
+            if cert_expires <= now:
+                self.logger.warning("Inside certificate of member %s expires within %d seconds",
+                                    member_id, EXPIRY_MARGIN)
+                # Don't cache it
+                expires = now
+            else:
+                expires = min(expires, cert_expires)
+        # mkstemp files are mode 0600
+        (key_fid, key_fname) = tempfile.mkstemp(prefix='key-', dir=self.key_dir)
+        os.write(key_fid, private_key)
+        os.close(key_fid)
+        (cert_fid, cert_fname) = tempfile.mkstemp(prefix='cert-',
+                                                  dir=self.key_dir)
+        os.write(cert_fid, certificate)
+        os.close(cert_fid)
+        return InsideKey(member_id, key_fname, cert_fname, expires)
+
+class ClientPool(object):
+    """Thread safe pool of XML-RPC clients to the AM at url, made with
+    members' inside keys. A client is used by one call at a time:
+    acquire it, make the call, then release it."""
+
+    def __init__(self, url, size=DEFAULT_POOL_SIZE, stats=None,
+                 make=make_client, sweep_interval=SWEEP_INTERVAL):
+        self.url = url
+        self.size = size
+        self.sweep_interval = sweep_interval
+        self._next_sweep = 0
+        self.stats = stats or ProxyStats()
+        self._make = make
+        self._lock = threading.Lock()
+        self._idle = {} # member_id => [(InsideKey, client)]
+
+    def acquire(self, key):
+        """Return an idle client made with the given InsideKey, or a new
+        one."""
+        self._maybe_sweep()
+        stale = []
+        client = None
+        with self._lock:
+            idle = self._idle.get(key.member_id, [])
+            while idle:
+                (client_key, idle_client) = idle.pop()
+                if client_key is key:
+                    client = idle_client
+                    break
+                # Made with an older key of this member
+                stale.append((client_key, idle_client))
+        for (client_key, idle_client) in stale:
+            self._close(client_key, idle_client)
+        if client is not None:
+            self.stats.count('client_hits')
+            return client
+        self.stats.count('client_misses')
+        client = self._make(self.url, key.key_fname, key.cert_fname)
+        key.add_client()
+        return client
+
+    def release(self, key, client, reuse=True):
+        """Return the given client, made with the given key, to the pool.
+        Pass reuse=False if the client's connection may be broken."""
+        self._maybe_sweep()
+        if reuse and key.is_current():
+            with self._lock:
+                idle = self._idle.setdefault(key.member_id, [])
+                if len(idle) < self.size:
+                    idle.append((key, client))
+                    return
+        self._close(key, client)
+
+    def sweep(self, now=None):
+        """Close the idle clients of all members made with keys that are
+        no longer current."""
+        if now is None:
+            now = time.time()
+        stale = []
+        with self._lock:
+            for (member_id, idle) in self._idle.items():
+                current = []
+                for (key, client) in idle:
+                    if key.is_current(now):
+                        current.append((key, client))
+                    else:
+                        stale.append((key, client))
+                if current:
+                    self._idle[member_id] = current
+                else:
+                    del self._idle[member_id]
+        for (key, client) in stale:
+            self._close(key, client)
+
+    def _maybe_sweep(self):
+        now = time.time()
+        if now >= self._next_sweep:
+            self._next_sweep = now + self.sweep_interval
+            self.sweep(now)
+
+    def clear(self):
+        with self._lock:
+            idle = self._idle
+            self._idle = {}
+        for clients in idle.values():
+            for (key, client) in clients:
+                self._close(key, client)
+
+    def _close(self, key, client):
+        try:
+            client('close')()
+        except Exception:
+            pass
+        key.remove_client()
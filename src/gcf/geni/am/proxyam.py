@@ -26,9 +26,11 @@ Speaks only AM API v2.'''
 
 from __future__ import absolute_import
 
+import atexit
 import logging
 import os
 import socket
+import time
 
 from ... import geni
 from ...geni.am.am2 import AggregateManager
@@ -36,7 +38,8 @@ from ...geni.am.am2 import AggregateManagerServer
 from ...geni.am.am2 import ReferenceAggregateManager
 from ...geni.SecureXMLRPCServer import SecureXMLRPCServer
 from ...geni.util.ch_interface import *
-from ...omnilib.xmlrpc.client import make_client
+from .proxy_clients import ClientPool, InsideKeyCache, ProxyStats
+from .proxy_clients import DEFAULT_POOL_SIZE, DEFAULT_TTL
 
 SR_URL = "https://" + socket.gethostname() + "/sr/sr_controller.php"
 
@@ -50,11 +53,9 @@ class ProxyAggregateManager(ReferenceAggregateManager):
     # URL of actual AM to which we're connecting
     am_url = None
 
-    # *** TO DO ***
-    # keep a cache of member_id => key/cert
-    # And a cache of connections
-
-    def __init__(self, am_url, root_cert, urn_authority):
+    def __init__(self, am_url, root_cert, urn_authority,
+                 inside_key_ttl=DEFAULT_TTL, inside_key_dir=None,
+                 pool_size=DEFAULT_POOL_SIZE):
         super(ProxyAggregateManager, self).__init__(root_cert, urn_authority);
         self.am_url = am_url
 #        print("SELF.AM_URL = " + self.am_url)
@@ -66,48 +67,62 @@ class ProxyAggregateManager(ReferenceAggregateManager):
             # print("MA_URL " + str(self.ma_url)) 
         self.logger = logging.getLogger('gcf.pxam')
 
-    # Helper function to create a proxy client that talks 
-    # to real AM using inside keys
-    def make_proxy_client(self):
-        key_certs = get_inside_cert_and_key(self._server.peercert, \
-                                                self.ma_url, self.logger);
-        key_fname = key_certs['key'];
-        cert_fname = key_certs['cert'];
-        client = make_client(self.am_url, key_fname, cert_fname)
-        client.key_fname = key_fname;
-        client.cert_fname = cert_fname;
-        return client;
-
-    def close_proxy_client(self, client):
-        os.unlink(client.key_fname);
-        os.unlink(client.cert_fname);
+        # Cache of member_id => inside key/cert, and pool of clients
+        # to the real AM per member
+        self.stats = ProxyStats()
+        self.inside_keys = InsideKeyCache(self.ma_url, self.logger,
+                                          ttl=inside_key_ttl,
+                                          key_dir=inside_key_dir,
+                                          stats=self.stats)
+        self.clients = ClientPool(self.am_url, pool_size, stats=self.stats)
+        atexit.register(self.close)
+        self.logger.info("Keeping inside keys in %s for up to %d seconds",
+                         self.inside_keys.key_dir, inside_key_ttl)
+
+    def close(self):
+        self.clients.clear()
+        self.inside_keys.close()
+
+    # Helper function to call the given method at the real AM as the
+    # caller, using the caller's (cached) inside keys and a pooled client
+    def _call(self, method, *args):
+        member_id = get_member_id(self._server.peercert)
+        key = None
+        if member_id is not None:
+            key = self.inside_keys.get(member_id)
+        if key is None:
+            self.logger.error("No inside key for caller %s: cannot call remote %s",
+                              member_id, method)
+            return None
+        client = self.clients.acquire(key)
+        client_ret = None
+        ok = False
+        start = time.time()
+        try:
+            client_ret = getattr(client, method)(*args)
+            ok = True
+        except Exception:
+            print "Error in remote %s call" % method
+        self.stats.add_call(method, time.time() - start)
+        # Don't reuse a client whose connection may be broken
+        self.clients.release(key, client, reuse=ok)
+        return client_ret
 
     # *** GetVersion should return something to indicate there is a proxy
     def GetVersion(self, options):
-        client = self.make_proxy_client();
-        client_ret = None;
-        try:
-            client_ret = client.GetVersion();
-        except Exception:
-            print "Error in remote GetVersion call";
+        client_ret = self._call('GetVersion');
         print("GetVersion.CLIENT_RET = " + str(client_ret));
-        self.close_proxy_client(client);
         return client_ret;
 
     def ListResources(self, credentials, options):
-        client = self.make_proxy_client();
 #        # Shouldn't need this - it is an indication of an version mismatch
 #        options['geni_rspec_version'] = dict(type='geni', version='3');
 #        print("OPTS = " + str(options));
 #        print("CREDS = " + str(credentials));
-        try:
-            client_ret = client.ListResources(credentials, options);
-        except Exception:
-            print "Error in remote ListResources call";
+        client_ret = self._call('ListResources', credentials, options);
         print("ListResources.CLIENT_RET = " + str(client_ret));
         # Why do I need to do this?
 #        client_ret = client_ret['value'];
-        self.close_proxy_client(client);
         return client_ret;
 
     def CreateSliver(self, slice_urn, credentials, rspec, users, options):
@@ -116,50 +131,21 @@ class ProxyAggregateManager(ReferenceAggregateManager):
 #        print("CREDS = " + str(credentials));
 #        print("RSPEC = " + str(rspec));
 #        print("USERS = " + str(users));
-        client = self.make_proxy_client();
-        try:
-            client_ret = client.CreateSliver(slice_urn, credentials, rspec, users, options);
-        except Exception:
-            print "Error in remote CreateSliver call";
+        client_ret = self._call('CreateSliver', slice_urn, credentials, rspec, users, options);
 #        print("CreateSliver.CLIENT_RET = " + str(client_ret));
-        self.close_proxy_client(client);
         return client_ret;
             
     def DeleteSliver(self, slice_urn, credentials, options):
-        client = self.make_proxy_client();
-        try:
-            client_ret = client.DeleteSliver(slice_urn, credentials, options);
-        except Exception:
-            print "Error in remote DeleteSliver call";
-        self.close_proxy_client(client);
-        return client_ret;
+        return self._call('DeleteSliver', slice_urn, credentials, options);
 
     def SliverStatus(self, slice_urn, credentials, options):
-        client = self.make_proxy_client();
-        try:
-            client_ret = client.SliverStatus(slice_urn, credentials, options);
-        except Exception:
-            print "Error in remote SliverStatus call";
-        self.close_proxy_client(client);
-        return client_ret;
+        return self._call('SliverStatus', slice_urn, credentials, options);
 
     def RenewSliver(self, slice_urn, credentials, expiration_time, options):
-        client = self.make_proxy_client();
-        try:
-            client_ret = client.RenewSliver(slice_urn, credentials, expiration_time, options);
-        except Exception:
-            print "Error in remote RenewSliver call"
-        self.close_proxy_client(client);
-        return client_ret;
+        return self._call('RenewSliver', slice_urn, credentials, expiration_time, options);
 
     def Shutdown(self, slice_urn, credentials, options):
-        client = self.make_proxy_client();
-        try:
-            client_ret = client.Shutdown(slice_urn, credentials, options);
-        except Exception:
-            print "Error in remote Shutdown call"
-        self.close_proxy_client(client);
-        return client_ret;
+        return self._call('Shutdown', slice_urn, credentials, options);
 
 class ProxyAggregateManagerServer(AggregateManagerServer):
     "A server that provides the AM API to tools, but passes requests"
@@ -167,17 +153,27 @@ class ProxyAggregateManagerServer(AggregateManagerServer):
 
     def __init__(self, addr, am_url, keyfile=None, certfile=None,
                  trust_roots_dir=None,
-                 ca_certs=None, base_name=None):
+                 ca_certs=None, base_name=None, metrics=None,
+                 inside_key_ttl=DEFAULT_TTL, inside_key_dir=None,
+                 pool_size=DEFAULT_POOL_SIZE):
         # ca_certs arg here must be a file of concatenated certs
         if ca_certs is None:
             raise Exception('Missing CA Certs')
         elif not os.path.isfile(os.path.expanduser(ca_certs)):
             raise Exception('CA Certs must be an existing file of accepted root certs: %s' % ca_certs)
 
-        delegate = ProxyAggregateManager(am_url, trust_roots_dir, base_name)
+        delegate = ProxyAggregateManager(am_url, trust_roots_dir, base_name,
+                                         inside_key_ttl=inside_key_ttl,
+                                         inside_key_dir=inside_key_dir,
+                                         pool_size=pool_size)
+        if metrics is not None:
+            metrics.add_section('proxy', delegate.stats.as_dict)
         self._server = SecureXMLRPCServer(addr, keyfile=keyfile,
                                           certfile=certfile, ca_certs=ca_certs)
-        self._server.register_instance(AggregateManager(delegate))
+        self._server.metrics = metrics
+        self._server.register_instance(AggregateManager(trust_roots_dir,
+                                                        delegate,
+                                                        metrics=metrics))
         # Set the server on the delegate so it can access the
         # client certificate.
         delegate._server = self._server
@@ -134,7 +134,7 @@ class GCFAM_Resource_Manager(Base_Resource_Manager):
 
         sliver_info = []
         slices = aggregate_manager._delegate._slices
-        user_urn = gid.GID(string=options['geni_true_caller_cert']).get_urn()
+        user_urn = gid.gid_from_string(options['geni_true_caller_cert']).get_urn()
 
         for slice_urn, slice_obj in slices.items():
             self.add_sliver_info_for_slice(slice_obj, sliver_info, 
@@ -179,7 +179,7 @@ class GCFAM_Resource_Manager(Base_Resource_Manager):
 
         sliver_info = []
         slice_urn = arguments['slice_urn']
-        user_urn = gid.GID(string=options['geni_true_caller_cert']).get_urn()
+        user_urn = gid.gid_from_string(options['geni_true_caller_cert']).get_urn()
 
         start_time = datetime.datetime.utcnow()
         if 'geni_start_time' in options:
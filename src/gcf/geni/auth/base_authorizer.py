@@ -83,7 +83,7 @@ class Base_Authorizer(object):
     def authorize(self, method, caller, creds, args, opts,
                   requested_allocation_state):
         if self._logger:
-            caller_urn = gid.GID(string=caller).get_urn()
+            caller_urn = gid.gid_from_string(caller).get_urn()
             template = "Authorizing %s %s #Creds = %s Args = %s Opts =%s"
             self._logger.info(template % \
                                   (method, caller_urn, len(creds), \
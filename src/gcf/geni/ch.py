@@ -42,7 +42,10 @@ from .util import cred_util
 from .util import cert_util
 from .util.tz_util import tzd
 from .util import urn_util
+from .slice_registry import SliceRegistry
 from ..sfa.trust import gid
+from ..sfa.trust.credential import Credential
+from ..sfa.trust.credential_signer import CredentialSigner
 
 # Variable to turn on multi-threaded CH server
 # If true, spawn a different thread for each RPC
@@ -105,7 +108,7 @@ class SampleClearinghouseServer(object):
     
     def ListMySlices(self, urn):
         '''List slices owned by the user URN provided, returning a list of slice URNs.
-        Expired slices are deleted (and not returned).'''
+        Expired slices of this user are deleted (and not returned).'''
         return self._delegate.ListMySlices(urn)
 
     def CreateUserCredential(self, cert):
@@ -116,9 +119,26 @@ class Clearinghouse(object):
 
     def __init__(self):
         self.logger = cred_util.logging.getLogger('gcf-ch')
-        self.slices = {}
+        self.slices = None
+        self.signer = None
         self.aggs = []
 
+    def open_slices(self):
+        """Open the slice registry. Slices are kept in memory, unless
+        the clearinghouse section of the config file names a slices_db
+        file."""
+        slices_db = None
+        if self.config and self.config.has_key('clearinghouse'):
+            slices_db = self.config['clearinghouse'].get('slices_db')
+        if slices_db is not None and slices_db.strip() == "":
+            slices_db = None
+        self.slices = SliceRegistry(slices_db, self.logger)
+        if slices_db:
+            self.logger.info("Keeping slices in %s", slices_db)
+            reaped = self.slices.reap_expired()
+            if reaped:
+                self.logger.info("Removed %d expired slices", len(reaped))
+
     def load_aggregates(self):
         """Loads aggregates from the clearinghouse section of the config file.
         
@@ -167,6 +187,10 @@ class Clearinghouse(object):
         if certfile is None or not os.path.isfile(os.path.expanduser(certfile)) or os.path.getsize(os.path.expanduser(certfile)) < 1:
             raise Exception("Missing CH cert file %s" % certfile)
 
+        # Sign the credentials we issue in process, loading our key once
+        self.signer = CredentialSigner(os.path.expanduser(keyfile),
+                                       os.path.expanduser(certfile))
+
         if ca_certs is None:
             ca_certs = certfile
             self.logger.info("Using only my CH cert as a trusted root cert")
@@ -183,6 +207,8 @@ class Clearinghouse(object):
 
         # Load up the aggregates
         self.load_aggregates()
+
+        self.open_slices()
         
         # This is the arg to _make_server
         ca_certs_onefname = cred_util.CredentialVerifier.getCAsFileFromDir(ca_certs)
@@ -247,18 +273,20 @@ class Clearinghouse(object):
         self.logger.info("Called CreateSlice URN REQ %r" % urn_req)
         slice_gid = None
 
-        if urn_req and self.slices.has_key(urn_req):
+        slice_record = None
+        if urn_req:
+            slice_record = self.slices.get(urn_req)
+        if slice_record:
             # If the Slice has expired, treat this as
             # a request to renew
-            slice_cred = self.slices[urn_req]
-            slice_exp = self._naiveUTC(slice_cred.expiration)
+            slice_exp = slice_record.expiration
             if slice_exp <= datetime.datetime.utcnow():
                 # Need to renew this slice
                 self.logger.info("CreateSlice on %r found existing cred that expired at %r - will renew", urn_req, slice_exp)
-                slice_gid = slice_cred.get_gid_object()
+                slice_gid = Credential(string=slice_record.credential).get_gid_object()
             else:
                 self.logger.debug("Slice cred is still valid at %r until %r - return it", datetime.datetime.utcnow(), slice_exp)
-                return slice_cred.save_to_string()
+                return slice_record.credential
 
         # Create a random uuid for the slice
         slice_uuid = uuid.uuid4()
@@ -333,13 +361,19 @@ class Clearinghouse(object):
             raise Exception('CreateSlice failed to get slice credential for user %r, slice %r' % (user_gid.get_hrn(), slice_gid.get_hrn()), exc)
         self.logger.info('Created slice %r' % (urn))
         
-        self.slices[urn] = slice_cred
-        
-        return slice_cred.save_to_string()
+        return self._save_slice(urn, user_gid, slice_cred)
+
+    def _save_slice(self, slice_urn, user_gid, slice_cred):
+        '''Record the slice credential for the given slice, returning it as a string'''
+        cred_string = slice_cred.save_to_string()
+        self.slices.put(slice_urn, user_gid.get_urn(),
+                        self._naiveUTC(slice_cred.expiration), cred_string)
+        return cred_string
     
     def RenewSlice(self, slice_urn, expire_str):
         self.logger.info("Called RenewSlice(%s, %s)", slice_urn, expire_str)
-        if not self.slices.has_key(slice_urn):
+        slice_record = self.slices.get(slice_urn)
+        if slice_record is None:
             self.logger.warning('Slice %s was not found', slice_urn)
             return False
         try:
@@ -366,7 +400,7 @@ class Clearinghouse(object):
         else:
             user_gid = gid.GID(string=self._server.pem_cert)
 
-        slice_cred = self.slices[slice_urn]
+        slice_cred = Credential(string=slice_record.credential)
         slice_gid = slice_cred.get_gid_object()
         # if original slice' privileges were all delegatable,
         # make all the privs here delegatable
@@ -377,13 +411,12 @@ class Clearinghouse(object):
         slice_cred = self.create_slice_credential(user_gid, slice_gid,
                                                   in_expiration, delegatable=dgatable)
         self.logger.info("Slice %s renewed to %s", slice_urn, expire_str)
-        self.slices[slice_urn] = slice_cred
+        self._save_slice(slice_urn, user_gid, slice_cred)
         return True
 
     def DeleteSlice(self, urn_req):
         self.logger.info("Called DeleteSlice %r" % urn_req)
-        if self.slices.has_key(urn_req):
-            self.slices.pop(urn_req)
+        if urn_req and self.slices.delete(urn_req):
             self.logger.info("Deleted slice")
             return True
         self.logger.info('Slice was not found')
@@ -398,31 +431,18 @@ class Clearinghouse(object):
 
     def ListMySlices(self, urn):
         '''List slices owned by the user URN provided, returning a list of slice URNs.
-        Expired slices are deleted (and not returned).'''
+        Expired slices of this user are deleted (and not returned).'''
 
         ret = list()
         self.logger.debug("Looking for slices owned by %s", urn)
 
         # We could take hrn or return hrn too. Or return hrn and uuid.
         # Here we take a URN and return a URN
-        if not self.slices:
-#            self.logger.debug("Returning from lms early")
-            return ret
-
-        for slicecred in self.slices.values():
-            if slicecred.get_gid_caller().get_urn() == urn:
-                # Confirm it has not expired. If it has, remove it from the list of slices
-                slice_exp = self._naiveUTC(slicecred.expiration)
-                sliceurn = slicecred.get_gid_object().get_urn()
-#                self.logger.debug("Matching slice %s", sliceurn)
-                if slice_exp <= datetime.datetime.utcnow():
-                    self.logger.info("Removing expired slice %s", sliceurn)
-                    self.slices.pop(sliceurn)
-                    continue
-                ret.append(sliceurn)
-            else:
-                self.logger.debug("Found slice %s owned by different user %s", slicecred.get_gid_object().get_urn(), slicecred.get_gid_caller().get_urn())
- 
+        now = datetime.datetime.utcnow()
+        for sliceurn in self.slices.reap_expired(now, owner_urn=urn):
+            self.logger.info("Removing expired slice %s", sliceurn)
+
+        ret.extend(self.slices.list_slices(urn, now))
         return ret
     
     def CreateUserCredential(self, user_gid):
@@ -434,7 +454,7 @@ class Clearinghouse(object):
         self.logger.info("Called CreateUserCredential for GID %s" % user_gid.get_hrn())
         expiration = datetime.datetime.utcnow() + datetime.timedelta(seconds=USER_CRED_LIFE)
         try:
-            ucred = cred_util.create_credential(user_gid, user_gid, expiration, 'user', self.keyfile, self.certfile, self.trusted_root_files)
+            ucred = cred_util.create_credential(user_gid, user_gid, expiration, 'user', self.keyfile, self.certfile, self.trusted_root_files, signer=self.signer)
         except Exception, exc:
             self.logger.error("Failed to create user credential for %s: %s", user_gid.get_hrn(), traceback.format_exc())
             raise Exception("Failed to create user credential for %s" % user_gid.get_hrn(), exc)
@@ -444,5 +464,5 @@ class Clearinghouse(object):
         '''Create a Slice credential object for this user_gid (object) on given slice gid (object)'''
         # FIXME: Validate the user_gid and slice_gid
         # are my user and slice
-        return cred_util.create_credential(user_gid, slice_gid, expiration, 'slice', self.keyfile, self.certfile, self.trusted_root_files, delegatable)
+        return cred_util.create_credential(user_gid, slice_gid, expiration, 'slice', self.keyfile, self.certfile, self.trusted_root_files, delegatable, signer=self.signer)
 
@@ -197,15 +197,32 @@ class GENIClearinghouse(object):
     def establish_ch_interface(self):
         self.sr_url = "https://" + socket.gethostname() + "/sr/sr_controller.php";
 #        print("SR_URL = " + self.sr_url);
-        self.sa_url = self.get_first_service_of_type(1); # SERVICE_AUTHORITY
-        self.pa_url = self.get_first_service_of_type(2); # PROJECT_AUTHORITY
-        self.ma_url = self.get_first_service_of_type(3); # MEMBER_AUTHORITY
+        # SERVICE_AUTHORITY, PROJECT_AUTHORITY, MEMBER_AUTHORITY
+        (self.sa_url, self.pa_url, self.ma_url) = \
+            self.get_first_services_of_types((1, 2, 3));
 
     def get_first_service_of_type(self, service_type):
         result = invokeCH(self.sr_url, 'get_services_of_type', 
                           self.logger, 
                           dict(service_type=service_type), 
                           self.certfile, self.keyfile);
+        return self._first_service_url(service_type, result)
+
+    # Look up the first service of each of the given types, at once
+    def get_first_services_of_types(self, service_types):
+        calls = [(self.sr_url, 'get_services_of_type',
+                  dict(service_type=service_type),
+                  self.certfile, self.keyfile)
+                 for service_type in service_types]
+        results = get_ch_client().invoke_many(calls, self.logger)
+        urls = []
+        for (service_type, (result, exc_info)) in zip(service_types, results):
+            if exc_info is not None:
+                raise exc_info[0], exc_info[1], exc_info[2]
+            urls.append(self._first_service_url(service_type, result))
+        return urls
+
+    def _first_service_url(self, service_type, result):
 #        print("GSOT.RESULT = " + str(result))
         if(result['code'] != 0):
             return None
@@ -46,6 +46,7 @@ from .util import urn_util
 from .util.ch_interface import *
 from ..sfa.trust import gid
 from ..sfa.trust import credential as sfacredential
+from ..sfa.trust.credential_signer import CredentialSigner
 from ..sfa.util import xrn
 
 # Substitute eg "openflow//stanford"
@@ -393,6 +394,8 @@ class PGClearinghouse(Clearinghouse):
         self.gcf=gcf
         # Cache inside keys for users.
         self.inside_keys = dict()
+        # Portal key and cert, read when first needed
+        self.portal_key_cert = None
 
     def loadURLs(self):
         for (key, val) in self.config['clearinghouse'].items():
@@ -443,6 +446,12 @@ class PGClearinghouse(Clearinghouse):
         # load up URLs for things we proxy for
         self.loadURLs()
 
+        self.open_slices()
+
+        # Sign the credentials we issue in process, loading our key once
+        self.signer = CredentialSigner(os.path.expanduser(keyfile),
+                                       os.path.expanduser(certfile))
+
         self.macert = ''
         if self.config['clearinghouse'].has_key('macert_path'):
             self.macert = self.config['clearinghouse']['macert_path']
@@ -506,8 +515,10 @@ class PGClearinghouse(Clearinghouse):
         # Fetch the inside keys...
         self.logger.info("get inside keys for %r", uuid);
         argsdict = dict(member_id=uuid)
-        portalKey = self.readfile('/usr/share/geni-ch/portal/portal-key.pem')
-        portalCert = self.readfile('/usr/share/geni-ch/portal/portal-cert.pem')
+        if self.portal_key_cert is None:
+            self.portal_key_cert = (self.readfile('/usr/share/geni-ch/portal/portal-key.pem'),
+                                    self.readfile('/usr/share/geni-ch/portal/portal-cert.pem'))
+        (portalKey, portalCert) = self.portal_key_cert
         triple = invokeCH(self.ma_url, "lookup_keys_and_certs", self.logger,
                           argsdict,
                           # Temporarily hardcode authority keys to get
@@ -788,8 +799,9 @@ class PGClearinghouse(Clearinghouse):
             if self.gcf:
                 # FIXME: Handle uuid input
                 # For type slice, error means no known slice. Else the slice exists.
-                if self.slices.has_key(urn):
-                    slice_cred = self.slices[urn]
+                slice_record = self.slices.get(urn)
+                if slice_record:
+                    slice_cred = sfacredential.Credential(string=slice_record.credential)
                     slice_cert = slice_cred.get_gid_object()
                     slice_uuid = ""
                     try:
@@ -1197,7 +1209,7 @@ class PGClearinghouse(Clearinghouse):
             urn = sfacredential.Credential(string=credential).get_gid_object().get_urn()            
             if self.RenewSlice(urn, expiration):
                 # return the new slice credential
-                return self.slices[urn]
+                return self.slices.get(urn).credential
             else:
                 # error
                 raise "Failed to renew slice %s until %s" % (urn, expiration)
@@ -0,0 +1,158 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Slice registry for the gcf clearinghouse (gcf-ch.py).
+
+Keeps a record per slice: its URN, the URN of its owner (the caller of
+its slice credential), its expiration and its slice credential (XML).
+Records are kept in SQLite, indexed by owner and by expiration, so
+that listing a user's slices and removing expired slices are index
+lookups rather than scans over every slice credential.
+
+The registry is in memory (and lost on restart) unless given a
+database file (the slices_db option in the clearinghouse section of
+gcf_config).
+"""
+
+from __future__ import absolute_import
+
+import calendar
+import collections
+import datetime
+import logging
+import os
+import sqlite3
+import threading
+
+_SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS slices (
+         urn TEXT PRIMARY KEY,
+         owner_urn TEXT NOT NULL,
+         expiration REAL NOT NULL,
+         credential TEXT NOT NULL)''',
+    'CREATE INDEX IF NOT EXISTS slices_owner ON slices (owner_urn, expiration)',
+    'CREATE INDEX IF NOT EXISTS slices_expiration ON slices (expiration)',
+)
+
+# A slice record, as returned by SliceRegistry.get
+SliceRecord = collections.namedtuple('SliceRecord',
+                                     ['urn', 'owner_urn', 'expiration',
+                                      'credential'])
+
+def _to_secs(dt):
+    """Seconds since the epoch of the given naive UTC datetime."""
+    return calendar.timegm(dt.timetuple()) + dt.microsecond / 1e6
+
+def _from_secs(secs):
+    return datetime.datetime.utcfromtimestamp(secs)
+
+class SliceRegistry(object):
+    """Thread safe store of slice records. Expirations are naive UTC
+    datetimes."""
+
+    def __init__(self, filename=None, logger=None):
+        # filename None means keep the records in memory
+        self.logger = logger or logging.getLogger('gcf-ch')
+        self.filename = filename
+        if filename is None:
+            filename = ':memory:'
+        else:
+            filename = os.path.abspath(os.path.expanduser(filename))
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(filename, check_same_thread=False)
+        self._conn.text_factory = str
+        with self._lock:
+            if self.filename is not None:
+                self._conn.execute('PRAGMA journal_mode=WAL')
+                self._conn.execute('PRAGMA synchronous=NORMAL')
+            with self._conn:
+                for statement in _SCHEMA:
+                    self._conn.execute(statement)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def put(self, urn, owner_urn, expiration, credential):
+        """Add or replace the record of the given slice."""
+        with self._lock:
+            with self._conn:
+                self._conn.execute('INSERT OR REPLACE INTO slices VALUES (?, ?, ?, ?)',
+                                   (urn, owner_urn, _to_secs(expiration),
+                                    credential))
+
+    def get(self, urn):
+        """Return the SliceRecord of the given slice, or None."""
+        with self._lock:
+            row = self._conn.execute('SELECT urn, owner_urn, expiration, credential FROM slices WHERE urn = ?',
+                                     (urn,)).fetchone()
+        if row is None:
+            return None
+        return SliceRecord(row[0], row[1], _from_secs(row[2]), row[3])
+
+    def has_slice(self, urn):
+        with self._lock:
+            row = self._conn.execute('SELECT 1 FROM slices WHERE urn = ?',
+                                     (urn,)).fetchone()
+        return row is not None
+
+    def delete(self, urn):
+        """Remove the given slice. Return whether it was there."""
+        with self._lock:
+            with self._conn:
+                cursor = self._conn.execute('DELETE FROM slices WHERE urn = ?',
+                                            (urn,))
+        return cursor.rowcount > 0
+
+    def list_slices(self, owner_urn, now=None):
+        """Return the URNs of the unexpired slices of the given owner."""
+        if now is None:
+            now = datetime.datetime.utcnow()
+        with self._lock:
+            rows = self._conn.execute('SELECT urn FROM slices WHERE owner_urn = ? AND expiration > ?',
+                                      (owner_urn, _to_secs(now))).fetchall()
+        return [row[0] for row in rows]
+
+    def reap_expired(self, now=None, owner_urn=None):
+        """Remove the slices that expired by now (default the current
+        time): only those of the given owner, if one is given. Return
+        their URNs."""
+        if now is None:
+            now = datetime.datetime.utcnow()
+        where = 'expiration <= ?'
+        args = (_to_secs(now),)
+        if owner_urn is not None:
+            where = 'owner_urn = ? AND ' + where
+            args = (owner_urn,) + args
+        with self._lock:
+            with self._conn:
+                rows = self._conn.execute('SELECT urn FROM slices WHERE ' + where,
+                                          args).fetchall()
+                if rows:
+                    self._conn.execute('DELETE FROM slices WHERE ' + where,
+                                       args)
+        return [row[0] for row in rows]
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM slices').fetchone()[0]
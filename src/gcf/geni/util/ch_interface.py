@@ -27,13 +27,21 @@
 # if code = 0, value is the result
 # if code is not 0, the output is additional info on the error
 
+import collections
+import errno
+import httplib
 import json
+import logging
 import os
+import socket
 import tempfile
+import threading
 import traceback
-import urllib2
+import urlparse
 import M2Crypto
 
+from ...omnilib.util.parallel import callInParallel
+
 # TODO: 
 # - Change get_inside_cert_and_key to use GID.py to get URN and UUID from cert
 # --- caller needs to pass in _server.pem_cert
@@ -61,28 +69,13 @@ import M2Crypto
 # Based on the SSL cert on the given connection
 def get_inside_cert_and_key(peercert, ma_url, logger):
 
-#   print(str(peercert))
-    san = peercert.get('subjectAltName');
-    uri = None
-    uuid = None
-    for e in san:
-        key = e[0];
-        value = e[1];
-        if(key == 'URI' and "IDN+" in value):
-            uri = value;
-        if(key == 'URI' and 'uuid' in value):
-            uuid_parts = value.split(':');
-            uuid = uuid_parts[2];
-#           print "URI = " + str(uri) +  " UUID = " + str(uuid)
-            args = dict(member_id = uuid)
-            row = invokeCH(ma_url, 'lookup_keys_and_certs', logger, args)
-        
-#    logger.info("ROW = " + str(row))
     result = dict();
-    if(row['code'] == 0):
-        row_raw = row['value'];
-        private_key = row_raw['private_key']
-        certificate = row_raw['certificate']
+    member_id = get_member_id(peercert)
+    if member_id is None:
+        return result
+    key_cert = lookup_inside_key_and_cert(member_id, ma_url, logger)
+    if key_cert is not None:
+        (private_key, certificate) = key_cert
         (key_fid, key_fname) = tempfile.mkstemp()
         os.write(key_fid, private_key);
         os.close(key_fid);
@@ -92,33 +85,54 @@ def get_inside_cert_and_key(peercert, ma_url, logger):
         result = {'key': key_fname, 'cert':cert_fname};
         
     return result;
+
+# Get the member UUID from the subjectAltName of the given SSL peer cert
+# (as from getpeercert()), or None if there is none
+def get_member_id(peercert):
+#   print(str(peercert))
+    san = peercert.get('subjectAltName', ());
+    for e in san:
+        key = e[0];
+        value = e[1];
+        if(key == 'URI' and 'uuid' in value):
+            uuid_parts = value.split(':');
+            return uuid_parts[2];
+    return None
+
+# Ask the MA at ma_url for the inside private key and certificate of
+# the given member. Return (private_key, certificate) as PEM strings,
+# or None if the MA doesn't have them.
+def lookup_inside_key_and_cert(member_id, ma_url, logger):
+    args = dict(member_id = member_id)
+    row = invokeCH(ma_url, 'lookup_keys_and_certs', logger, args)
+#    logger.info("ROW = " + str(row))
+    if(row['code'] != 0):
+        return None
+    row_raw = row['value'];
+    return (row_raw['private_key'], row_raw['certificate'])
             
 
-# Force the unicode strings python creates to be ascii
+# Force the unicode strings python creates to be ascii, in the lists
+# within an object. Objects in them were already done by _decode_pairs.
 def _decode_list(data):
-    rv = []
-    for item in data:
+    for (i, item) in enumerate(data):
         if isinstance(item, unicode):
-            item = item.encode('utf-8')
+            data[i] = item.encode('utf-8')
         elif isinstance(item, list):
-            item = _decode_list(item)
-        elif isinstance(item, dict):
-            item = _decode_dict(item)
-        rv.append(item)
-    return rv
+            _decode_list(item)
+    return data
 
-# Force the unicode strings python creates to be ascii
-def _decode_dict(data):
+# Force the unicode strings python creates to be ascii, as json decodes
+# each object (so without copying the decoded objects again)
+def _decode_pairs(pairs):
     rv = {}
-    for key, value in data.iteritems():
+    for (key, value) in pairs:
         if isinstance(key, unicode):
             key = key.encode('utf-8')
         if isinstance(value, unicode):
             value = value.encode('utf-8')
         elif isinstance(value, list):
             value = _decode_list(value)
-        elif isinstance(value, dict):
-            value = _decode_dict(value)
         rv[key] = value
     return rv
 
@@ -136,53 +150,252 @@ def decodeCHResponse(msg, logger):
     #logger.debug("Entering decodeCHResponse with msg=%s", msg);
     # Remove whitespace -- it seems to negatively impact SMIME decoding.
     msg = msg.strip()
-    # Load the message into an OpenSSL IO buffer
-    p7_bio = M2Crypto.BIO.MemoryBuffer(msg)
-    # Try to load the msg as a PKCS7 (SMIME) message.
-    json_data = None
-    try:
-        p7, data = M2Crypto.SMIME.smime_load_pkcs7_bio(p7_bio)
-        #logger.debug("decodeCHResponse: SMIME loaded");
-        # FIXME: Should verify here
-        json_data = data.read()
-    except M2Crypto.SMIME.SMIME_Error, err:
-        logger.error("SMIME_Error: %s", err)
-        #logger.debug("decodeCHResponse: Handling SMIME exception");
-        json_data = msg
-    result = json.loads(json_data, encoding='ascii', object_hook=_decode_dict)
+    json_data = msg
+    # Try to load the msg as a PKCS7 (SMIME) message, if it looks like one
+    if not msg.startswith('{') and not msg.startswith('['):
+        # Load the message into an OpenSSL IO buffer
+        p7_bio = M2Crypto.BIO.MemoryBuffer(msg)
+        try:
+            p7, data = M2Crypto.SMIME.smime_load_pkcs7_bio(p7_bio)
+            #logger.debug("decodeCHResponse: SMIME loaded");
+            # FIXME: Should verify here
+            json_data = data.read()
+        except M2Crypto.SMIME.SMIME_Error, err:
+            logger.error("SMIME_Error: %s", err)
+            #logger.debug("decodeCHResponse: Handling SMIME exception");
+    result = json.loads(json_data, encoding='ascii',
+                        object_pairs_hook=_decode_pairs)
     return result
 
+class SMIMESigner(object):
+    """Signs messages with the given key and certificate chain (PEM
+    strings), loaded once."""
+
+    def __init__(self, key, certs):
+        # Create an SMIME signer
+        self._smime = M2Crypto.SMIME.SMIME()
+        # Load the key and cert to use for signing
+        self._smime.load_key_bio(M2Crypto.BIO.MemoryBuffer(key),
+                                 M2Crypto.BIO.MemoryBuffer(certs[0]))
+        # Add the cert chain, if there is one
+        if len(certs) > 1:
+            sk = M2Crypto.X509.X509_Stack()
+            for c in certs[1:]:
+                # Load up a cert chain
+                sk.push(M2Crypto.X509.load_cert_bio(M2Crypto.BIO.MemoryBuffer(c)))
+            # Add the chain certs to the smime signer
+            self._smime.set_x509_stack(sk)
+        self._lock = threading.Lock()
+
+    def sign(self, msg):
+        """Signs 'msg' and returns the multipart S/MIME signed message."""
+        with self._lock:
+            # Load the msg into a BIO
+            msg_bio = M2Crypto.BIO.MemoryBuffer(msg)
+            # get the signature
+            p7 = self._smime.sign(msg_bio)
+            # Create a temporary BIO to hold the multipart message
+            tmp_bio = M2Crypto.BIO.MemoryBuffer()
+            # Load the msg into a BIO again -- wish I could rewind instead
+            msg_bio = M2Crypto.BIO.MemoryBuffer(msg)
+            # Write the multipart message to the temporary BIO
+            self._smime.write(tmp_bio, p7, msg_bio)
+            # Extract the multipart message from the temporary BIO
+            return tmp_bio.read()
+
 def sign_message(key, certs, msg):
     """Signs 'msg' and returns the multipart S/MIME signed message.
     More info can be found in the "howto.smime.html" file in the
     M2Crypto source.
     """
-    # Create an SMIME signer
-    smime = M2Crypto.SMIME.SMIME()
-    # Load the key and cert to use for signing
-    smime.load_key_bio(M2Crypto.BIO.MemoryBuffer(key),
-                       M2Crypto.BIO.MemoryBuffer(certs[0]))
-    # Add the cert chain, if there is one
-    if len(certs) > 1:
-        sk = M2Crypto.X509.X509_Stack()
-        for c in certs[1:]:
-            # Load up a cert chain
-            sk.push(M2Crypto.X509.load_cert_bio(M2Crypto.BIO.MemoryBuffer(c)))
-        # Add the chain certs to the smime signer
-        smime.set_x509_stack(sk)
-    # Load the msg into a BIO
-    msg_bio = M2Crypto.BIO.MemoryBuffer(msg)
-    # get the signature
-    p7 = smime.sign(msg_bio)
-    # Create a temporary BIO to hold the multipart message
-    tmp_bio = M2Crypto.BIO.MemoryBuffer()
-    # Load the msg into a BIO again -- wish I could rewind instead
-    msg_bio = M2Crypto.BIO.MemoryBuffer(msg)
-    # Write the multipart message to the temporary BIO
-    smime.write(tmp_bio, p7, msg_bio)
-    # Extract the multipart message from the temporary BIO
-    signed_message = tmp_bio.read()
-    return signed_message
+    return SMIMESigner(key, certs).sign(msg)
+
+# Errors sending on a kept-alive connection the server has closed
+_STALE_ERRNOS = (errno.ECONNRESET, errno.EPIPE)
+
+def _is_stale_send_error(e):
+    """Whether the given error sending a request means the connection was
+    closed by the server while idle (and so the request was not read)."""
+    return isinstance(e, socket.error) and \
+        not isinstance(e, socket.timeout) and \
+        e.errno in _STALE_ERRNOS
+
+def _is_closed_before_response(e):
+    """Whether the given error reading a response means the server closed
+    the connection without sending any of it."""
+    # httplib gives the empty status line (as its repr) or, in later 2.7
+    # releases, says there was none
+    return isinstance(e, httplib.BadStatusLine) and \
+        (e.line in ('', repr('')) or
+         e.line.startswith("No status line received"))
+
+class CHClient(object):
+    """Client for the JSON services of the Clearinghouse (SR, SA, PA, MA).
+
+    Keeps HTTP(S) connections open to each service for the next call,
+    keeps an SMIMESigner per signing key, and can make several calls at
+    once (invoke_many). Thread safe. Use get_ch_client() to share one.
+    """
+
+    # Signers kept, most recently used
+    MAX_SIGNERS = 100
+
+    def __init__(self, logger=None, timeout=None, max_idle=4, max_parallel=4):
+        self.logger = logger or logging.getLogger('gcf.ch_interface')
+        self.timeout = timeout
+        self.max_idle = max_idle # Idle connections kept per host
+        self.max_parallel = max_parallel
+        self._lock = threading.Lock()
+        self._idle = {} # (scheme, host:port) => [connection]
+        self._signers = collections.OrderedDict()
+
+    def signer(self, key, certs):
+        """Return the SMIMESigner for the given key and certs."""
+        signer_key = (key, tuple(certs))
+        with self._lock:
+            signer = self._signers.pop(signer_key, None)
+            if signer is not None:
+                self._signers[signer_key] = signer
+                return signer
+        signer = SMIMESigner(key, certs)
+        with self._lock:
+            self._signers[signer_key] = signer
+            while len(self._signers) > self.MAX_SIGNERS:
+                self._signers.popitem(last=False)
+        return signer
+
+    def invoke(self, url, operation, argsdict, mycerts=None, mykey=None,
+               logger=None):
+        """Call the given operation with the given args at the service at
+        url, signing the call with mykey and mycerts (if given). Return
+        the decoded result, a dict of code, value and output."""
+        if logger is None:
+            logger = self.logger
+        if not operation or operation.strip() == '':
+            raise Exception("missing operation")
+        if not url or url.strip() == '':
+            raise Exception("missing url")
+        if not argsdict:
+            raise Exception("missing argsdict")
+
+        # Put operation in front of argsdict
+        toencode = dict(operation=operation)
+        for (k,v) in argsdict.items():
+            toencode[k]=v
+        argstr = json.dumps(toencode)
+        if (mycerts and mykey):
+            argstr = self.signer(mykey, mycerts).sign(argstr)
+        logger.debug("Will do put of %s", argstr)
+
+        putres = self._put(url, argstr, logger)
+
+        resdict = None
+        if putres:
+            logger.debug("invokeCH Got result of %s" % putres)
+            resdict = decodeCHResponse(putres, logger)
+
+        # FIXME: Check for code, value, output keys?
+        return resdict
+
+    def invoke_many(self, calls, logger=None):
+        """Make the given calls, each a tuple of invoke arguments
+        (url, operation, argsdict[, mycerts, mykey]), up to max_parallel
+        at once. Return a list of (result, exc_info) pairs in the order
+        of the calls, as callInParallel does."""
+        def call(url, operation, argsdict, mycerts=None, mykey=None):
+            return self.invoke(url, operation, argsdict, mycerts, mykey,
+                               logger)
+        return callInParallel(call, calls, self.max_parallel, name="ch-call")
+
+    def close(self):
+        """Close the idle connections."""
+        with self._lock:
+            idle = self._idle
+            self._idle = {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def _put(self, url, data, logger):
+        # PUT the data to url on a kept-alive connection, and return the
+        # response body
+        (scheme, netloc, path, query, fragment) = urlparse.urlsplit(url)
+        if not path:
+            path = '/'
+        if query:
+            path += '?' + query
+        host = (scheme, netloc)
+        while True:
+            (conn, reused) = self._get_connection(host)
+            try:
+                conn.request('PUT', path, data,
+                             {'Content-Type': 'application/json'})
+            except (httplib.HTTPException, socket.error), e:
+                conn.close()
+                if reused and _is_stale_send_error(e):
+                    # The server closed the idle connection. Try again.
+                    continue
+                logger.error("invokeCH failed to open conn to %s: %s", url, e)
+                raise Exception("invokeCH failed to open conn to %s: %s" % (url, e))
+            try:
+                response = conn.getresponse()
+            except (httplib.HTTPException, socket.error), e:
+                conn.close()
+                if reused and _is_closed_before_response(e):
+                    # The server closed the idle connection without
+                    # reading the request. Try again.
+                    continue
+                # The server may have acted on the request: don't resend it
+                logger.error("invokeCH failed to get result of put to %s: %s", url, e)
+                raise Exception("invokeCH failed to get result of put to %s: %s" % (url, e))
+            try:
+                putres = response.read()
+            except Exception, e:
+                conn.close()
+                logger.error("invokeCH failed to read result of put to %s: %s", url, e)
+                raise Exception("invokeCH failed to read result of put to %s: %s" % (url, e))
+            if response.will_close:
+                conn.close()
+            else:
+                self._put_connection(host, conn)
+            if response.status < 200 or response.status >= 300:
+                e = "HTTP Error %d: %s" % (response.status, response.reason)
+                logger.error("invokeCH failed to open conn to %s: %s", url, e)
+                raise Exception("invokeCH failed to open conn to %s: %s" % (url, e))
+            return putres
+
+    def _get_connection(self, host):
+        with self._lock:
+            conns = self._idle.get(host)
+            if conns:
+                return (conns.pop(), True)
+        (scheme, netloc) = host
+        if scheme == 'https':
+            conn = httplib.HTTPSConnection(netloc, timeout=self.timeout)
+        elif scheme == 'http':
+            conn = httplib.HTTPConnection(netloc, timeout=self.timeout)
+        else:
+            raise Exception("invokeCH unsupported URL scheme %s" % scheme)
+        return (conn, False)
+
+    def _put_connection(self, host, conn):
+        with self._lock:
+            conns = self._idle.setdefault(host, [])
+            if len(conns) < self.max_idle:
+                conns.append(conn)
+                return
+        conn.close()
+
+_ch_client = None
+_ch_client_lock = threading.Lock()
+
+def get_ch_client():
+    """Return the CHClient shared by invokeCH and its callers."""
+    global _ch_client
+    with _ch_client_lock:
+        if _ch_client is None:
+            _ch_client = CHClient()
+        return _ch_client
 
 def invokeCH(url, operation, logger, argsdict, mycerts=None, mykey=None):
     # Invoke the real CH
@@ -190,54 +403,9 @@ def invokeCH(url, operation, logger, argsdict, mycerts=None, mykey=None):
     # entry 1 in dict is named operation and is the operation, rest are args
     # json decode result, getting a dict
     # return the result
-    if not operation or operation.strip() == '':
-        raise Exception("missing operation")
-    if not url or url.strip() == '':
-        raise Exception("missing url")
-    if not argsdict:
-        raise Exception("missing argsdict")
-
-    # Put operation in front of argsdict
-    toencode = dict(operation=operation)
-    for (k,v) in argsdict.items():
-        toencode[k]=v
-    argstr = json.dumps(toencode)
-    if (mycerts and mykey):
-        argstr = sign_message(mykey, mycerts, argstr)
-    logger.debug("Will do put of %s", argstr)
-#    print ("Doing  put of %s" % argstr)
-
-    # now http put this, grab result into putres
-    # This is the most trivial put client. This appears to be harder to do / less common than you would expect.
-    # See httplib2 for an alternative approach using another library.
-    # This approach isn't very robust, may have other issues
-    opener = urllib2.build_opener(urllib2.HTTPSHandler)
-    req = urllib2.Request(url, data=argstr)
-    req.add_header('Content-Type', 'application/json')
-    req.get_method = lambda: 'PUT'
-
-    putres = None
-    putresHandle = None
-    try:
-        putresHandle = opener.open(req)
-    except Exception, e:
-        logger.error("invokeCH failed to open conn to %s: %s", url, e)
-        raise Exception("invokeCH failed to open conn to %s: %s" % (url, e))
-
-    if putresHandle:
-        try:
-            putres=putresHandle.read()
-        except Exception, e:
-            logger.error("invokeCH failed to read result of put to %s: %s", url, e)
-            raise Exception("invokeCH failed to read result of put to %s: %s" % (url, e))
-
-    resdict = None
-    if putres:
-        logger.debug("invokeCH Got result of %s" % putres)
-        resdict = decodeCHResponse(putres, logger)
-    
-    # FIXME: Check for code, value, output keys?
-    return resdict
+    # Uses the shared CHClient, which keeps connections open
+    return get_ch_client().invoke(url, operation, argsdict, mycerts, mykey,
+                                  logger)
 
 def getValueFromTriple(triple, logger, opname, unwrap=False):
     if not triple:
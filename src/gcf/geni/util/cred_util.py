@@ -38,6 +38,7 @@ from ...sfa.trust import gid
 from ...sfa.trust import rights
 from ...sfa.util.xrn import hrn_authfor_hrn
 from ...sfa.trust.credential_factory import CredentialFactory
+from ...sfa.trust.credential_signer import CredentialSigner
 from ...sfa.trust.abac_credential import ABACCredential
 from ...sfa.trust.certificate import Certificate
 
@@ -182,12 +183,17 @@ class CredentialVerifier(object):
                            target_urn,
                            privileges)
         
-    def verify_source(self, source_gid, credential):
+    def verify_source(self, source_gid, credential, use_gids=True):
         '''Ensure the credential is giving privileges to the caller/client.
         Return True iff the given source (client) GID's URN
-        is == the given credential's Caller (Owner) URN'''
+        is == the given credential's Caller (Owner) URN.
+        If use_gids is False, use the owner URN from the credential XML,
+        which doesn't need the credential's GIDs parsed.'''
         source_urn = source_gid.get_urn()
-        cred_source_urn = credential.get_gid_caller().get_urn()
+        if use_gids:
+            cred_source_urn = credential.get_gid_caller().get_urn()
+        else:
+            cred_source_urn = credential.get_owner_urn()
         #self.logger.debug('Verifying source %r against credential source %r (cred target %s)',
         #              source_urn, cred_source_urn, credential.get_gid_object().get_urn())
         result = (cred_source_urn == source_urn)
@@ -198,16 +204,20 @@ class CredentialVerifier(object):
             self.logger.debug('Source URNs do not match. Source URN %r != credential source URN %r', source_urn, cred_source_urn)
         return result
     
-    def verify_target(self, target_urn, credential):
+    def verify_target(self, target_urn, credential, use_gids=True):
         '''Ensure the credential is giving privileges on the right subject/target.
         Return True if no target is specified, or the target URN
         matches the credential's Object's (target's) URN, else return False.
-        No target is required, for example, to ListResources.'''
+        No target is required, for example, to ListResources.
+        If use_gids is False, use the target URN from the credential XML.'''
         if not target_urn:
 #            self.logger.debug('No target specified, considering it a match.')
             return True
         else:
-            cred_target_urn = credential.get_gid_object().get_urn()
+            if use_gids:
+                cred_target_urn = credential.get_gid_object().get_urn()
+            else:
+                cred_target_urn = credential.get_target_urn()
             # self.logger.debug('Verifying target %r against credential target %r',
             #               target_urn, cred_target_urn)
             result = target_urn == cred_target_urn
@@ -230,7 +240,7 @@ class CredentialVerifier(object):
         privs = credential.get_privileges()
         for priv in privileges:
             if not privs.can_perform(priv):
-                self.logger.debug('Privilege %s not found on credential %s of %s', priv, credential.get_gid_object().get_urn(), credential.get_gid_caller().get_urn())
+                self.logger.debug('Privilege %s not found on credential %s of %s', priv, credential.get_target_urn(), credential.get_owner_urn())
                 result = False
         return result
 
@@ -266,7 +276,7 @@ class CredentialVerifier(object):
                 continue
 
             if cred.get_cred_type() == cred.SFA_CREDENTIAL_TYPE:
-                cS = cred.get_gid_caller().get_urn()
+                cS = cred.get_owner_urn()
             elif cred.get_cred_type() == ABACCredential.ABAC_CREDENTIAL_TYPE:
                 cS = cred.get_summary_tostring()
             else:
@@ -281,14 +291,27 @@ class CredentialVerifier(object):
                 failure = "Not an SFA credential: " + cS
                 continue
 
-            if not self.verify_source(gid, cred):
-                failure = "Cred %s fails: Credential doesn't grant rights to you (%s), but to %s (over object %s)" % (cred.get_gid_caller().get_urn(), gid.get_urn(), cred.get_gid_caller().get_urn(), cred.get_gid_object().get_urn())
-                continue
-            if not self.verify_target(target_urn, cred):
-                failure = "Cred granting rights to %s on %s fails: It grants permissions over a different target, not %s (URNs dont match)" % (cred.get_gid_caller().get_urn(), cred.get_gid_object().get_urn(), target_urn)
-                continue
-            if not self.verify_privileges(privileges, cred):
-                failure = "Cred for %s over %s doesn't provide sufficient privileges" % (cred.get_gid_caller().get_urn(), cred.get_gid_object().get_urn())
+            # Check the URNs and privileges from the credential XML
+            # first, as that is cheap: the GIDs, parents and signatures
+            # are only decoded for credentials that pass
+            try:
+                if not self.verify_source(gid, cred, use_gids=False):
+                    failure = "Cred %s fails: Credential doesn't grant rights to you (%s), but to %s (over object %s)" % (cred.get_owner_urn(), gid.get_urn(), cred.get_owner_urn(), cred.get_target_urn())
+                    continue
+                if not self.verify_target(target_urn, cred, use_gids=False):
+                    failure = "Cred granting rights to %s on %s fails: It grants permissions over a different target, not %s (URNs dont match)" % (cred.get_owner_urn(), cred.get_target_urn(), target_urn)
+                    continue
+                if not self.verify_privileges(privileges, cred):
+                    failure = "Cred for %s over %s doesn't provide sufficient privileges" % (cred.get_owner_urn(), cred.get_target_urn())
+                    continue
+                # The GIDs are what is signed: they must agree
+                if not self.verify_source(gid, cred) or \
+                        not self.verify_target(target_urn, cred):
+                    failure = "Cred for %s over %s fails: its owner or target GID does not match" % (cred.get_owner_urn(), cred.get_target_urn())
+                    continue
+            except Exception, exc:
+                failure = "Credential for %s was unparseable: %s: %s" % (cS, exc.__class__.__name__, exc)
+                self.logger.info(failure)
                 continue
 
             try:
@@ -318,11 +341,83 @@ class CredentialVerifier(object):
 #            raise xmlrpclib.Fault(fault_code, fault_string)
             raise Exception(fault_string)
 
-def create_credential(caller_gid, object_gid, expiration, typename, issuer_keyfile, issuer_certfile, trusted_roots, delegatable=False):
+def create_credential(caller_gid, object_gid, expiration, typename, issuer_keyfile, issuer_certfile, trusted_roots, delegatable=False, signer=None):
     '''Create and Return a Credential object issued by given key/cert for the given caller
     and object GID objects, given life in seconds, and given type.
     Privileges are determined by type per sfa/trust/rights.py
-    Privileges are delegatable if requested.'''
+    Privileges are delegatable if requested.
+    If a CredentialSigner for the issuer key/cert is given, the credential
+    is signed in process rather than by xmlsec1. The signature is then
+    not checked again here (that would run xmlsec1 for every credential):
+    only the caller and object GIDs are verified against the trusted
+    roots.'''
+    if trusted_roots is None:
+        raise ValueError("Missing list of trusted roots")
+    issuer_gid = _check_issuer(issuer_keyfile, issuer_certfile)
+    ucred = _make_credential(caller_gid, object_gid, expiration, typename,
+                             issuer_gid, delegatable)
+    ucred.set_issuer_keys(issuer_keyfile, issuer_certfile)
+    if signer:
+        ucred.set_signer(signer)
+    ucred.sign()
+    
+    try:
+        if signer:
+            _verify_gids(caller_gid, object_gid,
+                         [gid.GID(filename=f) for f in trusted_roots])
+        else:
+            ucred.verify(trusted_roots)
+    except Exception, exc:
+        raise Exception("Create Credential failed to verify new credential from trusted roots: %s" % exc)
+
+    return ucred
+
+def create_credentials(specs, issuer_keyfile, issuer_certfile, trusted_roots, signer=None):
+    '''Create and Return a list of Credential objects issued by given key/cert,
+    one per (caller_gid, object_gid, expiration, typename, delegatable)
+    tuple in specs (see create_credential).
+    The credentials are signed in process, by the given CredentialSigner
+    or by one made here, so the issuer key and cert are loaded only once.
+    As in create_credential with a signer, only the caller and object
+    GIDs are verified against the trusted roots.'''
+    if trusted_roots is None:
+        raise ValueError("Missing list of trusted roots")
+    issuer_gid = _check_issuer(issuer_keyfile, issuer_certfile)
+    if signer is None:
+        signer = CredentialSigner(issuer_keyfile, issuer_certfile)
+    trusted_gids = [gid.GID(filename=f) for f in trusted_roots]
+
+    creds = []
+    for (caller_gid, object_gid, expiration, typename, delegatable) in specs:
+        ucred = _make_credential(caller_gid, object_gid, expiration, typename,
+                                 issuer_gid, delegatable)
+        ucred.set_signer(signer)
+        ucred.sign()
+        try:
+            _verify_gids(caller_gid, object_gid, trusted_gids)
+        except Exception, exc:
+            raise Exception("Create Credential failed to verify new credential from trusted roots: %s" % exc)
+        creds.append(ucred)
+    return creds
+
+def _verify_gids(caller_gid, object_gid, trusted_gids):
+    '''Verify the caller and object GIDs of a credential signed here
+    against the trusted root GIDs'''
+    caller_gid.verify_chain(trusted_gids)
+    object_gid.verify_chain(trusted_gids)
+
+def _check_issuer(issuer_keyfile, issuer_certfile):
+    '''Check the issuer key and cert files, returning the issuer GID'''
+    if not os.path.isfile(issuer_keyfile):
+        raise ValueError("Cant read issuer key file %s" % issuer_keyfile)
+
+    if not os.path.isfile(issuer_certfile):
+        raise ValueError("Cant read issuer cert file %s" % issuer_certfile)
+
+    return gid.GID(filename=issuer_certfile)
+
+def _make_credential(caller_gid, object_gid, expiration, typename, issuer_gid, delegatable):
+    '''Check the arguments and return a new encoded (unsigned) credential'''
     # FIXME: Validate args: my gids, >0 life,
     # type of cred one I can issue
     # and readable key and cert files
@@ -337,8 +432,6 @@ def create_credential(caller_gid, object_gid, expiration, typename, issuer_keyfi
     life_secs = duration.seconds + duration.days * 24 * 3600
     if life_secs < 1:
         raise ValueError("Credential expiration is in the past")
-    if trusted_roots is None:
-        raise ValueError("Missing list of trusted roots")
 
     if typename is None or typename.strip() == '':
         raise ValueError("Missing credential type")
@@ -346,14 +439,6 @@ def create_credential(caller_gid, object_gid, expiration, typename, issuer_keyfi
     if typename not in ("user", "sa", "ma", "authority", "slice", "component"):
         raise ValueError("Unknown credential type %s" % typename)
 
-    if not os.path.isfile(issuer_keyfile):
-        raise ValueError("Cant read issuer key file %s" % issuer_keyfile)
-
-    if not os.path.isfile(issuer_certfile):
-        raise ValueError("Cant read issuer cert file %s" % issuer_certfile)
-
-    issuer_gid = gid.GID(filename=issuer_certfile)
-    
     if not (object_gid.get_urn() == issuer_gid.get_urn() or 
         (issuer_gid.get_type().find('authority') == 0 and
          hrn_authfor_hrn(issuer_gid.get_hrn(), object_gid.get_hrn()))):
@@ -382,14 +467,6 @@ def create_credential(caller_gid, object_gid, expiration, typename, issuer_keyfi
     privileges.delegate_all_privileges(delegatable)
     ucred.set_privileges(privileges)
     ucred.encode()
-    ucred.set_issuer_keys(issuer_keyfile, issuer_certfile)
-    ucred.sign()
-    
-    try:
-        ucred.verify(trusted_roots)
-    except Exception, exc:
-        raise Exception("Create Credential failed to verify new credential from trusted roots: %s" % exc)
-
     return ucred
 
 
@@ -29,15 +29,38 @@ RSpec validation and printing utilities.
 from __future__ import absolute_import
 
 import xml.etree.ElementTree as etree 
+import collections
+import hashlib
+import logging
+import os
 import subprocess
 import tempfile
+import threading
 import xml.parsers.expat
-import xml.dom.minidom as md
+from xml.sax.saxutils import escape
+from cStringIO import StringIO
+
+HAVELXML = False
+try:
+    from lxml import etree as lxml_etree
+    HAVELXML = True
+except:
+    pass
 
 from .rspec_schema import *
 
 RSPECLINT = "rspeclint" 
 
+# Directories holding local copies of RSpec schemas, each at the path of
+# its URL: the GENI v3 request schema would be
+# <dir>/www.geni.net/resources/rspec/3/request.xsd. Schemas (and the
+# schemas they import) are never fetched from the network. RSpecs whose
+# schema has no local copy are validated with rspeclint.
+RSPEC_SCHEMA_DIRS = [os.path.expanduser('~/.gcf/rspec-schemas')]
+
+# Number of RSpec validation results kept, by RSpec digest
+VALIDATION_CACHE_SIZE = 256
+
 def is_wellformed_xml( string, logger=None ):
     # Try to parse the XML code.
     # If it fails to parse, then it is not well-formed
@@ -248,19 +271,191 @@ def has_child_ids( xml, check_comp_id_list, version="GENI 3" ):
 #     newxml2 = etree.tostring(obj2)
 #     return newxml1 == newxml2
 
+_rspeclint_found = None # Whether rspeclint ran, once we have tried
+
 def rspeclint_exists():
-    """Try to run 'rspeclint' to see if we can find it."""
+    """Try to run 'rspeclint' to see if we can find it. Only tries once
+    per process."""
     # TODO: Hum....better way (or place) to do this? (wrapper? rspec_util?)
-    try:
-        cmd = [RSPECLINT]
-        output = subprocess.call( cmd, stderr=open('/dev/null', 'w') )
-    except:
+    global _rspeclint_found
+    if _rspeclint_found is None:
+        try:
+            cmd = [RSPECLINT]
+            output = subprocess.call( cmd, stderr=open('/dev/null', 'w') )
+            _rspeclint_found = True
+        except:
+            _rspeclint_found = False
+    if not _rspeclint_found:
         # TODO: WHAT EXCEPTION TO RAISE HERE?
         raise Exception, "Failed to locate or run '%s'" % RSPECLINT
 
+class RSpecValidator(object):
+    """Validates RSpecs against their XML schemas in process, with lxml,
+    as rspeclint does: against the given schema, and the schemas of
+    extensions named in the xsi:schemaLocation of the RSpec. Uses
+    rspeclint for schemas with no local copy.
+
+    Schemas are read from local copies (see RSPEC_SCHEMA_DIRS), and
+    each set of schemas is compiled once. Results are cached by digest
+    of the RSpec, so validating the same RSpec again is a lookup.
+    Thread safe."""
+
+    def __init__(self, schema_dirs=None, cache_size=VALIDATION_CACHE_SIZE,
+                 logger=None):
+        if schema_dirs is None:
+            schema_dirs = RSPEC_SCHEMA_DIRS
+        self.schema_dirs = schema_dirs
+        self.cache_size = cache_size
+        self.logger = logger or logging.getLogger("omni.rspec")
+        self._lock = threading.Lock()
+        self._schemas = dict() # ((namespace, schema URL), ...) => XMLSchema or None
+        self._results = collections.OrderedDict() # digest => (valid, message)
+
+    def find_schema(self, url):
+        """Return the path of the local copy of the schema at the given
+        URL, or None."""
+        path = url.split('://', 1)[-1].lstrip('/')
+        for schema_dir in self.schema_dirs:
+            fname = os.path.join(schema_dir, path)
+            if os.path.isfile(fname):
+                return fname
+        return None
+
+    def can_validate(self, namespace=GENI_3_NAMESPACE,
+                     schema=GENI_3_REQ_SCHEMA):
+        """Can RSpecs be validated against the given schema in process?"""
+        return HAVELXML and self.find_schema(schema) is not None
+
+    def validate(self, rspec, namespace=GENI_3_NAMESPACE,
+                 schema=GENI_3_REQ_SCHEMA):
+        """Validate the given RSpec string. Return (valid, message).
+        Raises an exception if the schema has no local copy and
+        rspeclint can't be run."""
+        if isinstance(rspec, unicode):
+            rspec = rspec.encode('utf-8')
+        digest = hashlib.sha1(rspec).hexdigest()
+        key = (digest, namespace, schema)
+        with self._lock:
+            result = self._results.pop(key, None)
+            if result is not None:
+                self._results[key] = result
+                return result
+        result = None
+        if self.can_validate(namespace, schema):
+            result = self._validate(rspec, namespace, schema)
+        if result is None:
+            if _run_rspeclint(rspec, namespace, schema):
+                result = (True, "")
+            else:
+                result = (False, "Failed rspeclint")
+        with self._lock:
+            self._results[key] = result
+            while len(self._results) > self.cache_size:
+                self._results.popitem(last=False)
+        return result
+
+    def clear(self):
+        """Forget the cached results (but not the compiled schemas)."""
+        with self._lock:
+            self._results.clear()
+
+    def _validate(self, rspec, namespace, schema):
+        parser = lxml_etree.XMLParser(resolve_entities=False, no_network=True)
+        try:
+            doc = lxml_etree.fromstring(rspec, parser)
+        except lxml_etree.XMLSyntaxError, e:
+            return (False, "Not well-formed XML: %s" % e)
+        # The schemas of extensions, as rspeclint validates against them
+        locations = [(namespace, schema)]
+        schema_location = doc.get('{%s}schemaLocation' % XSI)
+        if schema_location:
+            words = schema_location.split()
+            for (ns, url) in zip(words[::2], words[1::2]):
+                if ns == namespace:
+                    continue
+                if self.find_schema(url) is None:
+                    self.logger.debug("No local copy of schema %s: not validating %s elements",
+                                      url, ns)
+                    continue
+                locations.append((ns, url))
+        with self._lock:
+            xmlschema = self._get_schema(tuple(locations))
+            if xmlschema is None:
+                return None
+            # An XMLSchema validates one document at a time
+            if xmlschema.validate(doc):
+                return (True, "")
+            error = xmlschema.error_log.last_error
+            return (False, "%s (line %s)" % (error.message, error.line))
+
+    def _get_schema(self, locations):
+        # Compile (once) a schema importing the given schemas. Called
+        # with the lock held.
+        if locations in self._schemas:
+            return self._schemas[locations]
+        imports = []
+        for (ns, url) in locations:
+            imports.append('<xs:import namespace="%s" schemaLocation="%s"/>'
+                           % (escape(ns, {'"': '&quot;'}),
+                              escape(self.find_schema(url), {'"': '&quot;'})))
+        wrapper = ('<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema">%s</xs:schema>'
+                   % ''.join(imports))
+        parser = lxml_etree.XMLParser(no_network=True)
+        parser.resolvers.add(_LocalSchemaResolver(self))
+        try:
+            xmlschema = lxml_etree.XMLSchema(lxml_etree.fromstring(wrapper,
+                                                                   parser))
+        except lxml_etree.LxmlError, e:
+            self.logger.warn("Failed to compile RSpec schemas %s: %s",
+                             ', '.join(url for (ns, url) in locations), e)
+            xmlschema = None
+        self._schemas[locations] = xmlschema
+        return xmlschema
+
+if HAVELXML:
+    class _LocalSchemaResolver(lxml_etree.Resolver):
+        """Resolves schemas imported by URL to their local copies."""
+
+        def __init__(self, validator):
+            self.validator = validator
+
+        def resolve(self, url, pubid, context):
+            fname = self.validator.find_schema(url)
+            if fname is None:
+                return None
+            return self.resolve_filename(fname, context)
+
+_validator = None
+_validator_lock = threading.Lock()
+
+def get_rspec_validator():
+    """Return the RSpecValidator shared by this process."""
+    global _validator
+    with _validator_lock:
+        if _validator is None:
+            _validator = RSpecValidator()
+        return _validator
+
+def can_validate_rspec( namespace=GENI_3_NAMESPACE, schema=GENI_3_REQ_SCHEMA ):
+    """Can validate_rspec validate RSpecs against the given schema: in
+    process, or with rspeclint?"""
+    if get_rspec_validator().can_validate(namespace, schema):
+        return True
+    try:
+        rspeclint_exists()
+    except:
+        return False
+    return True
 
 # add some utility functions for testing various namespaces and schemas
 def validate_rspec( ad, namespace=GENI_3_NAMESPACE, schema=GENI_3_REQ_SCHEMA ):
+    """Validate an RSpec against its schemas: in process if there is a
+    local copy of the schema (see RSpecValidator), else with 'rspeclint'.
+    ad - a string containing an RSpec
+    """
+    return get_rspec_validator().validate(ad, namespace, schema)[0]
+
+def _run_rspeclint( ad, namespace, schema ):
     """Run 'rspeclint' on a file.
     ad - a string containing an RSpec
     """
@@ -347,20 +542,160 @@ def is_rspec_string( rspec, rspec_namespace=None, rspec_schema=None,
             return False
     return True
 
+# Size of the pieces in which RSpecs are parsed and written
+RSPEC_CHUNK_SIZE = 64*1024
+
+def _iterRSpecChunks(rspec, chunksize=RSPEC_CHUNK_SIZE):
+    '''Yield the given RSpec in pieces of at most chunksize bytes.
+    The RSpec may be a string, a file-like object or an iterable of strings.'''
+    if isinstance(rspec, unicode):
+        rspec = rspec.encode('utf-8')
+    if isinstance(rspec, str):
+        for i in xrange(0, len(rspec), chunksize):
+            yield rspec[i:i+chunksize]
+    elif hasattr(rspec, 'read'):
+        while True:
+            chunk = rspec.read(chunksize)
+            if not chunk:
+                break
+            yield chunk
+    else:
+        for chunk in rspec:
+            if isinstance(chunk, unicode):
+                chunk = chunk.encode('utf-8')
+            yield chunk
+
+def _escapeAttr(value):
+    return escape(value, {'"': '&quot;', '\n': '&#10;', '\r': '&#13;',
+                          '\t': '&#9;'})
+
+class _PrettyRSpecWriter(object):
+    '''Expat handlers that write the document being parsed to a
+    file-like object, one element per line, indented by depth.
+    Whitespace only text is dropped; an element holding only text
+    is written on one line.'''
+
+    def __init__(self, out, indent):
+        self.out = out
+        self.indent = indent
+        self.depth = 0
+        # Is the start tag of the current element written but not closed?
+        self.open = False
+        self.text = []
+        self.pending = []
+        self.pendingSize = 0
+
+    def write(self, data):
+        self.pending.append(data)
+        self.pendingSize += len(data)
+        if self.pendingSize >= RSPEC_CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.out.write(''.join(self.pending))
+        self.pending = []
+        self.pendingSize = 0
+
+    def _takeText(self):
+        text = ''.join(self.text)
+        self.text = []
+        if text.strip() == '':
+            return None
+        return text
+
+    def _startLine(self):
+        # Close any open start tag, and write any text before a new line
+        text = self._takeText()
+        if self.open:
+            self.write('>\n')
+            self.open = False
+        if text is not None:
+            self.write(self.indent * self.depth + escape(text) + '\n')
+
+    def startElement(self, name, attrs):
+        self._startLine()
+        self.write(self.indent * self.depth + '<' + name)
+        # attrs is a list of name, value, name, value... (ordered_attributes)
+        for i in xrange(0, len(attrs), 2):
+            self.write(' %s="%s"' % (attrs[i], _escapeAttr(attrs[i+1])))
+        self.open = True
+        self.depth += 1
+
+    def endElement(self, name):
+        self.depth -= 1
+        text = self._takeText()
+        if self.open:
+            if text is not None:
+                self.write('>' + escape(text) + '</' + name + '>\n')
+            else:
+                self.write('/>\n')
+            self.open = False
+            return
+        if text is not None:
+            self.write(self.indent * (self.depth + 1) + escape(text) + '\n')
+        self.write(self.indent * self.depth + '</' + name + '>\n')
+
+    def characters(self, data):
+        self.text.append(data)
+
+    def comment(self, data):
+        self._startLine()
+        self.write(self.indent * self.depth + '<!--' + data + '-->\n')
+
+    def processingInstruction(self, target, data):
+        self._startLine()
+        if data:
+            self.write(self.indent * self.depth + '<?%s %s?>\n' % (target, data))
+        else:
+            self.write(self.indent * self.depth + '<?%s?>\n' % target)
+
+def writePrettyRSpec(rspec, out, header=None, indent=' '*2):
+    '''Write the given XML RSpec pretty printed to the file-like object
+    out, as it is parsed. The RSpec may be a string, a file-like object
+    or an iterable of strings (like the pieces of a decompression).
+    No DOM or pretty printed copy of the RSpec is made: output is
+    written in pieces of about RSPEC_CHUNK_SIZE.
+    If given, header (like an XML comment) is written after the XML
+    declaration.
+    Raises xml.parsers.expat.ExpatError if the RSpec is not well formed
+    XML, after writing what came before the error.'''
+    writer = _PrettyRSpecWriter(out, indent)
+    parser = xml.parsers.expat.ParserCreate()
+    parser.returns_unicode = False
+    parser.ordered_attributes = True
+    parser.buffer_text = True
+    parser.buffer_size = RSPEC_CHUNK_SIZE
+    parser.StartElementHandler = writer.startElement
+    parser.EndElementHandler = writer.endElement
+    parser.CharacterDataHandler = writer.characters
+    parser.CommentHandler = writer.comment
+    parser.ProcessingInstructionHandler = writer.processingInstruction
+    writer.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    if header is not None:
+        writer.write(header + '\n')
+    try:
+        for chunk in _iterRSpecChunks(rspec):
+            parser.Parse(chunk, 0)
+        parser.Parse('', 1)
+    finally:
+        writer.flush()
+
 # prettify arg is whether to parse and reprint the rspec to format it nicely.
 # Default True
 def getPrettyRSpec(rspec, prettify=True):
     '''Produce a pretty print string for an XML RSpec'''
     prettyrspec = rspec
-    try:
-        newl = ''
-        if '\n' not in rspec:
-            newl = '\n'
-        # Parsing the RSpec is memory intensive, particularly for large RSpecs. Like the PG Ad
-        if prettify:
-            prettyrspec = md.parseString(rspec).toprettyxml(indent=' '*2, newl=newl)
-    except:
-        pass
+    # Parsing the RSpec into a DOM is memory intensive, particularly for large RSpecs. Like the PG Ad
+    # So pretty print it as it is parsed instead. To write a large RSpec
+    # to a file, use writePrettyRSpec on the file rather than this copy.
+    if prettify:
+        try:
+            out = StringIO()
+            writePrettyRSpec(rspec, out)
+            prettyrspec = out.getvalue()
+        except:
+            pass
     # set rspec to be UTF-8
     if isinstance(prettyrspec, unicode):
         prettyrspec = prettyrspec.encode('utf-8')
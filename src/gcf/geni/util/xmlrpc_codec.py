@@ -0,0 +1,381 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+XML-RPC marshalling for the Omni clients and the gcf servers.
+
+Drop in replacements for xmlrpclib.loads, xmlrpclib.dumps and
+xmlrpclib.getparser, giving the same results, that are faster on the
+large strings (RSpecs, credentials) and structs GENI calls pass
+around:
+
+ - The unmarshaller has expat deliver UTF-8 byte strings in large
+   buffered chunks (rather than a unicode string per line of an RSpec,
+   each then encoded back to ASCII), and dispatches end tags to bound
+   methods.
+ - The marshaller dumps the basic types in one recursive function,
+   leaving only other types (objects, subclasses of basic types) to
+   xmlrpclib.Marshaller.
+
+Also holds the gzip settings shared by the client transports and the
+server request handler.
+"""
+
+from __future__ import absolute_import
+
+import re
+import xmlrpclib
+from itertools import izip
+from xml.parsers import expat
+
+# Compress request and response bodies larger than this (bytes) with
+# gzip, where the other side accepts it. As xmlrpclib and
+# SimpleXMLRPCServer do: about an ethernet MTU.
+GZIP_THRESHOLD = 1400
+
+# Size of the expat character data buffer, and of the reads when
+# feeding a response to the parser
+TEXT_BUFFER_SIZE = 64*1024
+
+_is8bit = re.compile("[\x80-\xff]").search
+
+MAXINT = xmlrpclib.MAXINT
+MININT = xmlrpclib.MININT
+
+class Unmarshaller(object):
+    '''Unmarshal an XML-RPC request or response from expat events,
+    as xmlrpclib.Unmarshaller does. Expects UTF-8 byte strings.
+    Call close() to get the resulting tuple of values.'''
+
+    def __init__(self, use_datetime=0):
+        self._type = None
+        self._stack = []
+        self._marks = []
+        self._data = []
+        self._value = False
+        self._methodname = None
+        self._use_datetime = use_datetime
+        self.append = self._stack.append
+        self._dispatch = {
+            'value': self.end_value,
+            'string': self.end_string,
+            'name': self.end_string, # struct keys are always strings
+            'struct': self.end_struct,
+            'array': self.end_array,
+            'int': self.end_int,
+            'i4': self.end_int,
+            'i8': self.end_int,
+            'boolean': self.end_boolean,
+            'double': self.end_double,
+            'dateTime.iso8601': self.end_dateTime,
+            'base64': self.end_base64,
+            'nil': self.end_nil,
+            'params': self.end_params,
+            'fault': self.end_fault,
+            'methodName': self.end_methodName,
+            }
+
+    def close(self):
+        # return response tuple and target method
+        if self._type is None or self._marks:
+            raise xmlrpclib.ResponseError()
+        if self._type == "fault":
+            raise xmlrpclib.Fault(**self._stack[0])
+        return tuple(self._stack)
+
+    def getmethodname(self):
+        return self._methodname
+
+    # expat handlers
+
+    def start(self, tag, attrs):
+        if tag == "array" or tag == "struct":
+            self._marks.append(len(self._stack))
+        self._data = []
+        if self._value and tag not in self._dispatch:
+            raise xmlrpclib.ResponseError("unknown tag %r" % tag)
+        self._value = (tag == "value")
+
+    def data(self, text):
+        self._data.append(text)
+
+    def end(self, tag):
+        f = self._dispatch.get(tag)
+        if f is not None:
+            data = self._data
+            if len(data) == 1:
+                f(data[0])
+            else:
+                f("".join(data))
+
+    # element decoders
+
+    def end_nil(self, data):
+        self.append(None)
+        self._value = False
+
+    def end_boolean(self, data):
+        if data == "0":
+            self.append(False)
+        elif data == "1":
+            self.append(True)
+        else:
+            raise TypeError, "bad boolean value"
+        self._value = False
+
+    def end_int(self, data):
+        self.append(int(data))
+        self._value = False
+
+    def end_double(self, data):
+        self.append(float(data))
+        self._value = False
+
+    def end_string(self, data):
+        # Plain ASCII stays a str, like xmlrpclib gives
+        if _is8bit(data):
+            data = data.decode('utf-8')
+        self.append(data)
+        self._value = False
+
+    def end_array(self, data):
+        mark = self._marks.pop()
+        self._stack[mark:] = [self._stack[mark:]]
+        self._value = False
+
+    def end_struct(self, data):
+        mark = self._marks.pop()
+        items = self._stack[mark:]
+        if len(items) % 2:
+            raise xmlrpclib.ResponseError("struct member without a value")
+        it = iter(items)
+        self._stack[mark:] = [dict(izip(it, it))]
+        self._value = False
+
+    def end_base64(self, data):
+        value = xmlrpclib.Binary()
+        value.decode(data)
+        self.append(value)
+        self._value = False
+
+    def end_dateTime(self, data):
+        value = xmlrpclib.DateTime()
+        value.decode(data)
+        if self._use_datetime:
+            value = xmlrpclib._datetime_type(data)
+        self.append(value)
+
+    def end_value(self, data):
+        # A value with no type element is a string
+        if self._value:
+            self.end_string(data)
+
+    def end_params(self, data):
+        self._type = "params"
+
+    def end_fault(self, data):
+        self._type = "fault"
+
+    def end_methodName(self, data):
+        # A unicode string, as xmlrpclib gives
+        self._methodname = data.decode('utf-8')
+        self._type = "methodName" # no params
+
+class ExpatParser(object):
+    '''Feeds XML to an Unmarshaller, with expat buffering character
+    data and giving UTF-8 byte strings.'''
+
+    def __init__(self, target):
+        self._parser = parser = expat.ParserCreate(None, None)
+        parser.returns_unicode = False
+        parser.buffer_text = True
+        parser.buffer_size = TEXT_BUFFER_SIZE
+        parser.StartElementHandler = target.start
+        parser.EndElementHandler = target.end
+        parser.CharacterDataHandler = target.data
+
+    def feed(self, data):
+        self._parser.Parse(data, 0)
+
+    def close(self):
+        try:
+            parser = self._parser
+        except AttributeError:
+            pass
+        else:
+            del self._parser # get rid of circular references
+            parser.Parse("", 1) # end of data
+
+def getparser(use_datetime=0):
+    """getparser() -> parser, unmarshaller
+
+    Like xmlrpclib.getparser.
+    """
+    target = Unmarshaller(use_datetime=use_datetime)
+    return ExpatParser(target), target
+
+def loads(data, use_datetime=0):
+    """data -> unmarshalled data, method name
+
+    Like xmlrpclib.loads: raises xmlrpclib.Fault if the data is a fault.
+    """
+    p, u = getparser(use_datetime=use_datetime)
+    p.feed(data)
+    p.close()
+    return u.close(), u.getmethodname()
+
+def _escape(s):
+    # As xmlrpclib.escape
+    if '&' in s:
+        s = s.replace("&", "&amp;")
+    if '<' in s:
+        s = s.replace("<", "&lt;")
+    if '>' in s:
+        s = s.replace(">", "&gt;")
+    return s
+
+class _Marshaller(object):
+    '''Write the XML-RPC params for a tuple of values, exactly as
+    xmlrpclib.Marshaller does.'''
+
+    def __init__(self, encoding, allow_none):
+        self.encoding = encoding
+        self.allow_none = allow_none
+        self._memo = set()
+        self._fallback = None
+
+    def dumps(self, values):
+        out = []
+        write = out.append
+        dump = self._dump
+        if isinstance(values, xmlrpclib.Fault):
+            write("<fault>\n")
+            dump({'faultCode': values.faultCode,
+                  'faultString': values.faultString},
+                 write)
+            write("</fault>\n")
+        else:
+            write("<params>\n")
+            for v in values:
+                write("<param>\n")
+                dump(v, write)
+                write("</param>\n")
+            write("</params>\n")
+        return "".join(out)
+
+    def _dump(self, value, write):
+        t = type(value)
+        if t is str:
+            write("<value><string>")
+            write(_escape(value))
+            write("</string></value>\n")
+        elif t is dict:
+            i = id(value)
+            if i in self._memo:
+                raise TypeError, "cannot marshal recursive dictionaries"
+            self._memo.add(i)
+            dump = self._dump
+            write("<value><struct>\n")
+            for k, v in value.items():
+                write("<member>\n")
+                if type(k) is str:
+                    k = _escape(k)
+                elif type(k) is unicode:
+                    k = _escape(k).encode(self.encoding, 'xmlcharrefreplace')
+                else:
+                    raise TypeError, "dictionary key must be string"
+                write("<name>%s</name>\n" % k)
+                dump(v, write)
+                write("</member>\n")
+            write("</struct></value>\n")
+            self._memo.discard(i)
+        elif t is list or t is tuple:
+            i = id(value)
+            if i in self._memo:
+                raise TypeError, "cannot marshal recursive sequences"
+            self._memo.add(i)
+            dump = self._dump
+            write("<value><array><data>\n")
+            for v in value:
+                dump(v, write)
+            write("</data></array></value>\n")
+            self._memo.discard(i)
+        elif t is unicode:
+            write("<value><string>")
+            write(_escape(value).encode(self.encoding, 'xmlcharrefreplace'))
+            write("</string></value>\n")
+        elif t is bool:
+            write(value and "<value><boolean>1</boolean></value>\n" or
+                  "<value><boolean>0</boolean></value>\n")
+        elif t is int or t is long:
+            if value > MAXINT or value < MININT:
+                raise OverflowError, "int exceeds XML-RPC limits"
+            write("<value><int>%d</int></value>\n" % value)
+        elif t is float:
+            write("<value><double>%s</double></value>\n" % repr(value))
+        elif value is None:
+            if not self.allow_none:
+                raise TypeError, "cannot marshal None unless allow_none is enabled"
+            write("<value><nil/></value>")
+        else:
+            # DateTime, Binary, datetime, objects...
+            if self._fallback is None:
+                self._fallback = xmlrpclib.Marshaller(self.encoding,
+                                                      self.allow_none)
+            self._fallback._Marshaller__dump(value, write)
+
+def dumps(params, methodname=None, methodresponse=None, encoding=None,
+          allow_none=0):
+    """data [,options] -> marshalled data
+
+    Like xmlrpclib.dumps, giving the same XML.
+    """
+    assert isinstance(params, tuple) or isinstance(params, xmlrpclib.Fault),\
+           "argument must be tuple or Fault instance"
+
+    if isinstance(params, xmlrpclib.Fault):
+        methodresponse = 1
+    elif methodresponse and isinstance(params, tuple):
+        assert len(params) == 1, "response tuple must be a singleton"
+
+    if not encoding:
+        encoding = "utf-8"
+
+    data = _Marshaller(encoding, allow_none).dumps(params)
+
+    if encoding != "utf-8":
+        xmlheader = "<?xml version='1.0' encoding='%s'?>\n" % str(encoding)
+    else:
+        xmlheader = "<?xml version='1.0'?>\n" # utf-8 is default
+
+    if methodname:
+        # a method call
+        if not isinstance(methodname, str):
+            methodname = methodname.encode(encoding, 'xmlcharrefreplace')
+        return "".join((xmlheader,
+                        "<methodCall>\n<methodName>", methodname,
+                        "</methodName>\n", data, "</methodCall>\n"))
+    elif methodresponse:
+        # a method response, or a fault structure
+        return "".join((xmlheader, "<methodResponse>\n", data,
+                        "</methodResponse>\n"))
+    return data
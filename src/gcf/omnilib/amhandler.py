@@ -39,6 +39,7 @@ import os
 import pprint
 import re
 import string
+import threading
 import zlib
 
 from .util import OmniError, NoSliceCredError, RefusedError, naiveUTC, AMAPIError
@@ -49,16 +50,22 @@ from .util.handler_utils import _listaggregates, validate_url, _get_slice_cred,
     _derefRSpecNick, _get_user_urn, \
     _print_slice_expiration, _construct_output_filename, \
     _getRSpecOutput, _writeRSpec, _printResults, _load_cred, _lookupAggNick, \
-    expires_from_rspec, expires_from_status
+    _lookupAggNickURLFromURNInNicknames, expires_from_rspec, expires_from_status
 from .util.json_encoding import DateTimeAwareJSONEncoder, DateTimeAwareJSONDecoder
+from .util.parallel import callInParallel
 from .xmlrpc import client as xmlrpcclient
 from .util.files import *
 from .util.credparsing import *
 
 from ..geni.util.tz_util import tzd
 from ..geni.util import rspec_util, urn_util
+from ..sfa.util.xrn import get_leaf
 
 
+# Serializes updates to the GetVersion cache file, for callers
+# (like stitcher) that call GetVersion at several AMs at once
+_getversionCacheLock = threading.Lock()
+
 class BadClientException(Exception):
     ''' Internal only exception thrown if AM speaks wrong AM API version'''
     def __init__(self, client, msg):
@@ -75,6 +82,7 @@ class AMCallHandler(object):
         self.opts = opts # command line options as parsed
         self.GetVersionCache = None # The cache of GetVersion info in memory
         self.clients = None # XMLRPC clients for talking to AMs
+        self.prettyRSpecs = set() # (urn, url) of listresources RSpecs to pretty print
         if self.opts.abac:
             aconf = self.config['selected_framework']
             if 'abac' in aconf and 'abac_log' in aconf:
@@ -118,7 +126,8 @@ class AMCallHandler(object):
             return None
         call = args[0].lower().strip()
         # Skip createsliver and allocate and provision because the whole idea is to add a new AM here - so the CH doesn't know
-        if call in ('getversion', 'listimages', 'deleteimage', 'createsliver', 'allocate', 'provision'): # createimage?
+        # expirationreport takes a username, not a slice name
+        if call in ('getversion', 'listimages', 'deleteimage', 'createsliver', 'allocate', 'provision', 'expirationreport'): # createimage?
             return None
         elif len(args) > 1:
             ret = args[1].strip()
@@ -140,6 +149,11 @@ class AMCallHandler(object):
             msg = 'Missing -a argument: specify an aggregate where you want the reservation.'
             self._raise_omni_error(msg)
 
+        # expirationreport picks the aggregates for each slice. Without -a, don't contact
+        # every aggregate the clearinghouse knows just to check API versions.
+        if cmd is not None and cmd == 'expirationreport' and not self.opts.aggregate:
+            return None
+
         configVer = str(self.opts.api_version) # turn int into a string
         (clients, message) = self._getclients()
         numClients = len(clients)
@@ -483,8 +497,17 @@ class AMCallHandler(object):
             if not os.path.exists(fdir):
                 os.makedirs(fdir)
         try:
-            with open(self.opts.getversionCacheName, 'w') as f:
+            # Write a temp file and move it into place, so other threads
+            # never read a partly written cache
+            tmpname = "%s.%d.tmp" % (self.opts.getversionCacheName, os.getpid())
+            with open(tmpname, 'w') as f:
                 json.dump(self.GetVersionCache, f, cls=DateTimeAwareJSONEncoder)
+            try:
+                os.rename(tmpname, self.opts.getversionCacheName)
+            except OSError:
+                # Windows won't rename over an existing file
+                os.remove(self.opts.getversionCacheName)
+                os.rename(tmpname, self.opts.getversionCacheName)
             self.logger.debug("Wrote GetVersionCache to %s", self.opts.getversionCacheName)
         except Exception, e:
             self.logger.error("Failed to write GetVersion cache: %s", e)
@@ -539,20 +562,22 @@ class AMCallHandler(object):
         else:
             res['url'] = "unspecified_AM_URL"
         res['error'] = error
-        if self.GetVersionCache is None:
-            # Read the file as serialized JSON
-            self._load_getversion_cache()
-        if error:
-            # On error, leave existing data alone - just record the last error
-            if self.GetVersionCache.has_key(client.url):
-                self.GetVersionCache[client.url]['lasterror'] = error
-            self.logger.debug("Added GetVersion error output to cache for %s: %s", client.url, error)
-        else:
-            self.GetVersionCache[client.url] = res
-            self.logger.debug("Added GetVersion success output to cache for %s", client.url)
+        with _getversionCacheLock:
+            if self.GetVersionCache is None or not self.opts.noCacheFiles:
+                # Read the file as serialized JSON
+                # Re-read it even if already loaded, to keep any entries other threads saved since
+                self._load_getversion_cache()
+            if error:
+                # On error, leave existing data alone - just record the last error
+                if self.GetVersionCache.has_key(client.url):
+                    self.GetVersionCache[client.url]['lasterror'] = error
+                self.logger.debug("Added GetVersion error output to cache for %s: %s", client.url, error)
+            else:
+                self.GetVersionCache[client.url] = res
+                self.logger.debug("Added GetVersion success output to cache for %s", client.url)
 
-        # Write the file as serialized JSON
-        self._save_getversion_cache()
+            # Write the file as serialized JSON
+            self._save_getversion_cache()
 
     def _get_cached_getversion(self, client):
         '''Get GetVersion from cache or this AM, if any.'''
@@ -1088,6 +1113,7 @@ class AMCallHandler(object):
 
         # rspecs[(urn, url)] = decompressed rspec
         rspecs = {}
+        self.prettyRSpecs = set()
         options = {}
         
         # Pass in a dummy option for testing that is actually ok
@@ -1290,7 +1316,10 @@ class AMCallHandler(object):
                         # Are there no newlines in the Ad? Then set it true to make the ad prettier,
                         # but usually don't bother. FOAM ads are messy otherwise.
                         doPretty = True
-                    rspec = rspec_util.getPrettyRSpec(rspec, doPretty)
+                    # Pretty print the RSpec only as it is written out
+                    # (by listresources), rather than copying it here
+                    if doPretty:
+                        self.prettyRSpecs.add((client.urn, client.url))
                 else:
                     self.logger.warn("Didn't get a valid RSpec!")
                     if mymessage != "":
@@ -1438,7 +1467,7 @@ class AMCallHandler(object):
             else:
                 returnedRspecs[url] = rspecStruct
 
-            retVal, filename = _writeRSpec(self.opts, self.logger, rspecOnly, slicename, urn, url, None, len(rspecs))
+            retVal, filename = _writeRSpec(self.opts, self.logger, rspecOnly, slicename, urn, url, None, len(rspecs), pretty=((urn, url) in self.prettyRSpecs))
             if filename:
                 if not savedFileDesc.endswith(' ') and savedFileDesc != "" and not savedFileDesc.endswith('\n'):
                     savedFileDesc += " "
@@ -5631,6 +5660,291 @@ class AMCallHandler(object):
         return retVal, retItem
     # End of print_sliver_expirations
 
+    def expirationreport(self, args):
+        '''Report when each of a user's slices, and the resources in those slices at each
+        aggregate, expire. Soonest expirations first.
+        Argument: optional username (default is the current user).
+        Return is a string summary, and a list (sorted by first expiration) of dictionaries, one per slice:
+         - slice_urn, slice_name
+         - slice_expiration (datetime in UTC, or None if the slice credential could not be retrieved)
+         - first_expiration: soonest of the slice and sliver expirations
+         - error: why the slice could not be checked, or None
+         - aggregates: list of dictionaries (sorted by first expiration) of urn, url, nick,
+           expirations (sorted list of distinct sliver expirations), slivers (number of slivers, if known)
+           and message (why there are no expirations, if so)
+
+        The slices are listed once at the slice authority. Then each slice credential is retrieved,
+        and each aggregate queried with SliverStatus (AM API v1&2) or Status (AM API v3+),
+        up to --reportThreads calls at once.
+
+        Aggregates queried for each slice:
+        - Each aggregate recorded at the clearinghouse as having resources for that slice, unless you
+          supply `-a` without `--useSliceAggregates`, or `--noExtraCHCalls`
+          - Only supported at some clearinghouses, and the list of aggregates is only advisory
+        - Plus each aggregate given with an `-a` argument
+
+        Output directing options:
+        -o Save the report in a text file (a table) and a JSON file. Each slice is written to them
+           as soon as the results from all its aggregates are in, so the files are in that order.
+        -p (used with -o) Prefix for resulting filenames
+        --outputfile If supplied, use this output file name (with .txt and .json extensions)
+        If not saving results to a file, the table is logged.
+        If intead of -o you specify the --tostdout option, then instead of logging, print to STDOUT.
+
+        File names will indicate the username and the configuration file name of the framework
+        e.g.: myprefix-jsmith-expirations-portal.txt and myprefix-jsmith-expirations-portal.json
+
+        Sample usage:
+        omni.py expirationreport
+        omni.py -a utah-ig -o --reportThreads 4 expirationreport jsmith
+        '''
+        if len(args) > 0:
+            username = args[0].strip()
+        elif self.opts.speaksfor:
+            username = get_leaf(self.opts.speaksfor)
+        else:
+            username = get_leaf(_get_user_urn(self.logger, self.framework.config))
+            if not username:
+                self._raise_omni_error("expirationreport failed to find your username")
+
+        (slices, message) = _do_ssl(self.framework, None, "List Slices from Slice Authority", self.framework.list_my_slices, username)
+        if slices is None:
+            return "Failed to list slices for user '%s': %s" % (username, message), None
+        slices = sorted(slices)
+        self.logger.info("Checking expirations of %d slice(s) of user '%s'", len(slices), username)
+
+        # Aggregates to query for every slice
+        givenAggs = dict()
+        if self.opts.aggregate:
+            (aggs, message) = _listaggregates(self)
+            for (urn, url) in aggs.items():
+                givenAggs[url] = (urn, _lookupAggNick(self, url))
+        useCH = not self.opts.noExtraCHCalls and (not self.opts.aggregate or self.opts.useSliceAggregates)
+
+        # Each thread gets its own handler and framework: connections are not thread safe.
+        # Each slice credential comes from the slice authority, not any --slicecredfile
+        opts = copy(self.opts)
+        opts.slicecredfile = None
+        opts.sliceName = None
+        local = threading.local()
+        threads = max(1, self.opts.reportThreads)
+
+        # Sort: soonest first, unknown last
+        def firstOf(times):
+            times = [t for t in times if t is not None]
+            if len(times) == 0:
+                return None
+            return min(times)
+        def sortKey(item):
+            if item['first_expiration'] is None:
+                return (1, datetime.datetime.max)
+            return (0, item['first_expiration'])
+        def finishRow(row):
+            for entry in row['aggregates']:
+                entry['first_expiration'] = firstOf(entry['expirations'])
+            row['aggregates'].sort(key=sortKey)
+            row['first_expiration'] = firstOf([row['slice_expiration']] + \
+                                                  [entry['first_expiration'] for entry in row['aggregates']])
+
+        header = "Expirations of %d slice(s) of user '%s' and their resources (times in UTC):" % (len(slices), username)
+        retVal = ""
+        # With -o, open the files first, and write each slice's row to them
+        # as soon as the results from all its aggregates are in
+        (table, jsonOut) = (None, None)
+        jsonRows = [0]
+        if self.opts.output:
+            filename = _construct_output_filename(self.opts, username, self.opts.framework, None, "expirations", ".txt", 0)
+            root = os.path.splitext(filename)[0]
+            (tableFile, jsonFile) = (root + ".txt", root + ".json")
+            self.logger.info("Writing to '%s' and '%s'", tableFile, jsonFile)
+            fdir = os.path.dirname(tableFile)
+            if fdir and not os.path.exists(fdir):
+                os.makedirs(fdir)
+            table = open(tableFile, 'w')
+            jsonOut = open(jsonFile, 'w')
+            table.write(header + "\n")
+            table.write(_expirationReportHeading() + "\n")
+            jsonOut.write("[")
+        def writeRow(row):
+            finishRow(row)
+            if table is None:
+                return
+            for line in _expirationReportRowLines(row):
+                table.write(line + "\n")
+            table.flush()
+            if jsonRows[0] > 0:
+                jsonOut.write(",")
+            jsonOut.write("\n")
+            json.dump(row, jsonOut, cls=DateTimeAwareJSONEncoder, sort_keys=True)
+            jsonOut.flush()
+            jsonRows[0] += 1
+
+        rows = []
+        amCalls = []
+        failures = [0]
+        try:
+            sliceResults = callInParallel(self._expirationReportSlice,
+                                          [(local, opts, urn, useCH) for urn in slices],
+                                          threads, name="slice")
+            # The number of aggregate calls still to finish for each slice row
+            pending = dict()
+            for (urn, (result, excInfo)) in zip(slices, sliceResults):
+                if excInfo is not None:
+                    row = dict(slice_urn=urn, slice_name=urn_util.nameFromURN(urn), slice_expiration=None,
+                               error=str(excInfo[1]), aggregates=[])
+                    rows.append(row)
+                    writeRow(row)
+                    continue
+                (row, creds, aggs) = result
+                rows.append(row)
+                if creds is None:
+                    writeRow(row)
+                    continue
+                for (url, (aggURN, nick)) in givenAggs.items():
+                    if url not in aggs:
+                        aggs[url] = (aggURN, nick)
+                for (url, (aggURN, nick)) in aggs.items():
+                    amCalls.append((row, (local, opts, row['slice_name'], urn, creds, url, aggURN, nick)))
+                if len(aggs) == 0:
+                    writeRow(row)
+                else:
+                    pending[id(row)] = len(aggs)
+            self.logger.info("Getting sliver expirations with %d call(s) to aggregates", len(amCalls))
+
+            def gotAggregate(i, entry, excInfo):
+                (row, call) = amCalls[i]
+                if excInfo is not None:
+                    (url, aggURN, nick) = call[5:]
+                    entry = dict(urn=aggURN, url=url, nick=nick, expirations=[], slivers=None,
+                                 message=str(excInfo[1]))
+                if entry['message'] and not entry['expirations']:
+                    failures[0] += 1
+                row['aggregates'].append(entry)
+                pending[id(row)] -= 1
+                if pending[id(row)] == 0:
+                    writeRow(row)
+            callInParallel(self._expirationReportAggregate,
+                           [call for (row, call) in amCalls],
+                           threads, name="status", onResult=gotAggregate)
+        finally:
+            if table is not None:
+                table.close()
+                jsonOut.write("\n]\n")
+                jsonOut.close()
+        failures = failures[0]
+        rows.sort(key=sortKey)
+
+        if table is not None:
+            retVal += "Saved expiration report to files %s and %s. " % (tableFile, jsonFile)
+        else:
+            _printResults(self.opts, self.logger, None,
+                          header + "\n" + "\n".join(_expirationReportLines(rows)), None)
+
+        retVal += "Checked %d slice(s) of user '%s' with %d aggregate call(s)" % (len(rows), username, len(amCalls))
+        if failures > 0:
+            retVal += ", %d of which found no expiration" % failures
+        retVal += ". "
+        if len(rows) > 0 and rows[0]['first_expiration'] is not None:
+            retVal += "First expiration: slice %s at %s UTC." % (rows[0]['slice_name'], rows[0]['first_expiration'])
+        return retVal, rows
+    # End of expirationreport
+
+    def _expirationReportHandler(self, local, opts):
+        '''Return the AMCallHandler for the current thread of expirationreport, making it if needed.
+        Each has its own framework and so its own connections, which are not thread safe.'''
+        handler = getattr(local, 'handler', None)
+        if handler is None:
+            from .. import oscript
+            framework = oscript.load_framework(self.config, opts)
+            handler = AMCallHandler(framework, self.config, opts)
+            local.handler = handler
+        return handler
+
+    def _expirationReportSlice(self, local, opts, sliceURN, useCH):
+        '''Get the slice credential and expiration of the given slice for expirationreport, and if
+        useCH, the aggregates at which the clearinghouse records slivers in it.
+        Return the report row, the credentials for AM calls (None if none) and a dict of the
+        aggregates: URL -> (URN, nickname).'''
+        handler = self._expirationReportHandler(local, opts)
+        row = dict(slice_urn=sliceURN, slice_name=urn_util.nameFromURN(sliceURN),
+                   slice_expiration=None, error=None, aggregates=[])
+        aggs = dict()
+
+        (cred, message) = _get_slice_cred(handler, sliceURN)
+        if cred is None:
+            if message is None or message.strip() == "":
+                message = "(no reason given)"
+            row['error'] = "Could not get slice credential: %s" % message
+            return (row, None, aggs)
+        (expired, row['slice_expiration']) = handler._has_slice_expired(cred)
+        if expired:
+            row['error'] = "Slice has expired"
+            return (row, None, aggs)
+        if opts.api_version < 3:
+            cred = get_cred_xml(cred)
+        creds = handler._maybe_add_creds_from_files(_maybe_add_abac_creds(handler.framework, cred))
+
+        if useCH:
+            sliverAggs = []
+            try:
+                sliverAggs = handler.framework.list_sliver_infos_for_slice(sliceURN).keys()
+            except Exception, e:
+                handler.logger.warn("Error looking up aggregates for slice %s at CH: %s", sliceURN, e)
+            for aggURN in sliverAggs:
+                (nick, url) = _lookupAggNickURLFromURNInNicknames(handler.logger, handler.config, aggURN)
+                if url == '':
+                    handler.logger.info("Aggregate %s unknown", aggURN)
+                    continue
+                aggs[url] = (aggURN, nick)
+        return (row, creds, aggs)
+
+    def _expirationReportAggregate(self, local, opts, sliceName, sliceURN, creds, url, aggURN, nick):
+        '''Get the sliver expirations in the given slice at the given aggregate for expirationreport,
+        with SliverStatus (AM API v1&2) or Status (AM API v3+).
+        Return a dict of urn, url, nick, expirations (sorted), slivers (number if known) and message.'''
+        handler = self._expirationReportHandler(local, opts)
+        entry = dict(urn=aggURN, url=url, nick=nick, expirations=[], slivers=None, message=None)
+        client = make_client(url, handler.framework, opts)
+        client.urn = aggURN
+        client.nick = nick
+        if nick:
+            client.str = nick
+        else:
+            client.str = url
+
+        if opts.api_version >= 3:
+            op = 'Status'
+            callArgs = [[sliceURN], creds, handler._build_options(op, sliceName, None)]
+        else:
+            op = 'SliverStatus'
+            callArgs = [sliceURN, creds]
+            if opts.api_version >= 2:
+                callArgs.append(handler._build_options(op, sliceName, None))
+        try:
+            ((status, message), client) = handler._api_call(client, "%s of %s at %s" % (op, sliceURN, url), op, callArgs)
+            (status, message) = handler._retrieve_value(status, message, handler.framework)
+        except BadClientException, bce:
+            entry['message'] = bce.validMsg
+            return entry
+
+        if message and ("protogeni AM code: 12: No slice or aggregate here" in message or \
+                            "protogeni AM code: 12: No such slice here" in message):
+            # PG says this AM has no resources here
+            entry['message'] = "No resources"
+        elif not status:
+            if message is None or message.strip() == "":
+                message = "(no reason given)"
+            entry['message'] = "Failed to get %s: %s" % (op, message)
+        elif op == 'Status':
+            (orderedDates, sliverExps) = handler._getSliverExpirations(status, None)
+            entry['expirations'] = orderedDates
+            entry['slivers'] = sum([len(slivers) for slivers in sliverExps.values()])
+        elif isinstance(status, dict):
+            entry['expirations'] = sorted(set(expires_from_status(status, handler.logger)))
+        if not entry['expirations'] and entry['message'] is None:
+            entry['message'] = "No sliver expiration found"
+        return entry
+
     #######
 
     # Helper functions follow
@@ -6612,6 +6926,46 @@ class AMCallHandler(object):
 
 # End of AMHandler
 
+def _reportTime(time):
+    if time is None:
+        return "-"
+    return time.strftime("%Y-%m-%d %H:%M:%S")
+
+# Columns of the expirationreport table
+_EXPIRATION_REPORT_FORMAT = "%-19s  %-30s  %-24s  %s"
+
+def _expirationReportHeading():
+    '''The column headings line of the expirationreport table'''
+    return _EXPIRATION_REPORT_FORMAT % ("FIRST EXPIRATION", "SLICE", "AGGREGATE", "DETAILS")
+
+def _expirationReportRowLines(row):
+    '''Yield the lines of the expirationreport table for the given report row (slice)'''
+    fmt = _EXPIRATION_REPORT_FORMAT
+    if row['error']:
+        details = row['error']
+    else:
+        details = "Slice expires %s" % _reportTime(row['slice_expiration'])
+    yield fmt % (_reportTime(row['first_expiration']), row['slice_name'], "", details)
+    for entry in row['aggregates']:
+        agg = entry['nick'] or entry['url']
+        exps = entry['expirations']
+        if len(exps) == 0:
+            details = entry['message']
+        elif len(exps) == 1:
+            details = "Resources expire %s" % _reportTime(exps[0])
+        else:
+            details = "Resources expire at %d times, last %s" % (len(exps), _reportTime(exps[-1]))
+        if entry['slivers'] is not None and len(exps) > 0:
+            details += " (%d slivers)" % entry['slivers']
+        yield fmt % (_reportTime(entry['first_expiration']), "", agg, details)
+
+def _expirationReportLines(rows):
+    '''Yield the lines of the expirationreport table for the given (sorted) report rows'''
+    yield _expirationReportHeading()
+    for row in rows:
+        for line in _expirationReportRowLines(row):
+            yield line
+
 def make_client(url, framework, opts):
     """ Create an xmlrpc client, skipping the client cert if not opts.ssl"""
 
@@ -54,12 +54,75 @@ PATH_ID = 'id'
 
 # FIXME: As in RSpecParser, check use of getAttribute vs getAttributeNS and localName vs nodeName
 
+class ManifestIndex:
+    '''One pass index over the top level elements of an AM manifest (or request) DOM.
+    Lets the combiner look up nodes and links by client_id instead of
+    rescanning every child of the manifest for each template element.
+    Lists are in document order, so the first entry is what a linear scan would find.
+    The indexed DOM must not be edited while the index is in use.'''
+
+    def __init__(self, dom):
+        self.nodes_by_cid = {} # client_id -> list of node elements
+        self.links_by_cid = {} # client_id -> list of link elements
+        if dom is None:
+            return
+        for child in dom.documentElement.childNodes:
+            if child.nodeType != Node.ELEMENT_NODE:
+                continue
+            if child.localName == defs.NODE_TAG:
+                self.nodes_by_cid.setdefault(child.getAttribute(CLIENT_ID), []).append(child)
+            elif child.localName == defs.LINK_TAG:
+                self.links_by_cid.setdefault(child.getAttribute(CLIENT_ID), []).append(child)
+
 class ManifestRSpecCombiner:
 
     # Constructor
     def __init__(self, useReqs=False):
         self.logger = logging.getLogger('stitch.ManifestRSpecCombiner')
         self.useReqs = useReqs
+        self.resetIndexes()
+
+    # Forget all cached element indexes.
+    # Indexes are keyed by DOM / element object, and are only valid
+    # for the duration of a single combine
+    def resetIndexes(self):
+        self._manifestIndexes = {} # DOM -> ManifestIndex
+        self._pathIndexes = {} # stitching element -> dict of path ID -> first path element with that ID
+        self._hopIndexes = {} # path element -> dict of hop ID -> first hop element with that ID
+
+    def getManifestIndex(self, dom):
+        '''Get the (cached) ManifestIndex of the given AM DOM'''
+        if not self._manifestIndexes.has_key(dom):
+            self._manifestIndexes[dom] = ManifestIndex(dom)
+        return self._manifestIndexes[dom]
+
+    def getPathIndex(self, stitching):
+        '''Get the (cached) dictionary of path ID to path element under the given stitching element.
+        Callers that append paths to the stitching element must add them here too.'''
+        if not self._pathIndexes.has_key(stitching):
+            paths = {}
+            for child in stitching.childNodes:
+                if child.nodeType == Node.ELEMENT_NODE and \
+                        child.localName == defs.PATH_TAG:
+                    pid = child.getAttribute(PATH_ID)
+                    if not paths.has_key(pid):
+                        paths[pid] = child
+            self._pathIndexes[stitching] = paths
+        return self._pathIndexes[stitching]
+
+    def getHopIndex(self, path):
+        '''Get the (cached) dictionary of hop ID to hop element under the given path element.
+        Callers that replace or append hops on the path must update it too.'''
+        if not self._hopIndexes.has_key(path):
+            hops = {}
+            for child in path.childNodes:
+                if child.nodeType == Node.ELEMENT_NODE and \
+                        child.localName == HOP:
+                    hid = child.getAttribute(HOP_ID)
+                    if not hops.has_key(hid):
+                        hops[hid] = child
+            self._hopIndexes[path] = hops
+        return self._hopIndexes[path]
 
     # Combine the manifest, replacing elements in the dom_template
     # with the appropriate pieces from the manifests
@@ -68,6 +131,7 @@ class ManifestRSpecCombiner:
     #    dom_template is a dom object into which to replace selected
     #      components from the aggregate doms
     def combine(self, ams_list, dom_template):
+        self.resetIndexes()
         self.combineNodes(ams_list, dom_template)
         self.combineLinks(ams_list, dom_template)
         self.combineHops(ams_list, dom_template)
@@ -275,7 +339,7 @@ class ManifestRSpecCombiner:
 
         # Set up a dictionary mapping node by component_manager_id
         template_nodes_by_cmid={}
-        template_node_cids=[]
+        template_node_cids=set()
         doc_root = dom_template.documentElement
         children = doc_root.childNodes
         # Find all the client_ids for nodes in the template too
@@ -288,8 +352,7 @@ class ManifestRSpecCombiner:
                 template_nodes_by_cmid[cmid].append(child)
                 cid = child.getAttribute(CLIENT_ID)
                 key = cid + cmid
-                if not key in template_node_cids:
-                    template_node_cids.append(key)
+                template_node_cids.add(key)
 
 #        print "DICT = " + str(template_nodes_by_cmid)
         
@@ -312,6 +375,7 @@ class ManifestRSpecCombiner:
             if doc_root == am_doc_root:
                 self.logger.debug("combineNodes Skipping manifest from template AM %s", am)
                 continue
+            am_index = self.getManifestIndex(am_manifest_dom)
 
             # For each node in this AMs manifest for which this AM
             # is the component manager, if that client_id
@@ -355,33 +419,32 @@ class ManifestRSpecCombiner:
                 if template_nodes_by_cmid.has_key(urn):
                     for template_node in template_nodes_by_cmid[urn]:
                         template_client_id = template_node.getAttribute(CLIENT_ID)
-                        for child in am_doc_root.childNodes:
-                            if child.nodeType == Node.ELEMENT_NODE and \
-                                    child.localName == defs.NODE_TAG:
-                                child_cmid = child.getAttribute(COMPONENT_MGR_ID)
-                                child_client_id = child.getAttribute(CLIENT_ID)
-                                if child_client_id == template_client_id:
-                                    if child_cmid == urn:
-                                        self.logger.debug(("Replacing template for node %s (" % template_client_id) + str(template_node) + (") with that from %s" % am) + " (" + str(child) + "). Node comp_mgr ID: " + child_cmid)
-                                        doc_root.replaceChild(child.cloneNode(True), template_node)
-                                    elif ':' in child_cmid[len('urn:publicid:IDN+'):child_cmid.find('+authority')] and child_cmid not in am.urn_syns:
-                                        self.logger.debug("Node %s cmid %s shows it is from a sub-AM. See if the parent would be a match (so must replace the node) at %s", child_client_id, child_cmid, am)
-                                        # If the CM on this node had a sub-site, then try comparing the non-root cmid with that in the template.
-                                        # if no other AM claims that CM and there is no node with the trimmed (less specific) cmid in the template
-
-                                        # if there is an am with cmid as a urn_syn but not this am: continue
-                                        thatAM = objects.Aggregate.findDontMake(child_cmid)
-                                        if thatAM is not None and thatAM != am:
-                                            self.logger.debug("Node cmid belongs to someone else: %s, %s", child_cmid, thatAM)
-                                            continue
+                        # Only this AM's nodes with the same client_id can match
+                        for child in am_index.nodes_by_cid.get(template_client_id, []):
+                            child_cmid = child.getAttribute(COMPONENT_MGR_ID)
+                            child_client_id = child.getAttribute(CLIENT_ID)
+                            if child_client_id == template_client_id:
+                                if child_cmid == urn:
+                                    self.logger.debug(("Replacing template for node %s (" % template_client_id) + str(template_node) + (") with that from %s" % am) + " (" + str(child) + "). Node comp_mgr ID: " + child_cmid)
+                                    doc_root.replaceChild(child.cloneNode(True), template_node)
+                                elif ':' in child_cmid[len('urn:publicid:IDN+'):child_cmid.find('+authority')] and child_cmid not in am.urn_syns:
+                                    self.logger.debug("Node %s cmid %s shows it is from a sub-AM. See if the parent would be a match (so must replace the node) at %s", child_client_id, child_cmid, am)
+                                    # If the CM on this node had a sub-site, then try comparing the non-root cmid with that in the template.
+                                    # if no other AM claims that CM and there is no node with the trimmed (less specific) cmid in the template
+
+                                    # if there is an am with cmid as a urn_syn but not this am: continue
+                                    thatAM = objects.Aggregate.findDontMake(child_cmid)
+                                    if thatAM is not None and thatAM != am:
+                                        self.logger.debug("Node cmid belongs to someone else: %s, %s", child_cmid, thatAM)
+                                        continue
 
-                                        # Produce the cmid urn...exogeni.net+authority+am from urn...exogeni.net:site+authority+am
-                                        cmidTrim = child_cmid[:child_cmid.find('+authority')]
-                                        cmidTrim = cmidTrim[:cmidTrim.find(':', len('urn:publicid:IDN+'))]
-                                        cmidTrim += child_cmid[child_cmid.find('+authority'):]
-                                        if cmidTrim == urn:
-                                            self.logger.debug(("Replacing template for super AM (like EG-SM) node %s (" % template_client_id) + str(template_node) + (") with that from %s" % am) + " (" + str(child) + "). Node comp_mgr ID: " + child_cmid)
-                                            doc_root.replaceChild(child.cloneNode(True), template_node)
+                                    # Produce the cmid urn...exogeni.net+authority+am from urn...exogeni.net:site+authority+am
+                                    cmidTrim = child_cmid[:child_cmid.find('+authority')]
+                                    cmidTrim = cmidTrim[:cmidTrim.find(':', len('urn:publicid:IDN+'))]
+                                    cmidTrim += child_cmid[child_cmid.find('+authority'):]
+                                    if cmidTrim == urn:
+                                        self.logger.debug(("Replacing template for super AM (like EG-SM) node %s (" % template_client_id) + str(template_node) + (") with that from %s" % am) + " (" + str(child) + "). Node comp_mgr ID: " + child_cmid)
+                                        doc_root.replaceChild(child.cloneNode(True), template_node)
 
     def combineLinks(self, ams_list, dom_template):
         '''Replace each link in dom_template with matching link from (an) AM with same URN.
@@ -394,7 +457,7 @@ class ManifestRSpecCombiner:
         docAM = None
         children = doc_root.childNodes
         # Collect the link client_ids in the template
-        template_link_cids=[]
+        template_link_cids=set()
         for child in children:
             if child.nodeType == Node.ELEMENT_NODE and \
                     child.localName == defs.LINK_TAG:
@@ -402,7 +465,7 @@ class ManifestRSpecCombiner:
                 # Get first 'component_manager' child element
 #                print "LINK = " + str(link) + " " + cmid
                 client_id = str(link.getAttribute(CLIENT_ID))
-                template_link_cids.append(client_id)
+                template_link_cids.add(client_id)
 
         # loop over AMs. If an AM has a link client_id not in template_link_ids
         # and the link has that AM as a component_manager, then append this link to the template
@@ -446,7 +509,7 @@ class ManifestRSpecCombiner:
                 if myLink:
 #                    self.logger.debug("Adding link %s (%s)", cid, link2.toxml(encoding="utf-8"))
                     doc_root.appendChild(link2.cloneNode(True))
-                    template_link_cids.append(cid)
+                    template_link_cids.add(cid)
         # Done adding links from AMs not in template
 
         # Now go through the links in the template, swapping in info from the appropriate manifest RSpecs
@@ -538,10 +601,8 @@ class ManifestRSpecCombiner:
                         self.logger.debug("combineLinks Skipping manifest from %s - same as template", agg)
                         continue
                     self.logger.debug("combineLinks Considering manifest from %s", agg)
-                    for link2 in man.documentElement.childNodes:
-                        if link2.nodeType != Node.ELEMENT_NODE or \
-                                link2.localName != defs.LINK_TAG:
-                            continue
+                    # Only this AM's links with the same client_id can match
+                    for link2 in self.getManifestIndex(man).links_by_cid.get(client_id, []):
                         # If this is a manifest link and all irefs have
                         # manifest info, then this link is done. Move on.
                         # FIXME: This means we do not add the link sliver_id
@@ -934,13 +995,14 @@ class ManifestRSpecCombiner:
                     self.logger.debug("Cannot find path %s in template manifest", path_id)
                     # Find it on the AM and append it to the template
                     am_path = self.findPathByID(amStitch, path_id)
-                    template_stitching.appendChild(am_path.cloneNode(True))
+                    new_path = template_stitching.appendChild(am_path.cloneNode(True))
+                    self.getPathIndex(template_stitching)[path_id] = new_path
                     self.logger.debug(" ... added it from this AM")
                     continue
                 #self.logger.debug("Found path %s in template manifest: %s", path_id, template_path.toxml(encoding="utf-8"))
                 #                print "AGG " + str(am) + " HID " + str(hop_id)
                 if not am.isEG:
-                    res = self.replaceHopOrAddElement(template_path, self.getStitchingElement(am_manifest_dom), hop_id, path_id)
+                    res = self.replaceHopOrAddElement(template_path, amStitch, hop_id, path_id)
 #                    for child in template_path.childNodes:
 #                        if child.nodeType == Node.ELEMENT_NODE and \
 #                                child.localName == HOP and \
@@ -1114,14 +1176,8 @@ class ManifestRSpecCombiner:
     # Replace the hop element in the template DOM with the hop element 
     # from the aggregate DOM that has the given HOP ID
     def replaceHopOrAddElement(self, template_path, am_stitching, hop_id, path_id):
-        template_hop = None
-
-        for child in template_path.childNodes:
-            if child.nodeType == Node.ELEMENT_NODE and \
-                    child.localName == HOP and \
-                    child.getAttribute(HOP_ID) == hop_id:
-                template_hop = child
-                break
+        template_hops = self.getHopIndex(template_path)
+        template_hop = template_hops.get(hop_id)
         if template_hop is None:
             # This used to be an error and return, cause it means we can't replace
             # So now instead we will do an add
@@ -1132,12 +1188,7 @@ class ManifestRSpecCombiner:
 
         am_hop = None
         if am_path is not None:
-            for child in am_path.childNodes:
-                if child.nodeType == Node.ELEMENT_NODE and \
-                        child.localName == HOP and \
-                        child.getAttribute(HOP_ID) == hop_id:
-                    am_hop = child
-                    break
+            am_hop = self.getHopIndex(am_path).get(hop_id)
         else:
             self.logger.error("Cannot find path %s in AM's stitching extension when looking to use AM's version of hop %s", path_id, hop_id)
             # self.logger.debug("%s" % am_stitching)
@@ -1145,10 +1196,11 @@ class ManifestRSpecCombiner:
 
         if am_hop is not None and template_hop is not None:
 #            self.logger.debug("Replacing " + template_hop.toxml(encoding="utf-8") + " with " + am_hop.toxml(encoding="utf-8"))
-            template_path.replaceChild(am_hop.cloneNode(True), template_hop)
+            template_hops[hop_id] = am_hop.cloneNode(True)
+            template_path.replaceChild(template_hops[hop_id], template_hop)
         elif am_hop is not None:
             self.logger.debug("Instead of replacing hop, will add")
-            template_path.appendChild(am_hop.cloneNode(True))
+            template_hops[hop_id] = template_path.appendChild(am_hop.cloneNode(True))
         else:
             self.logger.error ("Can't replace hop %s from path %s in template: AM HOP %s TEMPLATE HOP %s" % (hop_id, path_id, am_hop, template_hop))
             return False
@@ -1243,13 +1295,7 @@ class ManifestRSpecCombiner:
         if stitching is None:
             self.logger.debug("findPathByID: stitching element was None")
             return None
-        for child in stitching.childNodes:
-            if child.nodeType == Node.ELEMENT_NODE and \
-                    child.localName == defs.PATH_TAG and \
-                    child.getAttribute(PATH_ID) == path_id:
-                # self.logger.debug("Found child for path: %s", child)
-                return child
-        return None
+        return self.getPathIndex(stitching).get(path_id)
 
     def getStitchingElement(self, manifest_dom):
         rspec_node = None
@@ -32,12 +32,14 @@ from xml.dom.minidom import parseString, getDOMImplementation
 from . import objects
 from .utils import StitchingError
 from . import defs
+from ..util import timing
 
 class RSpecParser:
 
     def __init__(self, logger=None):
         self.logger = logger if logger else logging.getLogger('stitch')
 
+    @timing.timed('rspec_parse')
     def parse(self, data):
         try:
             dom = parseString(data)
@@ -0,0 +1,149 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+'''Currently available VLAN tags at aggregates, from their advertisements.
+
+Stitcher only needs the available VLAN tags of the stitching hop links
+(the links of the aggregate ports) in an advertisement, which for
+ProtoGENI based aggregates is huge. extract_vlan_availability streams
+through the advertisement keeping only those, instead of building a DOM
+of it all. AvailabilityCache saves them per aggregate on disk for a short
+time, shared by stitcher runs.'''
+
+from __future__ import absolute_import
+
+import cStringIO
+import datetime
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
+
+from . import defs
+from .VLANRange import VLANRange
+
+# Defaults for the cache of VLAN availability
+DEFAULT_CACHE_DIR = '~/.gcf/vlan-avail-cache'
+DEFAULT_CACHE_AGE_SECS = 300
+
+# As HopLink
+VLAN_RANGE_TAG = 'vlanRangeAvailability'
+
+def _local_name(tag):
+    # Strip any {namespace}
+    return tag[tag.rfind('}') + 1:]
+
+def extract_vlan_availability(rspec):
+    '''Return a dict of hop link URN -> VLANRange of available tags, for
+    the links of the stitching ports in the given advertisement RSpec.
+    As in HopLink.fromDOM, an empty vlanRangeAvailability means any tag,
+    and a link without one has no tags available.'''
+    if isinstance(rspec, unicode):
+        rspec = rspec.encode('utf-8')
+    avail = dict()
+    names = [] # local names of the open elements
+    linkDepth = None # depth of the port link we are in, if any
+    for (event, elem) in ElementTree.iterparse(cStringIO.StringIO(rspec),
+                                               events=('start', 'end')):
+        if event == 'start':
+            names.append(_local_name(elem.tag))
+            if linkDepth is None and len(names) > 1 and \
+                    names[-1] == defs.LINK_TAG and names[-2] == defs.PORT_TAG:
+                linkDepth = len(names)
+            continue
+        if linkDepth is not None and len(names) > linkDepth:
+            # Inside a port link: keep this until we are done with the link
+            names.pop()
+            continue
+        if len(names) == linkDepth:
+            linkDepth = None
+            vlanRange = VLANRange()
+            for child in elem.iter():
+                if _local_name(child.tag) == VLAN_RANGE_TAG:
+                    vlanRange = VLANRange.fromString(child.text or "any")
+                    break
+            avail[elem.get('id')] = vlanRange
+        names.pop()
+        # Done with this element
+        elem.clear()
+    return avail
+
+class AvailabilityCache(object):
+    '''VLAN availability of aggregates, saved as one JSON file per aggregate
+    in a directory, and used for up to max_age_secs.'''
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR,
+                 max_age_secs=DEFAULT_CACHE_AGE_SECS, logger=None):
+        self.directory = os.path.normpath(os.path.expanduser(directory))
+        self.max_age_secs = max_age_secs
+        self.logger = logger or logging.getLogger('stitch.availability')
+
+    def _path(self, urn, url):
+        key = hashlib.sha256("%s %s" % (urn, url)).hexdigest()
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, urn, url):
+        '''Return the saved availability (hop link URN -> VLANRange) at the
+        given aggregate and when it was saved (a naive UTC datetime), or
+        (None, None) if there is none or it is too old.'''
+        path = self._path(urn, url)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return (None, None)
+        age = time.time() - mtime
+        if age > self.max_age_secs:
+            return (None, None)
+        try:
+            with open(path, 'r') as f:
+                saved = json.loads(f.read())
+            avail = dict((hopURN, VLANRange.fromString(vlans))
+                         for (hopURN, vlans) in saved['avail'].items())
+        except Exception, e:
+            self.logger.debug("Failed to read saved VLAN availability %s: %s", path, e)
+            return (None, None)
+        self.logger.debug("Using VLAN availability at %s saved %d seconds ago", urn, age)
+        return (avail, datetime.datetime.utcfromtimestamp(mtime))
+
+    def put(self, urn, url, avail):
+        '''Save the given availability (hop link URN -> VLANRange) at the
+        given aggregate.'''
+        saved = dict(urn=urn, url=url,
+                     avail=dict((hopURN, str(vlans))
+                                for (hopURN, vlans) in avail.items()))
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            # Write and rename, so concurrent stitchers never read part
+            (fd, tmpname) = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                f.write(json.dumps(saved))
+            os.rename(tmpname, self._path(urn, url))
+        except Exception, e:
+            self.logger.debug("Failed to save VLAN availability at %s: %s", urn, e)
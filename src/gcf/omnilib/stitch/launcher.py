@@ -28,8 +28,9 @@ import datetime
 import logging
 import time
 
-from .utils import StitchingRetryAggregateNewVlanError, StitchingRetryAggregateNewVlanImmediatelyError, StitchingError, StitchingStoppedError
+from .utils import StitchingRetryAggregateNewVlanError, StitchingRetryAggregateNewVlanImmediatelyError, StitchingError, StitchingStoppedError, StitchingCircuitFailedError
 from .objects import Aggregate
+from .requestplan import RequestIndex
 
 class Launcher(object):
 
@@ -39,11 +40,17 @@ class Launcher(object):
         self.slicename = slicename
         self.timeoutTime = timeoutTime
         self.logger = logger or logging.getLogger('stitch.launcher')
+        # Where a StitchingCircuitFailedError came from: the AM, and its hops that
+        # got new unavailable VLAN tags (if any). See stitchhandler.planIncrementalRetry
+        self.failedAgg = None
+        self.failedHops = []
 
     def launch(self, rspec, scsCallCount):
         '''The main loop for stitching: keep looking for AMs that are not complete, then 
         make a reservation there.'''
         lastAM = None
+        # Find the parts of the request each AM edits just once, for all AMs and tries
+        requestIndex = RequestIndex(rspec.dom)
         while not self._complete():
             if datetime.datetime.utcnow() >= self.timeoutTime:
                 msg = "Reservation attempt timed out after %d minutes." % self.opts.timeout
@@ -81,8 +88,16 @@ class Launcher(object):
 
                 lastAM = agg
                 # FIXME: Need a timeout mechanism on AM calls
+                unavailCounts = dict((hop, len(hop.vlans_unavailable)) for hop in agg.hops)
                 try:
-                    agg.allocate(self.opts, self.slicename, rspec.dom, scsCallCount)
+                    startTime = time.time()
+                    agg.allocate(self.opts, self.slicename, rspec.dom, scsCallCount, requestIndex)
+                    if agg.completed:
+                        agg.reservationSecs = time.time() - startTime
+                except StitchingCircuitFailedError:
+                    self.failedAgg = agg
+                    self.failedHops = [hop for hop in agg.hops if hop.excludeFromSCS or len(hop.vlans_unavailable) > unavailCounts[hop]]
+                    raise
                 except StitchingRetryAggregateNewVlanError, se:
                     self.logger.info("Will put %s back in the pool to allocate. Got: %s", agg, se)
 
@@ -39,6 +39,8 @@ import time
 from xml.dom.minidom import parseString, Node as XMLNode
 
 from . import defs
+from .availability import extract_vlan_availability
+from .requestplan import RequestIndex, RequestEditPlan
 from .GENIObject import *
 from .VLANRange import *
 from .utils import *
@@ -131,6 +133,12 @@ class Path(GENIObject):
     def editChangesIntoDom(self, pathDomNode):
         '''Edit any changes made in this element into the given DomNode'''
         # Note the parent RSpec element's dom is not touched, unless the given node is from that document
+        plan = RequestEditPlan()
+        self.planChangesIntoDom(plan, pathDomNode, RequestIndex())
+        plan.applyInPlace()
+
+    def planChangesIntoDom(self, plan, pathDomNode, index):
+        '''Plan edits of any changes made in this element into the given DomNode'''
         # Here we just find all the Hops and let them do stuff
 
         # Incoming node should be the node for this path
@@ -138,21 +146,14 @@ class Path(GENIObject):
         if nodeId != self.id:
             raise StitchingError("Path %s given Dom node with different Id: %s" % (self, nodeId))
 
-        # For each of this path's hops, find the appropriate Dom element, and let Hop edit itself in
-        domHops = pathDomNode.getElementsByTagName(self.HOP_TAG)
+        # For each of this path's hops, find the appropriate Dom element, and let Hop plan its edits
         for hop in self.hops:
-            domHopNode = None
-            if domHops:
-                for hopNode in domHops:
-                    hopNodeId = hopNode.getAttribute(self.ID_TAG)
-                    if hopNodeId == hop._id:
-                        domHopNode = hopNode
-                        break
+            domHopNode = index.hop(pathDomNode, hop._id)
             if domHopNode is None:
                 # Couldn't find this Hop in the dom
                 # FIXME: Create it?
                 raise StitchingError("Couldn't find Hop %s in given Dom node to edit in changes" % hop)
-            hop.editChangesIntoDom(domHopNode)
+            hop.planChangesIntoDom(plan, domHopNode, index)
         # End of loop over hops
         return
 
@@ -393,7 +394,8 @@ class Aggregate(object):
         self.isDependencyFor = set() # AMs that depend on this: for ripple down deletes
         self.logger = logging.getLogger('stitch.Aggregate')
         # Note these are sort of RSpecs but not RSpec objects, to avoid a loop
-        self.requestDom = None # the DOM as constructed to submit in request to this AM
+        self._requestDom = None # the DOM as constructed to submit in request to this AM
+        self._requestPlan = None # RequestEditPlan for the request, until the DOM is needed
         self.manifestDom = None # the DOM as we got back from the AM
         self.api_version = 2 # Set from stitchhandler.parseSCSResponse
         self.dcn = False # DCN AMs require waiting for sliverstatus to say ready before the manifest is legit
@@ -425,6 +427,9 @@ class Aggregate(object):
         # Last failure message (used for logging at end of run)
         self.lastError = None
 
+        # Seconds the last successful reservation here took (set by the Launcher)
+        self.reservationSecs = None
+
         # FIXME: See stitchhandler.saveAggregateState whenever a new attribute is added here
 
         # Ugly hack
@@ -481,6 +486,18 @@ class Aggregate(object):
     def dependsOn(self):
         return list(self._dependsOn)
 
+    @property
+    def requestDom(self):
+        # Made from the planned edits when first needed
+        if self._requestDom is None and self._requestPlan is not None:
+            self._requestDom = self._requestPlan.toDom()
+        return self._requestDom
+
+    @requestDom.setter
+    def requestDom(self, dom):
+        self._requestDom = dom
+        self._requestPlan = None
+
     def add_hop(self, hop):
         self._hops.add(hop)
 #        self.logger.debug("%s now has %d hops", self, len(self._hops))
@@ -515,6 +532,13 @@ class Aggregate(object):
     def ready(self):
         return not self.completed and not self.inProcess and self.dependencies_complete
 
+    @property
+    def hasReservation(self):
+        '''Is this AM complete, with a manifest from the AM?
+        With --incrementalRetry, such an AM keeps its reservation when stitcher retries
+        from the SCS.'''
+        return self.completed and self.manifestDom is not None
+
     def supportsAny(self):
         # Does this AM (by type) support requesting 'any' VLAN tag?
         if self.isEG or self.isGRAM or self.isOESS or self.dcn:
@@ -523,9 +547,10 @@ class Aggregate(object):
             return True
         return False # FIXME: Default false or true?
 
-    def allocate(self, opts, slicename, rspecDom, scsCallCount):
+    def allocate(self, opts, slicename, rspecDom, scsCallCount, requestIndex=None):
         '''Main workhorse function. Build the request rspec for this AM,
-        and make the reservation. On error, delete and signal failure.'''
+        and make the reservation. On error, delete and signal failure.
+        requestIndex is a RequestIndex of rspecDom, shared by the AMs.'''
 
         self.logger.debug("Starting allocate on %s...", self)
 
@@ -782,8 +807,9 @@ class Aggregate(object):
         # See ticket #577
         newExpires = self.getExpiresForRequest(opts)
 
-        # Generate the new request Dom
-        self.requestDom = self.getEditedRSpecDom(rspecDom, newExpires)
+        # Plan the edits for the new request. The request Dom is only made if needed.
+        self.requestDom = None
+        self._requestPlan = self.getRequestEditPlan(rspecDom, newExpires, requestIndex)
 
         # Get the manifest for this AM
         # result is a manifest RSpec string. Errors wouuld be raised
@@ -1392,12 +1418,27 @@ class Aggregate(object):
 #            self.logger.debug("No stitching schema in this attribute value: %s='%s'", attr.name, attr.value)
             return attr, 0
 
+    def getRequestXML(self):
+        '''The request RSpec for this AM as a utf-8 XML string, written
+        from the planned edits if the request Dom has not been made'''
+        if self._requestDom is None and self._requestPlan is not None:
+            return self._requestPlan.toxml(encoding="utf-8")
+        return self.requestDom.toxml(encoding="utf-8")
+
     def getEditedRSpecDom(self, originalRSpec, newExpires=None):
         # newExpires is a datetime value for the expires attribute in the request
+        # Return a deep clone of the incoming RSpec Dom with the edits for this AM
+        return self.getRequestEditPlan(originalRSpec, newExpires).toDom()
 
-        # For each path on this AM, get that Path to write whatever it thinks necessary into a
-        # deep clone of the incoming RSpec Dom
-        requestRSpecDom = originalRSpec.cloneNode(True)
+    def getRequestEditPlan(self, originalRSpec, newExpires=None, index=None):
+        # newExpires is a datetime value for the expires attribute in the request
+        # index is a RequestIndex of originalRSpec, if there is one
+
+        # For each path on this AM, get that Path to plan whatever edits it thinks necessary
+        # to the incoming RSpec Dom. The Dom itself is not changed.
+        if index is None:
+            index = RequestIndex(originalRSpec)
+        plan = RequestEditPlan(originalRSpec)
 
         # This block no longer necessary. If stitchhandler sets the
         # expires attribute, then this is true. Otherwise, don't do
@@ -1430,27 +1471,23 @@ class Aggregate(object):
 #                                     "will expire earlier than at other aggregates - requested expiration being reset from %s to %s", expires, newExpires)
 #                    rspecs[0].setAttribute(defs.EXPIRES_ATTRIBUTE, newExpires)
 
+        rspecNode = index.rspec()
         if newExpires is not None:
             newExpires = naiveUTC(newExpires).strftime('%Y-%m-%dT%H:%M:%SZ')
-            rspecs = requestRSpecDom.getElementsByTagName(defs.RSPEC_TAG)
-            if rspecs and len(rspecs) > 0:
-                rspecs[0].setAttribute(defs.EXPIRES_ATTRIBUTE, newExpires)
+            if rspecNode is not None:
+                plan.setAttribute(rspecNode, defs.EXPIRES_ATTRIBUTE, newExpires)
 
         changing1To2 = False # FIXME: Use this later to determine how to write attributes?
         changing2To1 = False
         # Look for an rspec element and see if it has the stich schema on it
-        rspecNodes = requestRSpecDom.getElementsByTagName(defs.RSPEC_TAG)
-        if rspecNodes and len(rspecNodes) > 0:
-            rspecNode = rspecNodes[0]
-        else:
+        if rspecNode is None:
             raise StitchingError("Couldn't find rspec element in rspec for %s request" % self)
 
         # For v2/v1, right here check if this is v2 and we want v1 or vice versa
         # Loop through all attributes checking against the stitch schema
         # Also check xsi:schemaLocation
         if rspecNode.hasAttributes():
-            for i in range(rspecNode.attributes.length):
-                attr = rspecNode.attributes.item(i)
+            for attr in plan.attributes(rspecNode):
                 attr, newVer = self.changeStitchSchemaVersion(attr, 'rspec')
                 if newVer == 2:
                     changing1To2 = True
@@ -1464,11 +1501,9 @@ class Aggregate(object):
                         # No stitching schema in this attribute. Nothing to do
                         pass
 
-        stitchNodes = requestRSpecDom.getElementsByTagName(defs.STITCHING_TAG)
-        if stitchNodes and len(stitchNodes) > 0:
-            stitchNode = stitchNodes[0]
-        else:
-            return requestRSpecDom
+        stitchNode = index.stitching()
+        if stitchNode is None:
+            return plan
         # For GRE requests, there won't be one
 #            raise StitchingError("Couldn't find stitching element in rspec for %s request" % self)
 
@@ -1476,8 +1511,7 @@ class Aggregate(object):
         # schema is marked direct on this node
         # If the value says v1 and we want v2 or vice versa, then change
         if stitchNode.hasAttributes():
-            for i in range(stitchNode.attributes.length):
-                attr = stitchNode.attributes.item(i)
+            for attr in plan.attributes(stitchNode):
                 attr, newVer = self.changeStitchSchemaVersion(attr, 'stitching')
                 if newVer == 2:
                     changing1To2 = True
@@ -1491,24 +1525,14 @@ class Aggregate(object):
                         # No stitching schema in this attribute. Nothing to do
                         pass
 
-        domPaths = stitchNode.getElementsByTagName(defs.PATH_TAG)
-#        domPaths = stitchNode.getElementsByTagNameNS(rspec_schema.STITCH_SCHEMA_V1, defs.PATH_TAG)
-#        domPaths = stitchNode.getElementsByTagNameNS(rspec_schema.STITCH_SCHEMA_V2, defs.PATH_TAG)
         for path in self.paths:
             #self.logger.debug("Looking for node for path %s", path)
-            domNode = None
-            if domPaths:
-                for pathNode in domPaths:
-                    pathNodeId = pathNode.getAttribute(Path.ID_TAG)
-                    if pathNodeId == path.id:
-                        domNode = pathNode
-                        #self.logger.debug("Found node for path %s", path.id)
-                        break
+            domNode = index.path(path.id)
             if domNode is None:
                 raise StitchingError("Couldn't find Path %s in stitching element of RSpec for %s request" % (path, self))
-            #self.logger.debug("Doing path.editChanges for path %s", path.id)
-            path.editChangesIntoDom(domNode)
-        return requestRSpecDom
+            #self.logger.debug("Doing path.planChanges for path %s", path.id)
+            path.planChangesIntoDom(plan, domNode, index)
+        return plan
 
     # For a given hop, extract from the Manifest DOM a tuple (pathGlobalId, vlanRangeAvailability, suggestedVLANRange)
     def getVLANRangeSuggested(self, manifest, hop_id, path_id):
@@ -1778,7 +1802,7 @@ class Aggregate(object):
 
         # Write the request rspec to a string that we save to a file
         try:
-            requestString = self.requestDom.toxml(encoding="utf-8")
+            requestString = self.getRequestXML()
         except Exception, xe:
             self.logger.debug("Failed to XMLify requestDOM for sending to AM: %s", xe)
             self.lastError = "%s: Constructed request RSpec malformed? Failed to XMLify" % self
@@ -4156,10 +4180,9 @@ class Aggregate(object):
         # This should be cases where all hops at this AM are requesting 'any' or import from another hop at the same AM
         return False
 
-    def updateWithAvail(self, opts):
-        # Update our hops availRange based on what is currently avail
-        # Return True if updated some avail Ranges
-
+    def getAvail(self, opts):
+        '''List the resources currently available here, and return the available VLAN tags
+        of the stitching hop links: a dict of hop link URN -> VLANRange. Or None if that fails.'''
         self.logger.info("Gathering currently available VLAN tags at %s...", self)
         rspec = None
         try:
@@ -4167,70 +4190,65 @@ class Aggregate(object):
         except StitchingError, se:
             self.logger.debug("Failed to list avail resources: %s", se)
         if rspec is None:
-            return False
+            return None
         try:
-            from xml.dom.minidom import parseString
-            dom = parseString(rspec)
+            return extract_vlan_availability(rspec)
         except Exception, e:
             self.logger.debug("Failed to parse rspec: %s", e)
+            return None
+
+    def updateWithAvail(self, opts, avail=None, takenAt=None):
+        # Update our hops availRange based on what is currently avail
+        # avail is the result of getAvail, if we already have it, and
+        # takenAt when that was (maybe by an earlier stitcher run)
+        # Return True if updated some avail Ranges
+
+        if avail is None:
+            avail = self.getAvail(opts)
+            takenAt = None
+        if avail is None:
             return False
-        self.lastAvailCheck = datetime.datetime.utcnow()
-        ports = dom.getElementsByTagName(defs.PORT_TAG)
-        if not ports or len(ports) == 0:
+        if takenAt is None:
+            takenAt = datetime.datetime.utcnow()
+        # So doAvail checks again once this snapshot is old, not once
+        # CHECK_AVAIL_INTERVAL_MINS have passed since we read it
+        self.lastAvailCheck = takenAt
+        if len(avail) == 0:
             self.logger.debug("No stitching ports found")
             return False
-        hops = []
         failToSCS = False
         didUpdates = False
-        for port in ports:
-            for child in port.childNodes:
-                if child.localName == defs.LINK_TAG:
-                    hLink = HopLink.fromDOM(child)
-                    hops.append(hLink)
-                    foundHop = False
-                    for myHop in self._hops:
-                        if myHop._hop_link.urn == hLink.urn:
-                            foundHop = True
-                            self.logger.debug("Found current available tags for %s", myHop)
-                            newAvail = hLink.vlan_range_request
-                            oldAvail = myHop._hop_link.vlan_range_request
-                            if newAvail == oldAvail:
-                                self.logger.debug("Availability is unchanged")
-                                continue
-
-                            revisedAvail = newAvail.intersection(oldAvail)
-                            if len(revisedAvail) > 0:
-                                self.logger.debug("Revised available range: '%s' from intersection of old '%s' and new '%s'", revisedAvail, oldAvail, newAvail)
-                                if revisedAvail != oldAvail:
-                                    myHop._hop_link.vlan_range_request = revisedAvail
-                                    didUpdates = True
-#                                else:
-#                                    self.logger.debug("No change: All calculated request range tags still available: %s", revisedAvail)
-                            else:
-                                self.logger.debug("New available range is disjoint from old! Intersection is empty! New: %s; Old: %s", newAvail, oldAvail)
-                                # Back to the SCS
-                                failToSCS = True
-
-                            markUnavail = oldAvail - newAvail
-                            if len(markUnavail) > 0:
-                                # Each of these tags is locally unavailable. Add them to the unavail list
-                                self.logger.debug("Noting unavailable tags: '%s'", markUnavail)
-                                myHop.vlans_unavailable = myHop.vlans_unavailable.union(markUnavail)
-                            else:
-                                self.logger.debug("All calculated available tags still available: %s", revisedAvail)
-                            # Cannot break here; If same hop is used by 2 paths, we need to update the range for both
-                        # End of block to check if this hop is the one from the Ad
-                    # End of loop over hops on this AM
-                    if not foundHop:
-                        self.logger.debug("Ignoring avail for unused hop %s", hLink.urn)
         for myHop in self._hops:
-            foundHop = False
-            for hopLink in hops:
-                if myHop._hop_link.urn == hopLink.urn:
-                    foundHop = True
-                    break
-            if not foundHop:
+            if not avail.has_key(myHop._hop_link.urn):
                 self.logger.debug("Failed to find updated availability in RSpec for Hop %s", myHop._hop_link.urn)
+                continue
+            # Note that if the same hop is used by 2 paths, we update the range for both
+            self.logger.debug("Found current available tags for %s", myHop)
+            newAvail = avail[myHop._hop_link.urn]
+            oldAvail = myHop._hop_link.vlan_range_request
+            if newAvail == oldAvail:
+                self.logger.debug("Availability is unchanged")
+                continue
+
+            revisedAvail = newAvail.intersection(oldAvail)
+            if len(revisedAvail) > 0:
+                self.logger.debug("Revised available range: '%s' from intersection of old '%s' and new '%s'", revisedAvail, oldAvail, newAvail)
+                if revisedAvail != oldAvail:
+                    myHop._hop_link.vlan_range_request = revisedAvail
+                    didUpdates = True
+            else:
+                self.logger.debug("New available range is disjoint from old! Intersection is empty! New: %s; Old: %s", newAvail, oldAvail)
+                # Back to the SCS
+                failToSCS = True
+
+            markUnavail = oldAvail - newAvail
+            if len(markUnavail) > 0:
+                # Each of these tags is locally unavailable. Add them to the unavail list
+                self.logger.debug("Noting unavailable tags: '%s'", markUnavail)
+                myHop.vlans_unavailable = myHop.vlans_unavailable.union(markUnavail)
+            else:
+                self.logger.debug("All calculated available tags still available: %s", revisedAvail)
+        # End of loop over hops on this AM
         if failToSCS:
             self.inProcess = False
             raise StitchingCircuitFailedError("1+ Hops have 0 available tags currently at %s" % self)
@@ -4515,6 +4533,12 @@ class Hop(object):
     def editChangesIntoDom(self, domHopNode):
         '''Edit any changes made in this element into the given DomNode'''
         # Note the parent RSpec object's dom is not touched, unless the given node is from that document
+        plan = RequestEditPlan()
+        self.planChangesIntoDom(plan, domHopNode, RequestIndex())
+        plan.applyInPlace()
+
+    def planChangesIntoDom(self, plan, domHopNode, index):
+        '''Plan edits of any changes made in this element into the given DomNode'''
         # Here we just like the HopLink do its thing
 
         # Incoming node should be the node for this hop
@@ -4524,12 +4548,11 @@ class Hop(object):
 
         # Mark hop explicitly loose if necessary
         if self.loose:
-            domHopNode.setAttribute(self.TYPE_TAG, 'loose')
+            plan.setAttribute(domHopNode, self.TYPE_TAG, 'loose')
 
-        for child in domHopNode.childNodes:
-            if child.localName == self.LINK_TAG:
-#                self.logger.debug("%s editChanges calling _hop_link with node %r", self, child)
-                self._hop_link.editChangesIntoDom(child)
+        for child in index.children(domHopNode, self.LINK_TAG):
+#            self.logger.debug("%s planChanges calling _hop_link with node %r", self, child)
+            self._hop_link.planChangesIntoDom(plan, child, index)
 
 class RSpec(GENIObject):
     '''RSpec'''
@@ -4934,7 +4957,13 @@ class HopLink(object):
     def editChangesIntoDom(self, domNode, request=True, really=False):
         '''Edit any changes made in this element into the given DomNode'''
         # Note that the parent RSpec object's dom is not touched, unless this domNode is from that
-        # Here we edit in the new vlan_range and vlan_available
+        plan = RequestEditPlan()
+        self.planChangesIntoDom(plan, domNode, RequestIndex(), request, really)
+        plan.applyInPlace()
+
+    def planChangesIntoDom(self, plan, domNode, index, request=True, really=False):
+        '''Plan edits of any changes made in this element into the given DomNode'''
+        # Here we plan edits for the new vlan_range and vlan_available
         # If request is False, use the manifest values. Otherwise, use requested.
         # If really is false (default), then if the given domNode (a hop link) doesn't have teh same ID as this object,
         # then raise an error. If really is True
@@ -4958,12 +4987,12 @@ class HopLink(object):
         # FIXME: We assume here there is no more than 1 switchingCapabilitySpecificInfo node on a hop
         capSpecInfol2Node = None
         # Find the switchingCapabilitySpecificInfo_L2sc node and append it there
-        l2scNodes = domNode.getElementsByTagName(HopLink.SCSI_L2_TAG)
+        l2scNodes = index.descendants(domNode, HopLink.SCSI_L2_TAG)
         if l2scNodes and len(l2scNodes) > 0:
             if len(l2scNodes) > 1:
                 self.logger.debug("Got >1 l2sc nodes? Using first")
             capSpecInfol2Node = l2scNodes[0]
-        l2ofNodes = domNode.getElementsByTagName(HopLink.SCSI_OFL2_TAG)
+        l2ofNodes = index.descendants(domNode, HopLink.SCSI_OFL2_TAG)
         if l2ofNodes and len(l2ofNodes) > 0:
             if capSpecInfol2Node != None:
                 self.logger.debug("Already found an l2sc node. Ignoring %d ofl2sc nodes.", len(l2ofNodes))
@@ -4972,33 +5001,29 @@ class HopLink(object):
                     self.logger.debug("Got >1 ofl2sc nodes? Using first")
                 capSpecInfol2Node = l2ofNodes[0]
 
-        vlan_range = domNode.getElementsByTagName(self.VLAN_RANGE_TAG)
+        vlan_range = index.descendants(domNode, self.VLAN_RANGE_TAG)
         if vlan_range and len(vlan_range) > 0:
             # vlan_range may have no child or no nodeValue. Meaning would then be 'any'
             if vlan_range[0].firstChild:
                 # Set the value
-                vlan_range[0].firstChild.nodeValue = newVlanRangeString
-#                self.logger.debug("Set vlan range on node %r: %s", vlan_range[0], vlan_range[0].firstChild.nodeValue)
+                plan.setValue(vlan_range[0].firstChild, newVlanRangeString)
+#                self.logger.debug("Set vlan range on node %r: %s", vlan_range[0], newVlanRangeString)
             else:
-                vlan_range[0].appendChild(domNode.ownerDocument.createTextNode(newVlanRangeString))
+                plan.appendText(vlan_range[0], newVlanRangeString)
         else:
-            vlanRangeNode = domNode.ownerDocument.createElement(self.VLAN_RANGE_TAG)
-            vlanRangeNode.appendChild(domNode.ownerDocument.createTextNode(newVlanRangeString))
             if capSpecInfol2Node != None:
-                capSpecInfol2Node.appendChild(vlanRangeNode)
+                plan.appendElement(capSpecInfol2Node, self.VLAN_RANGE_TAG, newVlanRangeString)
 
-        vlan_suggested = domNode.getElementsByTagName(self.VLAN_SUGGESTED_TAG)
+        vlan_suggested = index.descendants(domNode, self.VLAN_SUGGESTED_TAG)
         if vlan_suggested and len(vlan_suggested) > 0:
             # vlan_suggested may have no child or no nodeValue. Meaning would then be 'any'
             if vlan_suggested[0].firstChild:
                 # Set the value
-                vlan_suggested[0].firstChild.nodeValue = newVlanSuggestedString
-#                self.logger.debug("Set vlan suggested on node %r: %s", vlan_suggested[0], vlan_suggested[0].firstChild.nodeValue)
+                plan.setValue(vlan_suggested[0].firstChild, newVlanSuggestedString)
+#                self.logger.debug("Set vlan suggested on node %r: %s", vlan_suggested[0], newVlanSuggestedString)
             else:
-                vlan_suggested[0].appendChild(domNode.ownerDocument.createTextNode(newVlanSuggestedString))
+                plan.appendText(vlan_suggested[0], newVlanSuggestedString)
         else:
-            vlanSuggestedNode = domNode.ownerDocument.createElement(self.VLAN_RANGE_TAG)
-            vlanSuggestedNode.appendChild(domNode.ownerDocument.createTextNode(newVlanSuggestedString))
             if capSpecInfol2Node != None:
-                capSpecInfol2Node.appendChild(vlanSuggestedNode)
+                plan.appendElement(capSpecInfol2Node, self.VLAN_RANGE_TAG, newVlanSuggestedString)
 
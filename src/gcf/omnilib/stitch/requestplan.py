@@ -0,0 +1,269 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+'''Edits of the request RSpec for each aggregate, planned without copying it.
+
+The request to each aggregate is the expanded request from the SCS, with
+the aggregate's own stitching hops edited (requested VLAN tags, loose
+hops, stitching schema version, expiration). Rather than deep copying
+the whole request DOM for each aggregate on each try and searching the
+copy for the elements to edit:
+
+ - RequestIndex finds the elements stitcher edits (the rspec and
+   stitching elements, paths by id, hops by path and id, hop links and
+   their VLAN elements) once, remembering what it found.
+ - RequestEditPlan records the edits for one aggregate against the
+   nodes of the (unchanged) request DOM. The plan can write the edited
+   request straight to XML, make an edited copy of the DOM, or make the
+   edits in place.'''
+
+from __future__ import absolute_import
+
+import codecs
+import StringIO
+
+from xml.dom import Node
+
+from . import defs
+
+def _write_data(writer, data):
+    # Escape character data as minidom does
+    if data:
+        data = data.replace("&", "&amp;").replace("<", "&lt;"). \
+            replace("\"", "&quot;").replace(">", "&gt;")
+        writer.write(data)
+
+class RequestIndex(object):
+    '''The elements of a request RSpec DOM that stitcher edits, found on
+    first use and remembered. The DOM must not be changed while this is in
+    use. With no DOM, only the lookups under a given node work.'''
+
+    def __init__(self, dom=None):
+        self.dom = dom
+        self._found = dict()
+
+    def _memo(self, key, find):
+        try:
+            return self._found[key]
+        except KeyError:
+            found = self._found[key] = find()
+            return found
+
+    def _first(self, tagName):
+        if self.dom is None:
+            return None
+        nodes = self.dom.getElementsByTagName(tagName)
+        if nodes and len(nodes) > 0:
+            return nodes[0]
+        return None
+
+    def rspec(self):
+        '''The first rspec element, or None'''
+        return self._memo('rspec', lambda: self._first(defs.RSPEC_TAG))
+
+    def stitching(self):
+        '''The first stitching element, or None'''
+        return self._memo('stitching', lambda: self._first(defs.STITCHING_TAG))
+
+    def path(self, pathId):
+        '''The first path element in the stitching element with the given id, or None'''
+        def findPaths():
+            paths = dict()
+            stitchNode = self.stitching()
+            if stitchNode is not None:
+                for pathNode in stitchNode.getElementsByTagName(defs.PATH_TAG):
+                    paths.setdefault(pathNode.getAttribute('id'), pathNode)
+            return paths
+        return self._memo('paths', findPaths).get(pathId)
+
+    def hop(self, pathNode, hopId):
+        '''The first hop element under the given path element with the given id, or None'''
+        def findHops():
+            hops = dict()
+            for hopNode in pathNode.getElementsByTagName('hop'):
+                hops.setdefault(hopNode.getAttribute('id'), hopNode)
+            return hops
+        return self._memo(('hops', pathNode), findHops).get(hopId)
+
+    def children(self, node, localName):
+        '''The child elements of the given node with the given local name'''
+        return self._memo(('children', node, localName),
+                          lambda: [child for child in node.childNodes
+                                   if child.localName == localName])
+
+    def descendants(self, node, tagName):
+        '''The elements under the given node with the given tag name, as getElementsByTagName'''
+        return self._memo(('descendants', node, tagName),
+                          lambda: list(node.getElementsByTagName(tagName)))
+
+class PlannedAttribute(object):
+    '''An attribute of an element in a RequestEditPlan. Setting the value
+    plans the edit.'''
+
+    def __init__(self, plan, element, name):
+        self.plan = plan
+        self.element = element
+        self.name = name
+
+    @property
+    def value(self):
+        return self.plan.getAttribute(self.element, self.name)
+
+    @value.setter
+    def value(self, value):
+        self.plan.setAttribute(self.element, self.name, value)
+
+class RequestEditPlan(object):
+    '''Edits to make to a request RSpec DOM, recorded against its nodes,
+    which are not changed until applyInPlace.'''
+
+    def __init__(self, dom=None):
+        self.dom = dom
+        self._attributes = dict() # element => {name: new value}
+        self._values = dict() # character data node => new value
+        self._appends = dict() # element => [(tagName or None for text, text)]
+
+    def getAttribute(self, element, name):
+        '''The value of the named attribute of the given element, with any planned edit'''
+        attributes = self._attributes.get(element)
+        if attributes and name in attributes:
+            return attributes[name]
+        return element.getAttribute(name)
+
+    def attributes(self, element):
+        '''The attributes of the given element, as PlannedAttributes'''
+        return [PlannedAttribute(self, element, name)
+                for name in element.attributes.keys()]
+
+    def setAttribute(self, element, name, value):
+        self._attributes.setdefault(element, dict())[name] = value
+
+    def setValue(self, node, value):
+        '''Like setting node.nodeValue: changes text, CDATA or comment nodes'''
+        if node.nodeType in (Node.TEXT_NODE, Node.CDATA_SECTION_NODE,
+                             Node.COMMENT_NODE):
+            self._values[node] = value
+
+    def appendText(self, element, text):
+        self._appends.setdefault(element, []).append((None, text))
+
+    def appendElement(self, element, tagName, text):
+        '''Append a new element with the given text to the given element'''
+        self._appends.setdefault(element, []).append((tagName, text))
+
+    def _edited(self):
+        return set(self._attributes.keys() + self._values.keys() +
+                   self._appends.keys())
+
+    def _applyTo(self, target):
+        # Make the edits, on the node target(node) for each edited node
+        for (element, attributes) in self._attributes.items():
+            targetElement = target(element)
+            for (name, value) in attributes.items():
+                targetElement.setAttribute(name, value)
+        for (node, value) in self._values.items():
+            target(node).nodeValue = value
+        for (element, appends) in self._appends.items():
+            targetElement = target(element)
+            doc = targetElement.ownerDocument
+            for (tagName, text) in appends:
+                textNode = doc.createTextNode(text)
+                if tagName is None:
+                    targetElement.appendChild(textNode)
+                else:
+                    newElement = doc.createElement(tagName)
+                    newElement.appendChild(textNode)
+                    targetElement.appendChild(newElement)
+
+    def applyInPlace(self):
+        '''Make the edits to the nodes they were planned on'''
+        self._applyTo(lambda node: node)
+
+    def toDom(self):
+        '''A copy of the DOM with the edits made'''
+        dom = self.dom.cloneNode(True)
+        def target(node):
+            # Follow the child indices of node in the DOM down the copy
+            indices = []
+            while node is not self.dom:
+                parent = node.parentNode
+                indices.append(parent.childNodes.index(node))
+                node = parent
+            copy = dom
+            for index in reversed(indices):
+                copy = copy.childNodes[index]
+            return copy
+        self._applyTo(target)
+        return dom
+
+    def toxml(self, encoding=None):
+        '''The edited DOM as XML, as toDom().toxml(encoding) but without
+        copying the DOM'''
+        # Nodes with edits in them: the edited nodes and their ancestors
+        touched = set()
+        for node in self._edited():
+            while node is not None and node not in touched:
+                touched.add(node)
+                node = node.parentNode
+        writer = StringIO.StringIO()
+        if encoding is not None:
+            writer = codecs.lookup(encoding)[3](writer)
+            writer.write('<?xml version="1.0" encoding="%s"?>' % encoding)
+        else:
+            writer.write('<?xml version="1.0" ?>')
+        for node in self.dom.childNodes:
+            self._write(writer, node, touched)
+        return writer.getvalue()
+
+    def _write(self, writer, node, touched):
+        if node not in touched:
+            node.writexml(writer, "", "", "")
+            return
+        if node in self._values:
+            copy = node.cloneNode(False)
+            copy.nodeValue = self._values[node]
+            copy.writexml(writer, "", "", "")
+            return
+        # An element with edits in it. As Element.writexml
+        attributes = dict(node.attributes.items())
+        attributes.update(self._attributes.get(node, dict()))
+        writer.write("<" + node.tagName)
+        for name in sorted(attributes.keys()):
+            writer.write(" %s=\"" % name)
+            _write_data(writer, attributes[name])
+            writer.write("\"")
+        appends = self._appends.get(node, [])
+        if not node.childNodes and not appends:
+            writer.write("/>")
+            return
+        writer.write(">")
+        for child in node.childNodes:
+            self._write(writer, child, touched)
+        doc = node.ownerDocument
+        for (tagName, text) in appends:
+            if tagName is None:
+                doc.createTextNode(text).writexml(writer, "", "", "")
+            else:
+                newElement = doc.createElement(tagName)
+                newElement.appendChild(doc.createTextNode(text))
+                newElement.writexml(writer, "", "", "")
+        writer.write("</%s>" % node.tagName)
@@ -26,23 +26,29 @@
 
 from __future__ import absolute_import
 
+import hashlib
 import json
+import logging
+import os
 import os.path
 import pprint
 import sys
+import tempfile
+import time
 import urllib
+import xml.dom.minidom as md
 import xmlrpclib
 
 try:
     from .utils import StitchingError, StitchingServiceFailedError
     from ..xmlrpc.client import make_client
 
-    from ..util.json_encoding import DateTimeAwareJSONDecoder
+    from ..util.json_encoding import DateTimeAwareJSONDecoder, DateTimeAwareJSONEncoder
 except:
     from gcf.omnilib.stitch.utils import StitchingError, StitchingServiceFailedError
     from gcf.omnilib.xmlrpc.client import make_client
 
-    from gcf.omnilib.util.json_encoding import DateTimeAwareJSONDecoder
+    from gcf.omnilib.util.json_encoding import DateTimeAwareJSONDecoder, DateTimeAwareJSONEncoder
 
 # Tags used in the options to the SCS
 HOP_EXCLUSION_TAG = 'hop_exclusion_list'
@@ -51,6 +57,120 @@ GENI_PROFILE_TAG = 'geni_routing_profile'
 GENI_PATHS_MERGED_TAG = 'geni_workflow_paths_merged'
 ATTEMPT_PATH_FINDING_TAG = 'attempt_path_finding'
 
+# Defaults for the cache of ComputePath results
+DEFAULT_CACHE_DIR = '~/.gcf/scs-cache'
+DEFAULT_CACHE_AGE_HOURS = 24
+
+# Attributes of the request RSpec element that do not change the SCS result
+IGNORED_RSPEC_ATTRIBUTES = ('generated', 'generated_by')
+
+def canonicalize_rspec(rspec):
+    '''Return the given request RSpec in a canonical form, so that
+    requests that differ only in whitespace, comments, attribute order or
+    the generated timestamps are the same.'''
+    dom = md.parseString(rspec)
+    root = dom.documentElement
+    for attr in IGNORED_RSPEC_ATTRIBUTES:
+        if root.hasAttribute(attr):
+            root.removeAttribute(attr)
+    _strip_node(root)
+    # minidom writes attributes sorted by name
+    return root.toxml(encoding='utf-8')
+
+def _strip_node(node):
+    for child in list(node.childNodes):
+        if child.nodeType == child.COMMENT_NODE:
+            node.removeChild(child)
+        elif child.nodeType == child.TEXT_NODE:
+            if child.data.strip() == "":
+                node.removeChild(child)
+            else:
+                child.data = child.data.strip()
+        elif child.nodeType == child.ELEMENT_NODE:
+            _strip_node(child)
+
+def _canonicalize_options(options):
+    # Lists of hop names (as in hop exclusion lists) are unordered
+    if isinstance(options, dict):
+        return dict((k, _canonicalize_options(v)) for (k, v) in options.items())
+    if isinstance(options, (list, tuple)):
+        items = [_canonicalize_options(v) for v in options]
+        if all(isinstance(v, basestring) for v in items):
+            items.sort()
+        return items
+    return options
+
+class ComputePathCache(object):
+    '''Successful ComputePath results, saved as one JSON file per request
+    in a directory. Results are keyed by the canonicalized request RSpec,
+    the request options and the SCS version, and are used for up to
+    max_age_secs.'''
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR,
+                 max_age_secs=DEFAULT_CACHE_AGE_HOURS * 3600, logger=None):
+        self.directory = os.path.normpath(os.path.expanduser(directory))
+        self.max_age_secs = max_age_secs
+        self.logger = logger or logging.getLogger('stitch.scs')
+
+    def key(self, request_rspec, options, scs_version):
+        '''Return the cache key for the given request, or None if the
+        request cannot be canonicalized.'''
+        try:
+            rspec = canonicalize_rspec(request_rspec)
+        except Exception, e:
+            self.logger.debug("Not caching SCS result: failed to parse request RSpec: %s", e)
+            return None
+        data = json.dumps(dict(rspec=rspec,
+                               options=_canonicalize_options(options),
+                               scs_version=scs_version),
+                          sort_keys=True, cls=DateTimeAwareJSONEncoder)
+        return hashlib.sha256(data).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, key):
+        '''Return the saved result for the given key, or None if there is
+        none or it is too old.'''
+        path = self._path(key)
+        try:
+            age = time.time() - os.path.getmtime(path)
+        except OSError:
+            return None
+        if age > self.max_age_secs:
+            self.logger.debug("Saved SCS result %s is too old (%d seconds)", path, age)
+            self.remove(key)
+            return None
+        try:
+            with open(path, 'r') as f:
+                result = json.loads(f.read(), encoding='ascii', cls=DateTimeAwareJSONDecoder)
+        except Exception, e:
+            self.logger.debug("Failed to read saved SCS result %s: %s", path, e)
+            self.remove(key)
+            return None
+        self.logger.info("Using SCS result saved %d minutes ago", age / 60)
+        self.logger.debug("Saved SCS result is in %s", path)
+        return result
+
+    def put(self, key, result):
+        '''Save the given result for the given key.'''
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            # Write and rename, so concurrent stitchers never read part
+            (fd, tmpname) = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                f.write(json.dumps(result, encoding='ascii', cls=DateTimeAwareJSONEncoder))
+            os.rename(tmpname, self._path(key))
+        except Exception, e:
+            self.logger.debug("Failed to save SCS result: %s", e)
+
+    def remove(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
 class Result(object):
     '''Hold and parse the raw result from the SCS'''
     CODE = 'code'
@@ -78,10 +198,16 @@ class Result(object):
         return ret
 
 class Service(object):
-    def __init__(self, url, key=None, cert=None, timeout=None, verbose=False):
+    def __init__(self, url, key=None, cert=None, timeout=None, verbose=False, cache=None):
         self.url = url
         self.timeout=timeout
         self.verbose=verbose
+        # ComputePathCache to use, if any
+        self.cache = cache
+        self.cacheKey = None
+        self.resultFromCache = False
+        self._versionTag = None
+        self.logger = logging.getLogger('stitch.scs')
         if isinstance(url, unicode):
             url2 = url.encode('ISO-8859-1')
         else:
@@ -132,11 +258,36 @@ class Service(object):
             print pp.pformat(result)
         return result
 
-    def ComputePath(self, slice_urn, request_rspec, options, savedFile=None):
+    def versionTag(self):
+        '''A digest of the SCS GetVersion result, or None if that failed.'''
+        if self._versionTag is None:
+            try:
+                version = self.GetVersion(printResult=False)
+            except Exception, e:
+                self.logger.debug("SCS GetVersion failed: %s", e)
+                return None
+            if isinstance(version, dict) and version.has_key('value'):
+                version = version['value']
+            self._versionTag = hashlib.sha256(json.dumps(version, sort_keys=True, default=str)).hexdigest()
+        return self._versionTag
+
+    def discardCachedResult(self):
+        '''Forget the saved result used for the last ComputePath, if any
+        (because the reservation using it failed).'''
+        if self.cache and self.resultFromCache and self.cacheKey:
+            self.logger.debug("Discarding saved SCS result that did not work")
+            self.cache.remove(self.cacheKey)
+        self.resultFromCache = False
+
+    def ComputePath(self, slice_urn, request_rspec, options, savedFile=None, useCache=True):
         """Invoke the XML-RPC service with the request rspec.
         Create an SCS PathInfo from the result.
+        If there is a cache, use a saved result for the same request
+        (unless useCache is False), and save successful results.
         """
         result = None
+        self.cacheKey = None
+        self.resultFromCache = False
         if savedFile and os.path.exists(savedFile) and os.path.getsize(savedFile) > 0:
             # read it in
             try:
@@ -148,6 +299,13 @@ class Service(object):
                 import traceback
                 print "ERROR", e, traceback.format_exc()
                 raise
+        if result is None and self.cache:
+            versionTag = self.versionTag()
+            if versionTag:
+                self.cacheKey = self.cache.key(request_rspec, options, versionTag)
+            if self.cacheKey and useCache:
+                result = self.cache.get(self.cacheKey)
+                self.resultFromCache = result is not None
         if result is None:
             server = make_client(self.url, keyfile=self.key, certfile=self.cert, verbose=self.verbose, timeout=self.timeout)
             arg = dict(slice_urn=slice_urn, request_rspec=request_rspec,
@@ -156,11 +314,16 @@ class Service(object):
 #        print "Calling SCS with arg: %s" % (json.dumps(arg,
 #                                                       ensure_ascii=True,
 #                                                       indent=2))
+            start = time.time()
             try:
                 result = server.ComputePath(arg)
             except xmlrpclib.Error as v:
                 print "ERROR", v
                 raise
+            finally:
+                self.logger.info("SCS ComputePath took %.1f seconds", time.time() - start)
+            if self.cacheKey and Result(result).isSuccess():
+                self.cache.put(self.cacheKey, result)
 
         self.result = result # save the raw result for stitchhandler to print
         geni_result = Result(result) # parse result
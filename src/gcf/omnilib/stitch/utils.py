@@ -24,6 +24,7 @@
 from __future__ import absolute_import
 
 from ..util import OmniError
+from ..util.parallel import callInParallel
 from . import defs
 
 import os.path
@@ -33,6 +33,7 @@ import logging
 import os
 import string
 import sys
+import threading
 import time
 
 from .. import oscript as omni
@@ -48,12 +49,13 @@ from .stitch.ManifestRSpecCombiner import combineManifestRSpecs
 from .stitch.objects import Aggregate, Link, Node, LinkProperty
 from .stitch.RSpecParser import RSpecParser
 from .stitch import scs
+from .stitch.availability import AvailabilityCache
 from .stitch.workflow import WorkflowParser
-from .stitch.utils import StitchingError, StitchingCircuitFailedError, stripBlankLines, isRSpecStitchingSchemaV2, prependFilePrefix, StitchingStoppedError
+from .stitch.utils import StitchingError, StitchingCircuitFailedError, stripBlankLines, isRSpecStitchingSchemaV2, prependFilePrefix, StitchingStoppedError, callInParallel
 from .stitch.VLANRange import *
 
 from ..geni.util import rspec_schema
-from ..geni.util.rspec_util import is_rspec_string, is_rspec_of_type, rspeclint_exists, validate_rspec
+from ..geni.util.rspec_util import is_rspec_string, is_rspec_of_type, can_validate_rspec, validate_rspec
 from ..geni.util.urn_util import URN, urn_to_string_format
 
 from ..sfa.trust import gid
@@ -123,6 +125,18 @@ class StitchingHandler(object):
         # Remember we got the extra info for this AM
         self.amURNsAddedInfo = []
 
+        # GetVersion results not yet used by add_am_info: AM URL -> ((text, version), exc_info)
+        self.getVersionResults = dict()
+        self.amInfoPrefetchThread = None # Fetches AM info while we call the SCS
+        self.amURLsByURN = None # Index of the aggregate nicknames by AM URN
+
+        # Current VLAN availability this run: AM URL -> (datetime fetched, hop link URN -> VLANRange)
+        self.availSnapshots = dict()
+        # Current VLAN availability saved by recent stitcher runs
+        self.availCache = None
+        if self.opts.availCacheAge > 0 and not self.opts.fakeModeDir:
+            self.availCache = AvailabilityCache(self.opts.availCacheDir, self.opts.availCacheAge, self.logger)
+
         if self.opts.timeout == 0:
             self.config['timeoutTime'] = datetime.datetime.max
             self.logger.debug("Requested no timeout for stitcher.")
@@ -336,7 +350,12 @@ class StitchingHandler(object):
         if self.isStitching and not self.opts.noSCS:
             if not "geni-scs.net.internet2.edu:8443" in self.opts.scsURL:
                 self.logger.info("Using SCS at %s", self.opts.scsURL)
-            self.scsService = scs.Service(self.opts.scsURL, key=self.framework.key, cert=self.framework.cert, timeout=self.opts.ssltimeout, verbose=self.opts.verbosessl)
+            scsCache = None
+            if self.opts.useSCSCache and not self.opts.savedSCSResults:
+                scsCache = scs.ComputePathCache(self.opts.SCSCacheDir,
+                                                self.opts.SCSCacheAge * 3600,
+                                                self.logger)
+            self.scsService = scs.Service(self.opts.scsURL, key=self.framework.key, cert=self.framework.cert, timeout=self.opts.ssltimeout, verbose=self.opts.verbosessl, cache=scsCache)
         self.scsCalls = 0
         if self.isStitching and self.opts.noSCS:
             self.logger.info("Not calling SCS on stitched topology per commandline option.")
@@ -1301,6 +1320,9 @@ class StitchingHandler(object):
                 else:
                     self.logger.info("Calling SCS for the %d%s time...", self.scsCalls, thStr)
 
+            if self.scsCalls == 1:
+                # While the SCS computes paths, get GetVersion from the AMs we already know of
+                self.startAMInfoPrefetch()
             scsResponse = self.callSCS(sliceurn, requestDOM, existingAggs)
         self.lastException = None # Clear any last exception from the last run through
 
@@ -1309,17 +1331,9 @@ class StitchingHandler(object):
             # We are doing another call.
             # Let AMs recover. Is this long enough?
             # If one of the AMs is a DCN AM, use that sleep time instead - longer
-            sTime = Aggregate.PAUSE_FOR_V3_AM_TO_FREE_RESOURCES_SECS
+            # AMs where we kept the reservation (--incrementalRetry) have nothing to free
+            sTime = self.getPauseToFreeResources([agg for agg in existingAggs if not agg.hasReservation])
             for agg in existingAggs:
-                if agg.dcn and agg.triedRes:
-                    # Only need to sleep this much longer time
-                    # if this is a DCN AM that we tried a reservation on (whether it worked or failed)
-                    if sTime < Aggregate.PAUSE_FOR_DCN_AM_TO_FREE_RESOURCES_SECS:
-                        self.logger.debug("Must sleep longer cause had a previous reservation attempt at a DCN AM: %s", agg)
-                    sTime = Aggregate.PAUSE_FOR_DCN_AM_TO_FREE_RESOURCES_SECS
-                elif agg.api_version == 2 and agg.triedRes and sTime < Aggregate.PAUSE_FOR_AM_TO_FREE_RESOURCES_SECS:
-                    self.logger.debug("Must sleep longer cause had a previous v2 reservation attempt at %s", agg)
-                    sTime = Aggregate.PAUSE_FOR_AM_TO_FREE_RESOURCES_SECS
                 # Reset whether we've tried this AM this time through
                 agg.triedRes = False
 
@@ -1382,7 +1396,9 @@ class StitchingHandler(object):
         # Save off existing Aggregate object state
         parsedURNExistingAggs = [] # Existing aggs that came from a parsed URN, not in workflow
         self.parsedURNNewAggs = [] # New aggs created not from workflow
+        keptAggs = [] # Existing aggs whose reservation we kept (--incrementalRetry)
         if existingAggs:
+            keptAggs = [agg for agg in existingAggs if agg.hasReservation]
             # Copy existingAggs.hops.vlans_unavailable to workflow_parser.aggs.hops.vlans_unavailable? Other state?
             self.saveAggregateState(existingAggs, workflow_parser.aggs)
 
@@ -1454,6 +1470,32 @@ class StitchingHandler(object):
         parsedURNExistingAggs = []
         self.parsedURNNewAggs = []
 
+        # A reservation we kept at an AM no longer in the topology must go
+        for oldAgg in keptAggs:
+            found = False
+            for agg in self.ams_to_process:
+                if agg.urn == oldAgg.urn or agg.urn in oldAgg.urn_syns or oldAgg.urn in agg.urn_syns:
+                    found = True
+                    break
+            if not found:
+                self.logger.info("New SCS path does not use %s. Releasing its reservation after all.", oldAgg)
+                self.releaseKeptReservation(oldAgg)
+        # A kept reservation that depends on an AM we must reserve again got its VLAN tags from it: it must go too
+        if keptAggs:
+            mustCheck = True
+            while mustCheck:
+                mustCheck = False
+                for agg in self.ams_to_process:
+                    if not agg.hasReservation:
+                        continue
+                    for dep in agg.dependsOn:
+                        if not dep.hasReservation:
+                            self.logger.info("%s depends on %s, which must be reserved again. Releasing its reservation after all.", agg, dep)
+                            self.releaseKeptReservation(agg)
+                            mustCheck = True
+                            break
+        keptAggs = []
+
         # Add extra info about the aggregates to the AM objects
         self.add_am_info(self.ams_to_process)
 
@@ -1543,8 +1585,17 @@ class StitchingHandler(object):
                     raise StitchingError("Stitching reservation failed %d times. Last error: %s" % (self.scsCalls, se))
                 self.logger.warn("Stitching failed but will retry: %s", se)
                 success = False
+                delLauncher = launcher
+                if self.opts.incrementalRetry:
+                    releaseAggs = self.planIncrementalRetry(launcher)
+                    if releaseAggs is not None:
+                        # Delete only these reservations
+                        class DumbLauncher():
+                            def __init__(self, agglist):
+                                self.aggs = agglist
+                        delLauncher = DumbLauncher(releaseAggs)
                 try:
-                    (delRetText, delRetStruct) = self.deleteAllReservations(launcher)
+                    (delRetText, delRetStruct) = self.deleteAllReservations(delLauncher)
                     hadFail = False
                     for url in delRetStruct.keys():
                         if not delRetStruct[url]:
@@ -1587,7 +1638,16 @@ class StitchingHandler(object):
             # FIXME: aggs.hops have loose tag: mark the hops in the request as explicitly loose
             # FIXME: Here we pass in the request to give to the SCS. I'd like this
             # to be modified (different VLAN range? Some hops marked loose?) in future
-            lastAM = self.mainStitchingLoop(sliceurn, requestDOM, aggs)
+            if not self.opts.incrementalRetry:
+                lastAM = self.mainStitchingLoop(sliceurn, requestDOM, aggs)
+            else:
+                try:
+                    lastAM = self.mainStitchingLoop(sliceurn, requestDOM, aggs)
+                except (StitchingError, KeyboardInterrupt):
+                    # The retry may fail before its launcher takes charge of the reservations we kept
+                    if not self.opts.noDeleteAtEnd:
+                        self.deleteKeptReservations(aggs)
+                    raise
         except StitchingError, se:
             # A StitchingError is a permanent failure.
             # On any error, delete any partial reservations.
@@ -1841,19 +1901,63 @@ class StitchingHandler(object):
 
         # Done adding user requested non linked AMs to list of AMs to process
 
+    def getAvailSnapshot(self, am):
+        '''Return the current VLAN availability at the given AM (hop link URN -> VLANRange)
+        and when it was taken (a naive UTC datetime), or (None, None) if we can't get it.
+        We list resources at each AM at most once per run (every CHECK_AVAIL_INTERVAL_MINS),
+        and use what another stitcher run saved recently if we can. Safe to call from several
+        threads at once, for different AMs.'''
+        if self.availSnapshots.has_key(am.url):
+            (takenAt, avail) = self.availSnapshots[am.url]
+            if datetime.datetime.utcnow() - takenAt < datetime.timedelta(minutes=defs.CHECK_AVAIL_INTERVAL_MINS):
+                return (avail, takenAt)
+        (avail, takenAt) = (None, None)
+        if self.availCache:
+            (avail, takenAt) = self.availCache.get(am.urn, am.url)
+        if avail is None:
+            avail = am.getAvail(self.opts)
+            takenAt = datetime.datetime.utcnow()
+            if avail is not None and self.availCache:
+                self.availCache.put(am.urn, am.url, avail)
+        if avail is None:
+            return (None, None)
+        self.availSnapshots[am.url] = (takenAt, avail)
+        return (avail, takenAt)
+
     def updateAvailRanges(self, sliceurn, requestDOM):
         # Check current VLAN tag availability before doing allocations
-        # Loop over AMs. If I update an AM, then go to AMs that depend on it and intersect there (but don't redo avail query), and recurse.
+        # Get the availability at all the AMs where we need it at once, then
+        # loop over AMs. If I update an AM, then go to AMs that depend on it and intersect there (but don't redo avail query), and recurse.
+        checkAMs = []
         for am in self.ams_to_process:
+            # Tags we already hold (--incrementalRetry) are not available. Nor do we need them to be.
+            if am.hasReservation:
+                self.logger.debug("Kept reservation at %s - not checking VLAN availability", am)
+                continue
             # If doing the avail query at this AM doesn't work or wouldn't help or we did it recently, move on
             if not am.doAvail(self.opts):
                 self.logger.debug("Not checking VLAN availability at %s", am)
                 continue
+            checkAMs.append(am)
+        snapshots = dict()
+        if checkAMs:
+            results = callInParallel(self.getAvailSnapshot, [(am,) for am in checkAMs],
+                                     self.opts.getVersionThreads, name="availability")
+            for (am, (snapshot, excInfo)) in zip(checkAMs, results):
+                if excInfo is not None:
+                    self.logger.debug("Failed to get VLAN availability at %s: %s", am, excInfo[1])
+                elif snapshot[0] is not None:
+                    snapshots[am] = snapshot
+
+        for am in checkAMs:
+            if not snapshots.has_key(am):
+                continue
 
             self.logger.debug("Checking current availabilty at %s", am)
             madeChange = False
             try:
-                madeChange = am.updateWithAvail(self.opts)
+                (avail, takenAt) = snapshots[am]
+                madeChange = am.updateWithAvail(self.opts, avail, takenAt)
 
                 if madeChange:
                     # Must intersect the new ranges with others in the chain
@@ -1935,6 +2039,9 @@ class StitchingHandler(object):
             if not am.supportsAny():
                 self.logger.debug("%s doesn't support requesting 'any' VLAN tag - move on", am)
                 continue
+            if am.hasReservation:
+                # Kept from before (--incrementalRetry): we won't request anything here
+                continue
             # Could a complex topology have some hops producing VLANs and some accepting VLANs at the same AM?
 #            if len(am.dependsOn) == 0:
 #                self.logger.debug("%s says it depends on no other AMs", am)
@@ -2011,8 +2118,117 @@ class StitchingHandler(object):
             # End of loop over hops in AM
         # End of loop over AMs to process
 
+    def getPauseToFreeResources(self, aggs):
+        '''Seconds to pause before retrying, to let the given AMs free the resources we tried to reserve.'''
+        sTime = Aggregate.PAUSE_FOR_V3_AM_TO_FREE_RESOURCES_SECS
+        for agg in aggs:
+            if agg.dcn and agg.triedRes:
+                # Only need to sleep this much longer time
+                # if this is a DCN AM that we tried a reservation on (whether it worked or failed)
+                if sTime < Aggregate.PAUSE_FOR_DCN_AM_TO_FREE_RESOURCES_SECS:
+                    self.logger.debug("Must sleep longer cause had a previous reservation attempt at a DCN AM: %s", agg)
+                sTime = Aggregate.PAUSE_FOR_DCN_AM_TO_FREE_RESOURCES_SECS
+            elif agg.api_version == 2 and agg.triedRes and sTime < Aggregate.PAUSE_FOR_AM_TO_FREE_RESOURCES_SECS:
+                self.logger.debug("Must sleep longer cause had a previous v2 reservation attempt at %s", agg)
+                sTime = Aggregate.PAUSE_FOR_AM_TO_FREE_RESOURCES_SECS
+        return sTime
+
+    def planIncrementalRetry(self, launcher):
+        '''With --incrementalRetry, after a circuit failed: pick the reservations to delete before
+        calling the SCS again. The rest are kept, and the SCS is asked to keep their hops and VLAN tags.
+        Return the AMs whose reservations to delete, or None to delete all reservations.'''
+        # Release the AMs on the paths that failed. If we can't tell which hops failed,
+        # then all paths at the AM where the circuit failed failed.
+        failedAgg = launcher.failedAgg
+        if failedAgg is None:
+            self.logger.debug("Don't know where the circuit failed. Will delete all reservations.")
+            return None
+        if not self.isStitching or self.opts.noSCS:
+            return None
+        failedPaths = set([hop.path for hop in launcher.failedHops])
+        if not failedPaths:
+            failedPaths = set(failedAgg.paths)
+        release = set([failedAgg])
+        for path in failedPaths:
+            release.update(path.aggregates)
+
+        # Also release AMs without a reservation we can keep as is: not done, or a hop
+        # we now know can't have the tag it has
+        for agg in launcher.aggs:
+            if not agg.hasReservation:
+                release.add(agg)
+                continue
+            for hop in agg.hops:
+                suggested = hop._hop_link.vlan_suggested_manifest
+                if hop.excludeFromSCS or not suggested or suggested <= hop.vlans_unavailable:
+                    release.add(agg)
+                    break
+
+        # AMs that depend on a released AM got their VLAN tags from it: release those too
+        toCheck = list(release)
+        while toCheck:
+            agg = toCheck.pop()
+            for agg2 in agg.isDependencyFor:
+                if agg2 not in release:
+                    release.add(agg2)
+                    toCheck.append(agg2)
+
+        keep = [agg for agg in launcher.aggs if agg not in release]
+        if not keep:
+            self.logger.debug("Circuit failure at %s affects all aggregates. Will delete all reservations.", failedAgg)
+            return None
+        releaseAggs = [agg for agg in launcher.aggs if agg in release]
+
+        # Paths the SCS must compute anew: those with a hop at a released AM
+        allPaths = set()
+        redoPaths = set()
+        for agg in launcher.aggs:
+            for hop in agg.hops:
+                allPaths.add(hop.path)
+                if agg in release:
+                    redoPaths.add(hop.path)
+        for agg in releaseAggs:
+            if agg.hasReservation:
+                self.logger.debug("Will release %s hops: %s", agg, [str(hop) for hop in agg.hops])
+
+        # Time we expect to save: the reservations we keep (made one at a time), plus any
+        # shorter pause, as only the released AMs must free resources
+        savedSecs = sum([agg.reservationSecs or 0 for agg in keep]) + \
+            self.getPauseToFreeResources(launcher.aggs) - self.getPauseToFreeResources(releaseAggs)
+        self.logger.info("Circuit failed at %s on path(s) %s. Keeping reservations at %d aggregate(s): %s. Releasing %d aggregate(s) and asking the SCS for %d of %d path(s). Expect to save about %d seconds.",
+                         failedAgg, ", ".join(sorted([str(path.id) for path in failedPaths])), len(keep), keep,
+                         len(releaseAggs), len(redoPaths), len(allPaths), savedSecs)
+        return releaseAggs
+
+    def releaseKeptReservation(self, agg):
+        '''Delete a reservation kept by --incrementalRetry that we can't use after all,
+        pausing to let the AM free the resources.'''
+        agg.deleteReservation(self.opts, self.slicename)
+        sleepSecs = Aggregate.PAUSE_FOR_AM_TO_FREE_RESOURCES_SECS
+        if agg.dcn:
+            sleepSecs = Aggregate.PAUSE_FOR_DCN_AM_TO_FREE_RESOURCES_SECS
+        elif agg.api_version > 2:
+            sleepSecs = Aggregate.PAUSE_FOR_V3_AM_TO_FREE_RESOURCES_SECS
+        self.logger.info("Pausing %d seconds to let aggregate free resources...", sleepSecs)
+        time.sleep(sleepSecs)
+
+    def deleteKeptReservations(self, oldAggs):
+        '''Delete any reservations kept by --incrementalRetry at the given AMs from a previous
+        round, or at the AMs of this round, after the retry failed.'''
+        aggs = [agg for agg in oldAggs + (self.ams_to_process or []) if agg.hasReservation]
+        if not aggs:
+            return
+        class DumbLauncher():
+            def __init__(self, agglist):
+                self.aggs = agglist
+        self.deleteAllReservations(DumbLauncher(aggs))
+        for am in aggs:
+            if am.manifestDom:
+                self.logger.warn("You have a reservation at %s", am)
+
     def deleteAllReservations(self, launcher):
-        '''On error exit, ensure all outstanding reservations are deleted.'''
+        '''On error exit, ensure all outstanding reservations are deleted.
+        Deletes at up to opts.deleteThreads AMs at once: see deleteReservations.'''
         # Try to combine v2 and v3 results together
         # Text is just appended
         # all results in struct are keyed by am.url
@@ -2022,59 +2238,97 @@ class StitchingHandler(object):
         # So instead, the v2 return is True if the AM was found in the success list, False if found in Failed list,
         # and otherwise the return under the am.url is whatever the AM originally returned.
         # Note that failing to find the AM url may mean it's a variant of the URL
-        loggedDeleting = False
         retText = ""
         retStruct = {}
         if len(launcher.aggs) == 0:
             self.logger.debug("0 aggregates from which to delete")
-        for am in launcher.aggs:
-            if am.manifestDom:
-                if not loggedDeleting:
-                    loggedDeleting = True
-                    self.logger.info("Deleting existing reservations...")
-                self.logger.debug("Had reservation at %s", am)
-                try:
-                    (text, result) = am.deleteReservation(self.opts, self.slicename)
-                    self.logger.info("Deleted reservation at %s.", am)
-                    if text is not None and text.strip() != "":
-                        if retText != "":
-                            retText += "\n %s" % text
-                        else:
-                            retText = text
-                    if am.api_version < 3 or not isinstance(result, dict):
-                        if not (isinstance(result, tuple) and isinstance(result[0], list)):
-                            if result is None and text.startswith("Success"):
-                                retStruct[am.url] = True
-                            else:
-                                # Some kind of error
-                                self.logger.debug("Struct result from delete or deletesliver unknown from %s: %s", am, result)
-                                retStruct[am.url] = result
-                        else:
-                            (succ, fail) = result
-                            # FIXME: Do the handler_utils tricks for comparing URLs?
-                            if am.url in succ or am.alt_url in succ:
-                                retStruct[am.url] = True
-                            elif am.url in fail or am.alt_url in fail:
-                                retStruct[am.url] = False
-                            else:
-                                self.logger.debug("Failed to find AM URL in v2 deletesliver return struct. AM %s, return %s", am, result)
-                                retStruct[am.url] = result
-                    else:
-                        retCopy = retStruct.copy()
-                        retCopy.update(result)
-                        retStruct = retCopy
-                except StitchingError, se2:
-                    msg = "Failed to delete reservation at %s: %s" % (am, se2)
-                    self.logger.warn(msg)
-                    retStruct[am.url] = False
+        toDelete = [am for am in launcher.aggs if am.manifestDom]
+        if len(toDelete) > 0:
+            self.logger.info("Deleting existing reservations...")
+        deleteResults = self.deleteReservations(toDelete)
+        # Combine the results in AM order
+        unexpectedError = None
+        for am in toDelete:
+            (res, exc_info) = deleteResults[am]
+            try:
+                if exc_info is not None:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+                (text, result) = res
+                if text is not None and text.strip() != "":
                     if retText != "":
-                        retText += "\n %s" % msg
+                        retText += "\n %s" % text
                     else:
-                        retText = msg
+                        retText = text
+                if am.api_version < 3 or not isinstance(result, dict):
+                    if not (isinstance(result, tuple) and isinstance(result[0], list)):
+                        if result is None and text.startswith("Success"):
+                            retStruct[am.url] = True
+                        else:
+                            # Some kind of error
+                            self.logger.debug("Struct result from delete or deletesliver unknown from %s: %s", am, result)
+                            retStruct[am.url] = result
+                    else:
+                        (succ, fail) = result
+                        # FIXME: Do the handler_utils tricks for comparing URLs?
+                        if am.url in succ or am.alt_url in succ:
+                            retStruct[am.url] = True
+                        elif am.url in fail or am.alt_url in fail:
+                            retStruct[am.url] = False
+                        else:
+                            self.logger.debug("Failed to find AM URL in v2 deletesliver return struct. AM %s, return %s", am, result)
+                            retStruct[am.url] = result
+                else:
+                    retCopy = retStruct.copy()
+                    retCopy.update(result)
+                    retStruct = retCopy
+            except StitchingError, se2:
+                msg = "Failed to delete reservation at %s: %s" % (am, se2)
+                self.logger.warn(msg)
+                retStruct[am.url] = False
+                if retText != "":
+                    retText += "\n %s" % msg
+                else:
+                    retText = msg
+            except Exception, e:
+                # Finish combining the results, then raise the first of these
+                self.logger.error("Failed to delete reservation at %s: %s", am, e)
+                if unexpectedError is None:
+                    unexpectedError = sys.exc_info()
+        if unexpectedError is not None:
+            raise unexpectedError[0], unexpectedError[1], unexpectedError[2]
         if retText == "":
             retText = "No aggregates with reservations from which to delete"
         return (retText, retStruct)
 
+    def deleteReservationAt(self, am):
+        '''Delete the reservation at the given AM. Safe to call from several threads at once
+        (for different AMs).'''
+        self.logger.debug("Had reservation at %s", am)
+        (text, result) = am.deleteReservation(self.opts, self.slicename)
+        self.logger.info("Deleted reservation at %s.", am)
+        return (text, result)
+
+    def deleteReservations(self, aggs):
+        '''Delete the reservations at the given AMs, at up to opts.deleteThreads at once.
+        Return a dict of AM => (result, exc_info) from deleteReservationAt.
+        On KeyboardInterrupt, start no more deletes, and let those in progress finish (clearing
+        the manifestDom of their AMs) before raising it, so AMs with a manifestDom are still
+        exactly those that may have a reservation.'''
+        results = dict()
+        if len(aggs) == 0:
+            return results
+        startTime = time.time()
+        # Delete at DCN AMs (ie ION) last, once the circuits at the other AMs that use them are gone
+        for batch in ([am for am in aggs if not am.dcn], [am for am in aggs if am.dcn]):
+            if len(batch) == 0:
+                continue
+            batchResults = callInParallel(self.deleteReservationAt, [(am,) for am in batch],
+                                          self.opts.deleteThreads, name="delete",
+                                          waitOnInterrupt=True)
+            results.update(zip(batch, batchResults))
+        self.logger.debug("Deleting reservations at %d AM(s) took %.1f seconds", len(aggs), time.time() - startTime)
+        return results
+
     def confirmGoodRSpec(self, requestString, rspecType=rspec_schema.REQUEST, doRSpecLint=True):
         '''Ensure an rspec is valid'''
         typeStr = 'Request'
@@ -2095,17 +2349,16 @@ class StitchingHandler(object):
             else:
                 raise OmniError("%s RSpec file did not contain a %s RSpec (wrong type or schema)" % (typeStr, typeStr))
 
-        # Run rspeclint
+        # Validate against the schemas: in process if we have local
+        # copies of them, else with rspeclint
         if doRSpecLint:
-            try:
-                rspeclint_exists()
-            except:
-                self.logger.debug("No rspeclint found")
-                return
             # FIXME: Make this support GENIv4+? PGv2?
             schema = rspec_schema.GENI_3_REQ_SCHEMA
             if rspecType == rspec_schema.MANIFEST:
                 schema = rspec_schema.GENI_3_MAN_SCHEMA
+            if not can_validate_rspec(rspec_schema.GENI_3_NAMESPACE, schema):
+                self.logger.debug("No rspeclint or local RSpec schemas found")
+                return
             if not validate_rspec(requestString, rspec_schema.GENI_3_NAMESPACE, schema):
                 raise OmniError("%s RSpec does not validate against its schemas" % typeStr)
 
@@ -2483,8 +2736,12 @@ class StitchingHandler(object):
         self.logger.debug("Calling SCS with options %s", scsOptions)
         if self.opts.savedSCSResults:
             self.logger.debug("** Not actually calling SCS, using results from '%s'", self.opts.savedSCSResults)
+        # If the last attempt failed, do not use (and forget) any saved SCS result
+        useCache = self.scsCalls <= 1
+        if not useCache:
+            self.scsService.discardCachedResult()
         try:
-            scsResponse = self.scsService.ComputePath(sliceurn, requestString, scsOptions, self.opts.savedSCSResults)
+            scsResponse = self.scsService.ComputePath(sliceurn, requestString, scsOptions, self.opts.savedSCSResults, useCache)
         except StitchingError as e:
             self.logger.debug("Error from slice computation service: %s", e)
             raise 
@@ -2589,10 +2846,15 @@ class StitchingHandler(object):
         # If we have existing AMs,
         # Add the options to tell the SCS to exclude any hops marked for exclusion, or any VLANs
         # marked unavailable
+        # At AMs where we kept the reservation (--incrementalRetry), ask the SCS to keep
+        # the hops and VLAN tags we have, by including each hop and excluding all other tags
         if existingAggs and len(existingAggs) > 0:
             for agg in existingAggs:
                 for hop in agg.hops:
-                    if hop.excludeFromSCS or (hop.vlans_unavailable and len(hop.vlans_unavailable) > 0):
+                    keptTag = None
+                    if agg.hasReservation:
+                        keptTag = hop._hop_link.vlan_suggested_manifest
+                    if hop.excludeFromSCS or keptTag or (hop.vlans_unavailable and len(hop.vlans_unavailable) > 0):
                         # get path and ensure a pathStruct object
                         path = hop._path.id
                         if profile.has_key(path):
@@ -2612,6 +2874,14 @@ class StitchingHandler(object):
                         # Add to the excludes list
                         if hop.excludeFromSCS:
                             excludes.append(urn)
+                        elif keptTag:
+                            excludes.append(urn + "=" + str(VLANRange.fromString("any") - keptTag))
+                            if pathStruct.has_key(scs.HOP_INCLUSION_TAG):
+                                includes = pathStruct[scs.HOP_INCLUSION_TAG]
+                            else:
+                                includes = []
+                            includes.append(urn)
+                            pathStruct[scs.HOP_INCLUSION_TAG] = includes
                         elif hop.vlans_unavailable and len(hop.vlans_unavailable) > 0:
                             excludes.append(urn + "=" + str(hop.vlans_unavailable))
 
@@ -3063,96 +3333,219 @@ class StitchingHandler(object):
         nonExoSMs.append(exoSM)
         self.ams_to_process = nonExoSMs
 
-    def add_am_info(self, aggs):
-        '''Add extra information about the AMs to the Aggregate objects, like the API version'''
+    def getAMURLsByURN(self):
+        '''Index the aggregate nicknames by AM URN: URN -> list of (config order, URL)'''
+        if self.amURLsByURN is None:
+            index = dict()
+            order = 0
+            for (amURN, amURL) in self.config['aggregate_nicknames'].values():
+                index.setdefault(amURN.strip(), []).append((order, amURL))
+                order += 1
+            self.amURLsByURN = index
+        return self.amURLsByURN
+
+    def getVersionOptions(self):
+        '''Omni options for calling GetVersion from add_am_info'''
         options_copy = copy.deepcopy(self.opts)
         options_copy.debug = False
         options_copy.info = False
         options_copy.aggregate = []
+        return options_copy
+
+    def callGetVersion(self, url, options):
+        '''Call GetVersion at the given AM URL using Omni (and its GetVersion cache).
+        Return the Omni (text, version) result. Safe to call from several threads at once.'''
+        # Hack: Here we hard-code using APIv2 always to call getversion, assuming that v2 is the AM default
+        # and so the URLs are v2 URLs.
+        if options.warn:
+            omniargs = ['--ForceUseGetVersionCache', '-V2', '-a', url, 'getversion']
+        else:
+            omniargs = ['--ForceUseGetVersionCache', '-o', '--warn', '-V2', '-a', url, 'getversion']
+        return omni.call(omniargs, options)
+
+    def prefetchGetVersion(self, urls, options):
+        '''Call GetVersion at all the given AM URLs that we don't have results for,
+        up to opts.getVersionThreads at once. Save the results for add_am_info.'''
+        todo = []
+        for url in urls:
+            if url and url not in self.getVersionResults and url not in todo:
+                todo.append(url)
+        if len(todo) == 0:
+            return
+        self.logger.debug("Getting extra AM info from Omni for %d AM(s): %s", len(todo), todo)
+        results = callInParallel(self.callGetVersion, [(url, options) for url in todo],
+                                 self.opts.getVersionThreads, name="getversion")
+        for (url, result) in zip(todo, results):
+            self.getVersionResults[url] = result
+
+    def getVersion(self, url, options):
+        '''Return the Omni (text, version) from GetVersion at the given AM URL,
+        using a prefetched result if we have one. Raises whatever the call raised.'''
+        if url not in self.getVersionResults:
+            self.prefetchGetVersion([url], options)
+        (result, excInfo) = self.getVersionResults.pop(url)
+        if excInfo is not None:
+            raise excInfo[0], excInfo[1], excInfo[2]
+        return result
+
+    def listSCSAggregates(self):
+        '''Return the AMs the SCS knows: AM URN -> URL'''
+        aggs = dict()
+        scsAggs = self.scsService.ListAggregates(False)
+        if isinstance(scsAggs, dict) and scsAggs.has_key('value') and isinstance(scsAggs['value'], dict) and \
+                isinstance(scsAggs['value'].get('geni_aggregate_list'), dict):
+            for scsAgg in scsAggs['value']['geni_aggregate_list'].values():
+                if isinstance(scsAgg, dict) and scsAgg.get('urn') and scsAgg.get('url'):
+                    aggs[scsAgg['urn'].strip()] = scsAgg['url'].strip()
+        return aggs
+
+    def startAMInfoPrefetch(self):
+        '''Start getting GetVersion in the background for the AMs named in the request,
+        so add_am_info has them (or is warming the GetVersion cache) once the SCS returns.
+        The AM URLs come from the SCS list of aggregates, or the aggregate nicknames.'''
+        if self.parsedUserRequest is None or not self.parsedUserRequest.amURNs or self.opts.getVersionThreads < 2:
+            return
+        amURNs = list(self.parsedUserRequest.amURNs)
+        options = self.getVersionOptions()
+        useSCS = not self.opts.savedSCSResults
+
+        def prefetch():
+            try:
+                scsAggs = dict()
+                if useSCS:
+                    try:
+                        scsAggs = self.listSCSAggregates()
+                    except Exception, e:
+                        self.logger.debug("SCS ListAggregates failed: %s", e)
+                index = self.getAMURLsByURN()
+                urls = []
+                for urn in amURNs:
+                    if urn in scsAggs:
+                        urls.append(scsAggs[urn])
+                    elif urn in index:
+                        urls.append(min(index[urn])[1].strip())
+                self.prefetchGetVersion(urls, options)
+            except Exception, e:
+                self.logger.debug("Failed to prefetch AM info: %s", e)
+
+        self.amInfoPrefetchThread = threading.Thread(target=prefetch, name="am-info-prefetch")
+        self.amInfoPrefetchThread.daemon = True
+        self.amInfoPrefetchThread.start()
+
+    def finishAMInfoPrefetch(self):
+        '''Wait for any GetVersion prefetch started while calling the SCS'''
+        thread = self.amInfoPrefetchThread
+        self.amInfoPrefetchThread = None
+        if thread is not None:
+            # Join with a timeout so Ctrl-C still works
+            while thread.is_alive():
+                thread.join(0.5)
+
+    def add_am_url_info(self, agg):
+        '''Fill in the parts of the AM info that do not need GetVersion: whether the user
+        requested the AM, whether it is the ExoSM, and any alternate URL. This may change the AM URL.'''
+        # Note which AMs were user requested
+        if self.parsedUserRequest and agg.urn in self.parsedUserRequest.amURNs:
+            agg.userRequested = True
+        elif self.parsedUserRequest:
+            for urn2 in agg.urn_syns:
+                if urn2 in self.parsedUserRequest.amURNs:
+                    agg.userRequested = True
+
+        # FIXME: Better way to detect this?
+        if handler_utils._extractURL(self.logger, agg.url) in defs.EXOSM_URL:
+            agg.isExoSM = True
+#            self.logger.debug("%s is the ExoSM cause URL is %s", agg, agg.url)
+
+        # EG AMs in particular have 2 URLs in some sense - ExoSM and local
+        # So note the other one, since VMs are split between the 2
+        index = self.getAMURLsByURN()
+        candidates = []
+        for urn in set(agg.urn_syns):
+            candidates.extend(index.get(urn, []))
+        # Try them in the order of the aggregate nicknames
+        for (order, amURL) in sorted(candidates):
+            hadURL = handler_utils._extractURL(self.logger, agg.url)
+            newURL = handler_utils._extractURL(self.logger, amURL)
+            if hadURL != newURL and not hadURL in newURL and not newURL in hadURL and not newURL.strip == '':
+                agg.alt_url = amURL.strip()
+                break
+#            else:
+#                self.logger.debug("Not setting alt_url for %s. URL is %s, alt candidate was %s", agg, hadURL, newURL)
+
+        if "exogeni" in agg.urn and not agg.alt_url:
+#            self.logger.debug("No alt url for Orca AM %s (URL %s) with URN synonyms:", agg, agg.url)
+#            for urn in agg.urn_syns:
+#                self.logger.debug("\t%s", urn)
+            if not agg.isExoSM:
+                agg.alt_url = defs.EXOSM_URL
+
+        # Try to get a URL from the CH? Do we want/need this
+        # expense? This is a call to the CH....
+        # Comment this out - takes too long, not clear
+        # it is needed.
+#        if not agg.alt_url:
+#            fw_ams = dict()
+#            try:
+#                fw_ams = self.framework.list_aggregates()
+#                for fw_am_urn in fw_ams.keys():
+#                    if fw_am_urn and fw_am_urn.strip() in am.urn_syns and fw_ams[fw_am_urn].strip() != '':
+#                        cand_url = fw_ams[fw_am_urn]
+#                        if cand_url != am.url and not am.url in cand_url and not cand_url in am.url:
+#                            am.alt_url = cand_url
+#                            self.logger.debug("Found AM %s alternate URL from CH ListAggs: %s", am.urn, am.alt_url)
+#                            break
+#            except:
+#                pass
+
+        # If --noExoSM then ensure this is not the ExoSM
+        if agg.isExoSM and agg.alt_url and self.opts.noExoSM:
+            self.logger.warn("%s used ExoSM URL. Changing to %s", agg, agg.alt_url)
+            amURL = agg.url
+            agg.url = agg.alt_url
+            agg.alt_url = amURL
+            agg.isExoSM = False
+
+# For using the test ION AM
+#        if 'alpha.dragon' in agg.url:
+#            agg.url =  'http://alpha.dragon.maxgigapop.net:12346/'
+
+    def add_am_info(self, aggs):
+        '''Add extra information about the AMs to the Aggregate objects, like the API version'''
+        # Use any GetVersion results we got while calling the SCS
+        self.finishAMInfoPrefetch()
+
+        options_copy = self.getVersionOptions()
 
         aggsc = copy.copy(aggs)
 
+        # First fill in the info that may change the AM URLs, so we can then
+        # call GetVersion at all the AMs at once
+        urlInfoDone = []
+        for agg in aggsc:
+            # Don't do an aggregate twice
+            if agg.urn in self.amURNsAddedInfo or agg.urn in [agg2.urn for agg2 in urlInfoDone]:
+                continue
+            self.add_am_url_info(agg)
+            urlInfoDone.append(agg)
+        self.prefetchGetVersion([agg.url for agg in urlInfoDone], options_copy)
+
         for agg in aggsc:
             # Don't do an aggregate twice
             if agg.urn in self.amURNsAddedInfo:
                 continue
 #            self.logger.debug("add_am_info looking at %s", agg)
 
-            # Note which AMs were user requested
-            if self.parsedUserRequest and agg.urn in self.parsedUserRequest.amURNs:
-                agg.userRequested = True
-            elif self.parsedUserRequest:
-                for urn2 in agg.urn_syns:
-                    if urn2 in self.parsedUserRequest.amURNs:
-                        agg.userRequested = True
-
-            # FIXME: Better way to detect this?
-            if handler_utils._extractURL(self.logger, agg.url) in defs.EXOSM_URL:
-                agg.isExoSM = True
-#                self.logger.debug("%s is the ExoSM cause URL is %s", agg, agg.url)
-
-            # EG AMs in particular have 2 URLs in some sense - ExoSM and local
-            # So note the other one, since VMs are split between the 2
-            for (amURN, amURL) in self.config['aggregate_nicknames'].values():
-                if amURN.strip() in agg.urn_syns:
-                    hadURL = handler_utils._extractURL(self.logger, agg.url)
-                    newURL = handler_utils._extractURL(self.logger, amURL)
-                    if hadURL != newURL and not hadURL in newURL and not newURL in hadURL and not newURL.strip == '':
-                        agg.alt_url = amURL.strip()
-                        break
-#                    else:
-#                        self.logger.debug("Not setting alt_url for %s. URL is %s, alt candidate was %s with URN %s", agg, hadURL, newURL, amURN)
-#                elif "exogeni" in amURN and "exogeni" in agg.urn:
-#                    self.logger.debug("Config had URN %s URL %s, but that URN didn't match our URN synonyms for %s", amURN, newURL, agg)
-
-            if "exogeni" in agg.urn and not agg.alt_url:
-#                self.logger.debug("No alt url for Orca AM %s (URL %s) with URN synonyms:", agg, agg.url)
-#                for urn in agg.urn_syns:
-#                    self.logger.debug("\t%s", urn)
-                if not agg.isExoSM:
-                    agg.alt_url = defs.EXOSM_URL
-
-            # Try to get a URL from the CH? Do we want/need this
-            # expense? This is a call to the CH....
-            # Comment this out - takes too long, not clear
-            # it is needed.
-#            if not agg.alt_url:
-#                fw_ams = dict()
-#                try:
-#                    fw_ams = self.framework.list_aggregates()
-#                    for fw_am_urn in fw_ams.keys():
-#                        if fw_am_urn and fw_am_urn.strip() in am.urn_syns and fw_ams[fw_am_urn].strip() != '':
-#                            cand_url = fw_ams[fw_am_urn]
-#                            if cand_url != am.url and not am.url in cand_url and not cand_url in am.url:
-#                                am.alt_url = cand_url
-#                                self.logger.debug("Found AM %s alternate URL from CH ListAggs: %s", am.urn, am.alt_url)
-#                                break
-#                except:
-#                    pass
-
-            # If --noExoSM then ensure this is not the ExoSM
-            if agg.isExoSM and agg.alt_url and self.opts.noExoSM:
-                self.logger.warn("%s used ExoSM URL. Changing to %s", agg, agg.alt_url)
-                amURL = agg.url
-                agg.url = agg.alt_url
-                agg.alt_url = amURL
-                agg.isExoSM = False
-
-# For using the test ION AM
-#            if 'alpha.dragon' in agg.url:
-#                agg.url =  'http://alpha.dragon.maxgigapop.net:12346/'
-
-            # Use GetVersion to determine AM type, AM API versions spoken, etc
-            # Hack: Here we hard-code using APIv2 always to call getversion, assuming that v2 is the AM default
-            # and so the URLs are v2 URLs.
-            if options_copy.warn:
-                omniargs = ['--ForceUseGetVersionCache', '-V2', '-a', agg.url, 'getversion']
+            if agg in urlInfoDone:
+                urlInfoDone.remove(agg)
             else:
-                omniargs = ['--ForceUseGetVersionCache', '-o', '--warn', '-V2', '-a', agg.url, 'getversion']
+                # An AM we changed to the ExoSM below: redo its URL info
+                self.add_am_url_info(agg)
 
+            # Use GetVersion to determine AM type, AM API versions spoken, etc
             try:
                 self.logger.debug("Getting extra AM info from Omni for AM %s", agg)
-                (text, version) = omni.call(omniargs, options_copy)
+                (text, version) = self.getVersion(agg.url, options_copy)
                 aggurl = agg.url
                 if isinstance (version, dict) and version.has_key(aggurl) and isinstance(version[aggurl], dict) \
                         and version[aggurl].has_key('value') and isinstance(version[aggurl]['value'], dict):
@@ -3781,11 +4174,49 @@ class StitchingHandler(object):
                 # FIXME: correct?
                 agg.url = oldAgg.url
                 agg.urn_syns = copy.deepcopy(oldAgg.urn_syns)
+
+                if oldAgg.hasReservation:
+                    self.keepReservation(oldAgg, agg)
                 break # out of loop over oldAggs, cause we found the new 'agg'
             # Loop over oldAggs
         # Loop over newAggs
     # End of saveAggregateState
 
+    def keepReservation(self, oldAgg, agg):
+        '''Move a reservation kept by --incrementalRetry from an old Aggregate to the new one
+        for the same AM, so the launcher skips it. If the new SCS path changed the hops at
+        this AM, delete the reservation instead.'''
+        # Match hops by URN and path
+        matches = []
+        for hop in agg.hops:
+            for oldHop in oldAgg.hops:
+                if hop.urn == oldHop.urn and hop.path.id == oldHop.path.id:
+                    matches.append((hop, oldHop))
+                    break
+        if len(matches) != len(agg.hops) or len(agg.hops) != len(oldAgg.hops):
+            self.logger.info("New SCS path changed the hops at %s. Releasing its reservation after all.", agg)
+            self.releaseKeptReservation(oldAgg)
+            return
+
+        self.logger.debug("Keeping reservation at %s", agg)
+        for (hop, oldHop) in matches:
+            hop._hop_link.vlan_suggested_request = oldHop._hop_link.vlan_suggested_request
+            hop._hop_link.vlan_range_request = oldHop._hop_link.vlan_range_request
+            hop._hop_link.vlan_suggested_manifest = oldHop._hop_link.vlan_suggested_manifest
+            hop._hop_link.vlan_range_manifest = oldHop._hop_link.vlan_range_manifest
+            hop.globalId = oldHop.globalId
+        agg.requestDom = oldAgg.requestDom
+        agg.manifestDom = oldAgg.manifestDom
+        agg.rspecfileName = oldAgg.rspecfileName
+        agg.pgLogUrl = oldAgg.pgLogUrl
+        agg.sliverExpirations = oldAgg.sliverExpirations
+        agg.reservationSecs = oldAgg.reservationSecs
+        agg.completed = True
+
+        # The new Aggregate now has the reservation
+        oldAgg.manifestDom = None
+        oldAgg.completed = False
+
     def ensureSliverType(self):
         # DCN AMs seem to insist that there is at least one sliver_type specified one one node
         # So if we have a DCN AM, add one if needed
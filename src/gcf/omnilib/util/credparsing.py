@@ -28,17 +28,89 @@
 
 from __future__ import absolute_import
 
+import collections
 import datetime
 import dateutil.parser
+import hashlib
 import logging
+import threading
 import traceback
-import xml.dom.minidom as md
 
-from ...sfa.trust.credential import Credential
+from ...sfa.trust.credential import Credential, CredentialScan
 from ...sfa.trust.abac_credential import ABACCredential
 from ...sfa.trust.credential_factory import CredentialFactory
 from ...geni.util.tz_util import tzd
 
+# Number of credential summaries to keep
+CRED_SUMMARY_CACHE_SIZE = 100
+
+class CredSummary(object):
+    '''The fields of a credential XML string that the functions here
+    need, from a single streaming scan of the whole document
+    (sfa.trust.credential.CredentialScan): whether the document is a
+    signed-credential; the target and owner URNs and expiration of its
+    credential (the root element, or the first child of a root
+    signed-credential); whether that has a target GID; and the text of
+    every type element in the document.
+    Get these with get_cred_summary, which remembers them for recently
+    seen credentials. They must not be modified.'''
+
+    def __init__(self, credString):
+        self.error = None
+        self.is_signed = False
+        self.has_credential = False
+        self.has_target_gid = False
+        self.target_urn = None
+        self.owner_urn = None
+        self.expires = None
+        self.types = []
+        self._expiration = None
+        try:
+            scan = CredentialScan(credString, whole_document=True)
+        except Exception, exc:
+            self.error = exc
+            return
+        self.is_signed = scan.is_signed
+        self.has_credential = scan.has_credential
+        self.has_target_gid = scan.has_target_gid
+        self.target_urn = _utf8(scan.target_urn)
+        self.owner_urn = _utf8(scan.owner_urn)
+        self.expires = _utf8(scan.expires)
+        self.types = [_utf8(text) for text in scan.types]
+
+    def get_expiration(self):
+        '''The expiration as a datetime, or None if there is none.
+        Raises an exception if it cannot be parsed.'''
+        if self._expiration is None and self.expires is not None:
+            self._expiration = dateutil.parser.parse(self.expires, tzinfos=tzd)
+        return self._expiration
+
+def _utf8(text):
+    if text is not None:
+        text = text.encode('utf-8')
+    return text
+
+_summary_cache = collections.OrderedDict()
+_summary_cache_lock = threading.Lock()
+
+def get_cred_summary(credString):
+    '''Return the CredSummary of the given credential XML string,
+    parsing it only if it has not been seen recently.'''
+    if isinstance(credString, unicode):
+        credString = credString.encode('utf-8')
+    credString = credString.strip()
+    key = hashlib.sha256(credString).digest()
+    with _summary_cache_lock:
+        summary = _summary_cache.get(key)
+    if summary is not None:
+        return summary
+    summary = CredSummary(credString)
+    with _summary_cache_lock:
+        _summary_cache[key] = summary
+        while len(_summary_cache) > CRED_SUMMARY_CACHE_SIZE:
+            _summary_cache.popitem(last=False)
+    return summary
+
 # FIXME: Doesn't distinguish v2 vs v3 yet
 def is_valid_v3(logger, credString):
     '''Is the given credential a valid geni_sfa style v3 credential?'''
@@ -79,26 +151,19 @@ def is_valid_v3(logger, credString):
         logger.warn("No target_urn in cred: %s", credString)
         return False
 
-    try:
-        # Note this is relatively memory intensive
-        doc = md.parseString(credString)
-        signed_cred = doc.getElementsByTagName("signed-credential")
-
-        # Is this a signed-cred or just a cred?
-        if len(signed_cred) > 0:
-            cred = signed_cred[0].getElementsByTagName("credential")[0]
-        else:
-            logger.warn("No signed-credential element found")
-            return False
-
-        targetnode = cred.getElementsByTagName("target_urn")[0]
-        if len(targetnode.childNodes) > 0:
-            urn = str(targetnode.childNodes[0].nodeValue)
-        else:
-            logger.warn("No target_urn found")
-            return False
-    except Exception, exc:
-        logger.warn("Exception parsing cred to get target_urn: %s", exc)
+    summary = get_cred_summary(credString)
+    if summary.error:
+        logger.warn("Exception parsing cred to get target_urn: %s", summary.error)
+        return False
+    # Is this a signed-cred or just a cred?
+    if not summary.is_signed:
+        logger.warn("No signed-credential element found")
+        return False
+    if not summary.has_credential:
+        logger.warn("Exception parsing cred to get target_urn: no credential element")
+        return False
+    if summary.target_urn is None:
+        logger.warn("No target_urn found")
         return False
 
     return True
@@ -110,11 +175,15 @@ def get_cred_type(cred):
     is_abac = False
     is_sfa = False
     try:
-        doc = md.parseString(cred)
-        type_elts = doc.getElementsByTagName('type')
-        if len(type_elts) == 1 and type_elts[0].childNodes[0].nodeValue.strip() == 'abac':
+        summary = get_cred_summary(cred)
+        if summary.error:
+            raise summary.error
+        types = summary.types
+        if len(types) == 1 and types[0] is None:
+            raise ValueError("Empty credential type")
+        if len(types) == 1 and types[0].strip() == 'abac':
             is_abac = True
-        elif len(type_elts) == 1 and type_elts[0].childNodes[0].nodeValue.strip() == 'privilege':
+        elif len(types) == 1 and types[0].strip() == 'privilege':
             is_sfa = True
     except Exception, e:
         level = logging.INFO
@@ -174,18 +243,13 @@ def get_cred_target_urn(logger, cred):
         return urn
 
     try:
-        doc = md.parseString(credString)
-        signed_cred = doc.getElementsByTagName("signed-credential")
-
-        # Is this a signed-cred or just a cred?
-        if len(signed_cred) > 0:
-            cred = signed_cred[0].getElementsByTagName("credential")[0]
-        else:
-            cred = doc.getElementsByTagName("credential")[0]
-
-        targetnode = cred.getElementsByTagName("target_urn")[0]
-        if len(targetnode.childNodes) > 0:
-            urn = str(targetnode.childNodes[0].nodeValue)
+        summary = get_cred_summary(credString)
+        if summary.error:
+            raise summary.error
+        if not summary.has_credential:
+            raise ValueError("No credential element")
+        if summary.target_urn is not None:
+            urn = summary.target_urn
         else:
             if logger is None:
                 level = logging.INFO
@@ -227,18 +291,13 @@ def get_cred_owner_urn(logger, cred):
         return urn
 
     try:
-        doc = md.parseString(credString)
-        signed_cred = doc.getElementsByTagName("signed-credential")
-
-        # Is this a signed-cred or just a cred?
-        if len(signed_cred) > 0:
-            cred = signed_cred[0].getElementsByTagName("credential")[0]
-        else:
-            cred = doc.getElementsByTagName("credential")[0]
-
-        ownernode = cred.getElementsByTagName("owner_urn")[0]
-        if len(ownernode.childNodes) > 0:
-            urn = str(ownernode.childNodes[0].nodeValue)
+        summary = get_cred_summary(credString)
+        if summary.error:
+            raise summary.error
+        if not summary.has_credential:
+            raise ValueError("No credential element")
+        if summary.owner_urn is not None:
+            urn = summary.owner_urn
         else:
             if logger is None:
                 level = logging.INFO
@@ -284,17 +343,13 @@ def get_cred_exp(logger, cred):
         return credexp
 
     try:
-        doc = md.parseString(credString)
-        signed_cred = doc.getElementsByTagName("signed-credential")
-
-        # Is this a signed-cred or just a cred?
-        if len(signed_cred) > 0:
-            cred = signed_cred[0].getElementsByTagName("credential")[0]
-        else:
-            cred = doc.getElementsByTagName("credential")[0]
-        expirnode = cred.getElementsByTagName("expires")[0]
-        if len(expirnode.childNodes) > 0:
-            credexp = dateutil.parser.parse(expirnode.childNodes[0].nodeValue, tzinfos=tzd)
+        summary = get_cred_summary(credString)
+        if summary.error:
+            raise summary.error
+        if not summary.has_credential:
+            raise ValueError("No credential element")
+        if summary.get_expiration() is not None:
+            credexp = summary.get_expiration()
     except Exception, exc:
         if logger is None:
             level = logging.INFO
@@ -322,20 +377,13 @@ def is_cred_xml(cred):
     if not "signed-credential" in cred:
         return False
 
-    try:
-        doc = md.parseString(cred)
-        signed_cred = doc.getElementsByTagName("signed-credential")
-
-        # Is this a signed-cred or just a cred?
-        if len(signed_cred) > 0:
-            credEle = signed_cred[0].getElementsByTagName("credential")[0]
-        else:
-            return False
-
-        targetnode = credEle.getElementsByTagName("target_gid")[0]
-        if not targetnode:
-            return False
-    except Exception, exc:
+    summary = get_cred_summary(cred)
+    if summary.error:
+        return False
+    # Is this a signed-cred or just a cred?
+    if not summary.is_signed or not summary.has_credential:
+        return False
+    if not summary.has_target_gid:
         return False
 
     # Anything else? Starts with <?
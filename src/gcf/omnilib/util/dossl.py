@@ -37,6 +37,7 @@ import time
 import traceback
 import xmlrpclib
 
+from . import timing
 from .omnierror import OmniError
 from .faultPrinting import cln_xmlrpclib_fault
 from ...sfa.trust import gid
@@ -56,7 +57,23 @@ def _do_ssl(framework, suppresserrors, reason, fn, *args):
     """ Attempts to make an xmlrpc call, and will repeat the attempt
     if it failed due to a bad passphrase for the ssl key.  Also does some
     exception handling.  Returns: (1) the xmlrpc return if everything went okay,
-    otherwise returns None. And (2) A message explaining any errors."""
+    otherwise returns None. And (2) A message explaining any errors.
+    If a timing report is being collected, records the call there."""
+
+    call = timing.begin_call(reason)
+    if call is None:
+        return _do_ssl_attempts(call, framework, suppresserrors, reason, fn, *args)
+    try:
+        (result, message) = _do_ssl_attempts(call, framework, suppresserrors, reason, fn, *args)
+    except Exception, exc:
+        timing.end_call(call, error=exc)
+        raise
+    timing.end_call(call, result, message)
+    return (result, message)
+
+def _do_ssl_attempts(call, framework, suppresserrors, reason, fn, *args):
+    """ Does the work of _do_ssl, noting attempts and busy waits in the given
+    timing call record (if any)."""
 
     # Change exception name?
 
@@ -72,11 +89,13 @@ def _do_ssl(framework, suppresserrors, reason, fn, *args):
     failMsg = "Call for %s failed." % reason
     while(attempt <= max_attempts):
         attempt += 1
+        timing.note_attempt(call)
         try:
             result = fn(*args)
             if is_busy_reply(result) and attempt <= max_attempts:
                 framework.logger.info('Detected busy result for %s. Retrying in %d seconds.',
                                       reason, retry_pause_seconds)
+                timing.note_busy_wait(call, retry_pause_seconds)
                 time.sleep(retry_pause_seconds)
                 continue
             else:
@@ -177,6 +196,7 @@ def _do_ssl(framework, suppresserrors, reason, fn, *args):
             framework.logger.error("%s Server says: %s" % (failMsg, clnfault))
             if str(fault).find("try again later") > -1 and attempt <= max_attempts:
                 framework.logger.info(" ... pausing %d seconds and retrying ...." % retry_pause_seconds)
+                timing.note_busy_wait(call, retry_pause_seconds)
                 time.sleep(retry_pause_seconds)
                 continue
             else:
@@ -26,14 +26,17 @@ from __future__ import absolute_import
 
 import datetime
 import dateutil
+import gzip
 import json
 import logging
 import os
 import re
 import string
+import xml.parsers.expat
 
 from . import json_encoding
 from . import credparsing as credutils
+from . import timing
 from .dossl import _do_ssl
 from .dates import naiveUTC
 from .files import *
@@ -442,6 +445,7 @@ def _load_cred(handler, filename):
             handler.logger.debug("Using APIv%d and got cred seemingly in right form, return it", handler.opts.api_version)
     return cred
 
+@timing.timed('slice_cred_fetch')
 def _get_slice_cred(handler, urn):
     """Get a cred for the slice with the given urn.
     Try a couple times to get the given slice credential.
@@ -669,7 +673,9 @@ def _construct_output_filename(opts, slicename, clienturl, clienturn, methodname
     '''Construct a file name for omni command outputs; return that name.
     If --outputfile specified, use that.
     Else, overall form is [prefix-][slicename-]methodname-server.filetype
-    filetype should be .xml or .json'''
+    filetype should be .xml or .json
+    With --gzipOutput, .xml files are named .xml.gz (and so are written gzip compressed
+    by _printResults).'''
 
     # Construct server bit. Get HRN from URN, else use url
     # FIXME: Use sfa.util.xrn.get_authority or urn_to_hrn?
@@ -690,6 +696,8 @@ def _construct_output_filename(opts, slicename, clienturl, clienturn, methodname
             filename = string.replace(filename, "%s", slicename)
         return filename
 
+    if filetype == ".xml" and opts and opts.gzipOutput:
+        filetype += ".gz"
     if server is None or server.strip() == '':
         filename = methodname + filetype
     else:
@@ -705,6 +713,9 @@ def _construct_output_filename(opts, slicename, clienturl, clienturn, methodname
             filename  = opts.prefix.strip() + filename
     return filename
 
+# The content _getRSpecOutput gives when there is no valid RSpec
+_NO_RSPEC_CONTENT = "<!-- No valid RSpec returned. -->"
+
 def _getRSpecOutput(logger, rspec, slicename, urn, url, message, slivers=None):
     '''Get the header, rspec content, and retVal for writing the given RSpec to a file'''
     # Create HEADER
@@ -723,14 +734,18 @@ def _getRSpecOutput(logger, rspec, slicename, urn, url, message, slivers=None):
     if rspec and rspec_util.is_rspec_string( rspec, None, None, logger=logger ):
         # This line seems to insert extra \ns - GCF ticket #202
 #        content = rspec_util.getPrettyRSpec(rspec)
-        content = string.replace(rspec, "\\n", '\n')
+        # Avoid copying a large RSpec if there is nothing to replace
+        if "\\n" in rspec:
+            content = string.replace(rspec, "\\n", '\n')
+        else:
+            content = rspec
 #        content = rspec
         if slicename:
             retVal = "Got Reserved resources RSpec from %s" % server
         else:
             retVal = "Got RSpec from %s" % server
     else:
-        content = "<!-- No valid RSpec returned. -->"
+        content = _NO_RSPEC_CONTENT
         if rspec is not None:
             # FIXME: Diff for dev here?
             logger.warn("No valid RSpec returned: Invalid RSpec? Starts: %s...", str(rspec)[:min(40, len(rspec))])
@@ -755,10 +770,11 @@ def _getRSpecOutput(logger, rspec, slicename, urn, url, message, slivers=None):
             logger.warn(retVal)
     return header, content, retVal
 
-def _writeRSpec(opts, logger, rspec, slicename, urn, url, message=None, clientcount=1):
+def _writeRSpec(opts, logger, rspec, slicename, urn, url, message=None, clientcount=1, pretty=False):
     '''Write the given RSpec using _printResults.
     If given a slicename, label the output as a manifest.
-    Use rspec_util to check if this is a valid RSpec, and to format the RSpec nicely if so.
+    Use rspec_util to check if this is a valid RSpec.
+    If pretty, pretty print a valid RSpec as it is written.
     Do much of this using _getRSpecOutput
     Use _construct_output_filename to build the output filename.
     '''
@@ -779,15 +795,28 @@ def _writeRSpec(opts, logger, rspec, slicename, urn, url, message=None, clientco
     if filename or (rspec is not None and str(rspec).strip() != ''):
         # Create FILE
         # This prints or logs results, depending on whether filename is None
-        _printResults(opts, logger, header, content, filename)
+        _printResults(opts, logger, header, content, filename,
+                      prettyRSpec=(pretty and content is not None and not content.startswith(_NO_RSPEC_CONTENT)))
     return retVal, filename
 # End of _writeRSpec
 
-def _printResults(opts, logger, header, content, filename=None):
+@timing.timed('output_write')
+def _printResults(opts, logger, header, content, filename=None, prettyRSpec=False):
     """Print header string and content string to file of given
     name. If filename is none, then log to info.
     If --tostdout option, then instead of logging, print to STDOUT.
+    If the filename ends in '.gz', write the file gzip compressed.
+    Content is written to files in pieces, so large RSpecs are not copied.
+    If prettyRSpec, content is an XML RSpec to pretty print. It is pretty
+    printed straight into the file as it is parsed (or, if it is not well
+    formed, written as is).
     """
+    if prettyRSpec and content is not None:
+        if filename is not None:
+            if _printPrettyRSpec(logger, header, content, filename):
+                return
+        else:
+            content = rspec_util.getPrettyRSpec(content)
     cstart = 0
     # If the content is a single quote quoted XML doc then just drop those single quotes
     if content is not None and content.startswith("'<?xml") and content.endswith("'"):
@@ -837,11 +866,7 @@ def _printResults(opts, logger, header, content, filename=None):
             else:
                 print content[cstart:] + "\n"
     else:
-        fdir = os.path.dirname(filename)
-        if fdir and fdir != "":
-            if not os.path.exists(fdir):
-                os.makedirs(fdir)
-        with open(filename,'w') as file:
+        with _openOutputFile(filename) as file:
             logger.info( "Writing to '%s'"%(filename))
             if header is not None:
                 if cstart > 0:
@@ -861,10 +886,39 @@ def _printResults(opts, logger, header, content, filename=None):
                 pre = ""
                 if cstart > 0:
                     pre += "  "
-                file.write( pre + content[cstart:] )
+                file.write( pre )
+                for i in xrange(cstart, len(content), rspec_util.RSPEC_CHUNK_SIZE):
+                    file.write( content[i:i+rspec_util.RSPEC_CHUNK_SIZE] )
                 file.write( "\n" )
 # End of _printResults
 
+def _openOutputFile(filename):
+    '''Open the named output file for writing, making its directory if
+    need be. Files named '.gz' are written gzip compressed.'''
+    fdir = os.path.dirname(filename)
+    if fdir and fdir != "":
+        if not os.path.exists(fdir):
+            os.makedirs(fdir)
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'wb')
+    return open(filename, 'wb')
+
+def _printPrettyRSpec(logger, header, rspec, filename):
+    '''Write the given RSpec to the named file, pretty printed as it is
+    parsed, with the given header after the XML declaration.
+    Return False (having written a partial file) if the RSpec is not
+    well formed XML.'''
+    if header is not None:
+        header = "  " + header
+    try:
+        with _openOutputFile(filename) as file:
+            logger.info( "Writing to '%s'"%(filename))
+            rspec_util.writePrettyRSpec(rspec, file, header=header)
+    except xml.parsers.expat.ExpatError, e:
+        logger.debug("Could not pretty print RSpec for %s: %s", filename, e)
+        return False
+    return True
+
 def _maybe_save_slicecred(handler, name, slicecred):
     """Save slice credential to a file, returning the filename or
     None on error or config not specifying -o
@@ -0,0 +1,106 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Run calls in parallel threads, for Omni commands (and stitcher) that
+make many independent calls to aggregates or the clearinghouse.
+"""
+
+from __future__ import absolute_import
+
+import Queue
+import sys
+import threading
+
+def callInParallel(func, argsList, maxThreads, name="worker", waitOnInterrupt=False,
+                   onResult=None):
+    '''Call func(*args) for each tuple of args in argsList, running at most
+    maxThreads calls at once, each in its own thread.
+    Return a list of (result, exc_info) pairs, in the order of argsList.
+    exc_info is None, or the sys.exc_info() of the exception that call raised.
+    If given, onResult(i, result, exc_info) is called as each call finishes,
+    for argsList[i], by the thread that made the call. Only one onResult
+    call runs at a time. Exceptions from onResult are raised here, after
+    the calls in progress finish.
+    On KeyboardInterrupt the calls in progress are left running, unless
+    waitOnInterrupt: then no more calls are started, and the calls in
+    progress are waited for (until another KeyboardInterrupt) before
+    the KeyboardInterrupt is raised.'''
+    results = [(None, None)] * len(argsList)
+    todo = Queue.Queue()
+    for item in enumerate(argsList):
+        todo.put(item)
+    stop = threading.Event()
+    resultLock = threading.Lock()
+    resultErrors = []
+
+    def worker():
+        while not stop.isSet():
+            try:
+                (i, args) = todo.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[i] = (func(*args), None)
+            except Exception:
+                results[i] = (None, sys.exc_info())
+            if onResult is not None:
+                with resultLock:
+                    try:
+                        onResult(i, *results[i])
+                    except Exception:
+                        # Start no more calls
+                        resultErrors.append(sys.exc_info())
+                        stop.set()
+
+    def raiseResultError():
+        if resultErrors:
+            exc_info = resultErrors[0]
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+    if maxThreads < 2 or len(argsList) < 2:
+        worker()
+        raiseResultError()
+        return results
+
+    threads = []
+    for i in range(min(maxThreads, len(argsList))):
+        thread = threading.Thread(target=worker, name="%s-%d" % (name, i))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    def join():
+        for thread in threads:
+            # Join with a timeout so Ctrl-C still works
+            while thread.is_alive():
+                thread.join(0.5)
+    try:
+        join()
+    except KeyboardInterrupt:
+        if not waitOnInterrupt:
+            raise
+        exc_info = sys.exc_info()
+        stop.set()
+        join()
+        raise exc_info[0], exc_info[1], exc_info[2]
+    raiseResultError()
+    return results
@@ -0,0 +1,277 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+'''
+Lightweight timing instrumentation for Omni and stitcher.
+
+Records one entry per _do_ssl call (server URL, XML-RPC method, bytes
+sent and received, TLS connect time, server time, retries, busy waits
+and result code), plus named spans for client side phases like fetching
+credentials, parsing RSpecs and writing output.
+
+Instrumentation is off unless a report has been started (see the Omni
+option --timing-report). When off, every hook is a cheap no-op.
+The report is written as JSON lines (one record per line), or as a
+Chrome trace file (load it in chrome://tracing).
+'''
+
+from __future__ import absolute_import
+
+import json
+import os
+import re
+import threading
+import time
+
+JSONL_FORMAT = 'jsonl'
+CHROME_FORMAT = 'chrome'
+FORMATS = (JSONL_FORMAT, CHROME_FORMAT)
+
+# Pull the XML-RPC method name from the start of a request body
+_METHOD_NAME_RE = re.compile(r'<methodName>([^<]*)</methodName>')
+
+class TimingReport(object):
+    '''Collects call and span records from all threads, and writes them out.'''
+
+    def __init__(self, filename, fmt=JSONL_FORMAT):
+        if fmt not in FORMATS:
+            raise ValueError("Unknown timing report format '%s' (use one of %s)" % (fmt, ", ".join(FORMATS)))
+        self.filename = filename
+        self.format = fmt
+        self.records = []
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        with self._lock:
+            self.records.append(record)
+
+    def write(self, filename=None):
+        '''Write the records (sorted by start time) to the given file or our filename.'''
+        if filename is None:
+            filename = self.filename
+        with self._lock:
+            records = sorted(self.records, key=lambda r: r['start'])
+        fdir = os.path.dirname(filename)
+        if fdir and not os.path.exists(fdir):
+            os.makedirs(fdir)
+        with open(filename, 'w') as f:
+            if self.format == CHROME_FORMAT:
+                json.dump(_toChromeTrace(records), f)
+                f.write('\n')
+            else:
+                for record in records:
+                    f.write(json.dumps(record, sort_keys=True))
+                    f.write('\n')
+        return filename
+
+def _toChromeTrace(records):
+    '''Convert our records to Chrome trace 'complete' events, in microseconds.'''
+    pid = os.getpid()
+    events = []
+    for record in records:
+        args = dict((k, v) for (k, v) in record.iteritems() if k not in ('start', 'duration', 'thread', 'type', 'name'))
+        events.append({'name': record['name'],
+                       'cat': record['type'],
+                       'ph': 'X',
+                       'ts': int(record['start'] * 1000000),
+                       'dur': int(record['duration'] * 1000000),
+                       'pid': pid,
+                       'tid': record['thread'],
+                       'args': args})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+# The report in progress, if any
+_report = None
+_state = threading.local()
+
+def start_report(filename, fmt=JSONL_FORMAT):
+    '''Start collecting timing records to be written to filename.
+    Return True if this started a new report; False if filename is
+    empty or a report is already in progress (as when stitcher calls Omni).
+    Whoever gets True should call finish_report() when done.'''
+    global _report
+    if not filename or _report is not None:
+        return False
+    _report = TimingReport(os.path.normpath(os.path.expanduser(filename)), fmt or JSONL_FORMAT)
+    return True
+
+def finish_report():
+    '''Write out the report in progress and stop collecting. Return the filename written, or None.'''
+    global _report
+    report = _report
+    _report = None
+    if report is None:
+        return None
+    return report.write()
+
+def is_enabled():
+    return _report is not None
+
+def _callStack():
+    stack = getattr(_state, 'calls', None)
+    if stack is None:
+        stack = []
+        _state.calls = stack
+    return stack
+
+def begin_call(reason):
+    '''Start a call record for a _do_ssl call, or return None if not collecting.'''
+    if _report is None:
+        return None
+    call = {'type': 'call',
+            'name': reason,
+            'reason': reason,
+            'url': None,
+            'method': None,
+            'start': time.time(),
+            'thread': threading.current_thread().name,
+            'attempts': 0,
+            'busy_waits': 0,
+            'busy_wait_secs': 0.0,
+            'bytes_out': 0,
+            'bytes_in': 0,
+            'tls_connect_secs': None,
+            'server_secs': 0.0}
+    _callStack().append(call)
+    return call
+
+def end_call(call, result=None, message=None, error=None):
+    '''Finish the given call record with its result, and save it.'''
+    if call is None:
+        return
+    call['duration'] = time.time() - call['start']
+    call['retries'] = max(call['attempts'] - 1, 0)
+    call['result'] = _resultCode(result, message, error)
+    if call['method']:
+        call['name'] = call['method']
+    stack = _callStack()
+    for i in range(len(stack) - 1, -1, -1):
+        if stack[i] is call:
+            del stack[i]
+            break
+    report = _report
+    if report is not None:
+        report.add(call)
+
+def _resultCode(result, message, error):
+    if error is not None:
+        return "%s: %s" % (error.__class__.__name__, error)
+    if isinstance(result, dict) and result.has_key('code'):
+        code = result['code']
+        if isinstance(code, dict) and code.has_key('geni_code'):
+            return code['geni_code']
+        return code
+    if result is None and message:
+        return "error: %s" % message
+    return 0
+
+def note_attempt(call):
+    if call is not None:
+        call['attempts'] += 1
+
+def note_busy_wait(call, secs):
+    if call is not None:
+        call['busy_waits'] += 1
+        call['busy_wait_secs'] += secs
+
+def _currentCall():
+    stack = getattr(_state, 'calls', None)
+    if stack:
+        return stack[-1]
+    return None
+
+# Hooks used by the XML-RPC transports in omnilib/xmlrpc/client.py
+# Measurements go to the innermost call in progress on this thread.
+
+def note_connect(secs):
+    call = _currentCall()
+    if call is not None:
+        call['tls_connect_secs'] = (call['tls_connect_secs'] or 0.0) + secs
+
+def note_request(url, body):
+    '''Note the URL, XML-RPC method and size of a request being sent.'''
+    call = _currentCall()
+    if call is not None:
+        call['url'] = url
+        call['bytes_out'] += len(body)
+        match = _METHOD_NAME_RE.search(body[:512])
+        if match:
+            call['method'] = match.group(1)
+
+def note_response(server_secs, nbytes):
+    '''Note the server time (request sent to response received) and size of a response.'''
+    call = _currentCall()
+    if call is not None:
+        if server_secs is not None:
+            call['server_secs'] += server_secs
+        call['bytes_in'] += nbytes
+
+class _Span(object):
+    '''Context manager recording how long a named client phase takes.'''
+
+    def __init__(self, name, attrs):
+        self.record = {'type': 'span', 'name': name}
+        self.record.update(attrs)
+
+    def __enter__(self):
+        self.record['thread'] = threading.current_thread().name
+        self.record['start'] = time.time()
+        return self.record
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.record['duration'] = time.time() - self.record['start']
+        if exc_type is not None:
+            self.record['error'] = exc_type.__name__
+        report = _report
+        if report is not None:
+            report.add(self.record)
+        return False
+
+class _NoSpan(object):
+    def __enter__(self):
+        return None
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+_NO_SPAN = _NoSpan()
+
+def span(name, **attrs):
+    '''Time a client side phase:
+        with timing.span('rspec_parse'):
+            ...
+    Extra keyword arguments are saved with the record.'''
+    if _report is None:
+        return _NO_SPAN
+    return _Span(name, attrs)
+
+def timed(name):
+    '''Decorator to time every call of a function as a span of the given name.'''
+    def decorator(fn):
+        def wrapper(*args, **kwargs):
+            if _report is None:
+                return fn(*args, **kwargs)
+            with _Span(name, {}):
+                return fn(*args, **kwargs)
+        wrapper.__name__ = fn.__name__
+        wrapper.__doc__ = fn.__doc__
+        return wrapper
+    return decorator
@@ -25,10 +25,119 @@ import httplib
 import os
 import socket
 import ssl
+import time
 import urllib
 import xmlrpclib
 
-class SafeTransportWithCert(xmlrpclib.SafeTransport):
+from ...geni.util import xmlrpc_codec
+from ..util import timing
+
+class _CountingResponse:
+    '''Wrap an HTTP response, counting the bytes read from it.'''
+    def __init__(self, response):
+        self._response = response
+        self.nbytes = 0
+
+    def read(self, *args):
+        data = self._response.read(*args)
+        self.nbytes += len(data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+# Hosts (host[:port] as in the server URL) whose XML-RPC servers have
+# said, with an Accept-Encoding response header (RFC 7694), that they
+# accept gzip compressed requests
+_gzipHosts = set()
+
+def _acceptsGzip(acceptEncoding):
+    '''Does this Accept-Encoding header value allow gzip?'''
+    for coding in acceptEncoding.split(','):
+        params = coding.split(';')
+        if params[0].strip().lower() != 'gzip':
+            continue
+        for param in params[1:]:
+            (name, sep, value) = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    return float(value) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
+
+class CodecTransportMixin:
+    '''Mixin for our SSL transports that parses responses with the
+    faster gcf XML-RPC codec, and gzips large requests to servers that
+    have said they accept gzip. xmlrpclib already asks for and decodes
+    gzip responses.'''
+
+    _codecHost = None
+
+    def request(self, host, handler, request_body, verbose=0):
+        self._codecHost = host
+        if host in _gzipHosts:
+            self.encode_threshold = xmlrpc_codec.GZIP_THRESHOLD
+        return xmlrpclib.SafeTransport.request(self, host, handler, request_body, verbose)
+
+    def getparser(self):
+        return xmlrpc_codec.getparser(use_datetime=self._use_datetime)
+
+    def parse_response(self, response):
+        # As xmlrpclib, but feeding the parser larger chunks
+        stream = response
+        if hasattr(response, 'getheader'):
+            if self._codecHost is not None and \
+                    _acceptsGzip(response.getheader("Accept-Encoding", "")):
+                _gzipHosts.add(self._codecHost)
+            if response.getheader("Content-Encoding", "") == "gzip":
+                stream = xmlrpclib.GzipDecodedResponse(response)
+
+        p, u = self.getparser()
+        while True:
+            data = stream.read(xmlrpc_codec.TEXT_BUFFER_SIZE)
+            if not data:
+                break
+            if self.verbose:
+                print "body:", repr(data)
+            p.feed(data)
+
+        if stream is not response:
+            stream.close()
+        p.close()
+        return u.close()
+
+class TimedTransportMixin:
+    '''Mixin for our SSL transports that feeds request and response
+    sizes and server time to the Omni timing report, if enabled.'''
+
+    _timingSent = None
+
+    def request(self, host, handler, request_body, verbose=0):
+        if timing.is_enabled():
+            timing.note_request("https://%s%s" % (host, handler), request_body)
+            self._timingSent = None
+        return CodecTransportMixin.request(self, host, handler, request_body, verbose)
+
+    def send_content(self, connection, request_body):
+        xmlrpclib.SafeTransport.send_content(self, connection, request_body)
+        self._timingSent = time.time()
+
+    def parse_response(self, response):
+        if not timing.is_enabled():
+            return CodecTransportMixin.parse_response(self, response)
+        serverSecs = None
+        if self._timingSent is not None:
+            serverSecs = time.time() - self._timingSent
+        counted = _CountingResponse(response)
+        try:
+            return CodecTransportMixin.parse_response(self, counted)
+        finally:
+            timing.note_response(serverSecs, counted.nbytes)
+
+class SafeTransportWithCert(TimedTransportMixin, CodecTransportMixin,
+                            xmlrpclib.SafeTransport):
     '''Sample client for talking XMLRPC over SSL supplying
     a client X509 identity certificate.'''
 
@@ -96,6 +205,7 @@ class TLS1HTTPSConnection(httplib.HTTPSConnection):
 
     def connect(self):
         import sys
+        start = time.time()
         if sys.version_info >= (2,7,0):
             sock = socket.create_connection((self.host, self.port), self.timeout, self.source_address)
         else:
@@ -126,6 +236,8 @@ class TLS1HTTPSConnection(httplib.HTTPSConnection):
         else:
             # Python 2.6 doesn't let you specify the ciphers to use
             self.sock = ssl.wrap_socket(sock, self.key_file, self.cert_file, ssl_version=self.ssl_version)
+        # TCP connect plus TLS handshake
+        timing.note_connect(time.time() - start)
 
 # For Python2.6 safe transport, use our custom HTTPSConnection
 class TLS1P26HTTPS(httplib.HTTPS):
@@ -134,7 +246,8 @@ class TLS1P26HTTPS(httplib.HTTPS):
                  strict=None):
         httplib.HTTPS.__init__(self, host, port, key_file, cert_file, strict)
 
-class SafeTransportNoCert(xmlrpclib.SafeTransport):
+class SafeTransportNoCert(TimedTransportMixin, CodecTransportMixin,
+                          xmlrpclib.SafeTransport):
     # A standard SafeTransport that honors the requested SSL timeout
     def __init__(self, use_datetime=0, timeout=None, ssl_version=ssl.PROTOCOL_TLSv1, ciphers=None):
         # Ticket #776: As of Python 2.7.9, server certs are verified by default.
@@ -104,6 +104,7 @@ from __future__ import absolute_import
       Other functions:
        [string dictionary] = omni.py nicknames # List aggregate and rspec nicknames    
        [string dictionary] = omni.py print_sliver_expirations SLICENAME
+       [string listOfSliceDictionaries] = omni.py expirationreport USER
 """
 
 import ConfigParser
@@ -118,6 +119,7 @@ import sys
 import urllib2
 
 from .omnilib.util import OmniError, AMAPIError
+from .omnilib.util import timing
 from .omnilib.handler import CallHandler
 from .omnilib.util.handler_utils import validate_url, printNicknames
 
@@ -771,8 +773,23 @@ if __name__ == "__main__":
         raise OmniError("Invalid argv argument to call: must be a list")
 
     framework, config, args, opts = initialize(argv, options, dictLoggingConfig)
-    # process the user's call
-    return API_call( framework, config, args, opts, verbose=verbose )
+    # Collect a timing report if requested (and not already collecting one, as in stitcher)
+    startedTimingReport = timing.start_report(opts.timingReport, opts.timingFormat)
+    try:
+        # process the user's call
+        return API_call( framework, config, args, opts, verbose=verbose )
+    finally:
+        if startedTimingReport:
+            finishTimingReport(config['logger'])
+
+def finishTimingReport(logger):
+    '''Write out the timing report started per the --timing-report option'''
+    try:
+        fname = timing.finish_report()
+        if fname:
+            logger.info("Wrote timing report to '%s'", fname)
+    except Exception, e:
+        logger.warn("Failed to write timing report: %s", e)
 
 def getOptsUsed(parser, opts, logger=None):
     '''Get string to print out the options supplied'''
@@ -1053,6 +1070,7 @@ def getParser():
  \t\tOther functions: \n\
  \t\t\t nicknames \n\
  \t\t\t print_sliver_expirations <slicename> \n\
+ \t\t\t expirationreport [optional: username] \n\
 \n\t See README-omni.txt for details.\n\
 \t And see the Omni website at https://github.com/GENI-NSF/geni-tools/wiki."
 
@@ -1150,6 +1168,9 @@ def getParser():
     # If this next is set, then options.output is also set
     filegroup.add_option("--outputfile",  default=None, metavar="OUTPUT_FILENAME",
                       help="Name of file to write output to (instead of Omni picked name). '%a' will be replaced by servername, '%s' by slicename if any. Implies -o. Note that for multiple aggregates, without a '%a' in the name, only the last aggregate output will remain in the file. Will ignore -p.")
+    filegroup.add_option("--gzipOutput", default=False, action="store_true",
+                      help="Write RSpec (XML) output files gzip compressed, naming them '.xml.gz' (used with -o). " + \
+                          "Files named with --outputfile are compressed if the name ends in '.gz'.")
     filegroup.add_option("--usercredfile", default=os.getenv("GENI_USERCRED", None), metavar="USER_CRED_FILENAME",
                       help="Name of user credential file to read from if it exists, or save to when running like '--usercredfile " + 
                          "myUserCred.xml -o getusercred'. Defaults to value of 'GENI_USERCRED' environment variable if defined.")
@@ -1212,6 +1233,8 @@ def getParser():
                               "performoperationalaction. Default is false - your omni_config users are read and used.")
     devgroup.add_option("--ssltimeout", default=360, action="store", type="float",
                         help="Seconds to wait before timing out AM and CH calls. Default is %default seconds.")
+    devgroup.add_option("--reportThreads", default=8, type="int",
+                        help="Number of slice credential fetches and aggregate calls expirationreport makes at once. Default is %default.")
     devgroup.add_option("--noExtraCHCalls", default=False, action="store_true",
                         help="Disable extra Clearinghouse calls like reporting slivers. Default is %default.")
     devgroup.add_option("--devmode", default=False, action="store_true",
@@ -1221,6 +1244,13 @@ def getParser():
                       help="In AM API v2, if an AM returns a non-0 (failure) result code, raise an AMAPIError. Default is %default. For use by scripts.")
     devgroup.add_option("--maxBusyRetries", default=4, action="store", type="int",
                       help="Max times to retry AM or CH calls on getting a 'busy' error. Default: %default")
+    devgroup.add_option("--timing-report", dest="timingReport", default=None, metavar="TIMING_FILENAME",
+                      help="Record per call timing (server, method, bytes, TLS connect and server time, retries, busy waits, result) " + \
+                          "and time spent in client phases, and write it to this file at the end of the run.")
+    devgroup.add_option("--timing-format", dest="timingFormat", default=timing.JSONL_FORMAT,
+                      type="choice", choices=timing.FORMATS,
+                      help="Format of the --timing-report file: 'jsonl' for one JSON record per line, " + \
+                          "or 'chrome' for a Chrome trace file (see chrome://tracing). Default: %default")
     devgroup.add_option("--no-compress", dest='geni_compressed', 
                       default=True, action="store_false",
                       help="Do not compress returned values")
@@ -1329,7 +1359,13 @@ def main(argv=None):
         argv = sys.argv[1:]
     try:
         framework, config, args, opts = initialize(argv)
-        API_call(framework, config, args, opts, verbose=opts.verbose)
+        # Collect a timing report if requested
+        startedTimingReport = timing.start_report(opts.timingReport, opts.timingFormat)
+        try:
+            API_call(framework, config, args, opts, verbose=opts.verbose)
+        finally:
+            if startedTimingReport:
+                finishTimingReport(config['logger'])
     except AMAPIError, ae:
         if ae.returnstruct and isinstance(ae.returnstruct, dict) and ae.returnstruct.has_key('code'):
             if isinstance(ae.returnstruct['code'], int) or isinstance(ae.returnstruct['code'], str):
@@ -93,6 +93,10 @@ class ABACCredential(Credential):
 
     ABAC_CREDENTIAL_TYPE = 'geni_abac'
 
+    # Decode fully when loaded: the speaks-for checks use the signature
+    # and expiration attributes directly
+    _lazy_decode = False
+
     def __init__(self, create=False, subject=None, 
                  string=None, filename=None):
         self.head = None # An ABACElemenet
@@ -297,6 +297,10 @@ class Keypair:
 # from a file or a string, the parent chain will be automatically loaded.
 # When saving a certificate to a file or a string, the caller can choose
 # whether to save the parent certificates as well.
+#
+# Things we read from the X509 certificate (the M2Crypto form of the cert,
+# its extensions, public key and subject) are decoded once and cached.
+# Anything that changes the certificate clears the cache.
 
 class Certificate:
     digest = "sha256"
@@ -307,6 +311,14 @@ class Certificate:
     parent = None
     isCA = None # will be a boolean once set
 
+    # Decoded forms of cert, filled in as needed. See _clear_decoded.
+    _m2x509 = None
+    _extensions = None
+    _extension_list = None
+    _pubkey = None
+    _names = None
+    _printable_subject = None
+
     separator="-----parent-----"
 
     ##
@@ -338,6 +350,7 @@ class Certificate:
     # Create a blank X509 certificate and store it in this object.
 
     def create(self, lifeDays=1825):
+        self._clear_decoded()
         self.cert = crypto.X509()
         # FIXME: Use different serial #s
         self.cert.set_serial_number(3)
@@ -351,6 +364,7 @@ class Certificate:
     # certificate object.
 
     def load_from_pyopenssl_x509(self, x509):
+        self._clear_decoded()
         self.cert = x509
 
     ##
@@ -386,6 +400,7 @@ class Certificate:
         else:
             parts = string.split(Certificate.separator, 1)
 
+        self._clear_decoded()
         self.cert = crypto.load_certificate(crypto.FILETYPE_PEM, parts[0])
 
         if self.cert is None:
@@ -475,8 +490,7 @@ class Certificate:
     # Get the issuer name
 
     def get_issuer(self, which="CN"):
-        x = self.cert.get_issuer()
-        return getattr(x, which)
+        return self._get_name_part('issuer', which)
 
     ##
     # Set the subject name of the certificate
@@ -490,20 +504,34 @@ class Certificate:
         else:
             setattr(subj, "CN", name)
         self.cert.set_subject(subj)
+        self._clear_decoded()
 
     ##
     # Get the subject name of the certificate
 
     def get_subject(self, which="CN"):
-        x = self.cert.get_subject()
-        return getattr(x, which)
+        return self._get_name_part('subject', which)
+
+    def _get_name_part(self, kind, which):
+        if self._names is None:
+            self._names = {}
+        key = (kind, which)
+        if not self._names.has_key(key):
+            if kind == 'issuer':
+                x = self.cert.get_issuer()
+            else:
+                x = self.cert.get_subject()
+            self._names[key] = getattr(x, which)
+        return self._names[key]
 
     ##
     # Get a pretty-print subject name of the certificate
 
     def get_printable_subject(self):
-        x = self.cert.get_subject()
-        return "[ OU: %s, CN: %s, SubjectAltName: %s ]" % (getattr(x, "OU"), getattr(x, "CN"), self.get_data())
+        if self._printable_subject is None:
+            x = self.cert.get_subject()
+            self._printable_subject = "[ OU: %s, CN: %s, SubjectAltName: %s ]" % (getattr(x, "OU"), getattr(x, "CN"), self.get_data())
+        return self._printable_subject
 
     ##
     # Get the public key of the certificate.
@@ -513,17 +541,42 @@ class Certificate:
     def set_pubkey(self, key):
         assert(isinstance(key, Keypair))
         self.cert.set_pubkey(key.get_openssl_pkey())
+        self._clear_decoded()
 
     ##
     # Get the public key of the certificate.
-    # It is returned in the form of a Keypair object.
+    # It is returned in the form of a Keypair object, which is shared
+    # by later calls, so don't change it.
 
     def get_pubkey(self):
-        m2x509 = X509.load_cert_string(self.save_to_string())
-        pkey = Keypair()
-        pkey.key = self.cert.get_pubkey()
-        pkey.m2key = m2x509.get_pubkey()
-        return pkey
+        if self._pubkey is None:
+            pkey = Keypair()
+            pkey.key = self.cert.get_pubkey()
+            pkey.m2key = self.get_m2x509().get_pubkey()
+            self._pubkey = pkey
+        return self._pubkey
+
+    ##
+    # Return the M2Crypto form of this certificate (not including parents),
+    # for the things pyOpenSSL can't do. Loaded once until the certificate
+    # changes.
+
+    def get_m2x509(self):
+        if self._m2x509 is None:
+            self._m2x509 = X509.load_cert_string(crypto.dump_certificate(crypto.FILETYPE_PEM, self.cert))
+        return self._m2x509
+
+    ##
+    # Forget the decoded forms of the certificate. Called whenever
+    # the certificate changes.
+
+    def _clear_decoded(self):
+        self._m2x509 = None
+        self._extensions = None
+        self._extension_list = None
+        self._pubkey = None
+        self._names = None
+        self._printable_subject = None
 
     def set_intermediate_ca(self, val):
         return self.set_is_ca(val)
@@ -577,27 +630,32 @@ class Certificate:
 
         ext = crypto.X509Extension (name, critical, value)
         self.cert.add_extensions([ext])
+        self._clear_decoded()
 
     ##
-    # Get an X509 extension from the certificate
+    # Get an X509 extension from the certificate.
+    # Raises LookupError if the certificate has no such extension.
 
     def get_extension(self, name):
 
         if name is None:
             return None
 
-        certstr = self.save_to_string()
-        if certstr is None or certstr == "":
-            return None
-        # pyOpenSSL does not have a way to get extensions
-        m2x509 = X509.load_cert_string(certstr)
-        if m2x509 is None:
-            logger.warn("No cert loaded in get_extension")
-            return None
-        if m2x509.get_ext(name) is None:
+        if self.cert is None:
             return None
-        value = m2x509.get_ext(name).get_value()
-
+        if self._extensions is None:
+            self._extensions = {}
+        if not self._extensions.has_key(name):
+            # pyOpenSSL does not have a way to get extensions.
+            # Remember the value, or that there is no such extension.
+            try:
+                self._extensions[name] = self.get_m2x509().get_ext(name).get_value()
+            except LookupError:
+                self._extensions[name] = None
+                raise
+        value = self._extensions[name]
+        if value is None:
+            raise LookupError(name)
         return value
 
     ##
@@ -638,6 +696,7 @@ class Certificate:
         assert self.issuerKey != None
         self.cert.set_issuer(self.issuerSubject)
         self.cert.sign(self.issuerKey.get_openssl_pkey(), self.digest)
+        self._clear_decoded()
 
     ##
     # Verify the authenticity of a certificate.
@@ -646,7 +705,7 @@ class Certificate:
 
     def verify(self, pkey):
         # pyOpenSSL does not have a way to verify signatures
-        m2x509 = X509.load_cert_string(self.save_to_string())
+        m2x509 = self.get_m2x509()
         m2pkey = pkey.get_m2_pkey()
         # verify it
         return m2x509.verify(m2pkey)
@@ -772,14 +831,16 @@ class Certificate:
     ### more introspection
     def get_extensions(self):
         # pyOpenSSL does not have a way to get extensions
-        triples=[]
-        m2x509 = X509.load_cert_string(self.save_to_string())
-        nb_extensions=m2x509.get_ext_count()
-        logger.debug("X509 had %d extensions"%nb_extensions)
-        for i in range(nb_extensions):
-            ext=m2x509.get_ext_at(i)
-            triples.append( (ext.get_name(), ext.get_value(), ext.get_critical(),) )
-        return triples
+        if self._extension_list is None:
+            triples=[]
+            m2x509 = self.get_m2x509()
+            nb_extensions=m2x509.get_ext_count()
+            logger.debug("X509 had %d extensions"%nb_extensions)
+            for i in range(nb_extensions):
+                ext=m2x509.get_ext_at(i)
+                triples.append( (ext.get_name(), ext.get_value(), ext.get_critical(),) )
+            self._extension_list = triples
+        return list(self._extension_list)
 
     def get_data_names(self):
         return self.data.keys()
@@ -42,6 +42,7 @@ try:
 except:
     pass
 
+from xml.parsers import expat
 from xml.parsers.expat import ExpatError
 
 from ..util.faults import CredentialNotVerifiable, ChildRightsNotSubsetOfParent
@@ -50,7 +51,7 @@ from ..util.sfatime import utcparse
 from ..util.xrn import urn_to_hrn, hrn_authfor_hrn
 from .credential_legacy import CredentialLegacy
 from .rights import Right, Rights, determine_rights
-from .gid import GID
+from .gid import GID, gid_from_string
 
 # 2 weeks, in seconds 
 DEFAULT_CREDENTIAL_LIFETIME = 86400 * 31
@@ -145,6 +146,149 @@ def append_sub(doc, parent, element, text):
     ele.appendChild(doc.createTextNode(text))
     parent.appendChild(ele)
 
+##
+# Scan the XML of a credential with expat, without building a DOM, for the
+# fields of its credential element that say whether the credential
+# is worth verifying: the refid, expiration, owner and target URNs,
+# privileges, and whether it has a parent and a target GID. Also notes
+# whether the document is a signed-credential, and the text of the type
+# elements read. The scan stops at the end of that credential element, so
+# the parent credentials and signatures are not read, unless
+# whole_document is set.
+#
+# The only credential element scanned is the root element, or the first
+# child of a root signed-credential, which is the one that is signed.
+# Any other document has no credential, so that unsigned credential
+# elements elsewhere in it are never taken for the signed one.
+#
+# Fields that are missing or empty are None. complete says whether the
+# end of a credential element was found. Raises ExpatError on bad XML.
+
+class _ScanDone(Exception):
+    pass
+
+class CredentialScan(object):
+
+    def __init__(self, xml, whole_document=False):
+        self.is_signed = False
+        self.has_credential = False
+        self.complete = False
+        self.refid = None
+        self.expires = None
+        self.owner_urn = None
+        self.target_urn = None
+        self.privileges = []
+        self.has_parent = False
+        self.has_target_gid = False
+        self.types = []
+        self._scan(xml, whole_document)
+
+    def _scan(self, xml, whole_document):
+        state = {'inside': False, 'text': None, 'privilege': None,
+                 'type_text': None, 'depth': 0, 'first_child': True}
+        stack = []
+
+        def start(name, attrs):
+            if name == 'type':
+                self.types.append(None)
+                state['type_text'] = []
+            if not state['inside']:
+                depth = state['depth']
+                state['depth'] += 1
+                if depth == 0 and name == 'signed-credential':
+                    self.is_signed = True
+                    return
+                if depth == 1 and self.is_signed:
+                    if not state['first_child']:
+                        return
+                    state['first_child'] = False
+                elif depth != 0:
+                    return
+                if name == 'credential':
+                    state['inside'] = True
+                    self.has_credential = True
+                    self.refid = attrs.get('xml:id', '')
+                return
+            stack.append(name)
+            path = tuple(stack)
+            if path == ('parent',):
+                self.has_parent = True
+            elif path == ('target_gid',):
+                self.has_target_gid = True
+            elif path in (('expires',), ('owner_urn',), ('target_urn',)):
+                state['text'] = []
+            elif path == ('privileges', 'privilege'):
+                state['privilege'] = {}
+            elif path in (('privileges', 'privilege', 'name'),
+                          ('privileges', 'privilege', 'can_delegate')):
+                state['text'] = []
+
+        def end(name):
+            if state['type_text'] is not None:
+                self.types[-1] = "".join(state['type_text']) or None
+                state['type_text'] = None
+            if not state['inside']:
+                state['depth'] -= 1
+                return
+            if not stack:
+                # The end of the credential element
+                state['inside'] = False
+                state['depth'] -= 1
+                self.complete = True
+                if not whole_document:
+                    raise _ScanDone()
+                return
+            path = tuple(stack)
+            stack.pop()
+            text = state['text']
+            if text is not None:
+                state['text'] = None
+                value = "".join(text) or None
+                if len(path) == 1:
+                    setattr(self, name, value)
+                else:
+                    state['privilege'][name] = value
+            elif path == ('privileges', 'privilege'):
+                privilege = state['privilege']
+                state['privilege'] = None
+                self.privileges.append((privilege.get('name'),
+                                        privilege.get('can_delegate')))
+
+        def characters(data):
+            if state['text'] is not None:
+                state['text'].append(data)
+            if state['type_text'] is not None:
+                state['type_text'].append(data)
+
+        parser = expat.ParserCreate()
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        parser.CharacterDataHandler = characters
+        try:
+            parser.Parse(xml, True)
+        except _ScanDone:
+            pass
+
+##
+# The fields of a credential that decode_summary needs (see CredentialScan),
+# as a dict (privileges as a list of (name, can_delegate) string pairs), or
+# None if the credential doesn't have all of them.
+
+def scan_credential(xml):
+    scan = CredentialScan(xml)
+    if not scan.complete:
+        # Never found the end of a credential element
+        return None
+    for value in (scan.expires, scan.owner_urn, scan.target_urn):
+        if not value:
+            return None
+    for (name, can_delegate) in scan.privileges:
+        if name is None or can_delegate is None:
+            return None
+    return {'refid': scan.refid, 'expires': scan.expires,
+            'owner_urn': scan.owner_urn, 'target_urn': scan.target_urn,
+            'privileges': scan.privileges, 'has_parent': scan.has_parent}
+
 ##
 # Signature contains information about an xmlsec1 signature
 # for a signed-credential
@@ -261,6 +405,11 @@ class Credential(object):
 
     SFA_CREDENTIAL_TYPE = "geni_sfa"
 
+    # When loaded from XML, only scan it for the basic fields (see
+    # scan_credential), and wait to parse the GIDs, parents and
+    # signatures until something asks for them.
+    _lazy_decode = True
+
     ##
     # Create a Credential object
     #
@@ -272,17 +421,23 @@ class Credential(object):
     def __init__(self, create=False, subject=None, string=None, filename=None):
         self.gidCaller = None
         self.gidObject = None
+        self.owner_urn = None
+        self.target_urn = None
+        self._decoded = False
+        self._has_parent = False
         self.expiration = None
         self.privileges = None
         self.issuer_privkey = None
         self.issuer_gid = None
         self.issuer_pubkey = None
+        self.signer = None
         self.parent = None
         self.signature = None
         self.xml = None
         self.refid = None
         self.legacy = None
         self.cred_type = Credential.SFA_CREDENTIAL_TYPE
+        self._summary = None
 
         # Check if this is a legacy credential, translate it if so
         if string or filename:
@@ -296,7 +451,8 @@ class Credential(object):
                 self.translate_legacy(str)
             else:
                 self.xml = str
-                self.decode()
+                if not (self._lazy_decode and self.decode_summary()):
+                    self.decode()
 
         # Find an xmlsec1 path
         self.xmlsec_path = ''
@@ -313,13 +469,13 @@ class Credential(object):
 
     def get_subject(self):
         if not self.gidObject:
-            self.decode()
+            self.finish_decode()
         return self.gidObject.get_subject()
 
     # sounds like this should be __repr__ instead ??
     def get_summary_tostring(self):
         if not self.gidObject:
-            self.decode()
+            self.finish_decode()
         obj = self.gidObject.get_printable_subject()
         caller = self.gidCaller.get_printable_subject()
         exp = self.get_expiration()
@@ -328,7 +484,7 @@ class Credential(object):
 
     def get_signature(self):
         if not self.signature:
-            self.decode()
+            self.finish_decode()
         return self.signature
 
     def set_signature(self, sig):
@@ -362,6 +518,17 @@ class Credential(object):
         self.issuer_privkey = privkey
         self.issuer_gid = gid
 
+    ##
+    # Sign in process with the given CredentialSigner (see
+    # credential_signer), instead of calling out to xmlsec1.
+    # Sets the issuer keys to those of the signer.
+    #
+    # @param signer CredentialSigner of the issuing authority
+
+    def set_signer(self, signer):
+        self.signer = signer
+        self.set_issuer_keys(signer.keyfile, signer.certfile)
+
 
     ##
     # Set this credential's parent
@@ -369,6 +536,18 @@ class Credential(object):
         self.parent = cred
         self.updateRefID()
 
+    # The parent credential is only decoded when first used
+    def _get_parent(self):
+        if self._parent is None and self._has_parent and not self._decoded:
+            self.finish_decode()
+        return self._parent
+
+    def _set_parent(self, cred):
+        self._parent = cred
+
+    _parent = None
+    parent = property(_get_parent, _set_parent)
+
     ##
     # set the GID of the caller
     #
@@ -384,9 +563,23 @@ class Credential(object):
 
     def get_gid_caller(self):
         if not self.gidCaller:
-            self.decode()
+            self.finish_decode()
         return self.gidCaller
 
+    ##
+    # Get the URN of the caller (owner) of the credential. For a credential
+    # loaded from XML this is from the owner_urn element, without parsing
+    # the owner GID. Only use this to rule out credentials: it is the GID
+    # that gets verified.
+
+    def get_owner_urn(self):
+        if self.owner_urn:
+            return self.owner_urn
+        gid = self.get_gid_caller()
+        if gid is None:
+            return None
+        return gid.get_urn()
+
     ##
     # set the GID of the object
     #
@@ -400,8 +593,21 @@ class Credential(object):
 
     def get_gid_object(self):
         if not self.gidObject:
-            self.decode()
+            self.finish_decode()
         return self.gidObject
+
+    ##
+    # Get the URN of the object (target) of the credential. Like
+    # get_owner_urn, this doesn't parse the target GID when it doesn't
+    # have to, and is only good for ruling out credentials.
+
+    def get_target_urn(self):
+        if self.target_urn:
+            return self.target_urn
+        gid = self.get_gid_object()
+        if gid is None:
+            return None
+        return gid.get_urn()
             
     ##
     # Expiration: an absolute UTC time of expiration (as either an int or string or datetime)
@@ -567,7 +773,7 @@ class Credential(object):
                     # Below throws InUse exception if we forgot to clone the attribute first
                     oldAttr = signed_cred.setAttributeNode(attr.cloneNode(True))
                     if oldAttr and oldAttr.value != attr.value:
-                        msg = "Delegating cred from owner %s to %s over %s:\n - Replaced attribute %s value '%s' with '%s'" % (self.parent.gidCaller.get_urn(), self.gidCaller.get_urn(), self.gidObject.get_urn(), oldAttr.name, oldAttr.value, attr.value)
+                        msg = "Delegating cred from owner %s to %s over %s:\n - Replaced attribute %s value '%s' with '%s'" % (self.parent.get_gid_caller().get_urn(), self.gidCaller.get_urn(), self.gidObject.get_urn(), oldAttr.name, oldAttr.value, attr.value)
                         logger.warn(msg)
                         #raise CredentialNotVerifiable("Can't encode new valid delegated credential: %s" % msg)
 
@@ -674,6 +880,13 @@ class Credential(object):
         if not self.issuer_gid:
             logger.warn("Cannot sign credential (no issuer gid)")
             return
+        if self.signer:
+            self.xml = self.signer.sign_xml(self.get_xml(), self.get_refid())
+            if self.legacy:
+                self.legacy = None
+            self.decode()
+            return
+
         doc = parseString(self.get_xml())
         sigs = doc.getElementsByTagName("signatures")[0]
 
@@ -720,6 +933,68 @@ class Credential(object):
         self.decode()       
 
 
+    ##
+    # Get the basic fields of the credential from the XML, without building
+    # a DOM or parsing any certificates (see scan_credential): the refid,
+    # expiration, owner and target URNs and privileges.
+    # The rest is decoded by finish_decode when first needed.
+    # Return False if the XML is not a credential we can do this for,
+    # in which case use decode().
+
+    def decode_summary(self):
+        if not self.xml:
+            return False
+        fields = scan_credential(self.xml)
+        if fields is None:
+            return False
+        self.set_refid(fields['refid'])
+        self.set_expiration(utcparse(fields['expires']))
+        self.owner_urn = fields['owner_urn'].strip()
+        self.target_urn = fields['target_urn'].strip()
+        rlist = Rights()
+        for (kind, can_delegate) in fields['privileges']:
+            deleg = str2bool(can_delegate)
+            if kind == '*':
+                # Convert * into the default privileges for the credential's type
+                _ , type = urn_to_hrn(self.target_urn)
+                rl = determine_rights(type, self.target_urn)
+                for r in rl.rights:
+                    r.delegate = deleg
+                    rlist.add(r)
+            else:
+                rlist.add(Right(kind.strip(), deleg))
+        self.set_privileges(rlist)
+        self._has_parent = fields['has_parent']
+        # For finish_decode to check against what decode() reads
+        self._summary = (self.expiration, rlist.save_to_string())
+        return True
+
+    ##
+    # Decode the rest of a credential loaded with decode_summary:
+    # the GIDs, parent credentials and signatures.
+    # Raise CredentialNotVerifiable if decode() reads a different
+    # expiration or privileges than decode_summary did. Anything set
+    # since (expiration, privileges) is kept.
+
+    def finish_decode(self):
+        if self._decoded:
+            return
+        expiration = self.expiration
+        privileges = self.privileges
+        self.decode()
+        summary = self._summary
+        self._summary = None
+        if summary is None:
+            return
+        (summary_expiration, summary_privileges) = summary
+        if summary_expiration != self.expiration or \
+                summary_privileges != self.privileges.save_to_string():
+            raise CredentialNotVerifiable("Malformed XML: Credential summary does not match the credential")
+        if expiration:
+            self.expiration = expiration
+        if privileges:
+            self.privileges = privileges
+
     ##
     # Retrieve the attributes of the credential from the XML.
     # This is automatically called by the various get_* methods of
@@ -728,6 +1003,9 @@ class Credential(object):
     def decode(self):
         if not self.xml:
             return
+        # Set first, so anything asking for the parent while we decode
+        # doesn't decode again
+        self._decoded = True
         doc = parseString(self.xml)
         sigs = []
         signed_cred = doc.getElementsByTagName("signed-credential")
@@ -764,7 +1042,7 @@ class Credential(object):
 #                    break
 #            if not found:
 #                raise CredentialNotVerifiable("Malformed XML: No owner_gid found")
-        self.gidCaller = GID(string=og)
+        self.gidCaller = gid_from_string(og)
         tg = getTextNode(cred, "target_gid")
 #        if tg is None:
 #            found = False
@@ -774,7 +1052,7 @@ class Credential(object):
 #                    break
 #            if not found:
 #                raise CredentialNotVerifiable("Malformed XML: No target_gid found")
-        self.gidObject = GID(string=tg)
+        self.gidObject = gid_from_string(tg)
 
         # Process privileges
         rlist = Rights()
@@ -1071,10 +1349,13 @@ class Credential(object):
             parent_cred.verify_parent(parent_cred.parent)
 
 
-    def delegate(self, delegee_gidfile, caller_keyfile, caller_gidfile):
+    def delegate(self, delegee_gidfile, caller_keyfile, caller_gidfile,
+                 signer=None):
         """
         Return a delegated copy of this credential, delegated to the 
         specified gid's user.    
+        If a CredentialSigner for the caller is given, sign with it
+        rather than with xmlsec1.
         """
         # get the gid of the object we are delegating
         object_gid = self.get_gid_object()
@@ -1096,6 +1377,8 @@ class Credential(object):
         dcred.get_privileges().delegate_all_privileges(True)
         #dcred.set_issuer_keys(keyfile, delegee_gidfile)
         dcred.set_issuer_keys(caller_keyfile, caller_gidfile)
+        if signer:
+            dcred.set_signer(signer)
         dcred.encode()
         dcred.sign()
 
@@ -0,0 +1,308 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+##
+# In-process signing of credentials.
+#
+# Produces the same enveloped XML signature that 'xmlsec1 --sign' produces
+# from the credential signature template: a SHA1 digest of the inclusive
+# canonical form (C14N 1.0) of the referenced credential, and an RSA-SHA1
+# signature over the canonical form of the SignedInfo. But without writing
+# the key, certificates and credential to temporary files and forking
+# xmlsec1 for every credential.
+#
+# A CredentialSigner loads the issuer key and certificate chain once, so
+# an authority can reuse it for every credential it issues.
+##
+
+from __future__ import absolute_import
+
+import base64
+import hashlib
+import threading
+from xml.dom import Node
+from xml.dom.minidom import parseString
+from xml.sax.saxutils import escape
+
+from ..util.faults import ConnectionKeyGIDMismatch
+from .certificate import Keypair
+from .gid import GID
+
+XML_NAMESPACE = 'http://www.w3.org/XML/1998/namespace'
+
+# Same as credential.signature_template, with the values filled in
+_signed_template = \
+'''<Signature xml:id="Sig_%(refid)s" xmlns="http://www.w3.org/2000/09/xmldsig#">
+  <SignedInfo>
+    <CanonicalizationMethod Algorithm="http://www.w3.org/TR/2001/REC-xml-c14n-20010315"/>
+    <SignatureMethod Algorithm="http://www.w3.org/2000/09/xmldsig#rsa-sha1"/>
+    <Reference URI="#%(refid)s">
+      <Transforms>
+        <Transform Algorithm="http://www.w3.org/2000/09/xmldsig#enveloped-signature" />
+      </Transforms>
+      <DigestMethod Algorithm="http://www.w3.org/2000/09/xmldsig#sha1"/>
+      <DigestValue>%(digest)s</DigestValue>
+    </Reference>
+  </SignedInfo>
+  <SignatureValue />
+  <KeyInfo>
+    <X509Data>
+%(x509data)s
+    </X509Data>
+    <KeyValue>
+<RSAKeyValue>
+<Modulus>
+%(modulus)s
+</Modulus>
+<Exponent>
+%(exponent)s
+</Exponent>
+</RSAKeyValue>
+    </KeyValue>
+  </KeyInfo>
+</Signature>'''
+
+##
+# Canonical XML (inclusive C14N 1.0, without comments)
+#
+# canonicalize(element) returns the canonical form of a minidom element
+# and its descendants, as xmlsec1 computes it for a same-document
+# reference or the SignedInfo: namespaces in scope from ancestors are
+# declared on the element, and so are the xml:* attributes of its
+# ancestors (including xml:id, as in C14N 1.0).
+
+def _escape_text(text):
+    return escape(text, {'\r': '&#xD;'})
+
+# In attribute values C14N escapes only &, <, " and whitespace other
+# than spaces: '>' is left as is
+def _escape_attr(value):
+    return value.replace('&', '&amp;').replace('<', '&lt;'). \
+        replace('"', '&quot;').replace('\t', '&#x9;'). \
+        replace('\n', '&#xA;').replace('\r', '&#xD;')
+
+def _add_namespaces(element, namespaces):
+    for (name, value) in element.attributes.items():
+        if name == 'xmlns':
+            namespaces[''] = value
+        elif name.startswith('xmlns:'):
+            namespaces[name[6:]] = value
+
+def _canonicalize_element(element, parent_namespaces, rendered,
+                          inherited_attrs, out):
+    namespaces = dict(parent_namespaces)
+    _add_namespaces(element, namespaces)
+
+    # Declare the namespaces whose value differs from what the nearest
+    # output ancestor declared
+    decls = []
+    for prefix in sorted(namespaces.keys()):
+        if prefix == 'xml':
+            continue
+        uri = namespaces[prefix]
+        if rendered.get(prefix, '') != uri:
+            decls.append((prefix, uri))
+    if decls:
+        rendered = dict(rendered)
+        rendered.update(decls)
+
+    # Attributes are sorted by namespace URI, then local name
+    attrs = dict(inherited_attrs)
+    for (name, value) in element.attributes.items():
+        if name == 'xmlns' or name.startswith('xmlns:'):
+            continue
+        attrs[name] = value
+    keyed = []
+    for (name, value) in attrs.items():
+        if ':' in name:
+            (prefix, local) = name.split(':', 1)
+            if prefix == 'xml':
+                uri = XML_NAMESPACE
+            else:
+                uri = namespaces.get(prefix, '')
+        else:
+            (uri, local) = ('', name)
+        keyed.append(((uri, local), name, value))
+    keyed.sort()
+
+    out.append(u'<' + element.tagName)
+    for (prefix, uri) in decls:
+        if prefix:
+            out.append(u' xmlns:%s="%s"' % (prefix, _escape_attr(uri)))
+        else:
+            out.append(u' xmlns="%s"' % _escape_attr(uri))
+    for (key, name, value) in keyed:
+        out.append(u' %s="%s"' % (name, _escape_attr(value)))
+    out.append(u'>')
+
+    for child in element.childNodes:
+        if child.nodeType in (Node.TEXT_NODE, Node.CDATA_SECTION_NODE):
+            out.append(_escape_text(child.data))
+        elif child.nodeType == Node.ELEMENT_NODE:
+            _canonicalize_element(child, namespaces, rendered, {}, out)
+        elif child.nodeType == Node.PROCESSING_INSTRUCTION_NODE:
+            if child.data:
+                out.append(u'<?%s %s?>' % (child.target, child.data))
+            else:
+                out.append(u'<?%s?>' % child.target)
+    out.append(u'</%s>' % element.tagName)
+
+def canonicalize(element):
+    ancestors = []
+    node = element.parentNode
+    while node is not None and node.nodeType == Node.ELEMENT_NODE:
+        ancestors.insert(0, node)
+        node = node.parentNode
+    namespaces = {'': ''}
+    inherited_attrs = {}
+    for ancestor in ancestors:
+        _add_namespaces(ancestor, namespaces)
+        for (name, value) in ancestor.attributes.items():
+            if name.startswith('xml:'):
+                inherited_attrs[name] = value
+    for name in element.attributes.keys():
+        inherited_attrs.pop(name, None)
+    out = []
+    _canonicalize_element(element, namespaces, {'': ''}, inherited_attrs, out)
+    return u''.join(out).encode('utf-8')
+
+def _base64_lines(data):
+    # Base64 in 64 character lines, as xmlsec1 writes it
+    encoded = base64.b64encode(data)
+    return "\n".join(encoded[i:i+64] for i in range(0, len(encoded), 64))
+
+def _crypto_binary(mpint):
+    # M2Crypto gives RSA numbers as OpenSSL MPINTs (4 byte length first).
+    # XML DSig wants the big endian bytes without leading zeros.
+    return _base64_lines(mpint[4:].lstrip('\x00'))
+
+def _x509_name(name):
+    return ",".join("%s=%s" % (key, value) for (key, value)
+                    in reversed(name.get_components()))
+
+def _get_credential_element(doc, refid):
+    for cred in doc.getElementsByTagName("credential"):
+        if cred.getAttribute("xml:id") == refid:
+            return cred
+    return None
+
+##
+# Signs credentials with a given issuer private key and certificate
+# (chain), in process.
+#
+# @param keyfile Filename of the issuer private key (PEM)
+# @param certfile Filename of the issuer certificate, followed by the
+#     rest of its chain if any (PEM)
+
+class CredentialSigner(object):
+
+    def __init__(self, keyfile, certfile):
+        self.keyfile = keyfile
+        self.certfile = certfile
+        self.keypair = Keypair(filename=keyfile)
+        self.issuer_gid = GID(filename=certfile)
+        if self.issuer_gid.get_pubkey().get_pubkey_string() != \
+                self.keypair.get_pubkey_string():
+            raise ConnectionKeyGIDMismatch("Key %s is not the key of certificate %s" % (keyfile, certfile))
+
+        # The KeyInfo is the same for every signature
+        x509data = []
+        chain = self.issuer_gid
+        while chain:
+            pem = chain.save_to_string(save_parents=False)
+            body = "".join(line for line in pem.strip().splitlines()
+                           if not line.startswith('-----'))
+            x509data.append("<X509Certificate>%s</X509Certificate>" % \
+                                _base64_lines(base64.b64decode(body)))
+            chain = chain.get_parent()
+        x509 = self.issuer_gid.cert
+        x509data.append("<X509SubjectName>%s</X509SubjectName>" % \
+                            escape(_x509_name(x509.get_subject())))
+        x509data.append("<X509IssuerSerial>\n<X509IssuerName>%s</X509IssuerName>\n<X509SerialNumber>%d</X509SerialNumber>\n</X509IssuerSerial>" % \
+                            (escape(_x509_name(x509.get_issuer())),
+                             x509.get_serial_number()))
+        self._x509data = "\n".join(x509data)
+        rsa = self.keypair.get_m2_pkey().get_rsa()
+        self._modulus = _crypto_binary(rsa.n)
+        self._exponent = _crypto_binary(rsa.e)
+
+        # The M2Crypto key holds the signing context
+        self._lock = threading.Lock()
+
+    ##
+    # Sign the given data with RSA-SHA1, returning the signature bytes
+
+    def _sign(self, data):
+        key = self.keypair.get_m2_pkey()
+        with self._lock:
+            key.reset_context(md='sha1')
+            key.sign_init()
+            key.sign_update(data)
+            return key.sign_final()
+
+    ##
+    # Add a signature for the credential with the given refid to the
+    # signatures of the given credential XML, and return the signed XML.
+    # This is what 'xmlsec1 --sign' does for Credential.sign.
+
+    def sign_xml(self, xml, refid):
+        doc = parseString(xml)
+        cred = _get_credential_element(doc, refid)
+        if cred is None:
+            raise ValueError("No credential with xml:id %s to sign" % refid)
+        signatures = doc.getElementsByTagName("signatures")
+        if len(signatures) == 0:
+            raise ValueError("Credential %s has no signatures element" % refid)
+
+        digest = base64.b64encode(hashlib.sha1(canonicalize(cred)).digest())
+        sig_xml = _signed_template % dict(refid=escape(refid),
+                                          digest=digest,
+                                          x509data=self._x509data,
+                                          modulus=self._modulus,
+                                          exponent=self._exponent)
+        sig_doc = parseString(sig_xml)
+        sig = doc.importNode(sig_doc.documentElement, True)
+        signatures[0].appendChild(sig)
+
+        # The SignedInfo is signed in place, so it picks up the
+        # namespaces (and xml:id) it inherits there
+        signed_info = sig.getElementsByTagName("SignedInfo")[0]
+        value = _base64_lines(self._sign(canonicalize(signed_info)))
+        sig_value = sig.getElementsByTagName("SignatureValue")[0]
+        sig_value.appendChild(doc.createTextNode(value))
+        return doc.toxml("utf-8")
+
+##
+# Return a CredentialSigner for the given issuer key and certificate files,
+# reusing one made before for the same files.
+
+_signers = {}
+_signers_lock = threading.Lock()
+
+def get_signer(keyfile, certfile):
+    key = (keyfile, certfile)
+    with _signers_lock:
+        signer = _signers.get(key)
+        if signer is None:
+            signer = CredentialSigner(keyfile, certfile)
+            _signers[key] = signer
+    return signer
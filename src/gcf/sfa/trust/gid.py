@@ -27,6 +27,9 @@
 
 from __future__ import absolute_import
 
+import collections
+import hashlib
+import threading
 import xmlrpclib
 import uuid
 
@@ -41,6 +44,37 @@ from ..util.xrn import hrn_to_urn, urn_to_hrn, hrn_authfor_hrn
 def create_uuid():
     return str(uuid.uuid4().int)
 
+##
+# Interned GIDs, by digest of the string they were loaded from, so the
+# same certificate (like the owner and target GIDs repeated through a
+# delegation chain) is only parsed once.
+
+GID_CACHE_SIZE = 500
+
+_gid_cache = collections.OrderedDict()
+_gid_cache_lock = threading.Lock()
+
+##
+# Return a GID loaded from the given string, reusing the GID loaded from an
+# identical string before if there is one. The GID may be shared with
+# other callers, so treat it as read only: use GID(string=...) for a GID
+# you plan to change.
+
+def gid_from_string(string):
+    if string is None or string.strip() == "":
+        return GID(string=string)
+    key = hashlib.sha256(string.strip()).hexdigest()
+    with _gid_cache_lock:
+        gid = _gid_cache.get(key)
+    if gid is not None:
+        return gid
+    gid = GID(string=string)
+    with _gid_cache_lock:
+        _gid_cache[key] = gid
+        while len(_gid_cache) > GID_CACHE_SIZE:
+            _gid_cache.popitem(last=False)
+    return gid
+
 ##
 # GID is a tuple:
 #    (uuid, urn, public_key)
@@ -67,6 +101,9 @@ def create_uuid():
 
 
 class GID(Certificate):
+    # Whether the GID fields have been decoded from the certificate
+    _decoded = False
+
     ##
     # Create a new GID object
     #
@@ -103,7 +140,7 @@ class GID(Certificate):
             self.uuid = uuid
 
     def get_uuid(self):
-        if not self.uuid:
+        if not self.uuid and not self._decoded:
             self.decode()
         return self.uuid
 
@@ -111,7 +148,7 @@ class GID(Certificate):
         self.hrn = hrn
 
     def get_hrn(self):
-        if not self.hrn:
+        if not self.hrn and not self._decoded:
             self.decode()
         return self.hrn
 
@@ -120,7 +157,7 @@ class GID(Certificate):
         self.hrn, type = urn_to_hrn(urn)
  
     def get_urn(self):
-        if not self.urn:
+        if not self.urn and not self._decoded:
             self.decode()
         return self.urn            
 
@@ -129,12 +166,12 @@ class GID(Certificate):
         self.email = email
 
     def get_email(self):
-        if not self.email:
+        if not self.email and not self._decoded:
             self.decode()
         return self.email
 
     def get_type(self):
-        if not self.urn:
+        if not self.urn and not self._decoded:
             self.decode()
         _, t = urn_to_hrn(self.urn)
         return t
@@ -190,6 +227,11 @@ class GID(Certificate):
         self.email = dict.get("email", None)
         if self.urn:
             self.hrn = urn_to_hrn(self.urn)[0]
+        self._decoded = True
+
+    def _clear_decoded(self):
+        Certificate._clear_decoded(self)
+        self._decoded = False
 
     ##
     # Dump the credential to stdout.
@@ -244,7 +286,10 @@ class GID(Certificate):
             self.parent.verify_chain(trusted_certs)
         else:
             # make sure that the trusted root's hrn is a prefix of the child's
-            trusted_gid = GID(string=trusted_root.save_to_string())
+            if isinstance(trusted_root, GID):
+                trusted_gid = trusted_root
+            else:
+                trusted_gid = gid_from_string(trusted_root.save_to_string())
             trusted_type = trusted_gid.get_type()
             trusted_hrn = trusted_gid.get_hrn()
             #if trusted_type == 'authority':
@@ -68,16 +68,21 @@ import sys
 
 import gcf.oscript as omni
 from gcf.omnilib.util import OmniError, AMAPIError
+from gcf.omnilib.util import timing
 from gcf.omnilib.stitchhandler import StitchingHandler
 from gcf.omnilib.stitch.utils import StitchingError, prependFilePrefix
 from gcf.omnilib.stitch.objects import Aggregate
+from gcf.omnilib.stitch import scs
 import gcf.omnilib.stitch.objects
+import gcf.omnilib.stitch.availability
 #from gcf.omnilib.stitch.objects import DCN_AM_RETRY_INTERVAL_SECS as DCN_AM_RETRY_INTERVAL_SECS
 
 # URL of the SCS service
 SCS_URL = "https://geni-scs.net.internet2.edu:8443/geni/xmlrpc"
 
 DEFAULT_CAPACITY = 20000 # in Kbps
+DEFAULT_GETVERSION_THREADS = 8 # Max AMs to call GetVersion at at once
+DEFAULT_DELETE_THREADS = 8 # Max AMs to delete reservations at at once
 
 # Call is the way another script might call this.
 # It initializes the logger, options, config (using omni functions),
@@ -129,6 +134,10 @@ def call(argv, options=None):
     parser.add_option("--ionStatusIntervalSecs", type="int", 
                       help="Seconds to sleep between sliverstatus calls at DCN aggregates (default %default)",
                       default=30)
+    parser.add_option("--getVersionThreads", default=DEFAULT_GETVERSION_THREADS, type="int",
+                      help="Max number of aggregates to call GetVersion at at once when finding aggregate details, or ListResources when checking current VLAN availability (default %default). Use 1 to call them one at a time.")
+    parser.add_option("--deleteThreads", default=DEFAULT_DELETE_THREADS, type="int",
+                      help="Max number of aggregates to delete reservations at at once, when cleaning up after a failure or on delete (default %default). DCN aggregates are deleted after the others. Use 1 to delete one at a time.")
     parser.add_option("--noReservation", default=False, action="store_true",
                       help="Do no reservations: just generate the expanded request RSpec (default %default)")
     parser.add_option("--scsURL",
@@ -138,17 +147,29 @@ def call(argv, options=None):
                       help="Max minutes to allow stitcher to run before killing a reservation attempt (default %default minutes, 0 means no timeout).")
     parser.add_option("--noAvailCheck", default=False, action="store_true",
                       help="Disable checking current VLAN availability where possible.")
+    parser.add_option("--availCacheDir", default=gcf.omnilib.stitch.availability.DEFAULT_CACHE_DIR,
+                      help="Directory for current VLAN availability saved for use by later stitcher runs (default %default)")
+    parser.add_option("--availCacheAge", default=gcf.omnilib.stitch.availability.DEFAULT_CACHE_AGE_SECS, type="int",
+                      help="Max age in seconds of saved VLAN availability to use. 0 means neither use nor save it (default %default)")
     parser.add_option("--genRequest", default=False, action="store_true",
                       help="Generate and save an expanded request RSpec, but do no reservation.")
     parser.add_option("--noDeleteAtEnd", default=False, action="store_true",
                       help="On failure or Ctrl-C do not delete any reservations completed at some aggregates (default %default).")
     parser.add_option("--noTransitAMs", default=False, action="store_true",
                       help="Do not reserve resources at intermediate / transit aggregates; allow experimenter to manually complete the circuit (default %default).")
+    parser.add_option("--incrementalRetry", default=False, action="store_true",
+                      help="When a circuit fails, keep the reservations at aggregates whose paths it does not affect, and delete only the others. The whole request is still sent to the SCS again, with the hops and VLAN tags of the kept reservations pinned (default %default).")
     parser.add_option("--noSCS", default=False, action="store_true",
                       help="Do not call the SCS to expand or add a stitching extension. Use this only if supplying any needed stitching extension and the SCS would fail your request. (default %default).")
     parser.add_option("--fakeModeDir",
                       help="Developers only: If supplied, use canned server responses from this directory",
                       default=None)
+    parser.add_option("--useSCSCache", default=False, action="store_true",
+                      help="Save successful SCS results, and reuse them for identical requests (same request RSpec, options and SCS version) for up to --SCSCacheAge hours. A saved result is not used when retrying after a failed reservation (default %default).")
+    parser.add_option("--SCSCacheDir", default=scs.DEFAULT_CACHE_DIR,
+                      help="Directory for saved SCS results (default %default)")
+    parser.add_option("--SCSCacheAge", default=scs.DEFAULT_CACHE_AGE_HOURS, type="int",
+                      help="Max age in hours of saved SCS results to use (default %default)")
     parser.add_option("--savedSCSResults", default=None,
                       help="Developers only: Use this saved file of SCS results instead of calling SCS (saved previously using --debug)")
     parser.add_option("--useSCSSugg", default=False, action="store_true",
@@ -446,7 +467,13 @@ def call(argv, options=None):
             logger.debug(" ... therefore setting noDeleteAtEnd")
             options.noDeleteAtEnd = True
     handler = StitchingHandler(options, config, logger)
-    return handler.doStitching(args)
+    # Collect a timing report across all the omni calls stitcher makes, if requested
+    startedTimingReport = timing.start_report(options.timingReport, options.timingFormat)
+    try:
+        return handler.doStitching(args)
+    finally:
+        if startedTimingReport:
+            omni.finishTimingReport(logger)
 
 # Goal of main is to call the 'call' method and print the result
 def main(argv=None):
@@ -0,0 +1,121 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Tests of when stitcher considers VLAN availability checked, when the
+availability comes from the cache saved by an earlier stitcher run.
+"""
+
+from __future__ import absolute_import
+
+import datetime
+import logging
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from gcf.omnilib.stitch.availability import AvailabilityCache
+from gcf.omnilib.stitch.objects import Aggregate
+from gcf.omnilib.stitch.VLANRange import VLANRange
+from gcf.omnilib.stitchhandler import StitchingHandler
+
+AM_URN = 'urn:publicid:IDN+example.net+authority+cm'
+AM_URL = 'https://example.net:12369/protogeni/xmlrpc/am'
+HOP_URN = 'urn:publicid:IDN+example.net+interface+procurve2:1.19'
+
+class FakeAM(object):
+    """Stands in for an Aggregate: counts the times it lists resources."""
+
+    urn = AM_URN
+    url = AM_URL
+
+    def __init__(self):
+        self.listed = 0
+
+    def getAvail(self, opts):
+        self.listed += 1
+        return {HOP_URN: VLANRange.fromString('100-200')}
+
+class AvailabilityCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = AvailabilityCache(self.tmpdir, 300)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _saveAgo(self, secs):
+        self.cache.put(AM_URN, AM_URL, {HOP_URN: VLANRange.fromString('100-200')})
+        savedAt = int(time.time()) - secs
+        os.utime(self.cache._path(AM_URN, AM_URL), (savedAt, savedAt))
+        return datetime.datetime.utcfromtimestamp(savedAt)
+
+    def test_saved_time(self):
+        savedAt = self._saveAgo(120)
+        (avail, takenAt) = self.cache.get(AM_URN, AM_URL)
+        self.assertEqual(avail, {HOP_URN: VLANRange.fromString('100-200')})
+        self.assertEqual(takenAt, savedAt)
+
+    def test_too_old(self):
+        self._saveAgo(301)
+        self.assertEqual(self.cache.get(AM_URN, AM_URL), (None, None))
+
+    def test_none_saved(self):
+        self.assertEqual(self.cache.get(AM_URN, AM_URL), (None, None))
+
+    def test_snapshot_from_cache(self):
+        # As StitchingHandler.__init__ sets up, with a cache
+        handler = object.__new__(StitchingHandler)
+        handler.opts = None
+        handler.availSnapshots = dict()
+        handler.availCache = self.cache
+        am = FakeAM()
+        savedAt = self._saveAgo(120)
+        (avail, takenAt) = handler.getAvailSnapshot(am)
+        self.assertEqual(takenAt, savedAt)
+        self.assertEqual(am.listed, 0)
+        # The snapshot is kept for the rest of the run, with its time
+        self.assertEqual(handler.getAvailSnapshot(am), (avail, savedAt))
+
+        # Checked now when not from the cache
+        handler.availSnapshots = dict()
+        handler.availCache = None
+        before = datetime.datetime.utcnow()
+        (avail, takenAt) = handler.getAvailSnapshot(am)
+        self.assertEqual(am.listed, 1)
+        self.assertTrue(takenAt >= before)
+
+    def test_last_avail_check(self):
+        agg = Aggregate(AM_URN, AM_URL)
+        agg.logger = logging.getLogger('test_availability')
+        takenAt = self._saveAgo(120)
+        agg.updateWithAvail(None, dict(), takenAt)
+        self.assertEqual(agg.lastAvailCheck, takenAt)
+        before = datetime.datetime.utcnow()
+        agg.updateWithAvail(None, dict())
+        self.assertTrue(agg.lastAvailCheck >= before)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Tests of the Clearinghouse client's use of kept-alive connections.
+"""
+
+from __future__ import absolute_import
+
+import errno
+import httplib
+import logging
+import socket
+import unittest
+
+from gcf.geni.util.ch_interface import CHClient
+
+class FakeResponse(object):
+
+    status = 200
+    reason = 'OK'
+    will_close = False
+
+    def read(self):
+        return 'result'
+
+class FakeConnection(object):
+    """Fails the request or getting the response with the given errors."""
+
+    def __init__(self, send_error=None, response_error=None):
+        self.send_error = send_error
+        self.response_error = response_error
+        self.requests = 0
+        self.closed = False
+
+    def request(self, method, path, data, headers):
+        self.requests += 1
+        if self.send_error is not None:
+            raise self.send_error
+
+    def getresponse(self):
+        if self.response_error is not None:
+            raise self.response_error
+        return FakeResponse()
+
+    def close(self):
+        self.closed = True
+
+class FakeCHClient(CHClient):
+    """Hands out the given idle connections, then new good ones."""
+
+    def __init__(self, idle):
+        CHClient.__init__(self)
+        self.idle = list(idle)
+        self.new = []
+
+    def _get_connection(self, host):
+        if self.idle:
+            return (self.idle.pop(0), True)
+        conn = FakeConnection()
+        self.new.append(conn)
+        return (conn, False)
+
+class PutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger('test_ch_interface')
+        self.logger.addHandler(logging.NullHandler())
+
+    def _put(self, client):
+        return client._put('https://ch.example.net/SA', 'data', self.logger)
+
+    def _assertRetried(self, idle_conn):
+        client = FakeCHClient([idle_conn])
+        self.assertEqual(self._put(client), 'result')
+        self.assertTrue(idle_conn.closed)
+        self.assertEqual(len(client.new), 1)
+
+    def _assertNotRetried(self, conn, reused=True):
+        if reused:
+            client = FakeCHClient([conn])
+        else:
+            client = FakeCHClient([])
+            client._get_connection = lambda host: (conn, False)
+        self.assertRaises(Exception, self._put, client)
+        self.assertTrue(conn.closed)
+        self.assertEqual(conn.requests, 1)
+        self.assertEqual(client.new, [])
+
+    def test_reused(self):
+        client = FakeCHClient([FakeConnection()])
+        self.assertEqual(self._put(client), 'result')
+        self.assertEqual(client.new, [])
+
+    def test_retry_on_reset_send(self):
+        for err in (errno.ECONNRESET, errno.EPIPE):
+            self._assertRetried(FakeConnection(
+                    send_error=socket.error(err, "stale")))
+
+    def test_retry_on_no_status_line(self):
+        self._assertRetried(FakeConnection(
+                response_error=httplib.BadStatusLine('')))
+        self._assertRetried(FakeConnection(
+                response_error=httplib.BadStatusLine("No status line received - the server has closed the connection")))
+
+    def test_no_retry_on_timeout(self):
+        self._assertNotRetried(FakeConnection(
+                send_error=socket.timeout("timed out")))
+        self._assertNotRetried(FakeConnection(
+                response_error=socket.timeout("timed out")))
+
+    def test_no_retry_after_send(self):
+        # The server may have acted on the request
+        self._assertNotRetried(FakeConnection(
+                response_error=socket.error(errno.ECONNRESET, "reset")))
+        self._assertNotRetried(FakeConnection(
+                response_error=httplib.BadStatusLine('HTTP/1.1 garbage')))
+
+    def test_no_retry_on_other_send_errors(self):
+        self._assertNotRetried(FakeConnection(
+                send_error=socket.error(errno.ECONNREFUSED, "refused")))
+
+    def test_no_retry_on_new_connection(self):
+        self._assertNotRetried(FakeConnection(
+                send_error=socket.error(errno.ECONNRESET, "reset")),
+                               reused=False)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,199 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Tests of signing credentials in process with a CredentialSigner.
+"""
+
+from __future__ import absolute_import
+
+import datetime
+import os
+import re
+import shutil
+import tempfile
+import unittest
+import uuid
+from xml.dom.minidom import parseString
+
+import gcf.geni as geni
+from gcf.geni.util import cred_util
+from gcf.geni.util.cert_util import create_cert
+from gcf.omnilib.util.credparsing import CredSummary
+from gcf.sfa.trust import rights
+from gcf.sfa.trust.credential import Credential, CredentialNotVerifiable
+from gcf.sfa.trust.credential_signer import CredentialSigner, canonicalize
+
+AUTHORITY = 'test.example.net'
+
+def _xmlsec1():
+    # Credential looks for xmlsec1 when made
+    return Credential().xmlsec_path
+
+def _signature_values(xml):
+    doc = parseString(xml)
+    return [doc.getElementsByTagName(name)[0].firstChild.data.strip()
+            for name in ('DigestValue', 'SignatureValue')]
+
+class CanonicalizeTest(unittest.TestCase):
+
+    def test_attribute_escapes(self):
+        doc = parseString('<a b="x&gt;y&amp;z&lt;&quot;&#9;&#10;&#13;">1 &gt; 0&#13;</a>')
+        self.assertEqual(canonicalize(doc.documentElement),
+                         '<a b="x>y&amp;z&lt;&quot;&#x9;&#xA;&#xD;">1 &gt; 0&#xD;</a>')
+
+    def test_inherited_namespaces(self):
+        # Attributes without a namespace come first
+        doc = parseString('<r xmlns="urn:r" xmlns:p="urn:p" xml:lang="en"><p:c z="1" a="2"/></r>')
+        child = doc.getElementsByTagName('p:c')[0]
+        self.assertEqual(canonicalize(child),
+                         '<p:c xmlns="urn:r" xmlns:p="urn:p" a="2" z="1" xml:lang="en"></p:c>')
+
+class CredentialSignerTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.certs = dict()
+        ca_urn = geni.URN(AUTHORITY, 'authority', 'sa').urn_string()
+        (ca_gid, ca_keys) = create_cert(ca_urn, ca=True, lifeDays=1,
+                                        uuidarg=uuid.uuid4())
+        cls._save('ca', ca_gid, ca_keys)
+        for (name, typ) in (('alice', 'user'), ('slice', 'slice')):
+            urn = geni.URN(AUTHORITY, typ, name).urn_string()
+            (the_gid, keys) = create_cert(urn, issuer_key=ca_keys,
+                                          issuer_cert=ca_gid, lifeDays=1,
+                                          uuidarg=uuid.uuid4())
+            cls._save(name, the_gid, keys)
+        cls.signer = CredentialSigner(cls.certs['ca']['keyfile'],
+                                      cls.certs['ca']['certfile'])
+
+    @classmethod
+    def _save(cls, name, the_gid, keys):
+        certfile = os.path.join(cls.tmpdir, '%s-cert.pem' % name)
+        keyfile = os.path.join(cls.tmpdir, '%s-key.pem' % name)
+        the_gid.save_to_file(certfile, save_parents=True)
+        keys.save_to_file(keyfile)
+        cls.certs[name] = dict(certfile=certfile, keyfile=keyfile, gid=the_gid)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir)
+
+    def _unsigned_credential(self):
+        certs = self.certs
+        ucred = Credential()
+        ucred.set_gid_caller(certs['alice']['gid'])
+        ucred.set_gid_object(certs['slice']['gid'])
+        ucred.set_expiration(datetime.datetime.utcnow() +
+                             datetime.timedelta(days=1))
+        privileges = rights.determine_rights('slice', None)
+        privileges.delegate_all_privileges(True)
+        ucred.set_privileges(privileges)
+        ucred.encode()
+        ucred.set_issuer_keys(certs['ca']['keyfile'], certs['ca']['certfile'])
+        return ucred
+
+    def _create_credential(self):
+        certs = self.certs
+        return cred_util.create_credential(certs['alice']['gid'],
+                                           certs['slice']['gid'],
+                                           datetime.datetime.utcnow() +
+                                           datetime.timedelta(days=1),
+                                           'slice', certs['ca']['keyfile'],
+                                           certs['ca']['certfile'],
+                                           [certs['ca']['certfile']],
+                                           signer=self.signer)
+
+    @unittest.skipUnless(_xmlsec1(), "xmlsec1 not found")
+    def test_same_signature_as_xmlsec1(self):
+        # Including for an attribute value with '>' in it
+        ucred = self._unsigned_credential()
+        ucred.xml = ucred.get_xml().replace('<credential ',
+                                            '<credential note="a&gt;b" ', 1)
+        in_process = self.signer.sign_xml(ucred.get_xml(), ucred.get_refid())
+        ucred.sign()
+        self.assertEqual(_signature_values(in_process),
+                         _signature_values(ucred.get_xml()))
+
+    @unittest.skipUnless(_xmlsec1(), "xmlsec1 not found")
+    def test_xmlsec1_verifies(self):
+        ucred = self._create_credential()
+        self.assertTrue(ucred.verify([self.certs['ca']['certfile']]))
+
+    def test_create_credential_does_not_run_xmlsec1(self):
+        verify = Credential.verify
+        def fail(*args, **kwargs):
+            self.fail("Credential.verify called for a credential signed in process")
+        Credential.verify = fail
+        try:
+            ucred = self._create_credential()
+        finally:
+            Credential.verify = verify
+        self.assertTrue(ucred.get_signature() is not None)
+        self.assertEqual(ucred.get_gid_caller().get_urn(),
+                         self.certs['alice']['gid'].get_urn())
+
+    def test_create_credential_checks_trusted_roots(self):
+        other = os.path.join(self.tmpdir, 'other-cert.pem')
+        (other_gid, other_keys) = create_cert(geni.URN('other.example.net', 'authority', 'sa').urn_string(),
+                                              ca=True, lifeDays=1,
+                                              uuidarg=uuid.uuid4())
+        other_gid.save_to_file(other)
+        certs = self.certs
+        self.assertRaises(Exception, cred_util.create_credential,
+                          certs['alice']['gid'], certs['slice']['gid'],
+                          datetime.datetime.utcnow() + datetime.timedelta(days=1),
+                          'slice', certs['ca']['keyfile'],
+                          certs['ca']['certfile'], [other],
+                          signer=self.signer)
+
+    def test_unsigned_credential_is_not_scanned(self):
+        # A credential element outside the signed-credential must not
+        # stand in for the signed one
+        signed = self._create_credential().save_to_string()
+        signed = re.sub(r'^<\?xml[^>]*\?>', '', signed.strip())
+        bogus = ('<credential xml:id="bogus"><expires>2099-01-01T00:00:00Z</expires>'
+                 '<privileges><privilege><name>*</name>'
+                 '<can_delegate>true</can_delegate></privilege></privileges>'
+                 '</credential>')
+        wrapped = '<wrap>%s%s</wrap>' % (bogus, signed)
+        cred = Credential(string=wrapped)
+        self.assertTrue(cred.get_expiration().year < 2099)
+        self.assertFalse(cred.get_privileges().get_all_delegate())
+        summary = CredSummary(wrapped)
+        self.assertFalse(summary.has_credential)
+        self.assertEqual(summary.expires, None)
+
+    def test_finish_decode_checks_summary(self):
+        # decode() reads the first expires element anywhere in the
+        # credential, the summary only a child of it
+        xml = self._create_credential().save_to_string()
+        xml = re.sub(r'(<credential [^>]*>)',
+                     r'\1<note><expires>2099-01-01T00:00:00Z</expires></note>',
+                     xml, count=1)
+        cred = Credential(string=xml)
+        self.assertTrue(cred.get_expiration().year < 2099)
+        self.assertRaises(CredentialNotVerifiable, cred.get_gid_caller)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,260 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Tests of provisioning GENI-in-a-Box slivers, as dry runs with a
+RecordingRunner.
+"""
+
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from gcf.geni.am.gibaggregate import config, gib_manager, provisioning, \
+    resources
+from gcf.geni.am.gibaggregate.provisioning import RecordingRunner, Step, \
+    StepExecutor
+
+RSPEC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         '..', '..', 'gib-rspec-examples')
+
+SLICE_URN = 'urn:publicid:IDN+geni:gpo:gcf+slice+dryrun'
+USERS = [dict(urn = 'urn:publicid:IDN+geni:gpo:gcf+user+alice',
+              keys = ['ssh-rsa AAAAB3NzaC1yc2E alice@example.net\n'])]
+
+
+class CommandRunnerTest(unittest.TestCase) :
+
+    def test_abstract(self) :
+        self.assertRaises(TypeError, provisioning.CommandRunner)
+
+        class NoRun(provisioning.CommandRunner) :
+            pass
+        self.assertRaises(TypeError, NoRun)
+
+
+class StepExecutorTest(unittest.TestCase) :
+
+    def _steps(self) :
+        first = Step('first', ['echo first'])
+        left = Step('left', ['echo left'], [first], container = 101,
+                    mustSucceed = True, statusOnSuccess = 'configuring')
+        right = Step('right', ['echo right'], [first], container = 102,
+                     mustSucceed = True, statusOnSuccess = 'configuring')
+        leftReady = Step('left ready', [], [left], container = 101,
+                         statusOnSuccess = 'ready')
+        rightReady = Step('right ready', [], [right], container = 102,
+                          statusOnSuccess = 'ready')
+        return [first, left, right, leftReady, rightReady]
+
+    def _run(self, runner) :
+        statuses = []
+        executor = StepExecutor(self._steps(), runner, 2,
+                                lambda container, status :
+                                    statuses.append((container, status)))
+        ok = executor.run()
+        return (ok, executor, statuses)
+
+    def test_dependencies_first(self) :
+        runner = RecordingRunner()
+        (ok, executor, statuses) = self._run(runner)
+        self.assertTrue(ok)
+        names = [name for (name, script) in runner.steps]
+        # Steps with no commands are not run
+        self.assertEqual(names[0], 'first')
+        self.assertEqual(sorted(names[1:]), ['left', 'right'])
+        self.assertEqual(runner.steps[0][1], 'echo first\n')
+        self.assertEqual(sorted(statuses),
+                         [(101, 'configuring'), (101, 'ready'),
+                          (102, 'configuring'), (102, 'ready')])
+        self.assertTrue(executor.isDone())
+
+    def test_failed_step(self) :
+        runner = RecordingRunner(failSteps = ['left'])
+        (ok, executor, statuses) = self._run(runner)
+        self.assertFalse(ok)
+        self.assertEqual([step.name for step in executor.failedSteps()],
+                         ['left'])
+        states = dict((step.name, step.state) for step in executor.steps)
+        self.assertEqual(states['left ready'], Step.SKIPPED)
+        self.assertEqual(states['right ready'], Step.DONE)
+        self.assertTrue((101, 'failed') in statuses)
+        self.assertFalse((101, 'ready') in statuses)
+        self.assertTrue((102, 'ready') in statuses)
+
+    def test_failed_container_stays_failed(self) :
+        # Container 102 fails (its ready step also waits on 'left') while
+        #    its step 'right' is still running
+        first = Step('first', ['echo first'])
+        left = Step('left', ['echo left'], [first], container = 101,
+                    mustSucceed = True)
+        right = Step('right', ['echo right'], [first], container = 102,
+                     mustSucceed = True, statusOnSuccess = 'configuring')
+        rightReady = Step('right ready', [], [left, right], container = 102,
+                          statusOnSuccess = 'ready')
+        statuses = []
+        rightFailed = threading.Event()
+        def setStatus(container, status) :
+            statuses.append((container, status))
+            if (container, status) == (102, 'failed') :
+                rightFailed.set()
+        class SlowRightRunner(RecordingRunner) :
+            def run(self, step) :
+                if step.name == 'right' :
+                    rightFailed.wait(10)
+                return RecordingRunner.run(self, step)
+        executor = StepExecutor([first, left, right, rightReady],
+                                SlowRightRunner(failSteps = ['left']), 2,
+                                setStatus)
+        self.assertFalse(executor.run())
+        self.assertTrue(rightFailed.isSet())
+        self.assertEqual(right.state, Step.DONE)
+        self.assertEqual(statuses[-1], (102, 'failed'))
+        self.assertEqual(sorted(statuses), [(101, 'failed'), (102, 'failed')])
+
+
+class FailOnePingRunner(RecordingRunner) :
+    """ Fails the first ping step it is asked to run """
+    def run(self, step) :
+        if step.name.startswith('ping container ') :
+            with self._lock :
+                if not self.failSteps :
+                    self.failSteps.add(step.name)
+        return RecordingRunner.run(self, step)
+
+
+class DryRunSliverTest(unittest.TestCase) :
+
+    def setUp(self) :
+        self.tmpdir = tempfile.mkdtemp()
+        self.scriptsDir = config.sliceSpecificScriptsDir
+        config.sliceSpecificScriptsDir = self.tmpdir
+        # Dry runs on distributions the aggregate does not run on
+        self.distro = config.distro
+        if config.distro is None :
+            config.distro = 'UBUNTU10-STD'
+        self.runner = RecordingRunner()
+        gib_manager.setCommandRunner(self.runner)
+        self.containersAvailable = resources.containerIDs.available()
+
+    def tearDown(self) :
+        gib_manager.deleteSliver(SLICE_URN)
+        gib_manager.setCommandRunner(None)
+        config.sliceSpecificScriptsDir = self.scriptsDir
+        config.distro = self.distro
+        shutil.rmtree(self.tmpdir)
+
+    def _createSliver(self, rspecFile) :
+        rspec = open(os.path.join(RSPEC_DIR, rspecFile)).read()
+        self.assertEqual(gib_manager.createSliver(SLICE_URN, rspec, USERS),
+                         None)
+        topology = gib_manager._getTopology(SLICE_URN)
+        self.assertTrue(topology.executor.wait(30))
+        return topology
+
+    def _commands(self) :
+        # The commands recorded for each step, by step name
+        return dict((name, script.splitlines())
+                    for (name, script) in self.runner.steps)
+
+    def test_two_nodes(self) :
+        topology = self._createSliver('two-nodes-iperf.rspec')
+        names = [name for (name, script) in self.runner.steps]
+        containers = sorted(topology.hosts.keys())
+        self.assertEqual(len(containers), 2)
+        self.assertEqual(resources.containerIDs.available(),
+                         self.containersAvailable - 2)
+
+        # Every step with commands ran once, each after its dependencies
+        planned = [step for step in topology.provisioningSteps
+                   if step.commands]
+        self.assertEqual(sorted(names), sorted(step.name for step in planned))
+        for step in planned :
+            for dependency in step.dependsOn :
+                if dependency.commands :
+                    self.assertTrue(names.index(dependency.name) <
+                                    names.index(step.name),
+                                    '%s ran before %s' % (step.name,
+                                                          dependency.name))
+        self.assertEqual(names[0], 'delete leftover containers and bridges')
+
+        commands = self._commands()
+        bridge = topology.links[0].bridgeID
+        for container in containers :
+            self.assertTrue('vzctl start %s' % container in
+                            commands['start container %s' % container])
+            self.assertTrue('brctl addif %s veth%s.1' % (bridge, container)
+                            in commands['bridge %s' % bridge])
+            accounts = commands['accounts on container %s' % container]
+            self.assertTrue('vzctl set %s --userpasswd alice:%s' %
+                            (container, config.rootPwd) in accounts)
+            self.assertTrue('vzctl runscript %s /vz/root/%s//local/iperf-script.sh' %
+                            (container, container) in
+                            commands['startup scripts on container %s' %
+                                     container])
+        self.assertEqual([status['geni_status'] for status in
+                          resources.getResourceStatus(topology)],
+                         ['ready', 'ready'])
+
+        # createSliver.sh records the same commands
+        script = open(os.path.join(topology.scriptsDir,
+                                   config.shellScriptFile)).read()
+        for step in planned :
+            self.assertTrue('\n## Step: %s\n%s\n' %
+                            (step.name, '\n'.join(step.commands)) in script)
+
+    def test_delete(self) :
+        topology = self._createSliver('two-nodes-iperf.rspec')
+        bridge = topology.links[0].bridgeID
+        gib_manager.deleteSliver(SLICE_URN)
+        (name, script) = self.runner.steps[-1]
+        self.assertEqual(name, 'delete sliver')
+        for container in topology.hosts.keys() :
+            self.assertTrue('vzctl destroy %s' % container in script)
+        self.assertTrue('/usr/sbin/brctl delbr %s' % bridge in script)
+        self.assertEqual(resources.containerIDs.available(),
+                         self.containersAvailable)
+        self.assertFalse(os.path.exists(topology.scriptsDir))
+
+    def test_failed_ping(self) :
+        self.runner = FailOnePingRunner()
+        gib_manager.setCommandRunner(self.runner)
+        topology = self._createSliver('two-nodes-iperf.rspec')
+        failed = int(list(self.runner.failSteps)[0].split()[-1])
+        other = [c for c in topology.hosts.keys() if c != failed][0]
+        # The steps after the failed one are skipped. The other container
+        #    is set up, but its startup scripts wait for the whole network
+        names = [name for (name, script) in self.runner.steps]
+        self.assertFalse('accounts on container %s' % failed in names)
+        self.assertTrue('accounts on container %s' % other in names)
+        self.assertFalse('startup scripts on container %s' % other in names)
+        self.assertEqual([status['geni_status'] for status in
+                          resources.getResourceStatus(topology)],
+                         ['failed', 'failed'])
+
+
+if __name__ == "__main__" :
+    unittest.main()
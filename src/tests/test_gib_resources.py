@@ -0,0 +1,99 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Tests of the pools of IDs (containers, link subnets, MAC addresses) of the
+GENI-in-a-Box aggregate.
+"""
+
+from __future__ import absolute_import
+
+import threading
+import unittest
+
+from gcf.geni.am.gibaggregate import config, resources
+from gcf.geni.am.gibaggregate.provisioning import IdPool
+
+class IdPoolTest(unittest.TestCase) :
+
+    def test_allocate_in_order(self) :
+        pool = IdPool(3, 7)
+        self.assertEqual(pool.available(), 5)
+        self.assertEqual(pool.allocate(), [3])
+        self.assertEqual(pool.allocate(2), [4, 5])
+        self.assertEqual(pool.available(), 2)
+
+    def test_exhausted(self) :
+        pool = IdPool(1, 3)
+        self.assertEqual(pool.allocate(2), [1, 2])
+        # Not enough left: none are allocated
+        self.assertEqual(pool.allocate(2), None)
+        self.assertEqual(pool.available(), 1)
+        self.assertEqual(pool.allocate(), [3])
+        self.assertEqual(pool.allocate(), None)
+        self.assertEqual(pool.available(), 0)
+
+    def test_free_reused_oldest_first(self) :
+        pool = IdPool(1, 10)
+        pool.allocate(5)
+        pool.free([4, 2])
+        pool.free([5])
+        self.assertEqual(pool.available(), 8)
+        # Freed IDs first, then ones never used
+        self.assertEqual(pool.allocate(4), [4, 2, 5, 6])
+        self.assertEqual(pool.allocate(), [7])
+
+    def test_free_makes_room(self) :
+        pool = IdPool(1, 2)
+        ids = pool.allocate(2)
+        self.assertEqual(pool.allocate(), None)
+        pool.free(ids)
+        self.assertEqual(pool.available(), 2)
+        self.assertEqual(sorted(pool.allocate(2)), [1, 2])
+
+    def test_threads_get_distinct_ids(self) :
+        pool = IdPool(1, 400)
+        allocated = []
+        lock = threading.Lock()
+        def allocate() :
+            for i in range(50) :
+                ids = pool.allocate(2)
+                with lock :
+                    allocated.extend(ids)
+        threads = [threading.Thread(target = allocate) for i in range(4)]
+        for thread in threads :
+            thread.start()
+        for thread in threads :
+            thread.join()
+        self.assertEqual(sorted(allocated), range(1, 401))
+        self.assertEqual(pool.allocate(), None)
+
+class ModulePoolsTest(unittest.TestCase) :
+
+    def test_module_pools(self) :
+        self.assertEqual(resources.containerIDs.first, 101)
+        self.assertEqual(resources.containerIDs.last,
+                         100 + config.maxContainers)
+        self.assertEqual(resources.subnetNumbers.first, 3)
+
+if __name__ == "__main__" :
+    unittest.main()
@@ -0,0 +1,94 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Tests of writing RSpecs to output files.
+"""
+
+from __future__ import absolute_import
+
+import gzip
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+from gcf.geni.util import rspec_util
+from gcf.omnilib.util.handler_utils import _printResults, _writeRSpec
+from gcf.oscript import parse_args
+
+RSPEC = '''<?xml version="1.0"?><rspec xmlns="http://www.geni.net/resources/rspec/3" type="advertisement"><node component_id="a &amp; b"><sliver_type name="x"/><available now="true"/></node><!-- c --><node component_id="c">text</node></rspec>'''
+
+logger = logging.getLogger('omni')
+
+class WriteRSpecTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _opts(self, filename):
+        return parse_args(['-o', '--outputfile',
+                           os.path.join(self.tmpdir, filename),
+                           'listresources'])[0]
+
+    def _expected(self):
+        # As pretty printed by getPrettyRSpec, with the header after the
+        # XML declaration
+        pretty = rspec_util.getPrettyRSpec(RSPEC)
+        (decl, rest) = pretty.split('\n', 1)
+        header = "<!-- Resources at AM:\n\tURN: urn:am\n\tURL: http://am\n -->"
+        return decl + '\n  ' + header + '\n' + rest
+
+    def test_pretty_file(self):
+        (retVal, filename) = _writeRSpec(self._opts('ad.xml'), logger, RSPEC,
+                                         None, 'urn:am', 'http://am',
+                                         pretty=True)
+        self.assertEqual(open(filename).read(), self._expected())
+
+    def test_pretty_gzip_file(self):
+        (retVal, filename) = _writeRSpec(self._opts('ad.xml.gz'), logger,
+                                         RSPEC, None, 'urn:am', 'http://am',
+                                         pretty=True)
+        f = gzip.open(filename)
+        try:
+            self.assertEqual(f.read(), self._expected())
+        finally:
+            f.close()
+
+    def test_not_pretty_file(self):
+        (retVal, filename) = _writeRSpec(self._opts('ad.xml'), logger, RSPEC,
+                                         None, 'urn:am', 'http://am')
+        self.assertTrue(open(filename).read().endswith(RSPEC[len('<?xml version="1.0"?>'):] + '\n'))
+
+    def test_not_well_formed_written_as_is(self):
+        filename = os.path.join(self.tmpdir, 'bad.xml')
+        content = '<rspec><node></rspec>'
+        _printResults(self._opts('bad.xml'), logger, None, content, filename,
+                      prettyRSpec=True)
+        self.assertEqual(open(filename).read(), content + '\n')
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Tests of running calls in parallel threads.
+"""
+
+from __future__ import absolute_import
+
+import threading
+import time
+import unittest
+
+from gcf.omnilib.util.parallel import callInParallel
+
+def _square(x):
+    if x < 0:
+        raise ValueError("negative %d" % x)
+    time.sleep(0.001 * (x % 3))
+    return x * x
+
+class CallInParallelTest(unittest.TestCase):
+
+    def test_results_in_order(self):
+        args = [(x,) for x in range(20)]
+        for threads in (1, 4):
+            results = callInParallel(_square, args, threads)
+            self.assertEqual([result for (result, excInfo) in results],
+                             [x * x for x in range(20)])
+
+    def test_exceptions(self):
+        results = callInParallel(_square, [(2,), (-1,), (3,)], 2)
+        self.assertEqual(results[0], (4, None))
+        self.assertEqual(results[2], (9, None))
+        self.assertEqual(results[1][0], None)
+        self.assertTrue(isinstance(results[1][1][1], ValueError))
+
+    def test_on_result(self):
+        seen = []
+        active = [0]
+        def onResult(i, result, excInfo):
+            active[0] += 1
+            self.assertEqual(active[0], 1)
+            time.sleep(0.001)
+            seen.append((i, result, excInfo is not None))
+            active[0] -= 1
+        callInParallel(_square, [(x,) for x in range(-2, 8)], 4,
+                       onResult=onResult)
+        self.assertEqual(sorted(seen),
+                         [(i, (i - 2) ** 2 if i >= 2 else None, i < 2)
+                          for i in range(10)])
+
+    def test_on_result_error(self):
+        calls = []
+        lock = threading.Lock()
+        def func(x):
+            with lock:
+                calls.append(x)
+            return x
+        def onResult(i, result, excInfo):
+            raise KeyError(i)
+        self.assertRaises(KeyError, callInParallel, func,
+                          [(x,) for x in range(50)], 2, onResult=onResult)
+        # No more calls are started after onResult fails
+        self.assertTrue(len(calls) < 50)
+
+if __name__ == "__main__":
+    unittest.main()
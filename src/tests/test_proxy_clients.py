@@ -0,0 +1,265 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Tests of the inside key cache and client pool of the proxy AM.
+"""
+
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import gcf.geni as geni
+from gcf.geni.am.proxy_clients import ClientPool, InsideKeyCache, EXPIRY_MARGIN
+from gcf.geni.util.cert_util import create_cert
+
+class FakeLookup(object):
+    """Stands in for the MA: returns the given key and certificate and
+    counts the lookups."""
+
+    def __init__(self, certificate="not a certificate"):
+        self.certificate = certificate
+        self.lookups = []
+
+    def __call__(self, member_id, ma_url, logger):
+        self.lookups.append(member_id)
+        if member_id == 'unknown':
+            return None
+        return ("key of %s" % member_id, self.certificate)
+
+class FakeClient(object):
+    """Stands in for an XML-RPC client: calling client('close')() closes
+    it."""
+
+    def __init__(self, url, key_fname, cert_fname):
+        self.key_fname = key_fname
+        self.closed = False
+
+    def __call__(self, attr):
+        def close():
+            self.closed = True
+        return close
+
+class InsideKeyCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _cache(self, lookup, ttl=3600, sweep_interval=60):
+        cache = InsideKeyCache('https://ma.example.net', ttl=ttl,
+                               key_dir=self.tmpdir, lookup=lookup,
+                               sweep_interval=sweep_interval)
+        self.addCleanup(cache.close)
+        return cache
+
+    def test_cached_until_ttl(self):
+        lookup = FakeLookup()
+        cache = self._cache(lookup)
+        key = cache.get('alice')
+        self.assertTrue(key.is_current())
+        with open(key.key_fname) as f:
+            self.assertEqual(f.read(), "key of alice")
+        self.assertTrue(cache.get('alice') is key)
+        self.assertEqual(lookup.lookups, ['alice'])
+        self.assertFalse(key.is_current(now=time.time() + 3601))
+        self.assertEqual(cache.stats.counts['key_hits'], 1)
+        self.assertEqual(cache.stats.counts['key_misses'], 1)
+
+    def test_expired_key_looked_up_again(self):
+        lookup = FakeLookup()
+        cache = self._cache(lookup, ttl=0)
+        key = cache.get('alice')
+        self.assertFalse(key.is_current())
+        new_key = cache.get('alice')
+        self.assertFalse(new_key is key)
+        self.assertEqual(lookup.lookups, ['alice', 'alice'])
+        # The retired key had no clients: its files are gone
+        self.assertFalse(os.path.exists(key.key_fname))
+        self.assertFalse(os.path.exists(key.cert_fname))
+        self.assertTrue(os.path.exists(new_key.key_fname))
+
+    def test_sweep(self):
+        lookup = FakeLookup()
+        cache = self._cache(lookup)
+        key = cache.get('alice')
+        cache.sweep()
+        self.assertTrue(os.path.exists(key.key_fname))
+        cache.sweep(now=time.time() + 3601)
+        self.assertFalse(key.is_current())
+        self.assertFalse(os.path.exists(key.key_fname))
+        self.assertFalse(os.path.exists(key.cert_fname))
+        self.assertFalse(cache.get('alice') is key)
+
+    def test_other_member_sweeps(self):
+        # The key of a member who doesn't call again is still retired
+        lookup = FakeLookup()
+        cache = self._cache(lookup, ttl=0, sweep_interval=0)
+        key = cache.get('alice')
+        cache.get('bob')
+        self.assertFalse(os.path.exists(key.key_fname))
+        self.assertEqual(lookup.lookups, ['alice', 'bob'])
+
+    def test_expires_with_certificate(self):
+        urn = geni.URN('test.example.net', 'user', 'alice').urn_string()
+        (gid, keys) = create_cert(urn, lifeDays=1)
+        cache = self._cache(FakeLookup(gid.save_to_string()), ttl=2 * 86400)
+        key = cache.get('alice')
+        self.assertTrue(key.is_current())
+        # Refetched EXPIRY_MARGIN before the certificate expires, not
+        # after the TTL
+        self.assertTrue(key.expires <= time.time() + 86400 - EXPIRY_MARGIN)
+        self.assertTrue(key.expires > time.time() + 86400 - EXPIRY_MARGIN - 60)
+
+    def test_expiring_certificate_not_cached(self):
+        urn = geni.URN('test.example.net', 'user', 'alice').urn_string()
+        (gid, keys) = create_cert(urn, lifeDays=0)
+        lookup = FakeLookup(gid.save_to_string())
+        cache = self._cache(lookup)
+        self.assertFalse(cache.get('alice').is_current())
+        cache.get('alice')
+        self.assertEqual(lookup.lookups, ['alice', 'alice'])
+
+    def test_lookup_failure(self):
+        cache = self._cache(FakeLookup())
+        self.assertEqual(cache.get('unknown'), None)
+        self.assertEqual(cache.stats.counts['key_lookup_failures'], 1)
+
+    def test_invalidate_and_close(self):
+        lookup = FakeLookup()
+        cache = self._cache(lookup)
+        key = cache.get('alice')
+        cache.invalidate('alice')
+        self.assertFalse(key.is_current())
+        self.assertFalse(os.path.exists(key.key_fname))
+        cache.get('alice')
+        self.assertEqual(lookup.lookups, ['alice', 'alice'])
+        cache.close()
+        self.assertFalse(os.path.exists(cache.key_dir))
+
+class ClientPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = InsideKeyCache('https://ma.example.net',
+                                    key_dir=self.tmpdir, lookup=FakeLookup())
+        self.made = []
+        def make(url, key_fname, cert_fname):
+            client = FakeClient(url, key_fname, cert_fname)
+            self.made.append(client)
+            return client
+        self.pool = ClientPool('https://am.example.net', size=1, make=make)
+
+    def tearDown(self):
+        self.pool.clear()
+        self.cache.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_reuse(self):
+        key = self.cache.get('alice')
+        client = self.pool.acquire(key)
+        self.assertEqual(client.key_fname, key.key_fname)
+        self.pool.release(key, client)
+        self.assertTrue(self.pool.acquire(key) is client)
+        self.assertEqual(len(self.made), 1)
+        self.assertEqual(self.pool.stats.counts['client_hits'], 1)
+        self.assertEqual(self.pool.stats.counts['client_misses'], 1)
+
+    def test_pool_size(self):
+        key = self.cache.get('alice')
+        clients = [self.pool.acquire(key), self.pool.acquire(key)]
+        for client in clients:
+            self.pool.release(key, client)
+        # Only one is kept idle
+        self.assertFalse(clients[0].closed)
+        self.assertTrue(clients[1].closed)
+
+    def test_no_reuse_of_broken_client(self):
+        key = self.cache.get('alice')
+        client = self.pool.acquire(key)
+        self.pool.release(key, client, reuse=False)
+        self.assertTrue(client.closed)
+        self.assertFalse(self.pool.acquire(key) is client)
+
+    def test_expired_key(self):
+        key = self.cache.get('alice')
+        client = self.pool.acquire(key)
+        self.cache.invalidate('alice')
+        # The key's files are kept while its client is in use
+        self.assertTrue(os.path.exists(key.key_fname))
+        self.pool.release(key, client)
+        self.assertTrue(client.closed)
+        self.assertFalse(os.path.exists(key.key_fname))
+
+    def test_idle_client_of_old_key_closed(self):
+        key = self.cache.get('alice')
+        client = self.pool.acquire(key)
+        self.pool.release(key, client)
+        self.cache.invalidate('alice')
+        # Retired, but an idle client still uses its files
+        self.assertTrue(os.path.exists(key.key_fname))
+        new_key = self.cache.get('alice')
+        new_client = self.pool.acquire(new_key)
+        self.assertFalse(new_client is client)
+        self.assertTrue(client.closed)
+        self.assertFalse(os.path.exists(key.key_fname))
+        self.assertEqual(new_client.key_fname, new_key.key_fname)
+
+    def test_sweep(self):
+        key = self.cache.get('alice')
+        client = self.pool.acquire(key)
+        self.pool.release(key, client)
+        self.pool.sweep()
+        self.assertFalse(client.closed)
+        later = time.time() + 3601
+        self.cache.sweep(now=later)
+        # The idle client still uses the retired key's files
+        self.assertTrue(os.path.exists(key.key_fname))
+        self.pool.sweep(now=later)
+        self.assertTrue(client.closed)
+        self.assertFalse(os.path.exists(key.key_fname))
+        self.assertFalse(os.path.exists(key.cert_fname))
+
+    def test_other_member_sweeps(self):
+        pool = ClientPool('https://am.example.net', size=1,
+                          make=FakeClient, sweep_interval=0)
+        self.addCleanup(pool.clear)
+        key = self.cache.get('alice')
+        client = pool.acquire(key)
+        pool.release(key, client)
+        self.cache.invalidate('alice')
+        # Alice doesn't call again: Bob's call closes her idle client
+        bob_key = self.cache.get('bob')
+        bob_client = pool.acquire(bob_key)
+        self.assertTrue(client.closed)
+        self.assertFalse(os.path.exists(key.key_fname))
+        pool.release(bob_key, bob_client)
+        self.assertFalse(bob_client.closed)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,170 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Tests of planning the edits of a stitching request for one aggregate:
+the planned request must be what editing a copy of the DOM gives.
+"""
+
+from __future__ import absolute_import
+
+import unittest
+
+from xml.dom.minidom import parseString
+
+from gcf.omnilib.stitch import defs
+from gcf.omnilib.stitch.requestplan import RequestEditPlan, RequestIndex
+
+# A request as the SCS expands it, with the stitching elements unprefixed
+REQUEST = '''<?xml version="1.0" ?>
+<rspec xmlns="http://www.geni.net/resources/rspec/3" type="request">
+  <!-- Edited for each aggregate -->
+  <node client_id="a" component_manager_id="urn:publicid:IDN+emulab.net+authority+cm">
+    <interface client_id="a:if0"/>
+  </node>
+  <link client_id="link0">
+    <component_manager name="urn:publicid:IDN+emulab.net+authority+cm"/>
+    <interface_ref client_id="a:if0"/>
+  </link>
+  <stitching xmlns="%s" lastUpdateTime="20160101:00:00:00">
+    <path id="link0">
+      <hop id="1">
+        <link id="urn:publicid:IDN+emulab.net+interface+procurve2:1.19">
+          <switchingCapabilityDescriptor>
+            <switchingcapType>l2sc</switchingcapType>
+            <switchingCapabilitySpecificInfo>
+              <switchingCapabilitySpecificInfo_L2sc>
+                <vlanRangeAvailability>2-4094</vlanRangeAvailability>
+                <suggestedVLANRange>any</suggestedVLANRange>
+              </switchingCapabilitySpecificInfo_L2sc>
+            </switchingCapabilitySpecificInfo>
+          </switchingCapabilityDescriptor>
+        </link>
+        <nextHop>2</nextHop>
+      </hop>
+      <hop id="2">
+        <link id="urn:publicid:IDN+utah.geniracks.net+interface+procurve2:1.19">
+          <switchingCapabilityDescriptor>
+            <switchingcapType>l2sc</switchingcapType>
+            <switchingCapabilitySpecificInfo>
+              <switchingCapabilitySpecificInfo_L2sc>
+                <suggestedVLANRange>any</suggestedVLANRange>
+              </switchingCapabilitySpecificInfo_L2sc>
+            </switchingCapabilitySpecificInfo>
+          </switchingCapabilityDescriptor>
+        </link>
+        <nextHop>null</nextHop>
+      </hop>
+    </path>
+  </stitching>
+</rspec>
+''' % defs.STITCH_V1_NS
+
+EXPIRES = '2016-01-02T00:00:00Z'
+
+def _text(element):
+    return [child for child in element.childNodes
+            if child.nodeType == child.TEXT_NODE][0]
+
+class RequestEditPlanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dom = parseString(REQUEST)
+        self.original = self.dom.toxml()
+        self.index = RequestIndex(self.dom)
+
+    def _hopNodes(self, dom):
+        index = RequestIndex(dom)
+        path = index.path('link0')
+        return (index, [index.hop(path, '1'), index.hop(path, '2')])
+
+    def _plan(self):
+        # As stitcher edits the request for the aggregate of hop 1
+        plan = RequestEditPlan(self.dom)
+        (index, hops) = self._hopNodes(self.dom)
+        plan.setAttribute(index.rspec(), defs.EXPIRES_ATTRIBUTE, EXPIRES)
+        plan.setAttribute(hops[1], 'type', 'loose')
+        suggested = index.descendants(hops[0], 'suggestedVLANRange')[0]
+        plan.setValue(_text(suggested), '100')
+        l2sc = index.descendants(hops[1], 'switchingCapabilitySpecificInfo_L2sc')[0]
+        plan.appendElement(l2sc, 'vlanRangeAvailability', '100-200')
+        plan.appendText(l2sc, '\n')
+        plan.setAttribute(index.stitching(), 'lastUpdateTime', 'a "quoted" <&> time')
+        return plan
+
+    def _editCopy(self):
+        # The old way: deep copy the request DOM and edit the copy
+        dom = self.dom.cloneNode(True)
+        (index, hops) = self._hopNodes(dom)
+        index.rspec().setAttribute(defs.EXPIRES_ATTRIBUTE, EXPIRES)
+        hops[1].setAttribute('type', 'loose')
+        _text(index.descendants(hops[0], 'suggestedVLANRange')[0]).nodeValue = '100'
+        l2sc = index.descendants(hops[1], 'switchingCapabilitySpecificInfo_L2sc')[0]
+        vlans = dom.createElement('vlanRangeAvailability')
+        vlans.appendChild(dom.createTextNode('100-200'))
+        l2sc.appendChild(vlans)
+        l2sc.appendChild(dom.createTextNode('\n'))
+        index.stitching().setAttribute('lastUpdateTime', 'a "quoted" <&> time')
+        return dom
+
+    def test_toxml_as_minidom(self):
+        plan = self._plan()
+        expected = plan.toDom().toxml()
+        self.assertEqual(plan.toxml(), expected)
+        self.assertEqual(plan.toxml(), self._editCopy().toxml())
+        self.assertTrue('<vlanRangeAvailability>100-200</vlanRangeAvailability>' in expected)
+        # The request itself is not changed
+        self.assertEqual(self.dom.toxml(), self.original)
+
+    def test_toxml_encoding(self):
+        plan = self._plan()
+        self.assertEqual(plan.toxml('utf-8'), plan.toDom().toxml('utf-8'))
+        self.assertEqual(plan.toxml('utf-8'), self._editCopy().toxml('utf-8'))
+
+    def test_no_edits(self):
+        plan = RequestEditPlan(self.dom)
+        self.assertEqual(plan.toxml(), self.original)
+
+    def test_apply_in_place(self):
+        expected = self._editCopy().toxml()
+        self._plan().applyInPlace()
+        self.assertEqual(self.dom.toxml(), expected)
+
+    def test_planned_attributes(self):
+        plan = self._plan()
+        (index, hops) = self._hopNodes(self.dom)
+        self.assertEqual(plan.getAttribute(hops[1], 'type'), 'loose')
+        self.assertEqual(hops[1].getAttribute('type'), '')
+        # The attributes the element has, with planned values
+        attributes = dict((attr.name, attr)
+                          for attr in plan.attributes(index.stitching()))
+        self.assertEqual(sorted(attributes.keys()), ['lastUpdateTime', 'xmlns'])
+        self.assertEqual(attributes['lastUpdateTime'].value,
+                         'a "quoted" <&> time')
+        attributes['lastUpdateTime'].value = 'now'
+        self.assertEqual(plan.getAttribute(index.stitching(), 'lastUpdateTime'),
+                         'now')
+        self.assertEqual(index.stitching().getAttribute('lastUpdateTime'),
+                         '20160101:00:00:00')
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,262 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Tests of validating RSpecs in process against local copies of their schemas.
+"""
+
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from gcf.geni.util import rspec_util
+from gcf.geni.util.rspec_schema import GENI_3_NAMESPACE, \
+    GENI_3_MAN_SCHEMA, GENI_3_REQ_SCHEMA
+
+STITCHER_TEST_FILES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                   '..', '..', 'stitcherTestFiles')
+
+# A request as the SCS expands it: one stitched link of 2 hops
+STITCHING_REQUEST = '''<?xml version="1.0" ?>
+<rspec xmlns="http://www.geni.net/resources/rspec/3"
+       xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+       xmlns:stitch="%(ns)s"
+       xsi:schemaLocation="http://www.geni.net/resources/rspec/3 http://www.geni.net/resources/rspec/3/request.xsd %(ns)s %(ns)sstitch-schema.xsd"
+       type="request">
+  <node client_id="a" component_manager_id="urn:publicid:IDN+emulab.net+authority+cm">
+    <interface client_id="a:if0"/>
+  </node>
+  <node client_id="b" component_manager_id="urn:publicid:IDN+utah.geniracks.net+authority+cm">
+    <interface client_id="b:if0"/>
+  </node>
+  <link client_id="link0">
+    <component_manager name="urn:publicid:IDN+emulab.net+authority+cm"/>
+    <component_manager name="urn:publicid:IDN+utah.geniracks.net+authority+cm"/>
+    <interface_ref client_id="a:if0"/>
+    <interface_ref client_id="b:if0"/>
+    <property source_id="a:if0" dest_id="b:if0" capacity="100000"/>
+  </link>
+  <stitch:stitching lastUpdateTime="20160101:00:00:00">
+    <stitch:path id="link0">
+      <stitch:hop id="1">
+        <stitch:link id="urn:publicid:IDN+emulab.net+interface+procurve2:1.19">
+          <stitch:trafficEngineeringMetric>10</stitch:trafficEngineeringMetric>
+          <stitch:capacity>100000</stitch:capacity>
+          <stitch:switchingCapabilityDescriptor>
+            <stitch:switchingcapType>l2sc</stitch:switchingcapType>
+            <stitch:encodingType>ethernet</stitch:encodingType>
+            <stitch:switchingCapabilitySpecificInfo>
+              <stitch:switchingCapabilitySpecificInfo_L2sc>
+                <stitch:interfaceMTU>9000</stitch:interfaceMTU>
+                <stitch:vlanRangeAvailability>2-4094</stitch:vlanRangeAvailability>
+                <stitch:suggestedVLANRange>any</stitch:suggestedVLANRange>
+                <stitch:vlanTranslation>false</stitch:vlanTranslation>
+              </stitch:switchingCapabilitySpecificInfo_L2sc>
+            </stitch:switchingCapabilitySpecificInfo>
+          </stitch:switchingCapabilityDescriptor>
+        </stitch:link>
+        <stitch:nextHop>2</stitch:nextHop>
+      </stitch:hop>
+      <stitch:hop id="2" type="loose">
+        <stitch:link id="urn:publicid:IDN+utah.geniracks.net+interface+procurve2:1.19">
+          <stitch:switchingCapabilityDescriptor>
+            <stitch:switchingcapType>l2sc</stitch:switchingcapType>
+            <stitch:encodingType>ethernet</stitch:encodingType>
+            <stitch:switchingCapabilitySpecificInfo>
+              <stitch:switchingCapabilitySpecificInfo_L2sc>
+                <stitch:suggestedVLANRange>any</stitch:suggestedVLANRange>
+                <stitch:vlanRangeAvailability>2-4094</stitch:vlanRangeAvailability>
+              </stitch:switchingCapabilitySpecificInfo_L2sc>
+            </stitch:switchingCapabilitySpecificInfo>
+          </stitch:switchingCapabilityDescriptor>
+        </stitch:link>
+        <stitch:nextHop>null</stitch:nextHop>
+      </stitch:hop>
+    </stitch:path>
+  </stitch:stitching>
+</rspec>
+'''
+
+STITCH_V1_NS = 'http://hpn.east.isi.edu/rspec/ext/stitch/0.1/'
+STITCH_V2_NS = 'http://www.geni.net/resources/rspec/ext/stitch/2/'
+
+# Schemas for the tests that don't need the GENI schemas
+TEST_NS = 'http://example.net/rspec/test'
+TEST_SCHEMA = TEST_NS + '/request.xsd'
+TEST_EXT_NS = 'http://example.net/rspec/ext'
+TEST_EXT_SCHEMA = TEST_EXT_NS + '/ext.xsd'
+
+SCHEMAS = {
+    'example.net/rspec/test/request.xsd': '''<?xml version="1.0"?>
+<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema"
+           targetNamespace="%s" xmlns="%s" elementFormDefault="qualified">
+  <xs:element name="rspec">
+    <xs:complexType>
+      <xs:sequence>
+        <xs:element name="node" maxOccurs="unbounded">
+          <xs:complexType>
+            <xs:attribute name="client_id" type="xs:string" use="required"/>
+          </xs:complexType>
+        </xs:element>
+        <xs:any namespace="##other" processContents="lax"
+                minOccurs="0" maxOccurs="unbounded"/>
+      </xs:sequence>
+    </xs:complexType>
+  </xs:element>
+</xs:schema>
+''' % (TEST_NS, TEST_NS),
+    'example.net/rspec/ext/ext.xsd': '''<?xml version="1.0"?>
+<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema"
+           targetNamespace="%s" elementFormDefault="qualified">
+  <xs:element name="color">
+    <xs:simpleType>
+      <xs:restriction base="xs:string">
+        <xs:enumeration value="red"/>
+        <xs:enumeration value="blue"/>
+      </xs:restriction>
+    </xs:simpleType>
+  </xs:element>
+</xs:schema>
+''' % TEST_EXT_NS,
+    }
+
+TEST_REQUEST = '''<?xml version="1.0"?>
+<rspec xmlns="%s" xmlns:ext="%s"
+       xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+       xsi:schemaLocation="%s %s %s %s">
+  <node client_id="a"/>
+  <ext:color>red</ext:color>
+</rspec>
+''' % (TEST_NS, TEST_EXT_NS, TEST_NS, TEST_SCHEMA, TEST_EXT_NS,
+       TEST_EXT_SCHEMA)
+
+@unittest.skipUnless(rspec_util.HAVELXML, "lxml is not installed")
+class LocalSchemaTest(unittest.TestCase):
+
+    def setUp(self):
+        self.schema_dir = tempfile.mkdtemp()
+        for (path, text) in SCHEMAS.items():
+            fname = os.path.join(self.schema_dir, path)
+            os.makedirs(os.path.dirname(fname))
+            with open(fname, 'w') as f:
+                f.write(text)
+        self.validator = rspec_util.RSpecValidator([self.schema_dir])
+
+    def tearDown(self):
+        shutil.rmtree(self.schema_dir)
+
+    def _validate(self, rspec):
+        return self.validator.validate(rspec, TEST_NS, TEST_SCHEMA)
+
+    def test_can_validate(self):
+        self.assertTrue(self.validator.can_validate(TEST_NS, TEST_SCHEMA))
+        self.assertEqual(self.validator.find_schema(TEST_SCHEMA),
+                         os.path.join(self.schema_dir,
+                                      'example.net/rspec/test/request.xsd'))
+        # No local copy: left to rspeclint
+        self.assertFalse(self.validator.can_validate())
+        self.assertFalse(rspec_util.RSpecValidator([]).can_validate(TEST_NS,
+                                                                    TEST_SCHEMA))
+
+    def test_validate(self):
+        self.assertEqual(self._validate(TEST_REQUEST), (True, ""))
+        (valid, message) = self._validate(TEST_REQUEST.replace(' client_id="a"', ''))
+        self.assertFalse(valid)
+        self.assertTrue('client_id' in message, message)
+        (valid, message) = self._validate('<rspec')
+        self.assertFalse(valid)
+
+    def test_extension_validated(self):
+        (valid, message) = self._validate(TEST_REQUEST.replace('>red<', '>green<'))
+        self.assertFalse(valid)
+        # Not when its schema has no local copy
+        os.remove(os.path.join(self.schema_dir, 'example.net/rspec/ext/ext.xsd'))
+        self.validator.clear()
+        self.assertEqual(self._validate(TEST_REQUEST.replace('>red<', '>green<')),
+                         (True, ""))
+
+    def test_results_cached(self):
+        self._validate(TEST_REQUEST)
+        # Validating again doesn't need the schema
+        shutil.rmtree(os.path.join(self.schema_dir, 'example.net'))
+        self.assertEqual(self._validate(TEST_REQUEST), (True, ""))
+
+def _have_geni_schemas():
+    return rspec_util.RSpecValidator().can_validate(GENI_3_NAMESPACE,
+                                                    GENI_3_REQ_SCHEMA)
+
+@unittest.skipUnless(_have_geni_schemas(),
+                     "lxml or local copies of the GENI v3 schemas not found (see RSPEC_SCHEMA_DIRS)")
+class RSpecValidatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.validator = rspec_util.RSpecValidator()
+
+    def _assertValid(self, rspec, schema=GENI_3_REQ_SCHEMA):
+        (valid, message) = self.validator.validate(rspec, GENI_3_NAMESPACE,
+                                                   schema)
+        self.assertTrue(valid, message)
+
+    def _assertInvalid(self, rspec, schema=GENI_3_REQ_SCHEMA):
+        (valid, message) = self.validator.validate(rspec, GENI_3_NAMESPACE,
+                                                   schema)
+        self.assertFalse(valid)
+        return message
+
+    def test_geni_v3_request(self):
+        fname = os.path.join(STITCHER_TEST_FILES, 'request-pg-ig-utah.xml')
+        with open(fname) as f:
+            request = f.read()
+        self._assertValid(request)
+        self.assertTrue(rspec_util.validate_rspec(request))
+        # Not a manifest
+        self._assertInvalid(request, GENI_3_MAN_SCHEMA)
+        # A node must have a client_id
+        self._assertInvalid(request.replace('client_id="pg-utah"', '', 1))
+
+    def test_stitching_request(self):
+        for ns in (STITCH_V1_NS, STITCH_V2_NS):
+            if self.validator.find_schema(ns + 'stitch-schema.xsd') is None:
+                continue
+            request = STITCHING_REQUEST % dict(ns=ns)
+            self._assertValid(request)
+            # The stitching extension is validated too
+            message = self._assertInvalid(
+                request.replace('<stitch:nextHop>2', '<stitch:bogus/><stitch:nextHop>2'))
+            self.assertTrue('bogus' in message, message)
+            self._assertInvalid(request.replace(' type="loose"',
+                                                ' type="bogus"'))
+
+    def test_unknown_extension_skipped(self):
+        if self.validator.find_schema(STITCH_V2_NS + 'stitch-schema.xsd') is None:
+            self.skipTest("No local copy of the stitching schema")
+        request = (STITCHING_REQUEST % dict(ns=STITCH_V2_NS)).replace(
+            'xsi:schemaLocation="',
+            'xmlns:x="http://example.net/ext" xsi:schemaLocation="http://example.net/ext http://example.net/ext.xsd ').replace(
+            '</rspec>', '<x:anything/></rspec>')
+        self._assertValid(request)
+
+if __name__ == "__main__":
+    unittest.main()
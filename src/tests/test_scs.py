@@ -0,0 +1,179 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Tests of the cache of SCS ComputePath results, and of how requests are
+canonicalized for it.
+"""
+
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from gcf.omnilib.stitch.scs import ComputePathCache, Service, \
+    canonicalize_rspec, _canonicalize_options
+
+REQUEST = '''<?xml version="1.0" encoding="UTF-8"?>
+<rspec xmlns="http://www.geni.net/resources/rspec/3" type="request"
+       generated="2016-01-01T00:00:00Z" generated_by="omni">
+  <node client_id="a" component_manager_id="urn:publicid:IDN+emulab.net+authority+cm">
+    <interface client_id="a:if0"/>
+  </node>
+  <link client_id="link0">
+    <interface_ref client_id="a:if0"/>
+  </link>
+</rspec>
+'''
+
+# The same request: other whitespace, a comment, attributes in another
+# order and other generated timestamps
+SAME_REQUEST = '''<rspec generated_by="jFed" type="request" generated="2016-02-02T12:00:00Z" xmlns="http://www.geni.net/resources/rspec/3"><!-- two nodes -->
+<node component_manager_id="urn:publicid:IDN+emulab.net+authority+cm" client_id="a"><interface client_id="a:if0"/></node>
+
+    <link client_id="link0"><interface_ref client_id="a:if0"/></link></rspec>'''
+
+RESULT = {'code': {'geni_code': 0},
+          'value': {'service_rspec': '<rspec/>',
+                    'workflow_data': {}}}
+
+SCS_VERSION = 'scs-version'
+
+class CanonicalizeTest(unittest.TestCase):
+
+    def test_equivalent_requests(self):
+        self.assertEqual(canonicalize_rspec(REQUEST),
+                         canonicalize_rspec(SAME_REQUEST))
+
+    def test_generated_removed(self):
+        rspec = canonicalize_rspec(REQUEST)
+        self.assertFalse('generated' in rspec)
+        self.assertFalse('2016' in rspec)
+        self.assertTrue('type="request"' in rspec)
+
+    def test_different_requests(self):
+        self.assertNotEqual(canonicalize_rspec(REQUEST),
+                            canonicalize_rspec(REQUEST.replace('"a:if0"', '"b:if0"')))
+        # Text that is not just whitespace is kept
+        self.assertNotEqual(canonicalize_rspec('<rspec><x>1</x></rspec>'),
+                            canonicalize_rspec('<rspec><x>2</x></rspec>'))
+
+    def test_hop_lists_unordered(self):
+        options = {'hop_exclusion_list': ['urn:b', 'urn:a'],
+                   'geni_routing_profile': {'link0': {'hop_inclusion_list': ['z', 'y']}}}
+        self.assertEqual(_canonicalize_options(options),
+                         {'hop_exclusion_list': ['urn:a', 'urn:b'],
+                          'geni_routing_profile': {'link0': {'hop_inclusion_list': ['y', 'z']}}})
+        # Lists of other things keep their order
+        self.assertEqual(_canonicalize_options([2, 1]), [2, 1])
+
+class ComputePathCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = ComputePathCache(os.path.join(self.tmpdir, 'scs-cache'),
+                                      max_age_secs=3600)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_key(self):
+        options = {'hop_exclusion_list': ['urn:a', 'urn:b']}
+        key = self.cache.key(REQUEST, options, SCS_VERSION)
+        self.assertEqual(self.cache.key(SAME_REQUEST,
+                                        {'hop_exclusion_list': ['urn:b', 'urn:a']},
+                                        SCS_VERSION),
+                         key)
+        self.assertNotEqual(self.cache.key(REQUEST, {}, SCS_VERSION), key)
+        self.assertNotEqual(self.cache.key(REQUEST, options, 'other-version'),
+                            key)
+        # Not cached
+        self.assertEqual(self.cache.key('<rspec', options, SCS_VERSION), None)
+
+    def test_put_get(self):
+        key = self.cache.key(REQUEST, {}, SCS_VERSION)
+        self.assertEqual(self.cache.get(key), None)
+        self.cache.put(key, RESULT)
+        self.assertEqual(self.cache.get(key), RESULT)
+        self.cache.remove(key)
+        self.assertEqual(self.cache.get(key), None)
+
+    def test_too_old(self):
+        key = self.cache.key(REQUEST, {}, SCS_VERSION)
+        self.cache.put(key, RESULT)
+        path = os.path.join(self.cache.directory, key + '.json')
+        saved = time.time() - 3601
+        os.utime(path, (saved, saved))
+        self.assertEqual(self.cache.get(key), None)
+        # And removed
+        self.assertFalse(os.path.exists(path))
+
+    def test_unreadable(self):
+        key = self.cache.key(REQUEST, {}, SCS_VERSION)
+        self.cache.put(key, RESULT)
+        path = os.path.join(self.cache.directory, key + '.json')
+        with open(path, 'w') as f:
+            f.write('{"code": ')
+        self.assertEqual(self.cache.get(key), None)
+        self.assertFalse(os.path.exists(path))
+
+class CachedService(Service):
+    """An SCS whose GetVersion doesn't need the network. Nothing listens
+    at its URL, so ComputePath fails if it calls the SCS."""
+
+    def GetVersion(self, printResult=True):
+        return {'value': {'version': SCS_VERSION}}
+
+class ServiceCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = ComputePathCache(os.path.join(self.tmpdir, 'scs-cache'))
+        self.service = CachedService('http://127.0.0.1:1/', cache=self.cache,
+                                     timeout=5)
+        self.key = self.cache.key(REQUEST, {}, self.service.versionTag())
+        self.cache.put(self.key, RESULT)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_saved_result_used(self):
+        path_info = self.service.ComputePath('urn:slice', SAME_REQUEST, {})
+        self.assertEqual(path_info.rspec(), '<rspec/>')
+        self.assertTrue(self.service.resultFromCache)
+        self.assertEqual(self.service.cacheKey, self.key)
+
+    def test_discard_cached_result(self):
+        self.service.ComputePath('urn:slice', REQUEST, {})
+        self.service.discardCachedResult()
+        self.assertFalse(self.service.resultFromCache)
+        self.assertEqual(self.cache.get(self.key), None)
+
+    def test_discard_keeps_result_not_from_cache(self):
+        self.service.discardCachedResult()
+        self.assertEqual(self.cache.get(self.key), RESULT)
+
+if __name__ == "__main__":
+    unittest.main()
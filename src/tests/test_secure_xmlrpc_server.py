@@ -0,0 +1,80 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Tests of dispatching XML-RPC requests in SecureXMLRPCServer.
+"""
+
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import unittest
+import uuid
+import xmlrpclib
+
+import gcf.geni as geni
+from gcf.geni.SecureXMLRPCServer import SecureXMLRPCServer
+from gcf.geni.util.cert_util import create_cert
+
+class MarshaledDispatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        (server_gid, server_keys) = create_cert(geni.URN('test.example.net', 'authority', 'am').urn_string(),
+                                                ca=True, lifeDays=1,
+                                                uuidarg=uuid.uuid4())
+        certfile = os.path.join(self.tmpdir, 'am-cert.pem')
+        keyfile = os.path.join(self.tmpdir, 'am-key.pem')
+        server_gid.save_to_file(certfile)
+        server_keys.save_to_file(keyfile)
+        self.server = SecureXMLRPCServer(('localhost', 0), keyfile=keyfile,
+                                         certfile=certfile,
+                                         bind_and_activate=False)
+        self.server.register_function(lambda a, b: a + b, 'add')
+
+    def tearDown(self):
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_path(self):
+        # As SimpleXMLRPCDispatcher._marshaled_dispatch, which
+        # MultiPathXMLRPCServer calls with the path
+        request = xmlrpclib.dumps((2, 3), 'add')
+        response = self.server._marshaled_dispatch(request, None, '/RPC2')
+        self.assertEqual(xmlrpclib.loads(response), ((5,), None))
+
+    def test_dispatch_method(self):
+        request = xmlrpclib.dumps(('x',), 'echo')
+        response = self.server._marshaled_dispatch(request,
+                                                   lambda method, params: [method, params],
+                                                   path='/RPC2')
+        self.assertEqual(xmlrpclib.loads(response), (([u'echo', [u'x']],), None))
+
+    def test_fault(self):
+        request = xmlrpclib.dumps((1,), 'nosuchmethod')
+        response = self.server._marshaled_dispatch(request, path='/')
+        self.assertRaises(xmlrpclib.Fault, xmlrpclib.loads, response)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Tests of the gcf-ch slice registry.
+"""
+
+from __future__ import absolute_import
+
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from gcf.geni.slice_registry import SliceRegistry
+
+NOW = datetime.datetime(2016, 6, 1, 12, 0, 0)
+HOUR = datetime.timedelta(hours=1)
+
+ALICE = 'urn:publicid:IDN+test.example.net+user+alice'
+BOB = 'urn:publicid:IDN+test.example.net+user+bob'
+
+def _slice(name):
+    return 'urn:publicid:IDN+test.example.net+slice+%s' % name
+
+class SliceRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = SliceRegistry()
+        self.registry.put(_slice('a1'), ALICE, NOW + HOUR, '<a1/>')
+        self.registry.put(_slice('a2'), ALICE, NOW - HOUR, '<a2/>')
+        self.registry.put(_slice('b1'), BOB, NOW - HOUR, '<b1/>')
+
+    def tearDown(self):
+        self.registry.close()
+
+    def test_get(self):
+        record = self.registry.get(_slice('a1'))
+        self.assertEqual(record.owner_urn, ALICE)
+        self.assertEqual(record.expiration, NOW + HOUR)
+        self.assertEqual(record.credential, '<a1/>')
+        self.assertTrue(self.registry.get(_slice('none')) is None)
+
+    def test_list_slices_skips_expired(self):
+        self.assertEqual(self.registry.list_slices(ALICE, NOW), [_slice('a1')])
+        self.assertEqual(self.registry.list_slices(BOB, NOW), [])
+        # Listing does not remove expired slices
+        self.assertEqual(len(self.registry), 3)
+
+    def test_reap_expired_of_owner(self):
+        self.assertEqual(self.registry.reap_expired(NOW, owner_urn=ALICE),
+                         [_slice('a2')])
+        self.assertTrue(self.registry.has_slice(_slice('b1')))
+        self.assertTrue(self.registry.has_slice(_slice('a1')))
+        self.assertEqual(self.registry.reap_expired(NOW, owner_urn=ALICE), [])
+
+    def test_reap_expired(self):
+        self.assertEqual(sorted(self.registry.reap_expired(NOW)),
+                         [_slice('a2'), _slice('b1')])
+        self.assertEqual(len(self.registry), 1)
+
+    def test_put_replaces(self):
+        self.registry.put(_slice('a2'), ALICE, NOW + HOUR, '<renewed/>')
+        self.assertEqual(self.registry.get(_slice('a2')).credential,
+                         '<renewed/>')
+        self.assertEqual(len(self.registry), 3)
+
+    def test_delete(self):
+        self.assertTrue(self.registry.delete(_slice('a1')))
+        self.assertFalse(self.registry.delete(_slice('a1')))
+
+class SliceRegistryFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_kept_across_opens(self):
+        filename = os.path.join(self.tmpdir, 'slices.db')
+        registry = SliceRegistry(filename)
+        registry.put(_slice('a1'), ALICE, NOW + HOUR, '<a1/>')
+        registry.close()
+        registry = SliceRegistry(filename)
+        try:
+            self.assertEqual(registry.list_slices(ALICE, NOW), [_slice('a1')])
+        finally:
+            registry.close()
+
+if __name__ == "__main__":
+    unittest.main()